@@ -16,6 +16,7 @@ DEFAULT_MODEL_IDENTIFIER = "TheBloke/Mistral-7B-Instruct-v0.1-GGUF"
 DEFAULT_MODEL_FILENAME = "mistral-7b-instruct-v0.1.Q4_K_M.gguf"
 DEFAULT_MODEL_CTX = 4096
 DEFAULT_N_GPU_LAYERS = 0
+DEFAULT_DAEMON_SOCKET = os.path.join(DEFAULT_DATA_PATH, "anli-daemon.sock")
 
 class BaseConfig:
     """Base configuration class for the package"""
@@ -44,13 +45,51 @@ class LLMInterface(BaseConfig):
         self.model_path = None
         self.models = self.load_model()
 
+    def stream(self, prompt, max_queue=32, **kwargs):
+        """
+        Streams the completion of the prompt token by token.
+
+        :param prompt: The prompt to complete.
+        :param max_queue: Maximum number of decoded tokens waiting for the consumer before decoding pauses.
+        :param kwargs: Generation arguments passed to the backend, e.g. max_tokens or stop.
+        :return: TokenStream - iterate it with `for` or `async for`, cancel it to stop decoding.
+        """
+        from .llms.streaming import TokenStream
+        if not hasattr(self.models, 'stream'):
+            raise NotImplementedError(f"Token streaming is not supported by the "
+                                      f"{self.config.get('llm', {}).get('type')} backend.")
+        return TokenStream(self.models.stream(prompt, **kwargs), max_queue=max_queue)
+
+    def astream(self, prompt, max_queue=32, **kwargs):
+        """
+        Same as `stream`, for `async for token in llm.astream(prompt)`. Decoding runs off the event loop.
+        """
+        return self.stream(prompt, max_queue=max_queue, **kwargs)
+
     def load_model(self):
-        from huggingface_hub import hf_hub_download
-        from guidance import models, instruction
         # Determine which model class to use based on config
         backend_config = self.config.get('llm', {})
         backend_type = backend_config.get('type')
 
+        if backend_type == 'Daemon':
+            # The model is owned by a shared `anli-daemon` process on this host.
+            from .llms.daemon import DaemonClient
+            return DaemonClient(backend_config.get('socket_path', DEFAULT_DAEMON_SOCKET),
+                                timeout=backend_config.get('timeout'))
+
+        if backend_type == 'Fake':
+            # Scripted model for offline tests and benchmarks, no download needed.
+            from .llms.fake import FakeLLM
+            return FakeLLM(responses=backend_config.get('responses'),
+                           rules=backend_config.get('rules'),
+                           default_response=backend_config.get('default_response', "OK."),
+                           token_latency=backend_config.get('token_latency', 0.0),
+                           prefill_latency=backend_config.get('prefill_latency', 0.0),
+                           embedding_dims=backend_config.get('embedding_dims', 64),
+                           seed=backend_config.get('seed', 0))
+
+        from huggingface_hub import hf_hub_download
+        from guidance import models, instruction
         if backend_type == 'Transformers':
             logging.debug(f"loading chat model: {backend_config['model']}")
             return models.TransformersChat(backend_config['model'])
@@ -69,18 +108,23 @@ class LLMInterface(BaseConfig):
                 messages_to_prompt,
                 completion_to_prompt,
             )
-            # This is for LangChain
-            # Callbacks support token-wise streaming
-            callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
+            # Tokens are consumed with `stream`/`astream`, echoing them to stdout through LangChain is opt-in.
+            lc_kwargs = {}
+            if backend_config.get('stream_to_stdout', False):
+                lc_kwargs["callback_manager"] = CallbackManager([StreamingStdOutCallbackHandler()])
 
             identifier = backend_config.get('identifier', DEFAULT_MODEL_IDENTIFIER)
             filename = backend_config.get('filename', DEFAULT_MODEL_FILENAME)
             n_gpu_layers = backend_config.get('n_gpu_layers', DEFAULT_N_GPU_LAYERS)
-            self.model_path = hf_hub_download(repo_id=identifier, filename=filename)
+            self.model_path = backend_config.get('model_path') or hf_hub_download(repo_id=identifier,
+                                                                                  filename=filename)
+            # `embed` needs a llama.cpp context created with embeddings enabled
+            model_kwargs = {"embedding": True} if backend_config.get('embedding', False) else None
             return CombinedLlamaCpp(model_path=self.model_path,
                                     n_ctx=DEFAULT_MODEL_CTX,
                                     n_gpu_layers=n_gpu_layers,
-                                    lc_kwargs={"callback_manager":callback_manager},
+                                    model_kwargs=model_kwargs,
+                                    lc_kwargs=lc_kwargs,
                                     li_kwargs={"messages_to_prompt":messages_to_prompt,
                                                "completion_to_prompt":completion_to_prompt})
 
@@ -110,6 +154,23 @@ class RedisConfig(BaseConfig):
         else:
             self.ssl = False
             self.ssl_ca_certs = None
+        # Connection pool settings, shared by the stores connecting to the same url
+        redis_config = self.config.get("redis", {})
+        self.max_connections = redis_config.get("max_connections", 50)
+        self.socket_timeout = redis_config.get("socket_timeout", None)
+        self.socket_connect_timeout = redis_config.get("socket_connect_timeout", 5)
+        self.health_check_interval = redis_config.get("health_check_interval", 30)
+
+    def connection_kwargs(self):
+        """
+        Returns the keyword arguments of the Redis connection pools for this configuration.
+        """
+        kwargs = {"max_connections": self.max_connections,
+                  "socket_timeout": self.socket_timeout,
+                  "socket_connect_timeout": self.socket_connect_timeout,
+                  "health_check_interval": self.health_check_interval,
+                  "ssl_ca_certs": self.ssl_ca_certs}
+        return {key: value for key, value in kwargs.items() if value is not None}
 
     def __del__(self):
         # Delete the temporary certificate file
@@ -1,7 +1,253 @@
+import inspect
+import re
+from collections import deque
+
+from anli.utils.context_window import hit_location
+from anli.utils.lexical_index import LexicalIndex
+from anli.utils.vector_filters import VectorFilter
+
+_TOKEN = re.compile(r"\s*\S+|\s+")
+
+
+def count_tokens(text):
+    """Approximate token count: words with their leading whitespace, like the Fake LLM backend."""
+    return len(_TOKEN.findall(text))
+
+
+class _Turn:
+    """A turn of the conversation with its token count, computed once."""
+    __slots__ = ("position", "role", "content", "tokens")
+
+    def __init__(self, position, role, content, tokens):
+        self.position = position
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+    def message(self):
+        return {"role": self.role, "content": self.content}
+
+    def state(self):
+        return [self.position, self.role, self.content, self.tokens]
+
+
+def llm_summarizer(llm, max_tokens=96):
+    """Returns a summarizer for DialogManager that asks the LLM (with a `generate` method) for a short summary."""
+    def summarize(turns):
+        conversation = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        return llm.generate(f"Summarize the following conversation in a few sentences, keeping names, values and "
+                            f"decisions.\n\n{conversation}\n\nSummary:", max_tokens=max_tokens).strip()
+    return summarize
+
+
+def vector_store_retriever(vector_store, json_name, response_relative_position=1, search_factor=4):
+    """
+    Returns a retriever for DialogManager that recalls old turns of one conversation stored in a JSON vector store:
+    the prompts of the conversation close to the query are searched, and each is returned with its response. Stores
+    whose searches take a VectorFilter search the conversation only, for the others the hits of other conversations
+    are dropped.
+
+    :param vector_store: A JSON vector store indexing the conversation, e.g. with `append_item`.
+    :param json_name: The name of the conversation in the store, "{index_name}-{json_storage_id_suffix}".
+    :param response_relative_position: The position of the responses relative to the prompts.
+    :param search_factor: Hits searched per recalled prompt, to make up for the hits of other conversations, for
+    the stores without filters.
+    """
+    start, end = min(0, response_relative_position), max(0, response_relative_position) + 1
+    conversation = None
+    if "filter" in inspect.signature(vector_store.search_item).parameters and \
+            json_name.startswith(f"{vector_store.index_name}-"):
+        conversation = VectorFilter(documents=json_name[len(vector_store.index_name) + 1:])
+
+    def retrieve(query, k):
+        if conversation is not None:
+            hits = vector_store.search_item(query, num_results=k, return_fields=["name", "path"], filter=conversation)
+        else:
+            hits = vector_store.search_item(query, num_results=k * search_factor, return_fields=["name", "path"])
+        hits = [hit for hit in hits if hit_location(hit)[0] == json_name][:k]
+        return [turn for window in vector_store.get_context_windows(hits, start, end) for turn in window]
+    return retrieve
+
+
 class DialogManager:
-    def __init__(self):
+    """
+    Keeps the context of a conversation and assembles multi-turn prompts under a token budget.
+
+    The last `window` turns are kept in a ring buffer with their token counts, computed once when they are added.
+    Turns leaving the buffer are compacted: every `summary_size` of them are summarized once by `summarizer`, and
+    the last `max_summaries` summaries are kept. Old turns are also recalled by relevance: by `retriever` if given,
+    e.g. `vector_store_retriever(store, json_name)`, else from an in-memory BM25 index of the evicted turns.
+
+    `build_messages` fills the budget with, in priority order: the last `min_recent` turns, the summaries (newest
+    first, up to `summary_share` of the budget), the old turns relevant to the user input (up to `relevance_share`),
+    then the other recent turns, newest first. Its cost depends on the window, not on the length of the
+    conversation.
+
+    # Example usage
+    dialog = DialogManager(token_budget=1024, count_tokens=lambda text: len(llm.client.tokenize(text.encode())),
+                           summarizer=llm_summarizer(llm))
+    dialog.add_turn("user", "restart the pod worker-1")
+    dialog.add_turn("assistant", "Restarted worker-1.")
+    prompt = dialog.build_prompt("and show me its logs")
+    """
+    def __init__(self, token_budget=2048, window=32, count_tokens=count_tokens, summarizer=None, summary_size=8,
+                 max_summaries=4, retriever=None, relevant_turns=2, min_recent=2, summary_share=0.25,
+                 relevance_share=0.25, message_overhead=4, max_archived=1000):
+        """
+        Creates a DialogManager for one conversation.
+        :param token_budget: Maximum number of tokens of the assembled messages, the user input included.
+        :param window: Number of recent turns kept in full.
+        :param count_tokens: A function returning the number of tokens of a text for the model.
+        :param summarizer: A function summarizing a list of {"role", "content"} turns, see `llm_summarizer`.
+        Without it, old turns are only recalled by relevance.
+        :param summary_size: Number of evicted turns summarized together.
+        :param max_summaries: Number of summaries kept.
+        :param retriever: A function (query, k) returning up to k relevant old {"role", "content"} turns.
+        :param relevant_turns: Number of old turns recalled per prompt, 0 to disable the recall.
+        :param min_recent: Number of recent turns included before the summaries and the recalled turns.
+        :param summary_share: Share of the budget the summaries may use.
+        :param relevance_share: Share of the budget the recalled turns may use.
+        :param message_overhead: Tokens added per message for its role and separators.
+        :param max_archived: Number of evicted turns kept in the BM25 index when there is no retriever.
+        """
         self.context = {}
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.summarizer = summarizer
+        self.summary_size = summary_size
+        self.retriever = retriever
+        self.relevant_turns = relevant_turns
+        self.min_recent = min_recent
+        self.summary_share = summary_share
+        self.relevance_share = relevance_share
+        self.message_overhead = message_overhead
+        self.turns = deque(maxlen=window)
+        self.pending = []
+        self.summaries = deque(maxlen=max_summaries)
+        self.archive = LexicalIndex() if retriever is None else None
+        self.max_archived = max_archived
+        self.position = 0
+
+    def state(self):
+        """
+        Returns the conversation as a JSON-serializable dict: the turns with their token counts, the summaries, the
+        evicted turns indexed for recall and the context. The settings and functions are not included.
+        """
+        archived = sorted(self.archive.payloads.values(), key=lambda turn: turn.position) if self.archive else []
+        return {"position": self.position, "context": self.context,
+                "turns": [turn.state() for turn in self.turns], "pending": [turn.state() for turn in self.pending],
+                "summaries": [summary.state() for summary in self.summaries],
+                "archived": [turn.state() for turn in archived]}
+
+    def restore(self, state):
+        """Replaces the conversation with one returned by `state`, without counting tokens or summarizing again."""
+        self.position = state["position"]
+        self.context = dict(state["context"])
+        self.turns.clear()
+        self.turns.extend(_Turn(*turn) for turn in state["turns"])
+        self.pending = [_Turn(*turn) for turn in state["pending"]]
+        self.summaries.clear()
+        self.summaries.extend(_Turn(*summary) for summary in state["summaries"])
+        if self.archive is not None:
+            self.archive.clear()
+            archived = [_Turn(*turn) for turn in state["archived"][-self.max_archived:]]
+            self.archive.add_many((turn.position, turn.content, turn) for turn in archived)
+        return self
+
+    def _turn(self, role, content):
+        return _Turn(self.position, role, content, self.count_tokens(content) + self.message_overhead)
+
+    def add_turn(self, role, content):
+        """Adds a turn, compacting the turn it pushes out of the window."""
+        if len(self.turns) == self.turns.maxlen:
+            self._evict(self.turns[0])
+        self.turns.append(self._turn(role, content))
+        self.position += 1
+
+    def _evict(self, turn):
+        if self.archive is not None:
+            self.archive.add(turn.position, turn.content, turn)
+            if len(self.archive) > self.max_archived:
+                # Evicted turns have consecutive positions
+                self.archive.remove([turn.position - self.max_archived])
+        if self.summarizer is None:
+            return
+        self.pending.append(turn)
+        if len(self.pending) >= self.summary_size:
+            summary = self.summarizer([pending.message() for pending in self.pending])
+            content = f"Summary of earlier conversation: {summary}"
+            self.summaries.append(_Turn(self.pending[0].position, "system", content,
+                                        self.count_tokens(content) + self.message_overhead))
+            self.pending = []
 
     def manage_context(self, user_input, nlu_output):
-        # Code to manage and maintain conversation context, request more info, etc.
-        pass
\ No newline at end of file
+        """Records the user input as a turn and keeps the latest value of each NLU slot in `context`."""
+        self.add_turn("user", user_input)
+        if isinstance(nlu_output, dict):
+            self.context.update(nlu_output)
+
+    def _recall(self, query, excluded):
+        """The old turns relevant to the query, that are not among the excluded (role, content)."""
+        if not self.relevant_turns or not query:
+            return []
+        if self.retriever is not None:
+            turns = [self._turn(turn["role"], turn["content"]) for turn in self.retriever(query, self.relevant_turns)]
+        else:
+            turns = [turn for _, _, turn in self.archive.search(query, self.relevant_turns)]
+        return [turn for turn in turns if (turn.role, turn.content) not in excluded]
+
+    def build_messages(self, user_input=None):
+        """
+        Returns the {"role", "content"} messages of the prompt within the token budget, see above: the summaries,
+        the recalled turns, the recent turns, in this order, then the user input if given.
+        """
+        budget = self.token_budget
+        if user_input is not None:
+            budget -= self.count_tokens(user_input) + self.message_overhead
+        # Candidates from the newest: the window, then the evicted turns not summarized yet
+        recent = list(reversed(self.turns)) + list(reversed(self.pending))
+        chosen = []
+        used = 0
+        for turn in recent[:self.min_recent]:
+            if used + turn.tokens > budget:
+                break
+            chosen.append(turn)
+            used += turn.tokens
+
+        summaries = []
+        share = 0
+        for summary in reversed(self.summaries):
+            if share + summary.tokens > self.summary_share * self.token_budget or used + summary.tokens > budget:
+                break
+            summaries.append(summary)
+            share += summary.tokens
+            used += summary.tokens
+
+        recalled = []
+        share = 0
+        excluded = {(turn.role, turn.content) for turn in recent}
+        for turn in self._recall(user_input, excluded):
+            if share + turn.tokens > self.relevance_share * self.token_budget or used + turn.tokens > budget:
+                continue
+            recalled.append(turn)
+            share += turn.tokens
+            used += turn.tokens
+
+        if len(chosen) == min(self.min_recent, len(recent)):
+            for turn in recent[len(chosen):]:
+                if used + turn.tokens > budget:
+                    break
+                chosen.append(turn)
+                used += turn.tokens
+
+        messages = [summary.message() for summary in reversed(summaries)]
+        messages += [turn.message() for turn in sorted(recalled, key=lambda turn: turn.position)]
+        messages += [turn.message() for turn in reversed(chosen)]
+        if user_input is not None:
+            messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def build_prompt(self, user_input=None):
+        """Returns the messages of `build_messages` as a text prompt, one "role: content" line per message."""
+        lines = [f"{message['role']}: {message['content']}" for message in self.build_messages(user_input)]
+        return "\n".join(lines + ["assistant:"])
@@ -0,0 +1,285 @@
+import inspect
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Words that can surround a command without changing its meaning, e.g. "please list pods now".
+FILLER_WORDS = frozenset(["please", "can", "could", "would", "you", "kindly", "now", "just", "the", "me", "for",
+                          "hey", "ok", "okay", "thanks", "thank"])
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = ".!?;,"
+
+
+class FastPathMatch:
+    """The result of a fast path lookup."""
+    __slots__ = ("intent", "parameters", "confidence", "source")
+
+    def __init__(self, intent: str, parameters: Dict[str, Any], confidence: float, source: str):
+        self.intent = intent
+        self.parameters = parameters
+        self.confidence = confidence
+        self.source = source
+
+    def __repr__(self):
+        return (f"FastPathMatch(intent={self.intent!r}, parameters={self.parameters!r}, "
+                f"confidence={self.confidence}, source={self.source!r})")
+
+
+class FastPathMatcher:
+    """
+    A deterministic matcher that resolves short, formulaic commands without calling the LLM.
+
+    Patterns are compiled from the metadata given to `IntegrationLayer.register`:
+
+    - `examples=["add {a} and {b}", ...]`: each example becomes an anchored regular expression where `{name}`
+      placeholders capture the parameter of the same name. Captured values are converted using the function's type
+      annotations, and a match is only accepted if the parameters bind to the function signature.
+    - `aliases=["list pods", ...]`: phrases stored in a token trie, together with the intent name. An alias resolves
+      the intent on its own only if the function has no required parameters and the rest of the input is filler.
+
+    Exact phrasings of LLM parses confirmed by the caller, e.g. once their intent executed successfully, are added
+    with `learn` and matched first. A learned parse is only used while its intent is registered and its parameters
+    bind to the current function. Anything below `min_confidence` falls through to the LLM.
+
+    # Example usage
+    matcher = FastPathMatcher(integration_layer)
+    intent, parameters = matcher.resolve("add 3 and 4", fallback=llm_parse)
+    integration_layer.execute_intent(intent, parameters)
+    matcher.learn("add 3 and 4", intent, parameters)
+    """
+    EXACT_CONFIDENCE = 1.0
+    PATTERN_CONFIDENCE = 0.95
+    ALIAS_CONFIDENCE = 0.9
+    PARTIAL_ALIAS_CONFIDENCE = 0.5
+
+    def __init__(self, integration_layer, min_confidence: float = 0.9, max_learned: int = 10000,
+                 learned_file: str = None):
+        """
+        Initializes the matcher for the functions registered in `integration_layer`.
+
+        Args:
+            integration_layer (IntegrationLayer): The registry to compile patterns from.
+            min_confidence (float): Matches below this confidence fall through to the LLM.
+            max_learned (int): Maximum number of learned phrasings, the least recently used ones are evicted.
+            learned_file (str, optional): JSON file to load learned phrasings from and save them to.
+        """
+        self.integration_layer = integration_layer
+        self.min_confidence = min_confidence
+        self.max_learned = max_learned
+        self.learned_file = learned_file
+        self.learned = OrderedDict()
+        # Whether each learned parse binds to the registered functions, checked once per registry version
+        self._learned_valid = {}
+        self.patterns = []
+        self.alias_trie = {}
+        self._compiled_version = None
+        self.hits = 0
+        self.misses = 0
+        self.hit_time_ns = 0
+        self.miss_time_ns = 0
+        if learned_file is not None and os.path.exists(learned_file):
+            self.load_learned(learned_file)
+
+    @staticmethod
+    def clean(text: str) -> str:
+        """Collapses whitespace and strips trailing punctuation, preserving case."""
+        return _WHITESPACE.sub(" ", text.strip()).rstrip(_TRAILING_PUNCTUATION).strip()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Lower-cases the text, collapses whitespace and strips trailing punctuation."""
+        return FastPathMatcher.clean(text).lower()
+
+    @staticmethod
+    def compile_example(example: str):
+        """
+        Compiles an example such as "delete pod {name}" into an anchored, case-insensitive regular expression.
+        Each placeholder becomes a named group, literal words are matched with flexible whitespace.
+        """
+        words = []
+        for word in FastPathMatcher.clean(example).split(" "):
+            pieces = []
+            position = 0
+            for placeholder in _PLACEHOLDER.finditer(word):
+                pieces.append(re.escape(word[position:placeholder.start()]))
+                pieces.append(rf"['\"]?(?P<{placeholder.group(1)}>.+?)['\"]?")
+                position = placeholder.end()
+            pieces.append(re.escape(word[position:]))
+            words.append("".join(pieces))
+        return re.compile("^" + r"\s+".join(words) + "$", re.IGNORECASE)
+
+    def compile(self):
+        """(Re)compiles the patterns and the alias trie from the registered functions."""
+        self.patterns = []
+        self.alias_trie = {}
+        for intent, (func, metadata) in self.integration_layer.registered_functions.items():
+            signature = inspect.signature(func)
+            for example in metadata.get("examples", []):
+                self.patterns.append((self.compile_example(example), intent, func, signature))
+            required = [p for p in signature.parameters.values()
+                        if p.default is inspect.Parameter.empty
+                        and p.kind not in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)]
+            for alias in [intent.replace("_", " ")] + list(metadata.get("aliases", [])):
+                node = self.alias_trie
+                for token in self.normalize(alias).split(" "):
+                    node = node.setdefault(token, {})
+                node[None] = (intent, not required)
+        self._learned_valid = {}
+        self._compiled_version = self.integration_layer.version
+
+    def learn(self, text: str, intent: str, parameters: Dict[str, Any]):
+        """
+        Records a confirmed parse so the exact same phrasing is resolved without the LLM next time.
+
+        Args:
+            text (str): The user input.
+            intent (str): The intent the input was confirmed to map to.
+            parameters (dict): The confirmed parameters.
+        """
+        key = self.normalize(text)
+        self.learned[key] = (intent, dict(parameters))
+        self.learned.move_to_end(key)
+        self._learned_valid.pop(key, None)
+        while len(self.learned) > self.max_learned:
+            self._learned_valid.pop(self.learned.popitem(last=False)[0], None)
+
+    def load_learned(self, learned_file: str = None):
+        """Loads learned phrasings from a JSON file."""
+        with open(learned_file or self.learned_file, "r") as file:
+            for text, (intent, parameters) in json.load(file):
+                self.learn(text, intent, parameters)
+
+    def save_learned(self, learned_file: str = None):
+        """Saves learned phrasings to a JSON file."""
+        learned_file = learned_file or self.learned_file
+        os.makedirs(os.path.dirname(os.path.abspath(learned_file)), exist_ok=True)
+        with open(learned_file, "w") as file:
+            json.dump([[text, list(parse)] for text, parse in self.learned.items()], file)
+
+    @staticmethod
+    def _convert(value: str, annotation):
+        if annotation in (int, float):
+            return annotation(value)
+        if annotation is bool:
+            lowered = value.lower()
+            if lowered in ("true", "yes", "on", "1"):
+                return True
+            if lowered in ("false", "no", "off", "0"):
+                return False
+            raise ValueError(f"Not a boolean: {value}")
+        return value
+
+    def _match_patterns(self, text: str) -> Optional[FastPathMatch]:
+        for pattern, intent, func, signature in self.patterns:
+            found = pattern.match(text)
+            if found is None:
+                continue
+            try:
+                parameters = {name: self._convert(value.strip(), signature.parameters[name].annotation)
+                              for name, value in found.groupdict().items()}
+            except (KeyError, TypeError, ValueError):
+                continue
+            if self.integration_layer.validate_parameters(func, parameters):
+                return FastPathMatch(intent, parameters, self.PATTERN_CONFIDENCE, "pattern")
+        return None
+
+    def _match_aliases(self, tokens: List[str]) -> Optional[FastPathMatch]:
+        best = None
+        for start in range(len(tokens)):
+            node = self.alias_trie
+            for end in range(start, len(tokens)):
+                node = node.get(tokens[end])
+                if node is None:
+                    break
+                if None in node and (best is None or end + 1 - start > best[1] - best[0]):
+                    best = (start, end + 1, node[None])
+        if best is None:
+            return None
+        start, end, (intent, callable_without_parameters) = best
+        rest = tokens[:start] + tokens[end:]
+        if callable_without_parameters and all(token in FILLER_WORDS for token in rest):
+            return FastPathMatch(intent, {}, self.ALIAS_CONFIDENCE, "alias")
+        return FastPathMatch(intent, {}, self.PARTIAL_ALIAS_CONFIDENCE, "alias")
+
+    def _binds(self, key: str, intent: str, parameters: Dict[str, Any]) -> bool:
+        """Whether a learned parse still binds to its registered function, e.g. after the function was replaced."""
+        valid = self._learned_valid.get(key)
+        if valid is None:
+            registered = self.integration_layer.registered_functions.get(intent)
+            valid = registered is not None and self.integration_layer.validate_parameters(registered[0], parameters)
+            self._learned_valid[key] = valid
+        return valid
+
+    def lookup(self, text: str) -> Optional[FastPathMatch]:
+        """
+        Returns the best fast path candidate for the text regardless of its confidence, or None.
+        """
+        if self._compiled_version != self.integration_layer.version:
+            self.compile()
+        cleaned = self.clean(text)
+        normalized = cleaned.lower()
+        learned = self.learned.get(normalized)
+        if learned is not None and self._binds(normalized, *learned):
+            self.learned.move_to_end(normalized)
+            return FastPathMatch(learned[0], dict(learned[1]), self.EXACT_CONFIDENCE, "learned")
+        return self._match_patterns(cleaned) or self._match_aliases(normalized.split(" "))
+
+    def match(self, text: str) -> Optional[FastPathMatch]:
+        """
+        Resolves the text on the fast path.
+
+        Args:
+            text (str): The user input.
+
+        Returns:
+            FastPathMatch or None: The match if its confidence reaches `min_confidence`, otherwise None.
+        """
+        start = time.perf_counter_ns()
+        candidate = self.lookup(text)
+        if candidate is not None and candidate.confidence >= self.min_confidence:
+            self.hits += 1
+            self.hit_time_ns += time.perf_counter_ns() - start
+            return candidate
+        self.misses += 1
+        self.miss_time_ns += time.perf_counter_ns() - start
+        return None
+
+    def resolve(self, text: str, fallback: Callable[[str], Tuple[str, Dict[str, Any]]], learn: bool = False):
+        """
+        Resolves the intent and parameters of the text, calling `fallback` (usually the LLM parser) on a miss.
+
+        Args:
+            text (str): The user input.
+            fallback (function): Called with the text when the fast path misses, returns (intent, parameters).
+            learn (bool): Whether to learn the parse of `fallback` if its intent is registered and its parameters
+                bind to the function, without waiting for its confirmation. By default parses are only learned by
+                calling `learn`, e.g. after the intent executed successfully.
+
+        Returns:
+            tuple: (intent, parameters)
+        """
+        found = self.match(text)
+        if found is not None:
+            return found.intent, found.parameters
+        intent, parameters = fallback(text)
+        if learn and isinstance(parameters, dict):
+            registered = self.integration_layer.registered_functions.get(intent)
+            if registered is not None and self.integration_layer.validate_parameters(registered[0], parameters):
+                self.learn(text, intent, parameters)
+        return intent, parameters
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the fast path hit rate and the average lookup latency of hits and misses in microseconds."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "avg_hit_latency_us": self.hit_time_ns / self.hits / 1000 if self.hits else 0.0,
+            "avg_miss_latency_us": self.miss_time_ns / self.misses / 1000 if self.misses else 0.0,
+        }
@@ -6,6 +6,8 @@ from typing import Any, Callable, Dict
 class IntegrationLayer:
     def __init__(self):
         self.registered_functions = {}
+        # Incremented on every registration so that derived indexes (e.g. the fast path matcher) can recompile.
+        self.version = 0
 
     def register(self, intent=None, **metadata):
         """Decorator to register functions with associated metadata."""
@@ -14,6 +16,7 @@ class IntegrationLayer:
             nonlocal intent
             intent = intent or func.__name__
             self.registered_functions[intent] = (func, metadata)
+            self.version += 1
 
             @functools.wraps(func)
             def wrapper(*args, **kwargs):
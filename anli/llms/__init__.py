@@ -1 +1,7 @@
-from .llamacpp import CombinedLlamaCpp
\ No newline at end of file
+def __getattr__(name):
+    # CombinedLlamaCpp pulls in llama.cpp, LangChain, LlamaIndex and guidance, so it is only imported on first use.
+    # This keeps light modules such as the daemon client importable without the model stack.
+    if name == "CombinedLlamaCpp":
+        from .llamacpp import CombinedLlamaCpp
+        return CombinedLlamaCpp
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,326 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from collections import deque
+
+from anli.config import DEFAULT_DAEMON_SOCKET
+
+# Frame layout: 4-byte big-endian payload length, 1-byte frame type, payload.
+# REQUEST, RESULT and ERROR payloads are JSON, TOKEN payloads are the raw UTF-8 token text.
+# A stream is TOKEN frames ended by END, or by ERROR if the model fails while decoding.
+_HEADER = struct.Struct(">IB")
+REQUEST, TOKEN, END, RESULT, ERROR, CANCEL = range(1, 7)
+
+OPERATIONS = ("generate", "stream", "embed", "select", "ping")
+
+
+def send_frame(sock, frame_type, payload=b""):
+    sock.sendall(_HEADER.pack(len(payload), frame_type) + payload)
+
+
+def recv_frame(sock):
+    """Reads one frame, returns (frame_type, payload) or (None, None) if the peer closed the connection."""
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None, None
+    length, frame_type = _HEADER.unpack(header)
+    payload = _recv_exactly(sock, length) if length else b""
+    if payload is None:
+        return None, None
+    return frame_type, payload
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = sock.recv(size - len(buffer))
+        if not data:
+            return None
+        buffer += data
+    return bytes(buffer)
+
+
+class DaemonError(RuntimeError):
+    """Raised on the client side when the daemon reports an error."""
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.pending = deque()
+        self.cancelled = threading.Event()
+        self.closed = False
+
+
+class InferenceDaemon:
+    """
+    Serves one loaded model to many ANLI processes over a Unix domain socket.
+
+    The model is any object providing `generate(prompt, **kwargs)`, `stream(prompt, **kwargs)`,
+    `embed(texts)` and `select(prompt, options, **kwargs)`, such as `CombinedLlamaCpp`.
+    A single worker thread owns the model. Requests are taken from the client connections in round-robin order,
+    one request per connection per turn, so a busy client cannot starve the others. Streams are not interleaved at
+    token level because llama.cpp keeps a single KV cache per model.
+
+    # Example usage
+    daemon = InferenceDaemon(CombinedLlamaCpp(model_path), socket_path)
+    daemon.serve_forever()
+    """
+    def __init__(self, model, socket_path=DEFAULT_DAEMON_SOCKET):
+        self.model = model
+        self.socket_path = socket_path
+        self.requests_served = 0
+        self._connections = deque()
+        self._condition = threading.Condition()
+        self._shutdown = threading.Event()
+        self._listener = None
+        self._threads = []
+
+    def start(self):
+        """Starts accepting connections and serving requests in background threads."""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.socket_path)
+        self._listener.listen()
+        for target in (self._accept_loop, self._worker_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"ANLI inference daemon listening on {self.socket_path}")
+
+    def serve_forever(self):
+        """Starts the daemon and blocks until `shutdown` is called."""
+        self.start()
+        try:
+            self._shutdown.wait()
+        except KeyboardInterrupt:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stops serving, closes all connections and removes the socket file."""
+        self._shutdown.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._listener is not None:
+            self._listener.close()
+        for connection in list(self._connections):
+            connection.closed = True
+            connection.cancelled.set()
+            connection.sock.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def _accept_loop(self):
+        while not self._shutdown.is_set():
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                break
+            connection = _Connection(sock)
+            with self._condition:
+                self._connections.append(connection)
+            threading.Thread(target=self._read_loop, args=(connection,), daemon=True).start()
+
+    def _read_loop(self, connection):
+        while True:
+            try:
+                frame_type, payload = recv_frame(connection.sock)
+            except OSError:
+                frame_type = None
+            if frame_type is None:
+                connection.closed = True
+                connection.cancelled.set()
+                break
+            if frame_type == CANCEL:
+                connection.cancelled.set()
+            elif frame_type == REQUEST:
+                with self._condition:
+                    connection.pending.append(json.loads(payload))
+                    self._condition.notify()
+        with self._condition:
+            self._condition.notify()
+
+    def _next_connection(self):
+        """Picks the next connection with pending work in round-robin order, dropping closed ones."""
+        for _ in range(len(self._connections)):
+            connection = self._connections[0]
+            self._connections.rotate(-1)
+            if connection.closed:
+                self._connections.remove(connection)
+                connection.sock.close()
+            elif connection.pending:
+                return connection
+        return None
+
+    def _worker_loop(self):
+        while not self._shutdown.is_set():
+            with self._condition:
+                connection = self._next_connection()
+                while connection is None and not self._shutdown.is_set():
+                    self._condition.wait()
+                    connection = self._next_connection()
+                if connection is None:
+                    break
+                request = connection.pending.popleft()
+                connection.cancelled.clear()
+            try:
+                self._serve(connection, request)
+            except OSError:
+                connection.closed = True
+            self.requests_served += 1
+
+    def _serve(self, connection, request):
+        op = request.get("op")
+        kwargs = request.get("kwargs", {})
+        try:
+            if op == "stream":
+                tokens = self.model.stream(request["prompt"], **kwargs)
+                try:
+                    for token in tokens:
+                        if connection.cancelled.is_set():
+                            break
+                        send_frame(connection.sock, TOKEN, token.encode("utf-8"))
+                finally:
+                    # Closing the generator stops decoding immediately.
+                    if hasattr(tokens, "close"):
+                        tokens.close()
+                send_frame(connection.sock, END)
+                return
+            if op == "generate":
+                result = self.model.generate(request["prompt"], **kwargs)
+            elif op == "embed":
+                result = [list(map(float, vector)) for vector in self.model.embed(request["texts"])]
+            elif op == "select":
+                result = self.model.select(request["prompt"], request["options"], **kwargs)
+            elif op == "ping":
+                result = "pong"
+            else:
+                raise ValueError(f"Unsupported operation: {op}. Supported: {OPERATIONS}")
+        except OSError:
+            raise
+        except Exception as e:
+            logging.exception(f"Error while serving {op}")
+            send_frame(connection.sock, ERROR, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode("utf-8"))
+            return
+        send_frame(connection.sock, RESULT, json.dumps({"result": result}).encode("utf-8"))
+
+
+class DaemonClient:
+    """
+    Client backend for a running `InferenceDaemon`, selected with `llm.type: Daemon` in config.yaml.
+
+    It offers the same `generate`, `stream`, `embed` and `select` methods as the model served by the daemon.
+    A client runs one request at a time; use one client per thread for concurrent requests.
+    """
+    def __init__(self, socket_path=DEFAULT_DAEMON_SOCKET, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._sock = sock
+        return self._sock
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _receive(self, sock):
+        frame_type, payload = recv_frame(sock)
+        if frame_type is None:
+            self.close()
+            raise ConnectionError("The inference daemon closed the connection.")
+        if frame_type == ERROR:
+            raise DaemonError(json.loads(payload)["error"])
+        return frame_type, payload
+
+    def _call(self, request):
+        with self._lock:
+            sock = self._connect()
+            send_frame(sock, REQUEST, json.dumps(request).encode("utf-8"))
+            _, payload = self._receive(sock)
+            return json.loads(payload)["result"]
+
+    def ping(self):
+        return self._call({"op": "ping"})
+
+    def generate(self, prompt, **kwargs):
+        return self._call({"op": "generate", "prompt": prompt, "kwargs": kwargs})
+
+    def embed(self, texts):
+        return self._call({"op": "embed", "texts": list(texts)})
+
+    def select(self, prompt, options, **kwargs):
+        return self._call({"op": "select", "prompt": prompt, "options": list(options), "kwargs": kwargs})
+
+    def stream(self, prompt, **kwargs):
+        """
+        Yields tokens as the daemon decodes them. Closing the generator early cancels decoding on the daemon.
+        """
+        with self._lock:
+            sock = self._connect()
+            send_frame(sock, REQUEST, json.dumps({"op": "stream", "prompt": prompt, "kwargs": kwargs}).encode("utf-8"))
+            finished = False
+            try:
+                while True:
+                    try:
+                        frame_type, payload = self._receive(sock)
+                    except DaemonError:
+                        # ERROR ends the stream like END
+                        finished = True
+                        raise
+                    except OSError:
+                        # A timeout or a broken connection leaves frames in flight, the connection is not reused
+                        finished = True
+                        self.close()
+                        raise
+                    if frame_type == END:
+                        finished = True
+                        return
+                    yield payload.decode("utf-8")
+            finally:
+                if not finished and self._sock is not None:
+                    # The consumer stopped early: drain the tokens already in flight so the connection can be reused.
+                    send_frame(sock, CANCEL)
+                    try:
+                        while self._receive(sock)[0] != END:
+                            pass
+                    except DaemonError:
+                        pass
+
+
+def main():
+    from anli.config import BaseConfig, LLMInterface
+    parser = argparse.ArgumentParser(description="Serve one ANLI model to multiple processes on this host.")
+    parser.add_argument("--config", default="config.yaml", help="config.yaml, the llm section selects the model.")
+    parser.add_argument("--socket", default=None, help=f"Unix socket path. Default: {DEFAULT_DAEMON_SOCKET}")
+    parser.add_argument("--embedding", action="store_true",
+                        help="Load the model with embeddings enabled, needed by the embed operation of llama.cpp.")
+    args = parser.parse_args()
+    llm_config = BaseConfig(config_file=args.config).config.get("llm", {})
+    if llm_config.get("type") == "Daemon":
+        # The clients' config names the daemon, the model it serves is described under llm.backend.
+        socket_path = args.socket or llm_config.get("socket_path", DEFAULT_DAEMON_SOCKET)
+        llm_config = llm_config.get("backend", {"type": "LlamaCpp"})
+    else:
+        socket_path = args.socket or DEFAULT_DAEMON_SOCKET
+    if args.embedding:
+        llm_config = {**llm_config, "embedding": True}
+    model = LLMInterface(config={"llm": llm_config}).models
+    InferenceDaemon(model, socket_path).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
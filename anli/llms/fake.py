@@ -0,0 +1,134 @@
+import hashlib
+import itertools
+import math
+import re
+import time
+
+_TOKEN = re.compile(r"\s*\S+|\s+")
+
+
+class FakeLLM:
+    """
+    A deterministic stand-in for a real model, selected with `llm.type: Fake` in config.yaml.
+
+    It needs no model download, which makes end-to-end paths (caching, batching, streaming) testable and
+    benchmarkable offline with reproducible numbers. Responses are chosen in this order:
+
+    1. The first rule whose regular expression is found in the prompt. The response may refer to groups of the
+       match (`\\1`, `\\g<name>`), or be a function of the match object.
+    2. The next scripted response, cycling through `responses`.
+    3. `default_response`.
+
+    Tokens are words with their leading whitespace. Latency is simulated as `prefill_latency` seconds per prompt
+    token before the first token, and `token_latency` seconds per generated token.
+
+    # Example usage
+    llm = FakeLLM(rules=[(r"delete (?P<name>\\S+)", "Deleted \\g<name>.")], token_latency=0.02)
+    llm.generate("please delete temp-worker")  # "Deleted temp-worker."
+    """
+    def __init__(self, responses=None, rules=None, default_response="OK.",
+                 token_latency=0.0, prefill_latency=0.0, embedding_dims=64, seed=0):
+        """
+        Args:
+            responses (list of str, optional): Scripted responses, served in order and cycled.
+            rules (list, optional): (pattern, response) pairs or {"pattern": ..., "response": ...} dicts.
+            default_response (str): The response when no rule matches and no script is given.
+            token_latency (float): Simulated decoding time per generated token, in seconds.
+            prefill_latency (float): Simulated prompt processing time per prompt token, in seconds.
+            embedding_dims (int): Dimension of the vectors returned by `embed`.
+            seed (int): Seed for the deterministic choices (embeddings, select tie-breaking).
+        """
+        self.responses = itertools.cycle(responses) if responses else None
+        self.rules = []
+        for rule in rules or []:
+            pattern, response = (rule["pattern"], rule["response"]) if isinstance(rule, dict) else rule
+            self.rules.append((re.compile(pattern, re.IGNORECASE), response))
+        self.default_response = default_response
+        self.token_latency = token_latency
+        self.prefill_latency = prefill_latency
+        self.embedding_dims = embedding_dims
+        self.seed = seed
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @staticmethod
+    def tokenize(text):
+        return _TOKEN.findall(text)
+
+    def respond(self, prompt):
+        """Returns the full response text for the prompt, without simulating latency."""
+        for pattern, response in self.rules:
+            found = pattern.search(prompt)
+            if found is not None:
+                return response(found) if callable(response) else found.expand(response)
+        if self.responses is not None:
+            return next(self.responses)
+        return self.default_response
+
+    def _prefill(self, prompt):
+        self.calls += 1
+        prompt_tokens = len(self.tokenize(prompt))
+        self.prompt_tokens += prompt_tokens
+        if self.prefill_latency:
+            time.sleep(self.prefill_latency * prompt_tokens)
+
+    def stream(self, prompt, max_tokens=256, stop=None, **kwargs):
+        """Yields the response token by token, stopping before any of the `stop` strings."""
+        self._prefill(prompt)
+        text = self.respond(prompt)
+        if stop:
+            for stop_string in [stop] if isinstance(stop, str) else stop:
+                position = text.find(stop_string)
+                if position >= 0:
+                    text = text[:position]
+        for token in self.tokenize(text)[:max_tokens]:
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            self.completion_tokens += 1
+            yield token
+
+    def generate(self, prompt, max_tokens=256, stop=None, **kwargs):
+        return "".join(self.stream(prompt, max_tokens=max_tokens, stop=stop))
+
+    def select(self, prompt, options, **kwargs):
+        """
+        Returns the option produced by the rules if it is one of the options, otherwise the option sharing the most
+        words with the prompt, ties broken deterministically by the seed.
+        """
+        self._prefill(prompt)
+        options = list(options)
+        for pattern, response in self.rules:
+            found = pattern.search(prompt)
+            if found is not None:
+                chosen = response(found) if callable(response) else found.expand(response)
+                if chosen in options:
+                    break
+        else:
+            words = set(prompt.lower().split())
+            chosen = max(options, key=lambda option: (len(words & set(option.lower().split())),
+                                                      self._hash(f"{prompt}\x00{option}")))
+        tokens = len(self.tokenize(chosen))
+        self.completion_tokens += tokens
+        if self.token_latency:
+            time.sleep(self.token_latency * tokens)
+        return chosen
+
+    def _hash(self, text):
+        digest = hashlib.blake2b(f"{self.seed}\x00{text}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def embed(self, texts):
+        """
+        Embeds texts by hashing their words into `embedding_dims` signed buckets and normalizing to unit length,
+        so texts sharing words have a higher cosine similarity.
+        """
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.embedding_dims
+            for word in text.lower().split():
+                h = self._hash(word)
+                vector[h % self.embedding_dims] += 1.0 if (h >> 32) & 1 else -1.0
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            vectors.append([v / norm for v in vector])
+        return vectors
@@ -1,8 +1,7 @@
-from huggingface_hub import hf_hub_download
+import json
 from guidance import models
 from langchain.llms import LlamaCpp as LC_LlamaCpp
 from llama_index.llms import LlamaCPP as LI_LlamaCpp
-from anli.config import DEFAULT_MODEL_IDENTIFIER, DEFAULT_MODEL_FILENAME
 
 class CombinedLlamaCpp:
     def __init__(self, model_path,
@@ -21,15 +20,14 @@ class CombinedLlamaCpp:
             klc.update(lc_kwargs)
         self.LC_llm = LC_LlamaCpp(**klc)
 
-        dummy_model_path = hf_hub_download(repo_id=DEFAULT_MODEL_IDENTIFIER, filename=DEFAULT_MODEL_FILENAME)
-
         if li_kwargs is not None:
             kli = li_kwargs
         else:
             kli = {}
-        kli["model_kwargs"] = {"n_gpu_layers": 0}
-        # We will first load a dummy model on cpu to get the model config
-        self.LI_llm = LI_LlamaCpp(model_path=dummy_model_path, **kli)
+        kli["model_kwargs"] = {"n_gpu_layers": 0, "vocab_only": True}
+        # We will first load a dummy model on cpu to get the model config. Only the vocabulary of the same file is
+        # loaded, so no other model has to be downloaded and no weights are read twice.
+        self.LI_llm = LI_LlamaCpp(model_path=model_path, **kli)
         # Then we will replace it with the actual model on the gpu:
         del self.LI_llm._model
         self.LI_llm._model = self.LC_llm.client
@@ -37,3 +35,41 @@ class CombinedLlamaCpp:
         # guidance can load model object directly:
         self.GU_llm = models.LlamaCpp(self.LC_llm.client)
         self.GU_chat = models.LlamaCppChat(self.LC_llm.client)
+
+    @property
+    def client(self):
+        """The underlying llama_cpp.Llama object shared by all three frameworks."""
+        return self.LC_llm.client
+
+    def generate(self, prompt, max_tokens=256, stop=None, **kwargs):
+        """Generates a completion for the prompt and returns it as a string."""
+        output = self.client(prompt, max_tokens=max_tokens, stop=stop, **kwargs)
+        return output["choices"][0]["text"]
+
+    def stream(self, prompt, max_tokens=256, stop=None, **kwargs):
+        """
+        Generates a completion for the prompt, yielding tokens as they are decoded.
+        Closing the generator stops decoding.
+        """
+        for chunk in self.client(prompt, max_tokens=max_tokens, stop=stop, stream=True, **kwargs):
+            yield chunk["choices"][0]["text"]
+
+    def embed(self, texts):
+        """
+        Embeds a list of texts. The model must be loaded with `model_kwargs={"embedding": True}`.
+        """
+        output = self.client.create_embedding(list(texts))
+        return [item["embedding"] for item in output["data"]]
+
+    def select(self, prompt, options, **kwargs):
+        """
+        Constrains the completion of the prompt to one of the options with a GBNF grammar and returns the option.
+        """
+        from llama_cpp import LlamaGrammar
+        options = list(options)
+        alternatives = " | ".join(json.dumps(option) for option in options)
+        grammar = LlamaGrammar.from_string(f"root ::= {alternatives}", verbose=False)
+        max_tokens = max(len(self.client.tokenize(option.encode("utf-8"), add_bos=False)) for option in options)
+        text = self.generate(prompt, max_tokens=max_tokens + 1, grammar=grammar, **kwargs).strip()
+        # The grammar guarantees an exact option unless generation was cut short.
+        return text if text in options else next((o for o in options if o.startswith(text)), options[0])
@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+_END = object()
+
+
+class _Error:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class _Channel:
+    """
+    Bounded buffer between the decoding thread and the consumer.
+    It is kept separate from TokenStream so that the decoding thread does not keep the stream object alive,
+    which lets a dropped stream cancel decoding when it is garbage collected.
+    """
+    def __init__(self, max_queue):
+        self.max_queue = max_queue
+        self.buffer = deque()
+        self.condition = threading.Condition()
+        self.cancelled = False
+        self.loop = None
+        self.ready = None
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.token_count = 0
+
+    def put(self, item):
+        """Blocks while the buffer is full. Returns False if the stream was cancelled."""
+        with self.condition:
+            while len(self.buffer) >= self.max_queue and not self.cancelled:
+                self.condition.wait()
+            if self.cancelled:
+                return False
+            self.buffer.append(item)
+            self.condition.notify_all()
+            loop, ready = self.loop, self.ready
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # The consumer's event loop is closed, nobody is listening anymore.
+                self.cancel()
+                return False
+        return True
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.buffer.clear()
+            self.condition.notify_all()
+
+
+def _produce(tokens, channel):
+    try:
+        for token in tokens:
+            if channel.first_token_at is None:
+                channel.first_token_at = time.perf_counter()
+            channel.token_count += 1
+            if not channel.put(token):
+                break
+    except Exception as e:
+        channel.put(_Error(e))
+    finally:
+        # Closing the generator stops decoding immediately when the stream is cancelled.
+        if hasattr(tokens, "close"):
+            tokens.close()
+        channel.finished_at = time.perf_counter()
+        channel.put(_END)
+
+
+class TokenStream:
+    """
+    Delivers tokens from a decoding generator (e.g. `CombinedLlamaCpp.stream`) as they are produced.
+
+    Decoding runs in a background thread and hands tokens over through a bounded buffer of `max_queue` tokens,
+    so a slow consumer pauses decoding instead of letting tokens pile up in memory. The stream can be consumed with
+    `for` or `async for`, and `cancel` (also called when leaving a `with` block or when the stream is dropped) stops
+    decoding at the next token.
+
+    # Example usage
+    with llm.stream("Tell me a joke") as tokens:
+        for token in tokens:
+            print(token, end="")
+    print(tokens.time_to_first_token)
+
+    async for token in llm.astream("Tell me a joke"):
+        await websocket.send(token)
+    """
+    def __init__(self, tokens, max_queue: int = 32):
+        """
+        Args:
+            tokens (iterator): An iterator of tokens, started in the background immediately.
+            max_queue (int): Maximum number of decoded tokens waiting for the consumer.
+        """
+        self._channel = _Channel(max_queue)
+        self._thread = threading.Thread(target=_produce, args=(iter(tokens), self._channel), daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stops decoding. Tokens already buffered are discarded."""
+        self._channel.cancel()
+
+    @property
+    def cancelled(self):
+        return self._channel.cancelled
+
+    @property
+    def time_to_first_token(self):
+        """Seconds from the start of the stream to the first decoded token, or None if none was decoded yet."""
+        if self._channel.first_token_at is None:
+            return None
+        return self._channel.first_token_at - self._channel.started_at
+
+    def metrics(self):
+        """Returns the time to first token, the number of tokens and the decoding rate of the stream."""
+        channel = self._channel
+        end = channel.finished_at or time.perf_counter()
+        decoding_time = end - channel.first_token_at if channel.first_token_at is not None else 0.0
+        return {
+            "time_to_first_token": self.time_to_first_token,
+            "token_count": channel.token_count,
+            "tokens_per_second": (channel.token_count - 1) / decoding_time if decoding_time > 0 else None,
+            "total_time": end - channel.started_at,
+        }
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        channel = self._channel
+        with channel.condition:
+            while not channel.buffer:
+                if channel.cancelled:
+                    raise StopIteration
+                channel.condition.wait()
+            if channel.buffer[0] is _END:
+                raise StopIteration
+            item = channel.buffer.popleft()
+            channel.condition.notify_all()
+        if isinstance(item, _Error):
+            raise item.exception
+        return item
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        channel = self._channel
+        if channel.loop is None:
+            with channel.condition:
+                channel.loop = asyncio.get_running_loop()
+                channel.ready = asyncio.Event()
+        try:
+            while True:
+                with channel.condition:
+                    if channel.buffer:
+                        if channel.buffer[0] is _END:
+                            raise StopAsyncIteration
+                        item = channel.buffer.popleft()
+                        channel.condition.notify_all()
+                        break
+                    if channel.cancelled:
+                        raise StopAsyncIteration
+                    channel.ready.clear()
+                await channel.ready.wait()
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        if isinstance(item, _Error):
+            raise item.exception
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.cancel()
+
+    def __del__(self):
+        self._channel.cancel()
@@ -1,5 +1,277 @@
+import logging
+import re
+import string
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+_FORMATTER = string.Formatter()
+
+
+class ResponseTemplate:
+    """
+    A response template such as "Deleted pod {name}.", parsed once into literal text and fields.
+
+    Fields use the `str.format` syntax, including attribute and index access and format specs, e.g.
+    "{result[count]} pods restarted in {elapsed:.1f} s". With `bare_fields`, for phrasings written by the LLM from
+    user-controlled values, only `{name}` fields are allowed, so a phrasing cannot reach other objects through
+    attributes or indexes.
+    """
+    __slots__ = ("text", "parts", "fields")
+
+    def __init__(self, text: str, bare_fields: bool = False):
+        self.text = text
+        self.parts = []
+        self.fields = set()
+        for literal, field, spec, conversion in _FORMATTER.parse(text):
+            if field is not None:
+                if not field or field.isdigit():
+                    raise ValueError(f"Positional field in response template: {text!r}")
+                if "{" in spec:
+                    raise ValueError(f"Nested field in response template: {text!r}")
+                if bare_fields and (not field.isidentifier() or spec or conversion):
+                    raise ValueError(f"Only {{name}} fields are allowed, not {{{field}}}: {text!r}")
+                self.fields.add(_root(field))
+            self.parts.append((literal, field, spec, conversion))
+
+    def render(self, values: Dict[str, Any]) -> str:
+        """Renders the template, raises KeyError, AttributeError or IndexError if a field is not in `values`."""
+        pieces = []
+        for literal, field, spec, conversion in self.parts:
+            pieces.append(literal)
+            if field is not None:
+                value = _FORMATTER.get_field(field, (), values)[0]
+                if conversion:
+                    value = _FORMATTER.convert_field(value, conversion)
+                pieces.append(format(value, spec))
+        return "".join(pieces)
+
+
+def _root(field: str) -> str:
+    """The variable of a field, e.g. "result" for "result[count]" or "result.name"."""
+    for index, character in enumerate(field):
+        if character in ".[":
+            return field[:index]
+    return field
+
+
+def _bucket(value) -> str:
+    """The part of a value that changes the phrasing of a response: its type, and its size or sign."""
+    if isinstance(value, bool) or value is None:
+        return repr(value)
+    if isinstance(value, (int, float)):
+        return "zero" if value == 0 else "one" if value == 1 else "many"
+    if isinstance(value, (list, tuple, set, dict)):
+        return f"{type(value).__name__}:" + ("empty" if not value else "one" if len(value) == 1 else "many")
+    return type(value).__name__
+
+
+def _literals(value) -> List[str]:
+    """The texts of a value an LLM could copy into a phrasing instead of writing its placeholder."""
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # 0 and 1 are part of the shape of the values
+        return [] if value in (0, 1) else [str(value)]
+    if isinstance(value, (list, tuple, set)):
+        return [literal for item in value for literal in _literals(item)]
+    return []
+
+
 class ResponsesGenerator:
-    def generate(self, dialog_context, action_result):
-        # Code to generate a natural language response.
-        pass
-    
\ No newline at end of file
+    """
+    Phrases the outcome of an executed intent for the user, without calling the LLM in the common case.
+
+    Templates are declared with the metadata given to `IntegrationLayer.register`:
+
+    - `response_template="Deleted pod {name}."`: rendered from the parameters of the intent, `result` (the value
+      returned by its function), the keys of the result if it is a dict, `intent` and `action` (the intent in
+      words). Templates are parsed once, when the registry changes, and rendering takes microseconds.
+    - `response_generative=True`: the template is only an example, the LLM phrases the response.
+
+    The LLM is used only for errors, clarifications and generative templates. It is asked for a phrasing with
+    placeholders instead of values, which is cached per intent and result shape (the type and size of each value),
+    so recurring outcomes such as "no pods found" or "3 pods found" are phrased once. Without an LLM, or when its
+    phrasing is unusable, the default templates below are rendered.
+
+    # Example usage
+    @integration_layer.register(intent="delete_pod", response_template="Deleted pod {name}.")
+    def delete_pod(name: str): ...
+    generator = ResponsesGenerator(integration_layer, llm=llm)
+    text = generator.generate({"intent": "delete_pod", "parameters": {"name": "temp-worker"}}, None)
+    """
+    DEFAULT_TEMPLATE = "{result}"
+    DONE_TEMPLATE = "Done."
+    ERROR_TEMPLATE = "Sorry, {action} failed: {error}"
+    CLARIFICATION_TEMPLATE = "Please provide the {missing} to {action}."
+
+    def __init__(self, integration_layer, llm=None, max_cached: int = 10000, max_tokens: int = 64):
+        """
+        Initializes the generator for the functions registered in `integration_layer`.
+
+        Args:
+            integration_layer (IntegrationLayer): The registry to compile response templates from.
+            llm (optional): A model with a `generate(prompt, max_tokens)` method, e.g. `LLMInterface().models`.
+            max_cached (int): Maximum number of cached LLM phrasings, the least recently used ones are evicted.
+            max_tokens (int): Maximum number of tokens of an LLM phrasing.
+        """
+        self.integration_layer = integration_layer
+        self.llm = llm
+        self.max_cached = max_cached
+        self.max_tokens = max_tokens
+        self.templates = {}
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.defaults = {name: ResponseTemplate(getattr(self, name))
+                         for name in ("DEFAULT_TEMPLATE", "DONE_TEMPLATE", "ERROR_TEMPLATE", "CLARIFICATION_TEMPLATE")}
+        self._compiled_version = None
+        self.rendered = 0
+        self.cache_hits = 0
+        self.llm_calls = 0
+
+    def compile(self):
+        """(Re)compiles the response templates of the registered functions."""
+        templates = {}
+        for intent, (func, metadata) in self.integration_layer.registered_functions.items():
+            text = metadata.get("response_template")
+            if text is not None:
+                templates[intent] = (ResponseTemplate(text), bool(metadata.get("response_generative", False)))
+        self.templates = templates
+        with self.lock:
+            self.cache.clear()
+        self._compiled_version = self.integration_layer.version
+
+    @staticmethod
+    def values(intent: str, parameters: Dict[str, Any], result: Any = None) -> Dict[str, Any]:
+        """The values a template is rendered from, see above."""
+        values = {"action": intent.replace("_", " ")}
+        if isinstance(result, dict):
+            values.update((key, value) for key, value in result.items() if isinstance(key, str))
+        values.update(parameters)
+        values["intent"] = intent
+        values["result"] = result
+        return values
+
+    def generate(self, dialog_context: Dict[str, Any], action_result: Any) -> str:
+        """
+        Returns the response to the user.
+
+        Args:
+            dialog_context (dict): The parse of the user input: {"intent", "parameters"}, with "missing" listing the
+                required parameters the user did not give if the intent could not be executed.
+            action_result: The value returned by the function of the intent, or the exception it raised.
+
+        Returns:
+            str: The response.
+        """
+        if self._compiled_version != self.integration_layer.version:
+            self.compile()
+        intent = dialog_context.get("intent") or ""
+        parameters = dialog_context.get("parameters") or {}
+        missing = dialog_context.get("missing")
+        if missing:
+            values = self.values(intent, parameters)
+            values["missing"] = " and ".join(missing)
+            return self._phrase("clarification", intent, values, self.defaults["CLARIFICATION_TEMPLATE"],
+                                f"Ask the user for the missing {values['missing']}.")
+        if isinstance(action_result, BaseException):
+            values = self.values(intent, parameters)
+            values["error"] = str(action_result) or type(action_result).__name__
+            error_type = type(action_result).__name__
+            return self._phrase(f"error:{error_type}", intent, values, self.defaults["ERROR_TEMPLATE"],
+                                f"Tell the user the action failed with {error_type}.")
+
+        values = self.values(intent, parameters, action_result)
+        template, generative = self.templates.get(intent, (None, False))
+        if template is not None and not generative:
+            try:
+                text = template.render(values)
+                self.rendered += 1
+                return text
+            except (KeyError, AttributeError, IndexError, TypeError, ValueError) as error:
+                logging.warning(f"Response template of {intent} does not render: {error!r}")
+                template = None
+        if template is None:
+            return self._render(self.defaults["DEFAULT_TEMPLATE" if action_result is not None else "DONE_TEMPLATE"],
+                                values)
+        return self._phrase("result", intent, values, template,
+                            f"Confirm the outcome to the user, like: {template.text}")
+
+    def _render(self, template: ResponseTemplate, values: Dict[str, Any]) -> str:
+        try:
+            text = template.render(values)
+        except (KeyError, AttributeError, IndexError, TypeError, ValueError):
+            text = str(values["result"])
+        self.rendered += 1
+        return text
+
+    @staticmethod
+    def shape(kind: str, intent: str, values: Dict[str, Any]) -> Tuple:
+        """The cache key of an LLM phrasing: what changes its wording, not the values themselves."""
+        return (kind, intent) + tuple(sorted((name, _bucket(value)) for name, value in values.items()
+                                             if name not in ("action", "intent", "missing")))
+
+    def _phrase(self, kind: str, intent: str, values: Dict[str, Any], default: ResponseTemplate,
+                instruction: str) -> str:
+        """Renders the cached LLM phrasing for the shape of the values, asking the LLM for it on a miss."""
+        if self.llm is None:
+            return self._render(default, values)
+        key = self.shape(kind, intent, values)
+        with self.lock:
+            template = self.cache.get(key)
+            if template is not None:
+                self.cache.move_to_end(key)
+        if template is not None:
+            self.cache_hits += 1
+            return self._render(template, values)
+
+        names = [name for name in values if name != "intent"]
+        self.llm_calls += 1
+        text = self.llm.generate(self._prompt(kind, intent, values, names, instruction),
+                                 max_tokens=self.max_tokens).strip()
+        try:
+            template = ResponseTemplate(text, bare_fields=True)
+            if not text or not template.fields <= set(names):
+                raise ValueError(f"Unknown fields {template.fields - set(names)}")
+            rendered = template.render(values)
+        except (KeyError, AttributeError, IndexError, TypeError, ValueError) as error:
+            logging.warning(f"Unusable LLM phrasing for {intent}: {text!r} ({error!r})")
+            return self._render(default, values)
+        if not self._reusable(template, values):
+            logging.debug(f"LLM phrasing for {intent} contains values, not cached: {text!r}")
+            return rendered
+        with self.lock:
+            self.cache[key] = template
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return rendered
+
+    @staticmethod
+    def _reusable(template: ResponseTemplate, values: Dict[str, Any]) -> bool:
+        """Whether a phrasing can be rendered for other values of the same shape: it copies none of the values."""
+        text = "".join(literal for literal, _, _, _ in template.parts)
+        for name, value in values.items():
+            if name in ("action", "intent"):
+                continue
+            for literal in _literals(value):
+                if re.search(rf"(?<!\w){re.escape(literal)}(?!\w)", text, re.IGNORECASE):
+                    return False
+        return True
+
+    @staticmethod
+    def _prompt(kind: str, intent: str, values: Dict[str, Any], names: List[str], instruction: str,
+                max_value_length: int = 80) -> str:
+        lines = []
+        for name in names:
+            value = repr(values[name])
+            if len(value) > max_value_length:
+                value = value[:max_value_length] + "..."
+            lines.append(f"{{{name}}} = {value}")
+        return (f"Write one short sentence answering the user of an assistant. {instruction} Write the placeholders "
+                f"below instead of their values, so the sentence can be reused for other values.\n\n"
+                f"Intent: {intent}\nOutcome: {kind}\n" + "\n".join(lines) + "\n\nSentence:")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of responses rendered from a template, of cached LLM phrasings used and of LLM calls."""
+        return {"rendered": self.rendered, "cache_hits": self.cache_hits, "llm_calls": self.llm_calls,
+                "cached": len(self.cache)}
@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from anli.config import DEFAULT_DATA_PATH
+from anli.dialog_manager import DialogManager
+
+
+class SqliteSessionBackend:
+    """
+    Persists serialized sessions in a local sqlite file. Each thread uses its own connection and the file is in WAL
+    mode, so the sessions loaded by different shards are read concurrently while the write-behind thread writes.
+    """
+    def __init__(self, path=None, ttl=None):
+        """
+        :param path: The sqlite file, by default "sessions.sqlite" in the package data directory.
+        :param ttl: Seconds after its last write a persisted session expires, None to keep it.
+        """
+        self.path = path if path is not None else os.path.join(DEFAULT_DATA_PATH, "sessions.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.ttl = ttl
+        self.local = threading.local()
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL)")
+        db.commit()
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def load(self, session_id):
+        """Returns the serialized session, or None if it was not persisted or expired."""
+        row = self._db().execute("SELECT state, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or (self.ttl is not None and row[1] < time.time() - self.ttl):
+            return None
+        return row[0]
+
+    def save_many(self, states):
+        """Writes {session_id: serialized session} in one transaction, and drops the expired sessions."""
+        db = self._db()
+        now = time.time()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO sessions (id, state, updated) VALUES (?, ?, ?)",
+                           [(session_id, state, now) for session_id, state in states.items()])
+            if self.ttl is not None:
+                db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+
+    def delete_many(self, session_ids):
+        db = self._db()
+        with db:
+            db.executemany("DELETE FROM sessions WHERE id = ?", [(session_id,) for session_id in session_ids])
+
+
+class RedisSessionBackend:
+    """Persists serialized sessions in Redis, one string key per session, expiring with `ttl`."""
+    def __init__(self, redis_url="redis://localhost:6379", redis_config=None, prefix="anli_session:", ttl=None,
+                 **kwargs):
+        """
+        :param redis_url: The Redis URL.
+        :param redis_config: An optional RedisConfig, its url and connection pool settings replace redis_url.
+        :param prefix: The prefix of the session keys.
+        :param ttl: Seconds after its last write a persisted session expires, None to keep it.
+        :param kwargs: Connection settings, e.g. max_connections or socket_timeout.
+        """
+        import redis
+        from anli.utils.redis_pool import get_connection_pool
+        if redis_config is not None:
+            redis_url = redis_config.redis_url
+            kwargs = {**redis_config.connection_kwargs(), **kwargs}
+        self.client = redis.Redis(connection_pool=get_connection_pool(redis_url, **kwargs))
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def load(self, session_id):
+        """Returns the serialized session, or None if it was not persisted or expired."""
+        state = self.client.get(f"{self.prefix}{session_id}")
+        return state.decode() if state is not None else None
+
+    def save_many(self, states):
+        """Writes {session_id: serialized session} in one round trip."""
+        pipeline = self.client.pipeline(transaction=False)
+        for session_id, state in states.items():
+            pipeline.set(f"{self.prefix}{session_id}", state, ex=self.ttl)
+        pipeline.execute()
+
+    def delete_many(self, session_ids):
+        if session_ids:
+            self.client.delete(*[f"{self.prefix}{session_id}" for session_id in session_ids])
+
+
+class _Session:
+    """A resident session: its DialogManager, the lock serializing its messages and its bookkeeping."""
+    __slots__ = ("dialog", "lock", "users", "last_used", "size")
+
+    def __init__(self, dialog, size):
+        self.dialog = dialog
+        self.lock = threading.Lock()
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.size = size
+
+
+class _Shard:
+    """The sessions of one shard, least recently used first, and their writes waiting for the backend."""
+    __slots__ = ("lock", "sessions", "dirty", "pending", "flushing", "size")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+        self.dirty = set()
+        self.pending = {}
+        self.flushing = {}
+        self.size = 0
+
+
+class SessionStore:
+    """
+    Keeps the DialogManager of many concurrent sessions with bounded memory.
+
+    Sessions are spread over `shards` shards by id, each with its own lock, so messages of different sessions
+    rarely wait for each other and never for a global lock; messages of one session are serialized by its own lock.
+    A session is evicted when it has been idle for `idle_ttl` seconds, and the least recently used sessions of a
+    shard are evicted when the shard holds more than its share of `max_bytes`. The memory of a session is estimated
+    from its serialized size when it was last written.
+
+    Changed sessions are written behind: a background thread serializes them every `flush_interval` seconds and
+    writes them to the backend in one batch. Evicted sessions are written by the same thread. A session that is not
+    resident is lazily rehydrated from its waiting write or from the backend on its next message, else created by
+    `factory`.
+
+    # Example usage
+    store = SessionStore(factory=lambda: DialogManager(summarizer=llm_summarizer(llm)),
+                         backend=RedisSessionBackend(redis_config=RedisConfig()), idle_ttl=900)
+    with store.session(session_id) as dialog:
+        dialog.manage_context(user_input, nlu_output)
+        prompt = dialog.build_prompt()
+    store.close()
+    """
+    def __init__(self, factory=DialogManager, backend=None, shards=64, idle_ttl=1800, max_bytes=256 * 2 ** 20,
+                 session_overhead=4096, flush_interval=1.0):
+        """
+        :param factory: A function returning a new DialogManager, with the settings and functions of the sessions.
+        :param backend: A SqliteSessionBackend or RedisSessionBackend, by default a SqliteSessionBackend in the
+        package data directory.
+        :param shards: Number of shards.
+        :param idle_ttl: Seconds a session stays resident after its last message, None to keep it until memory is
+        needed.
+        :param max_bytes: Estimated memory of the resident sessions, across the shards.
+        :param session_overhead: Bytes added to the serialized size of each session for its objects.
+        :param flush_interval: Seconds between two writes of the changed sessions, None to write them only on
+        `flush` and `close`.
+        """
+        self.factory = factory
+        self.backend = backend if backend is not None else SqliteSessionBackend()
+        self.shards = [_Shard() for _ in range(shards)]
+        self.idle_ttl = idle_ttl
+        self.shard_bytes = max_bytes / shards
+        self.session_overhead = session_overhead
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = None
+        if flush_interval is not None:
+            self.flusher = threading.Thread(target=self._write_behind, args=(flush_interval,), daemon=True)
+            self.flusher.start()
+
+    def _shard(self, session_id):
+        return self.shards[hash(session_id) % len(self.shards)]
+
+    def __len__(self):
+        return sum(len(shard.sessions) for shard in self.shards)
+
+    def __contains__(self, session_id):
+        return session_id in self._shard(session_id).sessions
+
+    def _load(self, shard, session_id):
+        """
+        Rehydrates a session, from its newest write if it is still waiting for the backend. The shard is locked, the
+        other shards are not.
+        """
+        state = shard.pending.get(session_id)
+        if state is None:
+            state = shard.flushing.get(session_id)
+        if state is None:
+            state = self.backend.load(session_id)
+        dialog = self.factory()
+        if state is None:
+            return _Session(dialog, self.session_overhead)
+        return _Session(dialog.restore(json.loads(state)), len(state) + self.session_overhead)
+
+    @contextmanager
+    def session(self, session_id):
+        """
+        Returns a context manager holding the DialogManager of a session, rehydrated or created if needed. Other
+        messages of the session wait until it exits, then the session is marked for the next write.
+        """
+        shard = self._shard(session_id)
+        with shard.lock:
+            entry = shard.sessions.get(session_id)
+            if entry is None:
+                entry = shard.sessions[session_id] = self._load(shard, session_id)
+                shard.size += entry.size
+            else:
+                shard.sessions.move_to_end(session_id)
+            entry.users += 1
+        try:
+            with entry.lock:
+                yield entry.dialog
+        finally:
+            with shard.lock:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+                if shard.sessions.get(session_id) is entry:
+                    shard.dirty.add(session_id)
+                    self._evict(shard)
+
+    def _evict(self, shard, now=None):
+        """Evicts the idle sessions and the least recently used ones over the memory share, with the shard locked."""
+        victims = []
+        size = shard.size
+        # From the least recently used, stopping at the first session to keep
+        for session_id, entry in shard.sessions.items():
+            idle = self.idle_ttl is not None and now is not None and now - entry.last_used >= self.idle_ttl
+            if not idle and size <= self.shard_bytes:
+                break
+            if entry.users or (len(shard.sessions) - len(victims) == 1 and not idle):
+                continue
+            victims.append((session_id, entry))
+            size -= entry.size
+        for session_id, entry in victims:
+            del shard.sessions[session_id]
+            shard.size -= entry.size
+            if session_id in shard.dirty:
+                shard.dirty.discard(session_id)
+                shard.pending[session_id] = json.dumps(entry.dialog.state())
+
+    def evict_idle(self):
+        """Evicts the sessions idle for `idle_ttl` seconds, done by the write-behind thread before each write."""
+        now = time.monotonic()
+        for shard in self.shards:
+            with shard.lock:
+                self._evict(shard, now)
+
+    def flush(self):
+        """
+        Writes the changed and evicted sessions to the backend. The writes of a shard that fails wait for the next
+        flush, the other shards are written, then the first error is raised.
+        """
+        failure = None
+        with self.flush_lock:
+            for shard in self.shards:
+                with shard.lock:
+                    entries = [(session_id, shard.sessions[session_id]) for session_id in shard.dirty]
+                    shard.dirty = set()
+                    for _, entry in entries:
+                        entry.users += 1
+                    states = shard.flushing = shard.pending
+                    shard.pending = {}
+                for session_id, entry in entries:
+                    with entry.lock:
+                        state = json.dumps(entry.dialog.state())
+                    with shard.lock:
+                        entry.users -= 1
+                        shard.size += len(state) + self.session_overhead - entry.size
+                        entry.size = len(state) + self.session_overhead
+                    states[session_id] = state
+                try:
+                    if states:
+                        self.backend.save_many(states)
+                except Exception as error:
+                    failure = failure or error
+                    with shard.lock:
+                        # The writes queued during the flush are newer
+                        shard.pending = {**states, **shard.pending}
+                with shard.lock:
+                    shard.flushing = {}
+        if failure is not None:
+            raise failure
+
+    def delete(self, session_id):
+        """Forgets a session, resident or persisted."""
+        shard = self._shard(session_id)
+        with self.flush_lock:
+            with shard.lock:
+                entry = shard.sessions.pop(session_id, None)
+                if entry is not None:
+                    shard.size -= entry.size
+                shard.dirty.discard(session_id)
+                shard.pending.pop(session_id, None)
+            self.backend.delete_many([session_id])
+
+    def _write_behind(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.evict_idle()
+                self.flush()
+            except Exception:
+                logging.exception("Writing the sessions failed, retrying at the next flush.")
+
+    def close(self):
+        """Stops the write-behind thread and writes the changed sessions."""
+        self.stopped.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
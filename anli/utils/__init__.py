@@ -1,2 +1,10 @@
 from .redis_vector_store import RedisVectorStoreForJSON
-from .stream_sentence import StreamSentence
\ No newline at end of file
+from .async_redis_vector_store import AsyncRedisVectorStoreForJSON
+from .embedding_cache import EmbeddingCache
+from .embedding_engine import EmbeddingEngine, get_embedding_engine
+from .embedding_dispatcher import EmbeddingDispatcher
+from .vector_filters import VectorFilter
+from .lexical_index import LexicalIndex
+from .dedup import Deduplicator
+from .local_vector_store import LocalVectorStoreForJSON
+from .stream_sentence import StreamSentence, AsyncStreamSentence
\ No newline at end of file
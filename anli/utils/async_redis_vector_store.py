@@ -0,0 +1,232 @@
+import asyncio
+import functools
+import weakref
+from uuid import uuid4
+
+import redis.asyncio
+
+from anli.utils.context_window import afetch_context_windows, hit_location
+from anli.utils.lexical_index import fuse_results
+from anli.utils.redis_pool import get_async_connection_pool
+from anli.utils.redis_vector_store import RedisVectorStoreForJSON
+
+
+class AsyncRedisVectorStoreForJSON:
+    """
+    An asyncio variant of RedisVectorStoreForJSON, for event-loop front-ends serving many sessions.
+
+    Redis commands go through redis.asyncio on a connection pool shared by all async stores with the same url and
+    settings on the running event loop, so concurrent calls overlap their network waits. Embeddings are computed in
+    an executor so that they do not block the event loop. The vector index is created and configured by a
+    RedisVectorStoreForJSON with the same arguments, and the stored records are the same, so both variants can be
+    used on the same index.
+
+    # Example usage
+    store = AsyncRedisVectorStoreForJSON("conversations", redis_config=RedisConfig())
+    await store.upsert_item(conversation, "$.conversation[?(@.role == 'user')].content", 1)
+    hits = await store.search_item("delete the pod", num_results=3)
+    windows = await store.get_context_windows(hits, -1, 2)
+    """
+    # The synchronous store creating the vector index and preparing the records
+    store_class = RedisVectorStoreForJSON
+
+    def __init__(self, index_name, default_semantic_distance_threshold=0.1,
+                 redis_url="redis://localhost:6379", vectorizer=None, embedding_cache=None, redis_config=None,
+                 filter_fields=None, lexical_index=None, deduplicator=None, executor=None, redis_client=None,
+                 async_redis_client=None, **kwargs):
+        """
+        Creates an AsyncRedisVectorStoreForJSON object.
+        :param index_name: See RedisVectorStoreForJSON.
+        :param default_semantic_distance_threshold: See RedisVectorStoreForJSON.
+        :param redis_url: See RedisVectorStoreForJSON.
+        :param vectorizer: See RedisVectorStoreForJSON.
+        :param embedding_cache: See RedisVectorStoreForJSON.
+        :param redis_config: See RedisVectorStoreForJSON.
+        :param filter_fields: See RedisVectorStoreForJSON.
+        :param lexical_index: See RedisVectorStoreForJSON.
+        :param deduplicator: See RedisVectorStoreForJSON.
+        :param executor: The concurrent.futures executor running the vectorizer, None for the loop's default.
+        :param redis_client: See RedisVectorStoreForJSON, the synchronous client creating the vector index.
+        :param async_redis_client: An optional redis.asyncio client used on every event loop instead of the clients
+        of the shared connection pools of redis_url.
+        """
+        self.store = self.store_class(index_name, default_semantic_distance_threshold, redis_url, vectorizer,
+                                      embedding_cache, redis_config, filter_fields,
+                                      lexical_index, deduplicator, redis_client, **kwargs)
+        if redis_config is not None:
+            redis_url = redis_config.redis_url
+            kwargs = {**redis_config.connection_kwargs(), **kwargs}
+        self.redis_url = redis_url
+        self.connection_kwargs = kwargs
+        self._clients = weakref.WeakKeyDictionary()
+        self.async_redis_client = async_redis_client
+        self.index_name = index_name
+        self.executor = executor
+
+    @property
+    def client(self):
+        """The redis.asyncio client of the running event loop, a store can be used from several loops."""
+        if self.async_redis_client is not None:
+            return self.async_redis_client
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            pool = get_async_connection_pool(self.redis_url, **self.connection_kwargs)
+            client = self._clients[loop] = redis.asyncio.Redis(connection_pool=pool)
+        return client
+
+    @property
+    def vector_index(self):
+        return self.store.vector_index
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def upsert_item(self, json_data: dict,
+                          json_prompt_paths: [str] = None,
+                          response_relative_position: int = None,
+                          json_storage_id_suffix: str = None,
+                          json_storage_path: str = '$',
+                          metadata: dict = None):
+        """
+        See RedisVectorStoreForJSON.upsert_item.
+        """
+        return await self.upsert_many([json_data], json_prompt_paths, response_relative_position,
+                                      [json_storage_id_suffix], json_storage_path, metadatas=[metadata])
+
+    async def upsert_many(self, documents,
+                          json_prompt_paths: [str] = None,
+                          response_relative_position: int = None,
+                          json_storage_id_suffixes: [str] = None,
+                          json_storage_path: str = '$',
+                          batch_size: int = 500,
+                          embedding_batch_size: int = 256,
+                          metadatas: [dict] = None):
+        """
+        See RedisVectorStoreForJSON.upsert_many.
+        """
+        if isinstance(json_prompt_paths, str):
+            json_prompt_paths = [json_prompt_paths]
+        documents = list(documents)
+        suffixes = list(json_storage_id_suffixes) if json_storage_id_suffixes is not None else []
+        suffixes = [suffix if suffix is not None else str(uuid4())
+                    for suffix in suffixes + [None] * (len(documents) - len(suffixes))]
+        metadatas = list(metadatas) if metadatas is not None else []
+        metadatas += [None] * (len(documents) - len(metadatas))
+
+        diff = count = 0
+        for position in range(0, len(documents), batch_size):
+            batch = list(zip(suffixes[position:position + batch_size], documents[position:position + batch_size],
+                             metadatas[position:position + batch_size]))
+            pipe = self.client.pipeline(transaction=False)
+            for suffix, json_data, _ in batch:
+                pipe.json().set(f"{self.index_name}-{suffix}", json_storage_path, json_data)
+                pipe.sadd(f"{self.index_name}-collections", suffix)
+                pipe.delete(f"{self.index_name}-watermarks-{suffix}")
+            diff += sum((await pipe.execute())[1::3])
+
+            if json_prompt_paths is not None:
+                records = self.store._records(batch, json_prompt_paths, response_relative_position, json_storage_path)
+                count += await self._store_records(records, embedding_batch_size)
+                watermarks = self.store._watermarks(batch, json_prompt_paths, json_storage_path)
+                if watermarks:
+                    pipe = self.client.pipeline(transaction=False)
+                    for watermarks_key, mapping in watermarks.items():
+                        pipe.hset(watermarks_key, mapping=mapping)
+                    await pipe.execute()
+
+        if json_prompt_paths is not None:
+            return f"Upsert {diff} objects to JSON_store and {count} prompts to vector_index."
+        return f"Upsert {diff} objects to JSON_store, skipped vector_index."
+
+    async def _store_records(self, records, embedding_batch_size=256):
+        if not records:
+            return 0
+        index = self.vector_index
+        count = len(records)
+        if self.store.deduplicator is not None:
+            records = await self._run(self.store._deduplicate, records)
+            if not records:
+                return count
+        else:
+            records = self.store._collapse(records)
+        vectors = await self._run(self.store._embed_many, [prompt for prompt, _, _ in records], embedding_batch_size)
+        pipe = self.client.pipeline(transaction=False)
+        for (prompt, _, _), payload in zip(records, self.store._payloads(records, vectors)):
+            key = index.key(prompt)
+            pipe.hset(key, mapping=payload)
+            if index.ttl:
+                pipe.expire(key, index.ttl)
+        await pipe.execute()
+        self.store._index_lexically(records)
+        return count
+
+    async def search_item(self, query, num_results=1, return_fields=["response", "name", "path", "vector_distance"],
+                          semantic_distance_threshold=None, filter=None):
+        """
+        See RedisVectorStoreForJSON.search_item.
+        """
+        return (await self.search_many([query], num_results, return_fields, semantic_distance_threshold,
+                                       filter=filter))[0]
+
+    async def search_many(self, queries, num_results=1,
+                          return_fields=["response", "name", "path", "vector_distance"],
+                          semantic_distance_threshold=None, batch_size=256, filter=None):
+        """
+        See RedisVectorStoreForJSON.search_many. The searches of a batch run concurrently.
+        """
+        lexical_index = self.store.lexical_index
+        if lexical_index is not None and filter is None:
+            exact = [lexical_index.exact_match(query, num_results) for query in queries]
+            pending = [query for query, hits in zip(queries, exact) if hits is None]
+            vector_results = await self._vector_search_many(pending, num_results, return_fields,
+                                                            semantic_distance_threshold, batch_size)
+            return fuse_results(lexical_index, queries, exact, vector_results, num_results, ["id", *return_fields])
+        return await self._vector_search_many(queries, num_results, return_fields, semantic_distance_threshold,
+                                              batch_size, filter)
+
+    async def _vector_search_many(self, queries, num_results, return_fields, semantic_distance_threshold,
+                                  batch_size, filter=None):
+        index = self.vector_index
+        results = []
+        for position in range(0, len(queries), batch_size):
+            vectors = await self._run(self.store._embed_many, queries[position:position + batch_size], batch_size)
+            range_queries = [self.store._range_query(vector, num_results, return_fields, semantic_distance_threshold,
+                                                     filter) for vector in vectors]
+            results.extend(await index.asearch_many(self.client, range_queries))
+        keys = self.store._prepare_hits(results)
+        if keys:
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.expire(key, self.vector_index.ttl)
+            await pipe.execute()
+        return results
+
+    async def get_context_windows(self, hits, start_shift, end_shift):
+        """
+        See RedisVectorStoreForJSON.get_context_windows.
+        """
+        return await afetch_context_windows(self.client, [hit_location(hit) for hit in hits], start_shift, end_shift)
+
+    async def export_snapshot(self, path, batch_size=1000):
+        """
+        See RedisVectorStoreForJSON.export_snapshot, it runs in the executor.
+        """
+        return await self._run(self.store.export_snapshot, path, batch_size)
+
+    async def import_snapshot(self, path, verify=True, batch_size=1000):
+        """
+        See RedisVectorStoreForJSON.import_snapshot, it runs in the executor.
+        """
+        return await self._run(self.store.import_snapshot, path, verify, batch_size)
+
+    async def length(self):
+        return await self.client.scard(f"{self.index_name}-collections")
+
+    async def __aiter__(self):
+        async for key in self.client.sscan_iter(f"{self.index_name}-collections"):
+            yield key
+
+    def __getitem__(self, item):
+        """Returns a coroutine: `await store[suffix]`."""
+        return self.client.json().get(f"{self.index_name}-{item}")
@@ -1,23 +1,30 @@
 import redis
-from jsonpath_ng.ext import parse
-from jsonpath_ng import Index, Child
 from uuid import uuid4
 
-from langchain.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-
 from anli.config import DEFAULT_DATA_PATH
+from anli.utils.context_window import fetch_context_windows, hit_location
+from anli.utils.embedding_engine import get_embedding_engine
+from anli.utils.json_paths import array_lengths, compile_pair_extractor, extract_slice_pairs, plan_append, plan_update
+from anli.utils.snapshot import Snapshot, SnapshotWriter, load_redis_documents, redis_documents
+from anli.utils.vector_filters import VectorFilter, chroma_metadata, normalize_path, path_prefixes
 
 class ChromaVectorStoreForJSON:
     def __init__(self, index_name: str, default_num_results=10,
                  redis_url="redis://localhost:6379",
                  chromadb_path=f"{DEFAULT_DATA_PATH}/chromadb",
-                 embedding_model_name="jinaai/jina-embeddings-v2-base-en", **kwargs):
+                 embedding_model_name="jinaai/jina-embeddings-v2-base-en", embedding_cache=None, embedding_engine=None,
+                 **kwargs):
         """
         Creates a RedisVectorStoreForJSON object.
         :param index_name:
         :param default_semantic_distance_threshold:
         :param redis_url:
         :param embedding_model_name: If default to use "jinaai/jina-embeddings-v2-base-en" for English
+        :param embedding_cache: An optional EmbeddingCache consulted before embedding prompts, it can be shared with
+        other stores.
+        :param embedding_engine: The EmbeddingEngine to use, e.g. a CPU-optimized one, or an EmbeddingDispatcher to
+        embed concurrent requests in batches. If None, use the engine of embedding_model_name shared by the process,
+        loaded on first use.
         """
         try:
             import chromadb
@@ -29,20 +36,25 @@ class ChromaVectorStoreForJSON:
             )
         self.client = redis.Redis.from_url(redis_url, decode_responses=False, **kwargs)
         self.chroma_client = chromadb.PersistentClient(path=chromadb_path)
-        embedding_function = SentenceTransformerEmbeddings(model_name=embedding_model_name, trust_remote_code=True)
+        if embedding_engine is None:
+            embedding_engine = get_embedding_engine(embedding_model_name, trust_remote_code=True)
+        self.embedding_function = embedding_engine
+        self.embedding_model_name = embedding_engine.model
+        self.embedding_cache = embedding_cache
         self.index_name = index_name
         self.default_num_results = default_num_results
         self.collection = Chroma(
             client=self.chroma_client,
             collection_name=self.index_name,
-            embedding_function=embedding_function,
+            embedding_function=self.embedding_function,
         )
 
     def upsert_item(self, json_data: dict,
                     json_prompt_paths: [str] = None,
                     response_relative_position: int = None,
                     json_storage_id_suffix: str = None,
-                    json_storage_path: str = '$'):
+                    json_storage_path: str = '$',
+                    metadata: dict = None):
         """
         Inserts or updates a JSON object in Redis and optionally indexes its vector representations.
         Stores the JSON object in Redis at 'json_storage_path' in "{self.index_name}-{json_storage_id_suffix}" and
@@ -63,63 +75,312 @@ class ChromaVectorStoreForJSON:
                                        Specify this to update an existing object.
         :param json_storage_path: (Optional) Path in Redis where the JSON object is stored. Defaults to the root ('$').
                                   Specify this to store or update the JSON object at a specific subpath.
+        :param metadata: (Optional) A dict of str, int, float or bool values stored with each prompt, e.g.
+                         {"tenant": "acme", "timestamp": 1700000000}. Searches can filter on it.
         :return: str - A message indicating the number of objects upserted.
         """
-        # Set or generate the JSON object ID
-        if json_storage_id_suffix is None:
-            json_storage_id_suffix = str(uuid4())
-
-        # Store the JSON object in Redis
-        self.client.json().set(f"{self.index_name}-{json_storage_id_suffix}", json_storage_path, json_data)
-
-        l = self.client.scard(f"{self.index_name}-collections")
-        # Track the JSON object ID in a Redis set
-        self.client.sadd(f"{self.index_name}-collections", json_storage_id_suffix)
-
-        diff = self.client.scard(f"{self.index_name}-collections") - l
+        return self.upsert_many([json_data], json_prompt_paths, response_relative_position,
+                                [json_storage_id_suffix], json_storage_path, metadatas=[metadata])
 
-        # Convert json_prompt_paths to a list if it's a string
+    def upsert_many(self, documents,
+                    json_prompt_paths: [str] = None,
+                    response_relative_position: int = None,
+                    json_storage_id_suffixes: [str] = None,
+                    json_storage_path: str = '$',
+                    batch_size: int = 500,
+                    metadatas: [dict] = None):
+        """
+        Inserts or updates many JSON objects, like `upsert_item`, with batched writes and embeddings.
+
+        Each utterance is stored in Chroma under a stable id, "{json_storage_id_suffix}:{path}", so upserting a
+        document again updates its utterances in place. Utterances of a previous version of the document stored
+        under `json_storage_path` that are no longer extracted are deleted. For each batch of `batch_size` documents,
+        the JSON objects are written in one Redis pipeline, the prompts are embedded with one call and written with as
+        few Chroma upserts as its maximum batch size allows. The watermarks of `append_item` are set as in
+        RedisVectorStoreForJSON.
+
+        :param documents: An iterable of JSON objects to be stored.
+        :param json_prompt_paths: See `upsert_item`.
+        :param response_relative_position: See `upsert_item`.
+        :param json_storage_id_suffixes: An iterable of suffixes, one per document. A new UUID is generated for
+                                         the documents without one (None) or if not provided.
+        :param json_storage_path: See `upsert_item`.
+        :param batch_size: Number of documents per batch.
+        :param metadatas: An iterable of metadata dicts, one per document, see `upsert_item`.
+        :return: str - A message indicating the number of objects upserted.
+        """
         if isinstance(json_prompt_paths, str):
             json_prompt_paths = [json_prompt_paths]
+        documents = iter(documents)
+        suffixes = iter(json_storage_id_suffixes) if json_storage_id_suffixes is not None else None
+        metadatas = iter(metadatas) if metadatas is not None else None
+
+        diff = count = 0
+        while True:
+            batch = []
+            for json_data in documents:
+                suffix = next(suffixes, None) if suffixes is not None else None
+                metadata = next(metadatas, None) if metadatas is not None else None
+                batch.append((suffix if suffix is not None else str(uuid4()), json_data, metadata))
+                if len(batch) >= batch_size:
+                    break
+            if not batch:
+                break
+
+            # Store the JSON objects and track their IDs in one round-trip, SADD returns 1 for new IDs
+            pipe = self.client.json().pipeline(transaction=False)
+            for suffix, json_data, _ in batch:
+                pipe.set(f"{self.index_name}-{suffix}", json_storage_path, json_data)
+                pipe.sadd(f"{self.index_name}-collections", suffix)
+                pipe.delete(f"{self.index_name}-watermarks-{suffix}")
+            diff += sum(pipe.execute()[1::3])
+
+            if json_prompt_paths is not None:
+                count += self._index_batch(batch, json_prompt_paths, response_relative_position, json_storage_path)
+                if json_storage_path == "$":
+                    pipe = self.client.pipeline(transaction=False)
+                    for suffix, json_data, _ in batch:
+                        lengths = array_lengths(json_data, json_prompt_paths)
+                        if lengths:
+                            pipe.hset(f"{self.index_name}-watermarks-{suffix}", mapping=lengths)
+                    pipe.execute()
 
-        # Index prompts and responses if paths are provided
         if json_prompt_paths is not None:
-            count = 0
+            return f"Upsert {diff} objects to JSON_store and {count} prompts to vector_index."
+        return f"Upsert {diff} objects to JSON_store, skipped vector_index."
+
+    def _index_batch(self, batch, json_prompt_paths, response_relative_position, json_storage_path):
+        """
+        Indexes the prompts of a batch of (suffix, json_data, metadata) and prunes the stale utterances of these
+        documents.
+        :return: The number of prompts stored.
+        """
+        records = {}
+        for suffix, json_data, metadata in batch:
             for prompt_path in json_prompt_paths:
-                # Extract prompt-response pairs based on the provided path and position
                 pairs = self.extract_prompt_response_pairs(json_data, prompt_path,
                                                            response_relative_position=response_relative_position)
-                # Store each pair's vector representation
                 for prompt, response, p in pairs:
-                    # Remove leading '$' from prompt_path if present
-                    formatted_prompt_path = p.lstrip('$.')
+                    stored_path = f"{json_storage_path}.{p.lstrip('$.')}"
+                    # The last extraction of an utterance wins, as Chroma rejects duplicate ids in one upsert
+                    records[f"{suffix}:{stored_path}"] = (prompt, chroma_metadata({
+                        **(metadata or {}), "name": f"{self.index_name}-{suffix}", "response": response,
+                        "path": stored_path}))
+
+        collection = self.collection._collection
+        names = [f"{self.index_name}-{suffix}" for suffix, _, _ in batch]
+        # Utterances stored under the replaced subpath by a previous version of the documents that are gone now,
+        # "$.a" replaces "$.a.[0].content" but not "$.ab.[0].content"
+        replaced = normalize_path(json_storage_path)
+        existing = collection.get(where={"name": {"$in": names}}, include=["metadatas"])
+        stale = [record_id for record_id, metadata in zip(existing["ids"], existing["metadatas"])
+                 if record_id not in records and replaced in path_prefixes(metadata["path"])]
+        if stale:
+            collection.delete(ids=stale)
+        return self._upsert_utterances(records)
+
+    def _upsert_utterances(self, records):
+        """
+        Embeds and writes {utterance id: (prompt, metadata)} records with as few Chroma upserts as its maximum batch
+        size allows.
+        :return: The number of prompts stored.
+        """
+        if not records:
+            return 0
+        collection = self.collection._collection
+        ids = list(records)
+        prompts = [records[record_id][0] for record_id in ids]
+        metadatas = [records[record_id][1] for record_id in ids]
+        embeddings = self._embed_documents(prompts)
+        max_batch_size = getattr(self.chroma_client, "max_batch_size", 5000)
+        for start in range(0, len(ids), max_batch_size):
+            stop = start + max_batch_size
+            collection.upsert(ids=ids[start:stop], metadatas=metadatas[start:stop], documents=prompts[start:stop],
+                              embeddings=embeddings[start:stop])
+        return len(ids)
+
+    def _slice_records(self, suffix, json_prompt_paths, response_relative_position, array_path, elements, offset,
+                       starts, stop=None, metadata=None):
+        """Returns the {utterance id: (prompt, metadata)} records of the prompts in a slice of a conversation array."""
+        records = {}
+        for prompt, response, path in extract_slice_pairs(json_prompt_paths, response_relative_position, array_path,
+                                                          elements, offset, starts, stop):
+            records[f"{suffix}:{path}"] = (prompt, chroma_metadata({
+                **(metadata or {}), "name": f"{self.index_name}-{suffix}", "response": response, "path": path}))
+        return records
+
+    def append_item(self, new_items, json_storage_id_suffix: str,
+                    json_prompt_paths: [str] = None,
+                    response_relative_position: int = None,
+                    array_path: str = '$.conversation',
+                    metadata: dict = None):
+        """
+        Appends utterances to the conversation array of a stored JSON object and indexes only the new prompts, with
+        the watermarks set by `upsert_item`. See RedisVectorStoreForJSON.append_item.
+        :return: str - A message indicating the number of prompts indexed.
+        """
+        key = f"{self.index_name}-{json_storage_id_suffix}"
+        watermarks_key = f"{self.index_name}-watermarks-{json_storage_id_suffix}"
+        if isinstance(json_prompt_paths, str):
+            json_prompt_paths = [json_prompt_paths]
 
-                    # Merge paths
-                    stored_path = f"{json_storage_path}.{formatted_prompt_path}"
+        pipe = self.client.json().pipeline(transaction=False)
+        pipe.arrappend(key, array_path, *new_items)
+        if json_prompt_paths is not None:
+            pipe.hmget(watermarks_key, json_prompt_paths)
+        results = pipe.execute()
+        length = results[0][0] if isinstance(results[0], list) else results[0]
+        if json_prompt_paths is None:
+            return f"Append {len(new_items)} items to JSON_store, skipped vector_index."
+
+        starts, offset = plan_append(dict(zip(json_prompt_paths, results[1])), length, response_relative_position)
+        elements = self.client.json().get(key, f"{array_path}[{offset}:{length}]") or []
+        # Utterances have stable ids, the prompts indexed again replace their previous version
+        count = self._upsert_utterances(self._slice_records(json_storage_id_suffix, json_prompt_paths,
+                                                            response_relative_position, array_path, elements,
+                                                            offset, starts, metadata=metadata))
+        self.client.hset(watermarks_key, mapping={prompt_path: length for prompt_path in json_prompt_paths})
+        return f"Append {len(new_items)} items to JSON_store and {count} prompts to vector_index."
+
+    def update_utterance(self, json_storage_id_suffix: str, position: int, item=None,
+                         json_prompt_paths: [str] = None,
+                         response_relative_position: int = None,
+                         array_path: str = '$.conversation',
+                         metadata: dict = None):
+        """
+        Replaces or deletes one utterance of a stored conversation and re-indexes only the affected prompts. The
+        utterances that are no longer prompts at their path are deleted. See RedisVectorStoreForJSON.update_utterance.
+        :return: str - A message indicating the number of prompts indexed.
+        """
+        key = f"{self.index_name}-{json_storage_id_suffix}"
+        watermarks_key = f"{self.index_name}-watermarks-{json_storage_id_suffix}"
+        if isinstance(json_prompt_paths, str):
+            json_prompt_paths = [json_prompt_paths]
 
-                    self.collection._collection.upsert(
-                        ids=[json_storage_id_suffix],
-                        metadatas=[{"name": f"{self.index_name}-{json_storage_id_suffix}",
-                                    "response" :response,
-                                    "path": stored_path}],
-                        documents=[prompt],
-                    )
+        start, stop, offset, end = plan_update(position, item is None, response_relative_position)
+        old_elements = []
+        if json_prompt_paths is not None:
+            old_elements = self.client.json().get(key, f"{array_path}[{offset}:{'' if end is None else end}]") or []
 
-                    count += 1
-            return f"Upsert {diff} objects to JSON_store and {count} prompts to vector_index."
+        if item is None:
+            self.client.json().arrpop(key, array_path, position)
         else:
-            return f"Upsert {diff} objects to JSON_store, skipped vector_index."
+            self.client.json().set(key, f"{array_path}[{position}]", item)
+        if json_prompt_paths is None:
+            return "Update 1 item in JSON_store, skipped vector_index."
+
+        starts = {prompt_path: start for prompt_path in json_prompt_paths}
+        old_records = self._slice_records(json_storage_id_suffix, json_prompt_paths, response_relative_position,
+                                          array_path, old_elements, offset, starts, stop)
+        new_elements = list(old_elements)
+        if 0 <= position - offset < len(new_elements):
+            if item is None:
+                new_elements.pop(position - offset)
+            else:
+                new_elements[position - offset] = item
+        records = self._slice_records(json_storage_id_suffix, json_prompt_paths, response_relative_position,
+                                      array_path, new_elements, offset, starts, stop, metadata)
+        stale = [record_id for record_id in old_records if record_id not in records]
+        if stale:
+            self.collection._collection.delete(ids=stale)
+        count = self._upsert_utterances(records)
+
+        if item is None:
+            watermarks = self.client.hgetall(watermarks_key)
+            lowered = {field: int(value) - 1 for field, value in watermarks.items() if int(value) > position}
+            if lowered:
+                self.client.hset(watermarks_key, mapping=lowered)
+        return f"Update 1 item in JSON_store and {count} prompts to vector_index."
+
+    def _embed_documents(self, texts):
+        """Embeds texts with the embedding function of the collection, through the embedding cache if there is one."""
+        if not texts:
+            return []
+        if self.embedding_cache is None:
+            return self.embedding_function.embed_documents(texts)
+        return self.embedding_cache.embed_many(self.embedding_model_name, texts,
+                                               self.embedding_function.embed_documents)
 
-    def search_item(self, query, num_results=None):
+    def search_item(self, query, num_results=None, filter: VectorFilter = None):
+        """
+        Searches the prompts semantically close to the query.
+        :param query: The query text.
+        :param num_results: Maximum number of results, defaults to default_num_results.
+        :param filter: A VectorFilter, translated into a `where` clause so only the matching prompts are searched.
+        :return: A list of (Document, score) tuples, closest first.
+        """
         if num_results is None:
             num_results=self.default_num_results
-        res =  self.collection.similarity_search_with_score(query, num_results=num_results)
+        where = filter.to_chroma(self.index_name) if filter is not None else None
+        res =  self.collection.similarity_search_with_score(query, k=num_results, filter=where)
 
         return res
 
     def set_default_num_results(self, num_results):
         self.default_num_results = num_results
 
+    def export_snapshot(self, path, batch_size=5000):
+        """
+        Writes the JSON objects and the utterances of the store with their embeddings to a snapshot directory, see
+        SnapshotWriter.
+        :param path: The snapshot directory.
+        :param batch_size: Number of utterances read from Chroma at once.
+        :return: str - A message indicating the number of objects and prompts exported.
+        """
+        collection = self.collection._collection
+        with SnapshotWriter(path, self.embedding_model_name, self.index_name) as writer:
+            for documents in redis_documents(self.client, self.index_name):
+                writer.write_documents(documents)
+            offset = 0
+            while True:
+                got = collection.get(limit=batch_size, offset=offset,
+                                     include=["documents", "metadatas", "embeddings"])
+                if not got["ids"]:
+                    break
+                records = []
+                for prompt, metadata in zip(got["documents"], got["metadatas"]):
+                    metadata = {field: value for field, value in metadata.items() if not field.startswith("path:")}
+                    records.append((prompt, metadata.pop("response", ""), metadata))
+                writer.write_records(records, got["embeddings"])
+                offset += len(got["ids"])
+        return f"Export {writer.documents} objects and {writer.count} prompts to {path}."
+
+    def import_snapshot(self, path, verify=True, batch_size=5000):
+        """
+        Loads a snapshot written by `export_snapshot` of any JSON vector store, without embedding the prompts. Each
+        utterance gets the id it has when upserted, "{json_storage_id_suffix}:{path}", so stored utterances are
+        replaced.
+        :param path: The snapshot directory.
+        :param verify: Whether to check the checksums of the snapshot files.
+        :param batch_size: Number of snapshot records read at once.
+        :raises ValueError: If the snapshot is corrupted or its vectors were embedded with another model.
+        :return: str - A message indicating the number of objects and prompts imported.
+        """
+        snapshot = Snapshot(path, self.embedding_model_name, verify)
+        collection = self.collection._collection
+        max_batch_size = getattr(self.chroma_client, "max_batch_size", 5000)
+        diff = count = 0
+        for documents in snapshot.documents():
+            diff += load_redis_documents(self.client, self.index_name, documents)
+        for records, vectors in snapshot.records(self.index_name, batch_size):
+            # Deduplicated prompts are stored once per occurrence, the last utterance with an id wins
+            utterances = {}
+            for (prompt, response, metadata), vector in zip(records, vectors):
+                occurrences = metadata.pop("occurrences", None) or [{"name": metadata["name"],
+                                                                     "path": metadata["path"]}]
+                for occurrence in occurrences:
+                    suffix = occurrence["name"][len(self.index_name) + 1:]
+                    utterances[f"{suffix}:{occurrence['path']}"] = (
+                        prompt, chroma_metadata({**metadata, **occurrence, "response": response}), vector)
+            ids = list(utterances)
+            for start in range(0, len(ids), max_batch_size):
+                chunk = ids[start:start + max_batch_size]
+                collection.upsert(ids=chunk, documents=[utterances[record_id][0] for record_id in chunk],
+                                  metadatas=[utterances[record_id][1] for record_id in chunk],
+                                  embeddings=[utterances[record_id][2].tolist() for record_id in chunk])
+            count += len(ids)
+        return f"Import {diff} objects to JSON_store and {count} prompts to vector_index."
+
 
     def clear_index(self):
         """
@@ -164,37 +425,16 @@ class ChromaVectorStoreForJSON:
         If None, only prompts are extracted, and responses are set to an empty string.
 
         Returns:
-        - A list of tuples (prompt, response).
+        - A list of tuples (prompt, response, path of the prompt). The prompt path is parsed once and cached, responses
+        are read directly from the conversation array.
         """
-        prompt_expr = parse(prompt_path)
-        prompts = [match for match in prompt_expr.find(json_data)]
-
-        pairs = []
-        for prompt in prompts:
-            # Extract prompt text
-            prompt_text = prompt.value
-
-            # Check if response position is provided
-            if response_relative_position is not None:
-                conversation_index = prompt.full_path.left.right.index
-                response_index = conversation_index + response_relative_position
-                response_path = Child(prompt.full_path.left.left, Index(response_index))
-                response_expr = parse(str(response_path))
-                response_matches = response_expr.find(json_data)
-
-                response_content = response_matches[0].value.get('content', '') if response_matches else ''
-            else:
-                # If no response position is provided, set response to empty
-                response_content = ''
-
-            pairs.append((prompt_text, response_content, str(prompt.full_path)))
-
-        return pairs
+        return compile_pair_extractor(prompt_path, response_relative_position).extract(json_data)
 
     @staticmethod
     def extract_utterances(redis_client, json_name, path, start_shift, end_shift):
         """
-        Extracts a range of utterances from a RedisJSON object relative to the current index.
+        Extracts a range of utterances from a RedisJSON object relative to the current index. Only the range is
+        fetched from Redis, not the whole conversation.
 
         :param redis_client: The Redis client instance.
         :param json_name: The name of the JSON object in Redis.
@@ -204,29 +444,20 @@ class ChromaVectorStoreForJSON:
         :return: A list of utterances or None for indices out of boundary.
         """
         try:
-            # Extract the base path and current index from the path
-            path_parts = path.split('[')
-            # Assuming index is in the rightmost part of the path
-            current_index = int(path_parts[-1].split(']')[0])
-            # everything before the last part is the base path
-            base_path = '['.join(path_parts[:-1]).rstrip('.')
-
-            # Fetch the conversation from the base path, since the path should have no wildcards,
-            # this should return a list of 1
-            conversation = redis_client.json().get(json_name, base_path)[0]
-
-            # Calculate the range of indexes
-            start_index, end_index = (max(current_index + start_shift, 0),
-                                      min(current_index + end_shift, len(conversation)))
-
-            # Extract the relevant utterances
-            utterances = []
-            for i in range(start_index, end_index):
-                utterances.append(conversation[i])
-
-            return utterances
-
-        except IndexError as e:
+            return fetch_context_windows(redis_client, [(json_name, path)], start_shift, end_shift)[0]
+        except ValueError as e:
             import warnings
             warnings.warn(f"Index out of boundary when extracting utterances: {e}")
             return []
+
+    def get_context_windows(self, hits, start_shift, end_shift):
+        """
+        Fetches the utterances around each hit of a `search_item` result with one pipeline. Only the needed array
+        slices are read from RedisJSON, overlapping windows of the same conversation are fetched once.
+
+        :param hits: The result of `search_item`.
+        :param start_shift: The start of the range relative to each hit's index.
+        :param end_shift: The end of the range relative to each hit's index.
+        :return: A list with the utterances around each hit.
+        """
+        return fetch_context_windows(self.client, [hit_location(hit) for hit in hits], start_shift, end_shift)
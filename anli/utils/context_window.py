@@ -0,0 +1,104 @@
+import re
+
+_ARRAY_PATH = re.compile(r"^(?P<base>.*?)\.?\[(?P<index>\d+)\][^\[]*$")
+
+
+def split_array_path(path):
+    """
+    Splits the path of an utterance, as stored in the vector index, into the path of its conversation array and its
+    position, e.g. "$.conversation.[2].content" -> ("$.conversation", 2).
+    """
+    found = _ARRAY_PATH.match(path)
+    if found is None:
+        raise ValueError(f"No array index in path {path}")
+    base = found.group("base")
+    if not base.startswith("$"):
+        base = f"$.{base}" if base else "$"
+    return base, int(found.group("index"))
+
+
+def plan_context_windows(hits, start_shift, end_shift):
+    """
+    Groups the context windows of search hits into as few array slices as possible.
+
+    Windows of the same conversation array that overlap or touch are merged into one slice.
+
+    :param hits: An iterable of (json_name, path) of the hits.
+    :param start_shift: The start of each window relative to the hit's index.
+    :param end_shift: The end (exclusive) of each window relative to the hit's index.
+    :return: (slices, windows) - slices is a list of (json_name, base_path, start, end) to fetch, windows gives for
+             each hit (slice number, offset in the slice, length) or None for an empty window.
+    """
+    hits = list(hits)
+    requested = {}
+    for position, (json_name, path) in enumerate(hits):
+        base_path, index = split_array_path(path)
+        start, end = max(index + start_shift, 0), index + end_shift
+        if start < end:
+            requested.setdefault((json_name, base_path), []).append((start, end, position))
+
+    slices = []
+    windows = [None] * len(hits)
+    for (json_name, base_path), ranges in requested.items():
+        ranges.sort()
+        current = None
+        for start, end, position in ranges:
+            if current is None or start > slices[current][3]:
+                slices.append([json_name, base_path, start, end])
+                current = len(slices) - 1
+            else:
+                slices[current][3] = max(slices[current][3], end)
+            windows[position] = (current, start - slices[current][2], end - start)
+    return [tuple(s) for s in slices], windows
+
+
+def fetch_context_windows(redis_client, hits, start_shift, end_shift):
+    """
+    Fetches the utterances around many search hits with one pipeline, asking RedisJSON for array slices only.
+
+    :param redis_client: The Redis client instance.
+    :param hits: An iterable of (json_name, path) of the hits.
+    :param start_shift: The start of each window relative to the hit's index.
+    :param end_shift: The end (exclusive) of each window relative to the hit's index.
+    :return: A list with the utterances of each hit's window, truncated at the ends of the conversation.
+    """
+    slices, windows = plan_context_windows(hits, start_shift, end_shift)
+    fetched = []
+    if slices:
+        pipe = redis_client.json().pipeline(transaction=False)
+        for json_name, base_path, start, end in slices:
+            pipe.get(json_name, f"{base_path}[{start}:{end}]")
+        fetched = pipe.execute()
+    return _assign_windows(fetched, windows)
+
+
+async def afetch_context_windows(redis_client, hits, start_shift, end_shift):
+    """
+    Same as `fetch_context_windows` with a redis.asyncio client.
+    """
+    slices, windows = plan_context_windows(hits, start_shift, end_shift)
+    fetched = []
+    if slices:
+        # json().pipeline() is synchronous on redis.asyncio clients, JSON commands are queued on an async pipeline
+        pipe = redis_client.pipeline(transaction=False)
+        for json_name, base_path, start, end in slices:
+            pipe.json().get(json_name, f"{base_path}[{start}:{end}]")
+        fetched = await pipe.execute()
+    return _assign_windows(fetched, windows)
+
+
+def _assign_windows(fetched, windows):
+    fetched = [result or [] for result in fetched]
+    return [fetched[window[0]][window[1]:window[1] + window[2]] if window is not None else []
+            for window in windows]
+
+
+def hit_location(hit):
+    """
+    Returns (json_name, path) of a search hit: a dict returned by RedisVectorStoreForJSON.search_item, with the
+    fields at the top level or in its metadata, or a (Document, score) tuple returned by ChromaVectorStoreForJSON.
+    """
+    if isinstance(hit, tuple):
+        hit = hit[0].metadata
+    metadata = hit.get("metadata") if isinstance(hit.get("metadata"), dict) else {}
+    return hit.get("name", metadata.get("name")), hit.get("path", metadata.get("path"))
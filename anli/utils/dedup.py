@@ -0,0 +1,130 @@
+import hashlib
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+_DIGIT = re.compile(r"\d")
+_BITS = 64
+
+
+def canonical_text(text):
+    """The text compared for duplicates: NFKC, lower-cased, words only, e.g. "Thanks!" and "thanks" are equal."""
+    return " ".join(_WORD.findall(unicodedata.normalize("NFKC", text).lower()))
+
+
+def simhash(text):
+    """The 64-bit SimHash of the words and word pairs of the canonical text, close texts have close hashes."""
+    words = canonical_text(text).split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    if not features:
+        return 0
+    digests = b"".join(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest() for feature in features)
+    # One row of 64 bits per feature, the bits set by most features are set in the hash
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(features), _BITS)
+    return int.from_bytes(np.packbits(2 * bits.sum(axis=0) > len(features)).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class Deduplicator:
+    """
+    Finds the stored prompt a new prompt duplicates, before it is embedded.
+
+    Exact duplicates have the same canonical text (see `canonical_text`). Near duplicates of at least `min_words`
+    words have SimHashes at most `max_distance` bits apart and the same words with digits, so that "restart pod
+    worker-1" never stands for "restart pod worker-2". Candidates are found by locality-sensitive hashing: the hashes
+    are split in `max_distance + 1` bands, two hashes within the distance share at least one band.
+
+    # Example usage
+    dedup = Deduplicator()
+    dedup.add("record-1", "How do I restart the pod worker-1?")
+    dedup.find("how do i restart the pod worker-1")  # "record-1"
+    """
+    def __init__(self, max_distance=7, min_words=6):
+        """
+        Creates an empty Deduplicator.
+        :param max_distance: Maximum number of different SimHash bits of near duplicates, 0 for exact duplicates only.
+        :param min_words: Minimum number of words of the prompts compared as near duplicates, shorter prompts differ
+        by too few words for their SimHash to be reliable and are only compared exactly.
+        """
+        self.max_distance = max_distance
+        self.min_words = min_words
+        self.band_bits = _BITS // (max_distance + 1)
+        self.exact = {}
+        self.hashes = {}
+        self.bands = [{} for _ in range(max_distance + 1)] if max_distance else []
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _bands(self, canonical, value):
+        """The band keys of a hash, with the words with digits of its text, so that only they are candidates."""
+        mask = (1 << self.band_bits) - 1
+        numbers = frozenset(word for word in canonical.split() if _DIGIT.search(word))
+        return [((value >> (band * self.band_bits)) & mask, numbers) for band in range(len(self.bands))]
+
+    def find(self, text):
+        """Returns the key of a stored duplicate of the text, or None."""
+        canonical = canonical_text(text)
+        with self.lock:
+            key = self.exact.get(canonical)
+            if key is not None or not self.bands or len(canonical.split()) < self.min_words:
+                return key
+            value = simhash(canonical)
+            candidates = set()
+            for table, band in zip(self.bands, self._bands(canonical, value)):
+                candidates.update(table.get(band, ()))
+            best = None
+            for candidate in candidates:
+                distance = hamming(value, self.hashes[candidate][1])
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, candidate)
+            return best[1] if best is not None else None
+
+    def add(self, key, text):
+        """Stores the text of a canonical prompt under its key."""
+        canonical = canonical_text(text)
+        with self.lock:
+            self.remove(key)
+            self.exact.setdefault(canonical, key)
+            value = simhash(canonical) if self.bands and len(canonical.split()) >= self.min_words else None
+            self.hashes[key] = (canonical, value)
+            if value is not None:
+                for table, band in zip(self.bands, self._bands(canonical, value)):
+                    table.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        with self.lock:
+            stored = self.hashes.pop(key, None)
+            if stored is None:
+                return
+            canonical, value = stored
+            if self.exact.get(canonical) == key:
+                del self.exact[canonical]
+            if value is not None:
+                for table, band in zip(self.bands, self._bands(canonical, value)):
+                    keys = table.get(band)
+                    keys.discard(key)
+                    if not keys:
+                        del table[band]
+
+    def clear(self):
+        with self.lock:
+            self.exact = {}
+            self.hashes = {}
+            self.bands = [{} for _ in self.bands]
+
+
+def merge_occurrences(occurrences, new_occurrences):
+    """Appends the new {"name", "path"} occurrences of a canonical prompt that it does not list yet."""
+    merged = list(occurrences)
+    for occurrence in new_occurrences:
+        if occurrence not in merged:
+            merged.append(occurrence)
+    return merged
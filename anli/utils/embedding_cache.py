@@ -0,0 +1,305 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from anli.config import DEFAULT_CACHE_PATH
+
+_DIGEST_SIZE = 16
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class _FileLock:
+    """An exclusive lock on a file, held with `with`, that serializes the processes sharing the cache directory."""
+    def __init__(self, path):
+        self.file = open(path, "a+b")
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        self.file.close()
+
+
+class _ModelFile:
+    """
+    The embeddings of one model: a memory-mapped float32 matrix and an append-only index of text digests.
+    Row i of the matrix holds the embedding of the i-th digest in the index file.
+
+    The files are shared by the processes using the cache directory. Appends hold an exclusive lock on a lock file,
+    read the digests appended by the other processes, and write the vectors before their digests, so every digest
+    in the index has its vector. At most `max_rows` embeddings are written, the next ones are only kept in memory.
+    """
+    def __init__(self, path, dims, initial_rows=1024, max_rows=None):
+        self.vectors_path = path + ".f32"
+        self.index_path = path + ".idx"
+        self.dims = dims
+        self.max_rows = max_rows
+        self.rows = {}
+        self.indexed = 0
+        self.vectors = None
+        self.capacity = 0
+        self.lock = _FileLock(path + ".lock")
+        with self.lock:
+            if os.path.exists(self.index_path):
+                # A digest partly written by a process that crashed is dropped
+                size = os.path.getsize(self.index_path)
+                if size % _DIGEST_SIZE:
+                    with open(self.index_path, "r+b") as file:
+                        file.truncate(size - size % _DIGEST_SIZE)
+            self._refresh()
+            self._map(max(initial_rows, self.indexed, 1))
+        self.index_file = open(self.index_path, "ab")
+
+    def _refresh(self):
+        """Reads the digests appended to the index since the last read, by this process or another."""
+        if not os.path.exists(self.index_path):
+            return
+        size = os.path.getsize(self.index_path) // _DIGEST_SIZE * _DIGEST_SIZE
+        if size <= self.indexed * _DIGEST_SIZE:
+            return
+        with open(self.index_path, "rb") as file:
+            file.seek(self.indexed * _DIGEST_SIZE)
+            data = file.read(size - self.indexed * _DIGEST_SIZE)
+        vector_rows = os.path.getsize(self.vectors_path) // (4 * self.dims) if os.path.exists(self.vectors_path) else 0
+        count = min(len(data) // _DIGEST_SIZE, vector_rows - self.indexed)
+        for i in range(max(count, 0)):
+            self.rows.setdefault(data[i * _DIGEST_SIZE:(i + 1) * _DIGEST_SIZE], self.indexed + i)
+        self.indexed += max(count, 0)
+
+    def _map(self, capacity):
+        """Maps at least `capacity` rows, growing the file if needed, and the rows other processes added."""
+        mode = "r+" if os.path.exists(self.vectors_path) else "w+"
+        file_rows = os.path.getsize(self.vectors_path) // (4 * self.dims) if mode == "r+" else 0
+        if mode == "r+" and file_rows < capacity:
+            with open(self.vectors_path, "r+b") as file:
+                file.truncate(capacity * self.dims * 4)
+        capacity = max(capacity, file_rows)
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(capacity, self.dims))
+        self.capacity = capacity
+
+    def get(self, digest):
+        row = self.rows.get(digest)
+        if row is None:
+            # Written by another process since the last read
+            self._refresh()
+            row = self.rows.get(digest)
+            if row is None:
+                return None
+        if row >= self.capacity:
+            self._map(row + 1)
+        return self.vectors[row]
+
+    def put_many(self, digests, vectors):
+        """Appends the embeddings of the digests that are not stored yet, up to `max_rows`."""
+        with self.lock:
+            self._refresh()
+            new = {}
+            for digest, vector in zip(digests, vectors):
+                if digest not in self.rows:
+                    new.setdefault(digest, vector)
+            if self.max_rows is not None:
+                new = dict(list(new.items())[:max(self.max_rows - self.indexed, 0)])
+            if not new:
+                return
+            start, end = self.indexed, self.indexed + len(new)
+            if end > self.capacity:
+                self._map(max(end, self.capacity * 2))
+            self.vectors[start:end] = np.asarray(list(new.values()), dtype=np.float32)
+            self.vectors.flush()
+            self.index_file.write(b"".join(new))
+            self.index_file.flush()
+            for row, digest in enumerate(new, start):
+                self.rows[digest] = row
+            self.indexed = end
+
+    def flush(self):
+        self.vectors.flush()
+        self.index_file.flush()
+
+    def close(self):
+        self.flush()
+        self.index_file.close()
+        self.lock.close()
+
+
+class EmbeddingCache:
+    """
+    A content-addressed cache of text embeddings, shared by the vector stores.
+
+    Embeddings are keyed by (model id, hash of the normalized text), so re-upserting a conversation
+    only embeds the utterances that changed. They are kept in one memory-mapped float32 file per
+    model under `DEFAULT_CACHE_PATH`, shared by the processes using it, with an in-memory LRU of float32 arrays in
+    front of it. Each file holds at most `max_disk_entries` embeddings, e.g. of the prompts and of the first search
+    queries; later embeddings are only kept in the LRU.
+
+    # Example usage
+    cache = EmbeddingCache()
+    vectors = cache.embed_many("all-mpnet-base-v2", texts, model.encode)
+    print(cache.stats())
+    """
+    def __init__(self, cache_dir=None, lru_limit=10000, max_disk_entries=1000000):
+        """
+        Parameters:
+        cache_dir (str, optional): Directory of the embedding files. Default: DEFAULT_CACHE_PATH/embeddings.
+        lru_limit (int): Number of embeddings kept in memory.
+        max_disk_entries (int, optional): Number of embeddings stored per model on disk, None for no limit.
+        """
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(DEFAULT_CACHE_PATH, "embeddings")
+        self.lru_limit = lru_limit
+        self.max_disk_entries = max_disk_entries
+        self.lru = OrderedDict()
+        self.files = {}
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bytes_saved": 0}
+
+    @staticmethod
+    def normalize(text):
+        """Unicode NFC with collapsed whitespace, so formatting-only changes do not re-embed the text."""
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def key(self, text):
+        return hashlib.blake2b(self.normalize(text).encode("utf-8"), digest_size=_DIGEST_SIZE).digest()
+
+    def _file(self, model_id, dims):
+        model_file = self.files.get(model_id)
+        if model_file is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_id)
+            model_file = _ModelFile(os.path.join(self.cache_dir, f"{name}-{dims}"), dims,
+                                    max_rows=self.max_disk_entries)
+            self.files[model_id] = model_file
+        elif model_file.dims != dims:
+            raise ValueError(f"Embeddings of {model_id} have {model_file.dims} dimensions, got {dims}.")
+        return model_file
+
+    def _get(self, model_id, digest):
+        vector = self.lru.get((model_id, digest))
+        if vector is not None:
+            self.lru.move_to_end((model_id, digest))
+            self.counters["memory_hits"] += 1
+            return vector
+        model_file = self.files.get(model_id)
+        if model_file is None:
+            model_file = self._open_existing(model_id)
+        vector = model_file.get(digest) if model_file is not None else None
+        if vector is not None:
+            vector = np.array(vector)
+            self._remember(model_id, digest, vector)
+            self.counters["disk_hits"] += 1
+        return vector
+
+    def _open_existing(self, model_id):
+        """Opens the file of a model from a previous run, if any."""
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_id)
+        if not os.path.isdir(self.cache_dir):
+            return None
+        for file_name in os.listdir(self.cache_dir):
+            prefix, _, dims = file_name[:-len(".idx")].rpartition("-")
+            if file_name.endswith(".idx") and prefix == name and dims.isdigit():
+                return self._file(model_id, int(dims))
+        return None
+
+    def _remember(self, model_id, digest, vector):
+        self.lru[(model_id, digest)] = vector
+        if len(self.lru) > self.lru_limit:
+            self.lru.popitem(last=False)
+
+    def get_many(self, model_id, texts):
+        """
+        Returns the cached embeddings of the texts, None for the texts not in the cache.
+        """
+        with self.lock:
+            vectors = [self._get(model_id, self.key(text)) for text in texts]
+        return [vector.tolist() if vector is not None else None for vector in vectors]
+
+    def put_many(self, model_id, texts, vectors):
+        """Stores the embeddings of the texts."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        digests = [self.key(text) for text in texts]
+        with self.lock:
+            self._file(model_id, vectors.shape[1]).put_many(digests, vectors)
+            for digest, vector in zip(digests, vectors):
+                self._remember(model_id, digest, vector)
+
+    def embed_many(self, model_id, texts, embed_function):
+        """
+        Returns the embeddings of the texts, calling `embed_function` once for the texts not in the cache.
+
+        Parameters:
+        model_id (str): Identifies the embedding model, embeddings of different models are kept apart.
+        texts (list of str): The texts to embed.
+        embed_function (function): Takes a list of texts and returns a list of embeddings.
+
+        Returns:
+        list: One embedding (list of floats) per text.
+        """
+        vectors = self.get_many(model_id, texts)
+        missing = OrderedDict()
+        for position, (text, vector) in enumerate(zip(texts, vectors)):
+            if vector is None:
+                missing.setdefault(self.key(text), []).append(position)
+        with self.lock:
+            self.counters["misses"] += len(missing)
+            self.counters["bytes_saved"] += sum(len(text.encode("utf-8")) for text in texts) - sum(
+                len(texts[positions[0]].encode("utf-8")) for positions in missing.values())
+        if missing:
+            missing_texts = [texts[positions[0]] for positions in missing.values()]
+            new_vectors = [[float(value) for value in vector] for vector in embed_function(missing_texts)]
+            self.put_many(model_id, missing_texts, new_vectors)
+            for positions, vector in zip(missing.values(), new_vectors):
+                for position in positions:
+                    vectors[position] = vector
+        return vectors
+
+    def embed(self, model_id, text, embed_function):
+        """Returns the embedding of one text, calling `embed_function` with a list of one text on a miss."""
+        return self.embed_many(model_id, [text], embed_function)[0]
+
+    def stats(self):
+        """
+        Returns the hit counts, hit rate, bytes of text not sent to the embedding models and the number of
+        stored embeddings.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+            stats["entries"] = {model_id: len(model_file.rows) for model_id, model_file in self.files.items()}
+            return stats
+
+    def flush(self):
+        with self.lock:
+            for model_file in self.files.values():
+                model_file.flush()
+
+    def close(self):
+        with self.lock:
+            for model_file in self.files.values():
+                model_file.close()
+            self.files = {}
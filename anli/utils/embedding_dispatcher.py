@@ -0,0 +1,206 @@
+import asyncio
+import bisect
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from anli.utils.embedding_engine import redisvl_vectorizer
+
+QUEUE_WAIT_BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 500)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 1024)
+
+
+class Histogram:
+    """A fixed-bucket histogram. Bucket i counts the values v with bounds[i - 1] < v <= bounds[i]."""
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q-quantile, the maximum for the overflow bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": dict(zip([*self.bounds, float("inf")], self.counts)),
+        }
+
+
+class _Request:
+    __slots__ = ("texts", "future", "enqueued_at")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class EmbeddingDispatcher:
+    """
+    Coalesces the embedding requests of concurrent callers into batches.
+
+    A worker thread waits until the oldest queued request is `max_wait` seconds old, or until `max_batch_size` texts
+    are queued, then embeds the texts of the queued requests with one call and resolves the future of each request.
+    On CPU a batch of short texts costs little more than one text, so concurrent searches of many sessions are
+    served at the cost of a few milliseconds of queueing.
+
+    The dispatcher has the interface of an EmbeddingEngine, so it can be used by the vector stores in place of one:
+    as the vectorizer of the local store, as the embedding engine of the Chroma store, and with `as_vectorizer()`
+    as the vectorizer of the Redis stores.
+
+    # Example usage
+    dispatcher = EmbeddingDispatcher(get_embedding_engine(), max_wait=0.005, max_batch_size=32)
+    store = RedisVectorStoreForJSON("conversations", vectorizer=dispatcher.as_vectorizer())
+    hits = store.search_item("delete the pod")  # from many threads
+    print(dispatcher.metrics()["batch_size"])
+    """
+    def __init__(self, embedder, max_wait=0.005, max_batch_size=32):
+        """
+        Creates an EmbeddingDispatcher object, its worker thread starts with the first request.
+        :param embedder: An object with `embed_many` (EmbeddingEngine, redisvl vectorizer), `embed_documents`
+        (langchain embeddings) or a function taking a list of texts and returning their embeddings.
+        :param max_wait: Seconds a request waits for other requests to join its batch.
+        :param max_batch_size: Number of texts at which a batch is embedded without waiting. Larger requests are
+        embedded in a batch of their own.
+        """
+        self.embedder = embedder
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        if hasattr(embedder, "embed_many"):
+            self._embed = embedder.embed_many
+        elif hasattr(embedder, "embed_documents"):
+            self._embed = embedder.embed_documents
+        else:
+            self._embed = embedder
+        self.queue = deque()
+        self.queued_texts = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = None
+        self.queue_wait_ms = Histogram(QUEUE_WAIT_BUCKETS_MS)
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+
+    @property
+    def model(self):
+        return getattr(self.embedder, "model", None) or getattr(self.embedder, "model_name", None) or \
+            getattr(self.embedder, "__name__", type(self.embedder).__name__)
+
+    @property
+    def dims(self):
+        return self.embedder.dims
+
+    def submit(self, texts):
+        """Queues texts, returns a concurrent.futures.Future of the list of their embeddings."""
+        request = _Request(list(texts))
+        if not request.texts:
+            request.future.set_result([])
+            return request.future
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The embedding dispatcher is closed.")
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._work, name="embedding-dispatcher", daemon=True)
+                self.thread.start()
+            self.queue.append(request)
+            self.queued_texts += len(request.texts)
+            self.condition.notify()
+        return request.future
+
+    def embed_many(self, texts, batch_size=None, **kwargs):
+        """Returns the embeddings of texts, embedded together with the texts of concurrent callers."""
+        return self.submit(texts).result()
+
+    def embed(self, text, **kwargs):
+        return self.embed_many([text])[0]
+
+    def embed_documents(self, texts):
+        return self.embed_many(texts)
+
+    def embed_query(self, text):
+        return self.embed(text)
+
+    async def aembed_many(self, texts):
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def as_vectorizer(self):
+        """Returns a redisvl vectorizer embedding through this dispatcher."""
+        return redisvl_vectorizer(self)
+
+    def _next_batch(self):
+        """Waits for a batch to be due and dequeues it, returns None once closed and drained."""
+        with self.condition:
+            while not self.queue:
+                if self.closed:
+                    return None
+                self.condition.wait()
+            deadline = self.queue[0].enqueued_at + self.max_wait
+            while self.queued_texts < self.max_batch_size and not self.closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = [self.queue.popleft()]
+            count = len(batch[0].texts)
+            while self.queue and count + len(self.queue[0].texts) <= self.max_batch_size:
+                count += len(self.queue[0].texts)
+                batch.append(self.queue.popleft())
+            self.queued_texts -= count
+            return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started_at = time.perf_counter()
+            texts = [text for request in batch for text in request.texts]
+            with self.condition:
+                for request in batch:
+                    self.queue_wait_ms.observe((started_at - request.enqueued_at) * 1000)
+                self.batch_size.observe(len(texts))
+            try:
+                vectors = list(self._embed(texts))
+            except BaseException as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            position = 0
+            for request in batch:
+                request.future.set_result(vectors[position:position + len(request.texts)])
+                position += len(request.texts)
+
+    def metrics(self):
+        """Returns the histograms of the queue wait of requests in milliseconds and of the batch sizes in texts."""
+        with self.condition:
+            return {"queue_wait_ms": self.queue_wait_ms.to_dict(), "batch_size": self.batch_size.to_dict()}
+
+    def close(self):
+        """Embeds the queued requests and stops the worker thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,172 @@
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+_lock = threading.Lock()
+_engines = {}
+
+
+class EmbeddingEngine:
+    """
+    A sentence-transformers model loaded on first use, shared by the vector stores of a process.
+
+    Use `get_embedding_engine` to get the engine of a model, so that stores using the same model name load it once.
+    The engine can be passed as the embedding function of the Chroma store (`embed_documents`, `embed_query`), as the
+    vectorizer of the local store (`embed_many`), and to the Redis store with `as_vectorizer()`.
+
+    With `cpu_optimized`, the model runs with `num_threads` torch threads (default: the CPU count) and its linear
+    layers are quantized to int8 with dynamic quantization, or with `backend="onnx"` it runs on ONNX Runtime
+    (sentence-transformers >= 3.2 and optimum). Texts are embedded in batches of similar lengths holding about
+    `max_batch_tokens` tokens, so short texts are batched more and little padding is computed.
+
+    # Example usage
+    engine = get_embedding_engine("sentence-transformers/all-mpnet-base-v2", cpu_optimized=True)
+    vectors = engine.embed_many(["delete the pod", "scale the deployment"])
+    """
+    def __init__(self, model, cpu_optimized=False, backend="torch", num_threads=None, device=None,
+                 trust_remote_code=False, batch_size=32, max_batch_tokens=8192, normalize=False):
+        """
+        Creates an EmbeddingEngine object, the model is not loaded.
+        :param model: The sentence-transformers model name or path.
+        :param cpu_optimized: Run int8 dynamically quantized weights (or the ONNX backend) on a tuned thread count.
+        :param backend: "torch" or "onnx".
+        :param num_threads: Number of torch threads in CPU-optimized mode, None for the CPU count.
+        :param device: The device of the model, None to let sentence-transformers choose. "cpu" if cpu_optimized.
+        :param trust_remote_code: Allow the custom model code of e.g. "jinaai/jina-embeddings-v2-base-en".
+        :param batch_size: Maximum number of texts per batch.
+        :param max_batch_tokens: Approximate number of tokens per batch, texts are estimated at 4 characters per
+        token.
+        :param normalize: Return unit length embeddings.
+        """
+        self.model = model
+        self.cpu_optimized = cpu_optimized
+        self.backend = backend
+        self.num_threads = num_threads
+        self.device = "cpu" if cpu_optimized and device is None else device
+        self.trust_remote_code = trust_remote_code
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.normalize = normalize
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    @property
+    def client(self):
+        """The sentence-transformers model, loaded on first access."""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "`sentence-transformers` package not found, please install it with "
+                "`pip install sentence-transformers`"
+            )
+        kwargs = {"device": self.device, "trust_remote_code": self.trust_remote_code}
+        if self.backend != "torch":
+            kwargs["backend"] = self.backend
+        if self.cpu_optimized:
+            import torch
+            torch.set_num_threads(self.num_threads or os.cpu_count() or 1)
+        model = SentenceTransformer(self.model, **kwargs)
+        if self.cpu_optimized and self.backend == "torch":
+            import torch
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    @property
+    def dims(self):
+        return self.client.get_sentence_embedding_dimension()
+
+    def batches(self, texts):
+        """
+        Yields lists of positions of texts in batches of similar lengths, longest first. A batch holds at most
+        `batch_size` texts, and more than one text only if it fits in `max_batch_tokens` padded tokens.
+        """
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        batch = []
+        for i in order:
+            # The first text of a batch is the longest, it sets the padded length of the batch
+            tokens = (len(texts[batch[0]]) if batch else len(texts[i])) // 4 + 2
+            if batch and (len(batch) >= self.batch_size or (len(batch) + 1) * tokens > self.max_batch_tokens):
+                yield batch
+                batch = []
+            batch.append(i)
+        if batch:
+            yield batch
+
+    def encode(self, texts):
+        """Returns the embeddings of texts as a float32 matrix, in the order of the texts."""
+        texts = list(texts)
+        model = self.client
+        vectors = None
+        for batch in self.batches(texts):
+            encoded = np.asarray(model.encode([texts[i] for i in batch], batch_size=len(batch),
+                                              normalize_embeddings=self.normalize, convert_to_numpy=True),
+                                 dtype=np.float32)
+            if vectors is None:
+                vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+            vectors[batch] = encoded
+        return vectors if vectors is not None else np.empty((0, 0), dtype=np.float32)
+
+    def embed_many(self, texts, batch_size=None, **kwargs):
+        """Returns the embeddings of texts as lists of floats. `batch_size` is accepted for redisvl compatibility."""
+        return self.encode(texts).tolist()
+
+    def embed(self, text, **kwargs):
+        return self.embed_many([text])[0]
+
+    def embed_documents(self, texts):
+        return self.embed_many(texts)
+
+    def embed_query(self, text):
+        return self.embed(text)
+
+    def as_vectorizer(self):
+        """Returns a redisvl vectorizer embedding with this engine. Its dimensions are read from the model."""
+        return redisvl_vectorizer(self)
+
+
+def redisvl_vectorizer(embedder):
+    """
+    Returns a redisvl vectorizer delegating to an object with `model`, `dims`, `embed` and `embed_many`, such as an
+    EmbeddingEngine or an EmbeddingDispatcher.
+    """
+    from redisvl.utils.vectorize import BaseVectorizer
+
+    class EngineVectorizer(BaseVectorizer):
+        def embed(self, text, preprocess=None, as_buffer=False, **kwargs):
+            if preprocess is not None:
+                text = preprocess(text)
+            return self._process_embedding(self.client.embed(text), as_buffer)
+
+        def embed_many(self, texts, preprocess=None, batch_size=1000, as_buffer=False, **kwargs):
+            if preprocess is not None:
+                texts = [preprocess(text) for text in texts]
+            return [self._process_embedding(vector, as_buffer) for vector in self.client.embed_many(texts)]
+
+    return EngineVectorizer(model=embedder.model, dims=embedder.dims, client=embedder)
+
+
+def get_embedding_engine(model=DEFAULT_EMBEDDING_MODEL, **kwargs):
+    """
+    Returns the EmbeddingEngine shared by all callers with the same model name and options, see EmbeddingEngine.
+    """
+    key = (model, tuple(sorted(kwargs.items())))
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = EmbeddingEngine(model, **kwargs)
+        return engine
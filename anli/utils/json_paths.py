@@ -0,0 +1,209 @@
+from functools import lru_cache
+
+from jsonpath_ng import Index
+from jsonpath_ng.ext import parse
+
+
+@lru_cache(maxsize=256)
+def compile_path(path):
+    """Parses a JSONPath expression once, later calls with the same expression reuse the compiled path."""
+    return parse(path)
+
+
+def _array_index(path):
+    """The position of an Index path element, across jsonpath-ng versions (`index` or `indices`)."""
+    if hasattr(path, "indices"):
+        return path.indices[0] if len(path.indices) == 1 else None
+    return path.index
+
+
+class PairExtractor:
+    """
+    Extracts (prompt, response, path) tuples from JSON conversations with a compiled prompt path.
+
+    The response of a prompt is read directly from the list that contains the prompt's utterance, at
+    `response_relative_position` from it, instead of building and parsing a JSONPath per prompt.
+
+    # Example usage
+    extractor = compile_pair_extractor("$.conversation[?(@.role == 'user')].content", 1)
+    pairs = extractor.extract(json_data)
+    """
+    def __init__(self, prompt_path, response_relative_position=None):
+        """
+        Parameters:
+        prompt_path (str): JSONPath expression to extract prompts.
+        response_relative_position (int, optional): Relative position of the response to the prompt in the
+        conversation array. If None, responses are empty strings.
+        """
+        self.prompt_path = prompt_path
+        self.response_relative_position = response_relative_position
+        self.expression = compile_path(prompt_path)
+
+    def response_of(self, match):
+        """Returns the content of the response of a prompt match, or an empty string if there is none."""
+        utterance = match.context
+        if utterance is None or not isinstance(utterance.path, Index) or utterance.context is None:
+            return ''
+        conversation = utterance.context.value
+        position = _array_index(utterance.path)
+        if position is None or not isinstance(conversation, list):
+            return ''
+        response_index = position + self.response_relative_position
+        if not 0 <= response_index < len(conversation):
+            return ''
+        response = conversation[response_index]
+        return response.get('content', '') if isinstance(response, dict) else ''
+
+    def extract(self, json_data):
+        """
+        Returns:
+        - A list of tuples (prompt, response, path of the prompt).
+        """
+        pairs = []
+        for match in self.expression.find(json_data):
+            response = self.response_of(match) if self.response_relative_position is not None else ''
+            pairs.append((match.value, response, str(match.full_path)))
+        return pairs
+
+    def extract_slice(self, array_path, elements, offset, start=0, stop=None):
+        """
+        Extracts the pairs of the prompts found in a slice of a conversation array, with the same paths and
+        responses as `extract` on the whole document. Responses outside of the slice are empty strings, so the
+        slice should extend `response_relative_position` beyond the prompts of interest.
+
+        Parameters:
+        array_path (str): A simple path of the conversation array, e.g. "$.conversation". The prompt path must
+        select prompts inside the elements of this array.
+        elements (list): The slice, array_path[offset:offset + len(elements)].
+        offset (int): The position of the first element of the slice in the array.
+        start, stop (int, optional): Only prompts at positions start <= position < stop are extracted.
+
+        Returns:
+        - A list of tuples (prompt, response, path of the prompt).
+        """
+        keys = array_keys(array_path)
+        document = elements
+        for key in reversed(keys):
+            document = {key: document}
+        prefix = ".".join(keys)
+        pairs = []
+        for match in self.expression.find(document):
+            utterance = match.context
+            if utterance is None or utterance.context is None or utterance.context.value is not elements:
+                continue
+            local = _array_index(utterance.path)
+            if local is None or local + offset < start or stop is not None and local + offset >= stop:
+                continue
+            path = str(match.full_path)
+            local_prefix = f"{prefix}.[{local}]" if prefix else f"[{local}]"
+            if not path.startswith(local_prefix):
+                continue
+            path = (f"{prefix}.[{local + offset}]" if prefix else f"[{local + offset}]") + path[len(local_prefix):]
+            response = self.response_of(match) if self.response_relative_position is not None else ''
+            pairs.append((match.value, response, path))
+        return pairs
+
+
+def array_keys(array_path):
+    """Returns the keys of a simple dotted path, e.g. "$.a.b" -> ["a", "b"]."""
+    path = array_path[1:] if array_path.startswith("$") else array_path
+    keys = [key for key in path.split(".") if key]
+    if any(not key.replace("_", "").replace("-", "").isalnum() for key in keys):
+        raise ValueError(f"Only simple dotted array paths are supported, got {array_path}")
+    return keys
+
+
+@lru_cache(maxsize=256)
+def compile_pair_extractor(prompt_path, response_relative_position=None):
+    """Returns a cached PairExtractor for the prompt path and response position."""
+    return PairExtractor(prompt_path, response_relative_position)
+
+
+def extract_prompt_response_pairs(json_data, prompt_path, response_relative_position=None):
+    """
+    Extracts pairs of prompts and responses from a given JSON structure based on provided JSONPath for prompts.
+    See `PairExtractor`.
+
+    Returns:
+    - A list of tuples (prompt, response, path of the prompt).
+    """
+    return compile_pair_extractor(prompt_path, response_relative_position).extract(json_data)
+
+
+def array_lengths(json_data, json_prompt_paths):
+    """
+    Returns {prompt path: length of the array holding its prompts} for the prompt paths below a simple array path,
+    e.g. len(json_data["conversation"]) for "$.conversation[?(@.role == 'user')].content". The stores keep these
+    lengths as the watermarks of `append_item`, the prompts before them are indexed.
+    """
+    lengths = {}
+    for prompt_path in json_prompt_paths:
+        array_path = prompt_path.split("[", 1)[0]
+        if "[" not in prompt_path or ".." in array_path:
+            continue
+        try:
+            keys = array_keys(array_path)
+        except ValueError:
+            continue
+        value = json_data
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else None
+        if isinstance(value, list):
+            lengths[prompt_path] = len(value)
+    return lengths
+
+
+def plan_append(watermarks, length, response_relative_position=None):
+    """
+    Plans the indexing of a conversation array grown to `length` elements by `append_item`.
+
+    Parameters:
+    watermarks (dict): {prompt path: array length indexed so far, None if unknown}.
+    length (int): The length of the array after the append.
+
+    Returns:
+    - (starts, offset): the position of the first prompt to index of each prompt path, including the prompts whose
+    response is among the new elements, and the start of the slice array[offset:length] to extract them from.
+    """
+    shift = response_relative_position or 0
+    starts = {}
+    for prompt_path, watermark in watermarks.items():
+        watermark = int(watermark) if watermark is not None and int(watermark) <= length else 0
+        # Prompts whose response is among the new items are indexed again with it
+        starts[prompt_path] = max(0, watermark - max(shift, 0))
+    offset = max(0, min(starts.values()) + min(shift, 0))
+    return starts, offset
+
+
+def plan_update(position, deleted, response_relative_position=None):
+    """
+    Plans the re-indexing of a conversation array whose element at `position` is replaced, or deleted.
+
+    Replacing an element affects the prompt at its position and the prompt whose response it is. Deleting it shifts
+    the following elements, so the prompts from its position on are affected.
+
+    Returns:
+    - (start, stop, offset, end): the affected prompts are at start <= position < stop, the slice array[offset:end]
+    holds them and their responses. stop and end are None when the prompts up to the end are affected.
+    """
+    shift = response_relative_position or 0
+    start = max(0, min(position, position - shift))
+    stop = None if deleted else max(position, position - shift) + 1
+    offset = max(0, start + min(shift, 0))
+    end = None if stop is None else stop + max(shift, 0)
+    return start, stop, offset, end
+
+
+def extract_slice_pairs(json_prompt_paths, response_relative_position, array_path, elements, offset, starts,
+                        stop=None):
+    """
+    Extracts the (prompt, response, path) tuples of all the prompt paths in a slice of a conversation array, see
+    `PairExtractor.extract_slice`. `starts` is {prompt path: position of its first prompt to extract}.
+    """
+    pairs = []
+    for prompt_path in json_prompt_paths:
+        extractor = compile_pair_extractor(prompt_path, response_relative_position)
+        for prompt, response, path in extractor.extract_slice(array_path, elements, offset, starts[prompt_path],
+                                                              stop):
+            pairs.append((prompt, response, f"$.{path.lstrip('$.')}"))
+    return pairs
@@ -0,0 +1,230 @@
+import math
+import re
+import threading
+from collections import Counter
+
+_TOKEN = re.compile(r"\w+(?:[-_.:/]\w+)*")
+_IDENTIFIER = re.compile(r"\d|[-_.:/]")
+
+
+def tokenize(text):
+    """
+    Lower-cased word tokens. Identifiers such as "worker-12" or "ERR_CONN_RESET" are kept whole and also split into
+    their parts, so they match both exactly and by their words.
+    """
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        if _IDENTIFIER.search(token):
+            parts = re.split(r"[-_.:/]", token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+    return tokens
+
+
+def is_identifier(token):
+    """True for tokens with digits or inner separators, like pod names, error codes or versions."""
+    return bool(_IDENTIFIER.search(token))
+
+
+class LexicalIndex:
+    """
+    An in-memory BM25 inverted index over the prompts of a vector store.
+
+    The stores keep it up to date when they write or delete prompts, and use it in their searches:
+    a query made of a few terms that are all indexed, at least one of them an identifier, and matched together
+    by at most `max_exact_hits` prompts is answered from the index alone, without embedding the query. Other queries
+    are answered with the reciprocal-rank fusion of the lexical and the vector results. There, the lexical hits
+    re-rank the vector hits, which passed the semantic distance threshold, and a prompt found only lexically is
+    returned only if it contains at least `min_coverage` of the query terms: sharing a common word with the query
+    does not make a cached response an answer to it.
+
+    # Example usage
+    store = LocalVectorStoreForJSON("conversations", lexical_index=LexicalIndex())
+    store.upsert_item(conversation, "$.conversation[?(@.role == 'user')].content", response_relative_position=1)
+    hits = store.search_item("worker-12", num_results=3)
+    """
+    def __init__(self, k1=1.2, b=0.75, max_exact_terms=3, max_exact_hits=10, max_df_ratio=0.5, min_coverage=1.0):
+        """
+        Creates an empty LexicalIndex.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        :param max_exact_terms: Maximum number of terms of a query answered from the index alone.
+        :param max_exact_hits: Maximum number of prompts matching all the terms of a query answered from the index
+        alone, more matches mean the terms are not selective.
+        :param max_df_ratio: Terms of more than this share of the prompts are ignored by searches, unless all the
+        terms of the query are: they barely change the ranking but have the longest posting lists.
+        :param min_coverage: Share of the distinct query terms a prompt found only by the lexical search must contain
+        to be returned by a hybrid search.
+        """
+        self.k1 = k1
+        self.b = b
+        self.max_exact_terms = max_exact_terms
+        self.max_exact_hits = max_exact_hits
+        self.max_df_ratio = max_df_ratio
+        self.min_coverage = min_coverage
+        self.postings = {}
+        self.terms = {}
+        self.lengths = {}
+        self.payloads = {}
+        self.total_length = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.lengths
+
+    def add(self, doc_id, text, payload=None):
+        """Indexes a prompt under `doc_id`, replacing its previous text. `payload` is returned with lexical hits."""
+        self.add_many([(doc_id, text, payload)])
+
+    def add_many(self, items):
+        """Indexes (doc_id, text, payload) items."""
+        with self.lock:
+            for doc_id, text, payload in items:
+                self._remove(doc_id)
+                counts = Counter(tokenize(text))
+                for token, count in counts.items():
+                    self.postings.setdefault(token, {})[doc_id] = count
+                length = sum(counts.values())
+                self.terms[doc_id] = set(counts)
+                self.lengths[doc_id] = length
+                self.total_length += length
+                self.payloads[doc_id] = payload
+
+    def remove(self, doc_ids):
+        """Removes prompts from the index, unknown ids are ignored."""
+        with self.lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        terms = self.terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.lengths.pop(doc_id)
+        self.payloads.pop(doc_id, None)
+        for token in terms:
+            postings = self.postings[token]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[token]
+
+    def clear(self):
+        with self.lock:
+            self.postings = {}
+            self.terms = {}
+            self.lengths = {}
+            self.payloads = {}
+            self.total_length = 0
+
+    def _scores(self, query, candidates=None):
+        """BM25 scores of the prompts matching the query, or of the candidates only."""
+        count = len(self.lengths)
+        average = self.total_length / count
+        scores = Counter()
+        postings_lists = [self.postings[token] for token in set(tokenize(query)) if token in self.postings]
+        if candidates is None:
+            selective = [postings for postings in postings_lists if len(postings) <= self.max_df_ratio * count]
+            postings_lists = selective or postings_lists
+        for postings in postings_lists:
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id in (postings if candidates is None else candidates.intersection(postings)):
+                frequency = postings[doc_id]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def coverage(self, query, doc_id):
+        """The share of the distinct terms of the query contained in a prompt."""
+        terms = set(tokenize(query))
+        with self.lock:
+            return len(terms.intersection(self.terms.get(doc_id, ()))) / len(terms) if terms else 0.0
+
+    def search(self, query, k=10):
+        """Returns the (doc_id, score, payload) of the k best BM25 matches of the query, best first."""
+        with self.lock:
+            if not self.lengths:
+                return []
+            return [(doc_id, score, self.payloads[doc_id]) for doc_id, score in self._scores(query).most_common(k)]
+
+    def exact_match(self, query, k=10):
+        """
+        Returns the lexical hits of the query if it is a high-confidence exact-term match (see above), else None.
+        """
+        terms = _TOKEN.findall(query.lower())
+        if not terms or len(terms) > self.max_exact_terms or not any(is_identifier(term) for term in terms):
+            return None
+        with self.lock:
+            matched = None
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    return None
+                matched = set(postings) if matched is None else matched.intersection(postings)
+            if not matched or len(matched) > self.max_exact_hits:
+                return None
+            return [(doc_id, score, self.payloads[doc_id])
+                    for doc_id, score in self._scores(query, matched).most_common(k)]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses rankings (lists of ids, best first) by the sum of 1 / (k + rank) of each id, returns (id, score) best
+    first.
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] += 1 / (k + rank)
+    return scores.most_common()
+
+
+def hybrid_hits(vector_hits, lexical_hits, num_results, return_fields, id_field="id", k=60):
+    """
+    Merges the vector hits (dicts with an `id_field`) and the lexical hits ((doc_id, score, payload) with the same
+    ids) of a query by reciprocal-rank fusion. Prompts only found lexically are returned with their payload and
+    without "vector_distance". Hits carry the fields of return_fields they have, and "lexical_score" if requested.
+    """
+    by_id = {hit[id_field]: dict(hit) for hit in vector_hits}
+    for doc_id, score, payload in lexical_hits:
+        hit = by_id.setdefault(doc_id, {id_field: doc_id, **(payload or {})})
+        hit["lexical_score"] = score
+    fused = reciprocal_rank_fusion([[hit[id_field] for hit in vector_hits],
+                                    [doc_id for doc_id, _, _ in lexical_hits]], k)
+    return [{field: by_id[doc_id][field] for field in return_fields if field in by_id[doc_id]}
+            for doc_id, _ in fused[:num_results]]
+
+
+def hybrid_search(lexical_index, queries, num_results, vector_search, return_fields, id_field="id"):
+    """
+    Searches queries with a lexical index and a vector search. Exact-term queries are answered by the lexical index
+    alone, the other queries by `vector_search(queries)`, which returns the hit lists of the queries with their
+    `id_field`, fused with the lexical hits. Returns the hit lists with the fields of return_fields.
+    """
+    exact = [lexical_index.exact_match(query, num_results) for query in queries]
+    pending = [query for query, hits in zip(queries, exact) if hits is None]
+    vector_results = vector_search(pending) if pending else []
+    return fuse_results(lexical_index, queries, exact, vector_results, num_results, return_fields, id_field)
+
+
+def fuse_results(lexical_index, queries, exact, vector_results, num_results, return_fields, id_field="id"):
+    """
+    The second half of `hybrid_search`: `exact` are the exact matches of the queries (None if not exact) and
+    `vector_results` the vector hit lists of the queries without exact matches. Prompts found only by the lexical
+    search are kept if they cover `min_coverage` of the query, see LexicalIndex.
+    """
+    vector_results = iter(vector_results)
+    results = []
+    for query, hits in zip(queries, exact):
+        if hits is not None:
+            results.append(hybrid_hits([], hits, num_results, return_fields, id_field))
+        else:
+            vector_hits = next(vector_results)
+            found = {hit[id_field] for hit in vector_hits}
+            lexical_hits = [hit for hit in lexical_index.search(query, num_results)
+                            if hit[0] in found or lexical_index.coverage(query, hit[0]) >= lexical_index.min_coverage]
+            results.append(hybrid_hits(vector_hits, lexical_hits, num_results, return_fields, id_field))
+    return results
@@ -0,0 +1,930 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from uuid import uuid4
+
+import numpy as np
+
+from anli.config import DEFAULT_DATA_PATH
+from anli.utils.context_window import hit_location, plan_context_windows
+from anli.utils.dedup import Deduplicator, merge_occurrences
+from anli.utils.embedding_engine import DEFAULT_EMBEDDING_MODEL, get_embedding_engine
+from anli.utils.json_paths import (array_keys, array_lengths, compile_pair_extractor, compile_path,
+                                   extract_slice_pairs, plan_append, plan_update)
+from anli.utils.lexical_index import hybrid_search
+from anli.utils.snapshot import Snapshot, SnapshotWriter
+
+
+class _VectorMatrix:
+    """An append-only, memory-mapped matrix that grows by doubling its file."""
+    def __init__(self, path, dims, rows, initial_rows=1024, dtype=np.float32):
+        self.path = path
+        self.dims = dims
+        self.rows = rows
+        self.dtype = np.dtype(dtype)
+        self._map(max(initial_rows, rows))
+
+    def _map(self, capacity):
+        size = capacity * self.dims * self.dtype.itemsize
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < size:
+            with open(self.path, "ab") as file:
+                file.truncate(size)
+        self.vectors = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(capacity, self.dims))
+        self.capacity = capacity
+
+    def write(self, row, vectors):
+        end = row + len(vectors)
+        if end > self.capacity:
+            self.vectors.flush()
+            capacity = self.capacity
+            while capacity < end:
+                capacity *= 2
+            self._map(capacity)
+        self.vectors[row:end] = vectors
+        self.rows = max(self.rows, end)
+
+    def chunks(self, chunk_rows=262144):
+        """Yields (start, stop, rows as float32) over the written rows."""
+        for start in range(0, self.rows, chunk_rows):
+            stop = min(start + chunk_rows, self.rows)
+            yield start, stop, self.vectors[start:stop].astype(np.float32, copy=False)
+
+    def scores(self, queries):
+        """Cosine similarities of unit queries with all rows."""
+        scores = np.empty((len(queries), self.rows), dtype=np.float32)
+        for start, stop, vectors in self.chunks():
+            scores[:, start:stop] = queries @ vectors.T
+        return scores
+
+    @property
+    def nbytes(self):
+        return self.rows * self.dims * self.dtype.itemsize
+
+    def flush(self):
+        self.vectors.flush()
+
+
+class _ScalarCodes:
+    """
+    float16 or int8 codes of unit vectors. int8 codes are scaled per vector by its largest absolute value.
+    """
+    def __init__(self, directory, dims, rows, kind):
+        self.kind = kind
+        self.trained = True
+        if kind == "float16":
+            self.codes = _VectorMatrix(os.path.join(directory, "codes.f16"), dims, rows, dtype=np.float16)
+            self.scales = None
+        else:
+            self.codes = _VectorMatrix(os.path.join(directory, "codes.i8"), dims, rows, dtype=np.int8)
+            self.scales = _VectorMatrix(os.path.join(directory, "codes.scales"), 1, rows)
+
+    def write(self, row, vectors):
+        if self.scales is None:
+            self.codes.write(row, vectors.astype(np.float16))
+            return
+        scales = np.abs(vectors).max(axis=1, keepdims=True) / 127
+        scales[scales == 0] = 1
+        self.codes.write(row, np.round(vectors / scales).astype(np.int8))
+        self.scales.write(row, scales)
+
+    def scores(self, queries, rows, block_rows=16384):
+        """
+        Approximate similarities of unit queries with all rows. The codes are converted to float32 for the matrix
+        product by blocks of `block_rows` (48 MB at 768 dimensions), not by whole chunks of the matrix.
+        """
+        scores = np.empty((len(queries), rows), dtype=np.float32)
+        for start, stop, codes in self.codes.chunks(block_rows):
+            block = scores[:, start:stop]
+            np.matmul(queries, codes.T, out=block)
+            if self.scales is not None:
+                block *= self.scales.vectors[start:stop, 0]
+        return scores
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def flush(self):
+        self.codes.flush()
+        if self.scales is not None:
+            self.scales.flush()
+
+
+class _ProductCodes:
+    """
+    Product quantization: each vector is split in `subspaces` parts, each part is coded by the nearest of 256
+    centroids (one byte). Scores are sums of per-part lookup tables. The codebooks are trained with k-means once
+    `train_size` vectors are stored, until then the codes are empty and searches are exact.
+    """
+    def __init__(self, directory, dims, rows, subspaces=None, train_size=4096):
+        if subspaces is None:
+            subspaces = max(d for d in range(1, max(dims // 4, 1) + 1) if dims % d == 0)
+        if dims % subspaces:
+            raise ValueError(f"{dims} dimensions can not be split in {subspaces} subspaces.")
+        self.dims = dims
+        self.subspaces = subspaces
+        self.train_size = train_size
+        self.codebooks_path = os.path.join(directory, "codebooks.npy")
+        self.codebooks = np.load(self.codebooks_path) if os.path.exists(self.codebooks_path) else None
+        self.codes = _VectorMatrix(os.path.join(directory, "codes.pq"), subspaces, rows if self.trained else 0,
+                                   dtype=np.uint8)
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    def _parts(self, vectors):
+        return vectors.reshape(len(vectors), self.subspaces, self.dims // self.subspaces)
+
+    def train(self, vectors, iterations=10, seed=0):
+        """Trains the codebooks on a sample of unit vectors with k-means."""
+        rng = np.random.default_rng(seed)
+        parts = self._parts(vectors).transpose(1, 0, 2)
+        codebooks = np.zeros((self.subspaces, 256, parts.shape[2]), dtype=np.float32)
+        for subspace, points in enumerate(parts):
+            means = points[rng.choice(len(points), 256, replace=len(points) < 256)].copy()
+            for _ in range(iterations):
+                assignment = self._nearest(points, means)
+                counts = np.bincount(assignment, minlength=256)
+                sums = np.zeros_like(means)
+                np.add.at(sums, assignment, points)
+                filled = counts > 0
+                means[filled] = sums[filled] / counts[filled, None]
+            codebooks[subspace] = means
+        self.codebooks = codebooks
+        np.save(self.codebooks_path, codebooks)
+
+    @staticmethod
+    def _nearest(points, means):
+        distances = (means * means).sum(axis=1) - 2 * points @ means.T
+        return np.argmin(distances, axis=1)
+
+    def encode(self, vectors):
+        parts = self._parts(vectors)
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for subspace in range(self.subspaces):
+            codes[:, subspace] = self._nearest(parts[:, subspace], self.codebooks[subspace])
+        return codes
+
+    def write(self, row, vectors):
+        if self.trained:
+            self.codes.write(row, self.encode(vectors))
+
+    def scores(self, queries, rows):
+        # tables[q, subspace, centroid]: similarity of each query part with each centroid
+        tables = np.einsum("qsd,scd->qsc", self._parts(queries), self.codebooks)
+        scores = np.zeros((len(queries), rows), dtype=np.float32)
+        for start in range(0, self.codes.rows, 65536):
+            stop = min(start + 65536, self.codes.rows)
+            codes = self.codes.vectors[start:stop]
+            for subspace in range(self.subspaces):
+                scores[:, start:stop] += tables[:, subspace, codes[:, subspace]]
+        return scores
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.codebooks.nbytes if self.trained else 0)
+
+    def flush(self):
+        self.codes.flush()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class LocalVectorStoreForJSON:
+    """
+    An in-process vector store for JSON objects, for edge deployments without any external service.
+
+    It has the API of RedisVectorStoreForJSON: JSON objects and the prompt/response records are kept in a sqlite
+    database, the prompt embeddings in an append-only memory-mapped float32 matrix next to it. Opening a store maps
+    the files without reading them. Searches score all vectors with one matrix product and select the top k with
+    argpartition. As in the Redis store, a record is identified by its prompt, so storing the same prompt again
+    replaces its record.
+
+    For large indexes, `quantization` keeps compact codes of the vectors next to them: "float16" (2 bytes per
+    dimension), "int8" (1 byte per dimension) or "pq" (product quantization, 1 byte per subspace). Searches then
+    score the codes and re-rank the `rerank_factor * num_results` best candidates exactly, reading only their
+    float32 vectors from the memory-mapped file. The setting is kept per index, changing it rebuilds the codes.
+
+    # Example usage
+    store = LocalVectorStoreForJSON("conversations", vectorizer=HFTextVectorizer("sentence-transformers/all-mpnet-base-v2"))
+    store.upsert_item(conversation, "$.conversation[?(@.role == 'user')].content", response_relative_position=1)
+    hits = store.search_item("delete the pod", num_results=3)
+    """
+    def __init__(self, index_name, default_semantic_distance_threshold=0.1, path=None, vectorizer=None,
+                 embedding_cache=None, quantization=None, rerank_factor=4, pq_subspaces=None, pq_train_size=4096,
+                 lexical_index=None, deduplicator=None):
+        """
+        Creates a LocalVectorStoreForJSON object.
+        :param index_name: The name of the store, its files are in `path`/`index_name`.
+        :param default_semantic_distance_threshold: Maximum cosine distance of search results.
+        :param path: The directory of the stores. Default: DEFAULT_DATA_PATH/local_vector_store.
+        :param vectorizer: A redisvl vectorizer (embed_many), a langchain embedding (embed_documents) or a function
+        taking a list of texts. If None, use the shared EmbeddingEngine of "sentence-transformers/all-mpnet-base-v2".
+        An EmbeddingDispatcher embeds the queries of concurrent searches in batches.
+        :param embedding_cache: An optional EmbeddingCache consulted before every vectorizer call.
+        :param quantization: None, "float16", "int8" or "pq", see above.
+        :param rerank_factor: Candidates re-ranked exactly per result when quantization is used.
+        :param pq_subspaces: Number of product quantization subspaces, it must divide the embedding dimensions.
+        Default: the largest divisor up to a quarter of the dimensions.
+        :param pq_train_size: Number of stored vectors from which the product quantization codebooks are trained.
+        :param lexical_index: An optional LexicalIndex of the prompts, see RedisVectorStoreForJSON. It is built from
+        the stored records when empty.
+        :param deduplicator: An optional Deduplicator, see RedisVectorStoreForJSON. The occurrences of the canonical
+        prompts are kept in the sqlite database, hits have them in the "occurrences" return field. It is built from
+        the stored records when empty.
+        """
+        if quantization not in (None, "float16", "int8", "pq"):
+            raise ValueError(f"Unknown quantization {quantization}, use None, 'float16', 'int8' or 'pq'.")
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.pq_subspaces = pq_subspaces
+        self.pq_train_size = pq_train_size
+        self.index_name = index_name
+        self.default_semantic_distance_threshold = default_semantic_distance_threshold
+        self.directory = os.path.join(path if path is not None else os.path.join(DEFAULT_DATA_PATH,
+                                                                                   "local_vector_store"), index_name)
+        os.makedirs(self.directory, exist_ok=True)
+        # The shared default engine only loads its model when the first prompt is embedded
+        self.vectorizer = vectorizer if vectorizer is not None else get_embedding_engine(DEFAULT_EMBEDDING_MODEL)
+        self.embedding_cache = embedding_cache
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(os.path.join(self.directory, "store.sqlite"), check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (suffix TEXT PRIMARY KEY, json TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS records (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, prompt TEXT,
+                                                response TEXT, name TEXT, path TEXT, deleted INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS occurrences (id TEXT NOT NULL, name TEXT NOT NULL, path TEXT NOT NULL,
+                                                    PRIMARY KEY (id, name, path));
+            CREATE TABLE IF NOT EXISTS watermarks (suffix TEXT NOT NULL, prompt_path TEXT NOT NULL, length INTEGER,
+                                                   PRIMARY KEY (suffix, prompt_path));
+        """)
+        self.matrix = None
+        self.codes = None
+        self.deleted = np.zeros(0, dtype=bool)
+        dims = self._setting("dims")
+        if dims is not None:
+            self._open_matrix(int(dims))
+        self.lexical_index = lexical_index
+        if lexical_index is not None and not len(lexical_index):
+            self.rebuild_lexical_index()
+        self.deduplicator = deduplicator
+        if deduplicator is not None and not len(deduplicator):
+            self.rebuild_deduplicator()
+
+    def rebuild_deduplicator(self):
+        """Adds the stored prompts to the deduplicator."""
+        with self.lock:
+            self.deduplicator.clear()
+            for record_id, prompt in self.db.execute("SELECT id, prompt FROM records WHERE deleted = 0"):
+                self.deduplicator.add(record_id, prompt)
+
+    def _deduplicate(self, records):
+        """
+        Maps (prompt, response, metadata) records to their canonical prompts, see `deduplicator`. Nothing is changed
+        until `_add_deduplicated` is called with the result, after the new records are written.
+        :return: The positions of the records of new canonical prompts, and the occurrences of all records.
+        """
+        # Duplicates within the batch are found in a deduplicator of the batch
+        batch = Deduplicator(self.deduplicator.max_distance, self.deduplicator.min_words)
+        kept, occurrences = [], []
+        for position, (prompt, _, metadata) in enumerate(records):
+            record_id = self.deduplicator.find(prompt) or batch.find(prompt)
+            if record_id is None:
+                record_id = self.record_id(prompt)
+                batch.add(record_id, prompt)
+                kept.append(position)
+            occurrences.append((record_id, metadata["name"], metadata["path"]))
+        return kept, occurrences
+
+    def _add_deduplicated(self, records, kept, occurrences):
+        """Adds the new canonical prompts to the deduplicator and stores the occurrences, with the store locked."""
+        for position in kept:
+            self.deduplicator.add(self.record_id(records[position][0]), records[position][0])
+        self.db.executemany("INSERT OR IGNORE INTO occurrences VALUES (?, ?, ?)", occurrences)
+
+    def rebuild_lexical_index(self):
+        """Indexes the stored prompts in the lexical index."""
+        with self.lock:
+            self.lexical_index.clear()
+            self._index_lexically(self.db.execute(
+                "SELECT id, prompt, response, name, path FROM records WHERE deleted = 0"))
+
+    def _index_lexically(self, rows):
+        """Adds (record id, prompt, response, name, path) rows to the lexical index, under the ids of their hits."""
+        self.lexical_index.add_many((f"{self.index_name}:{record_id}", prompt,
+                                     {"prompt": prompt, "response": response, "name": name, "path": path})
+                                    for record_id, prompt, response, name, path in rows)
+
+    def _setting(self, key, value=None):
+        if value is None:
+            row = self.db.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+        self.db.execute("INSERT OR REPLACE INTO settings VALUES (?, ?)", (key, str(value)))
+
+    def _open_matrix(self, dims):
+        rows = self.db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM records").fetchone()[0]
+        self.matrix = _VectorMatrix(os.path.join(self.directory, "vectors.f32"), dims, rows)
+        self.deleted = np.zeros(rows, dtype=bool)
+        deleted = [row for row, in self.db.execute("SELECT row FROM records WHERE deleted = 1")]
+        self.deleted[deleted] = True
+        self._open_codes()
+
+    def _code_files(self):
+        return [os.path.join(self.directory, name) for name in
+                ("codes.f16", "codes.i8", "codes.scales", "codes.pq", "codebooks.npy")]
+
+    def _open_codes(self):
+        """Opens the codes of the vectors, rebuilding them if the quantization of the index changed."""
+        rebuild = (self._setting("quantization") or "none") != (self.quantization or "none")
+        if rebuild:
+            for code_file in self._code_files():
+                if os.path.exists(code_file):
+                    os.remove(code_file)
+            self._setting("quantization", self.quantization or "none")
+            self.db.commit()
+        dims, rows = self.matrix.dims, self.matrix.rows
+        if self.quantization is None:
+            self.codes = None
+        elif self.quantization == "pq":
+            self.codes = _ProductCodes(self.directory, dims, 0 if rebuild else rows, self.pq_subspaces,
+                                       self.pq_train_size)
+            self._train_codes()
+        else:
+            self.codes = _ScalarCodes(self.directory, dims, 0 if rebuild else rows, self.quantization)
+            if rebuild:
+                for start, _, vectors in self.matrix.chunks():
+                    self.codes.write(start, vectors)
+                self.codes.flush()
+
+    def _train_codes(self):
+        """Trains the product quantization codebooks once enough vectors are stored, then codes all vectors."""
+        if self.codes is None or self.codes.trained or self.matrix.rows < self.pq_train_size:
+            return
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(self.matrix.rows, min(self.matrix.rows, 65536), replace=False))
+        self.codes.train(np.asarray(self.matrix.vectors[sample]))
+        for start, _, vectors in self.matrix.chunks():
+            self.codes.write(start, vectors)
+        self.codes.flush()
+
+    def _write_vectors(self, row, vectors):
+        self.matrix.write(row, vectors)
+        if self.codes is not None:
+            self.codes.write(row, vectors)
+
+    def memory_usage(self):
+        """
+        Returns the bytes of the full precision vectors and of their codes. With quantization, searches read all
+        codes but only the vectors of the re-ranked candidates.
+        """
+        return {"vectors": self.matrix.nbytes if self.matrix is not None else 0,
+                "codes": self.codes.nbytes if self.codes is not None else 0}
+
+    def _vectorize(self, texts):
+        if hasattr(self.vectorizer, "embed_many"):
+            return self.vectorizer.embed_many(texts)
+        if hasattr(self.vectorizer, "embed_documents"):
+            return self.vectorizer.embed_documents(texts)
+        return self.vectorizer(texts)
+
+    @property
+    def model_id(self):
+        """The id of the embedding model, used by the embedding cache and the snapshots."""
+        return getattr(self.vectorizer, "model", None) or getattr(self.vectorizer, "model_name", None) or \
+            getattr(self.vectorizer, "__name__", type(self.vectorizer).__name__)
+
+    def _embed_many(self, texts):
+        if self.embedding_cache is None:
+            return _normalize(self._vectorize(texts))
+        return _normalize(self.embedding_cache.embed_many(self.model_id, texts, self._vectorize))
+
+    @staticmethod
+    def record_id(prompt):
+        """Records are identified by the SHA256 of their prompt, like SemanticCache entries."""
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def upsert_item(self, json_data: dict,
+                    json_prompt_paths: [str] = None,
+                    response_relative_position: int = None,
+                    json_storage_id_suffix: str = None,
+                    json_storage_path: str = '$'):
+        """
+        Inserts or updates a JSON object and optionally indexes its prompts. See RedisVectorStoreForJSON.upsert_item.
+        :return: str - A message indicating the number of objects upserted.
+        """
+        return self.upsert_many([json_data], json_prompt_paths, response_relative_position,
+                                [json_storage_id_suffix], json_storage_path)
+
+    def upsert_many(self, documents,
+                    json_prompt_paths: [str] = None,
+                    response_relative_position: int = None,
+                    json_storage_id_suffixes: [str] = None,
+                    json_storage_path: str = '$'):
+        """
+        Inserts or updates many JSON objects in one transaction, embedding their prompts with one vectorizer call.
+        See RedisVectorStoreForJSON.upsert_many.
+        :return: str - A message indicating the number of objects upserted.
+        """
+        if isinstance(json_prompt_paths, str):
+            json_prompt_paths = [json_prompt_paths]
+        documents = list(documents)
+        suffixes = list(json_storage_id_suffixes) if json_storage_id_suffixes is not None else []
+        suffixes = [suffix if suffix is not None else str(uuid4())
+                    for suffix in suffixes + [None] * (len(documents) - len(suffixes))]
+
+        with self.lock, self.db:
+            diff = 0
+            records = []
+            for suffix, json_data in zip(suffixes, documents):
+                stored = self._get(suffix)
+                diff += stored is None
+                if json_storage_path == '$':
+                    stored = json_data
+                else:
+                    stored = compile_path(json_storage_path).update_or_create(stored or {}, json_data)
+                self.db.execute("INSERT OR REPLACE INTO documents VALUES (?, ?)", (suffix, json.dumps(stored)))
+                self.db.execute("DELETE FROM watermarks WHERE suffix = ?", (suffix,))
+                if json_storage_path == '$' and json_prompt_paths is not None:
+                    # The occurrences of the replaced object are recorded again with its records
+                    self.db.execute("DELETE FROM occurrences WHERE name = ?", (f"{self.index_name}-{suffix}",))
+                for prompt_path in json_prompt_paths or []:
+                    extractor = compile_pair_extractor(prompt_path, response_relative_position)
+                    for prompt, response, p in extractor.extract(json_data):
+                        stored_path = f"{json_storage_path}.{p.lstrip('$.')}"
+                        records.append((prompt, response, {"name": f"{self.index_name}-{suffix}",
+                                                           "path": stored_path}))
+        count = self._store_records(records)
+        if json_prompt_paths is not None and json_storage_path == '$':
+            # The watermarks of append_item, see RedisVectorStoreForJSON.append_item
+            with self.lock, self.db:
+                self.db.executemany("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)", [
+                    (suffix, prompt_path, length) for suffix, json_data in zip(suffixes, documents)
+                    for prompt_path, length in array_lengths(json_data, json_prompt_paths).items()])
+        if json_prompt_paths is not None:
+            return f"Upsert {diff} objects to JSON_store and {count} prompts to vector_index."
+        return f"Upsert {diff} objects to JSON_store, skipped vector_index."
+
+    def append_item(self, new_items, json_storage_id_suffix: str,
+                    json_prompt_paths: [str] = None,
+                    response_relative_position: int = None,
+                    array_path: str = '$.conversation'):
+        """
+        Appends utterances to the conversation array of a stored JSON object and indexes only the new prompts, with
+        the watermarks set by `upsert_item`. See RedisVectorStoreForJSON.append_item.
+        :return: str - A message indicating the number of prompts indexed.
+        """
+        if isinstance(json_prompt_paths, str):
+            json_prompt_paths = [json_prompt_paths]
+        with self.lock, self.db:
+            document, array = self._array(json_storage_id_suffix, array_path)
+            array.extend(new_items)
+            self.db.execute("UPDATE documents SET json = ? WHERE suffix = ?",
+                            (json.dumps(document), json_storage_id_suffix))
+            if json_prompt_paths is None:
+                return f"Append {len(new_items)} items to JSON_store, skipped vector_index."
+            watermarks = dict(self.db.execute(
+                f"SELECT prompt_path, length FROM watermarks WHERE suffix = ? AND prompt_path IN "
+                f"({','.join('?' * len(json_prompt_paths))})", [json_storage_id_suffix, *json_prompt_paths]))
+        length = len(array)
+        starts, offset = plan_append({prompt_path: watermarks.get(prompt_path) for prompt_path in json_prompt_paths},
+                                     length, response_relative_position)
+        count = self._store_records(self._slice_records(json_storage_id_suffix, json_prompt_paths,
+                                                        response_relative_position, array_path,
+                                                        array[offset:length], offset, starts))
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)",
+                                [(json_storage_id_suffix, prompt_path, length) for prompt_path in json_prompt_paths])
+        return f"Append {len(new_items)} items to JSON_store and {count} prompts to vector_index."
+
+    def update_utterance(self, json_storage_id_suffix: str, position: int, item=None,
+                         json_prompt_paths: [str] = None,
+                         response_relative_position: int = None,
+                         array_path: str = '$.conversation'):
+        """
+        Replaces or deletes one utterance of a stored conversation and re-indexes only the affected prompts. See
+        RedisVectorStoreForJSON.update_utterance.
+        :return: str - A message indicating the number of prompts indexed.
+        """
+        if isinstance(json_prompt_paths, str):
+            json_prompt_paths = [json_prompt_paths]
+        start, stop, offset, end = plan_update(position, item is None, response_relative_position)
+        with self.lock, self.db:
+            document, array = self._array(json_storage_id_suffix, array_path)
+            old_elements = array[offset:end]
+            if item is None:
+                array.pop(position)
+            else:
+                array[position] = item
+            self.db.execute("UPDATE documents SET json = ? WHERE suffix = ?",
+                            (json.dumps(document), json_storage_id_suffix))
+            if json_prompt_paths is None:
+                return "Update 1 item in JSON_store, skipped vector_index."
+            starts = {prompt_path: start for prompt_path in json_prompt_paths}
+            self._remove_occurrences(self._slice_records(json_storage_id_suffix, json_prompt_paths,
+                                                         response_relative_position, array_path, old_elements,
+                                                         offset, starts, stop))
+            if item is None:
+                self.db.execute("UPDATE watermarks SET length = length - 1 WHERE suffix = ? AND length > ?",
+                                (json_storage_id_suffix, position))
+        count = self._store_records(self._slice_records(json_storage_id_suffix, json_prompt_paths,
+                                                        response_relative_position, array_path, array[offset:end],
+                                                        offset, starts, stop))
+        return f"Update 1 item in JSON_store and {count} prompts to vector_index."
+
+    def _array(self, suffix, array_path):
+        """Returns a stored JSON object and its conversation array at a simple path."""
+        document = self._get(suffix)
+        if document is None:
+            raise KeyError(f"No JSON object {self.index_name}-{suffix}")
+        array = document
+        for key in array_keys(array_path):
+            array = array[key]
+        return document, array
+
+    def _slice_records(self, suffix, json_prompt_paths, response_relative_position, array_path, elements, offset,
+                       starts, stop=None):
+        """Extracts the (prompt, response, metadata) records of the prompts in a slice of a conversation array."""
+        return [(prompt, response, {"name": f"{self.index_name}-{suffix}", "path": path})
+                for prompt, response, path in extract_slice_pairs(json_prompt_paths, response_relative_position,
+                                                                  array_path, elements, offset, starts, stop)]
+
+    def _store_records(self, records, vectors=None):
+        """
+        Writes (prompt, response, metadata) records and their embeddings. Vectors are computed if not given.
+        :return: The number of records stored.
+        """
+        if not records:
+            return 0
+        count = None
+        deduplicated = None
+        if self.deduplicator is not None:
+            # Duplicates of stored prompts are only recorded as occurrences, they are not embedded
+            count = len(records)
+            with self.lock:
+                kept, occurrences = self._deduplicate(records)
+            if not kept:
+                with self.lock, self.db:
+                    self._add_deduplicated(records, kept, occurrences)
+                return count
+            # Recorded with the new records, so nothing points at them if embedding fails
+            deduplicated = (records, kept, occurrences)
+            records = [records[p] for p in kept]
+            vectors = np.asarray(vectors)[kept] if vectors is not None else None
+        # A prompt stored twice keeps its last record, like SemanticCache
+        ids = [self.record_id(prompt) for prompt, _, _ in records]
+        unique = {}
+        for position, record_id in enumerate(ids):
+            unique[record_id] = position
+        positions = list(unique.values())
+        repeated = []
+        if deduplicated is None:
+            # A prompt repeated in the JSON object of its record lists all its paths as occurrences, so the record
+            # stays while one of them remains, see `_remove_occurrences`
+            paths = {}
+            for record_id, (_, _, metadata) in zip(ids, records):
+                if metadata["name"] == records[unique[record_id]][2]["name"]:
+                    paths.setdefault(record_id, []).append((record_id, metadata["name"], metadata["path"]))
+            repeated = [occurrence for occurrences in paths.values() if len(occurrences) > 1
+                        for occurrence in occurrences]
+        vectors = self._embed_many([records[p][0] for p in positions]) if vectors is None else \
+            _normalize(vectors)[positions]
+        with self.lock, self.db:
+            if self.matrix is None:
+                self._setting("dims", vectors.shape[1])
+                self._open_matrix(vectors.shape[1])
+            existing = dict(self.db.execute(
+                f"SELECT id, row FROM records WHERE id IN ({','.join('?' * len(unique))})", list(unique)))
+            next_row = self.matrix.rows
+            rows = []
+            for record_id in unique:
+                if record_id in existing:
+                    rows.append(existing[record_id])
+                else:
+                    rows.append(next_row)
+                    next_row += 1
+            self.db.executemany(
+                "INSERT OR REPLACE INTO records (row, id, prompt, response, name, path, deleted) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                [(row, record_id, records[p][0], records[p][1], records[p][2]["name"], records[p][2]["path"])
+                 for row, record_id, p in zip(rows, unique, positions)])
+            rows = np.asarray(rows)
+            appended = rows >= self.matrix.rows
+            if appended.any():
+                # New rows are contiguous after the existing ones
+                self._write_vectors(int(rows[appended][0]), vectors[appended])
+            for row, vector in zip(rows[~appended], vectors[~appended]):
+                self._write_vectors(int(row), vector[None])
+            if len(self.deleted) < self.matrix.rows:
+                self.deleted = np.concatenate([self.deleted, np.zeros(self.matrix.rows - len(self.deleted), bool)])
+            self.deleted[rows] = False
+            self.matrix.flush()
+            if self.codes is not None:
+                self._train_codes()
+                self.codes.flush()
+            if self.lexical_index is not None:
+                self._index_lexically((record_id, *records[p][:2], records[p][2]["name"], records[p][2]["path"])
+                                      for record_id, p in zip(unique, positions))
+            if deduplicated is not None:
+                self._add_deduplicated(*deduplicated)
+            else:
+                self.db.executemany("INSERT OR IGNORE INTO occurrences VALUES (?, ?, ?)", repeated)
+        return count if count is not None else len(unique)
+
+    def search_item(self, query, num_results=1, return_fields=["response", "name", "path", "vector_distance"],
+                    semantic_distance_threshold=None):
+        """
+        Searches the prompts semantically close to the query. See RedisVectorStoreForJSON.search_item.
+        :return: A list of dicts with the return fields, closest first. "vector_distance" is the cosine distance,
+        it is missing from the hits found only by the lexical index.
+        """
+        return self.search_many([query], num_results, return_fields, semantic_distance_threshold)[0]
+
+    def search_many(self, queries, num_results=1, return_fields=["response", "name", "path", "vector_distance"],
+                    semantic_distance_threshold=None, batch_size=256):
+        """
+        Searches many queries with one vectorizer call and one matrix product per batch.
+        :return: A list with the results of each query, in the order of the queries.
+        """
+        if self.lexical_index is not None:
+            return hybrid_search(self.lexical_index, queries, num_results,
+                                 lambda pending: self._vector_search_many(pending, num_results, ["id", *return_fields],
+                                                                          semantic_distance_threshold, batch_size),
+                                 return_fields)
+        return self._vector_search_many(queries, num_results, return_fields, semantic_distance_threshold, batch_size)
+
+    def _vector_search_many(self, queries, num_results, return_fields, semantic_distance_threshold, batch_size):
+        if semantic_distance_threshold is None:
+            semantic_distance_threshold = self.default_semantic_distance_threshold
+        results = []
+        for position in range(0, len(queries), batch_size):
+            batch = queries[position:position + batch_size]
+            if self.matrix is None or self.matrix.rows == 0:
+                results.extend([] for _ in batch)
+                continue
+            # Embedding outside the lock lets an EmbeddingDispatcher batch the queries of concurrent searches
+            vectors = self._embed_many(batch)
+            with self.lock:
+                # The index may have been cleared while the queries were embedded
+                candidates = self._top_k(vectors, num_results) if self.matrix is not None and self.matrix.rows \
+                    else [((), ())] * len(batch)
+            results.extend(self._hits(rows, distances, return_fields, semantic_distance_threshold)
+                           for rows, distances in candidates)
+        return results
+
+    def _top_k(self, queries, k):
+        """Returns (rows, cosine distances) of the k closest vectors of each query, closest first."""
+        if self.codes is not None and self.codes.trained:
+            return self._top_k_reranked(queries, k)
+        scores = self.matrix.scores(queries)
+        scores[:, self.deleted[:scores.shape[1]]] = -np.inf
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        candidates = []
+        for query_scores, rows in zip(scores, top):
+            rows = rows[np.argsort(-query_scores[rows], kind="stable")]
+            candidates.append((rows, 1 - query_scores[rows]))
+        return candidates
+
+    def _top_k_reranked(self, queries, k):
+        """Selects candidates with the codes and re-ranks them with the full precision vectors."""
+        scores = self.codes.scores(queries, self.matrix.rows)
+        scores[:, self.deleted[:scores.shape[1]]] = -np.inf
+        candidates = min(k * self.rerank_factor, scores.shape[1])
+        top = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+        results = []
+        for query, rows in zip(queries, top):
+            # Sorted rows read the memory-mapped vectors sequentially
+            rows = np.sort(rows)
+            exact = np.asarray(self.matrix.vectors[rows]) @ query
+            exact[self.deleted[rows]] = -np.inf
+            order = np.argsort(-exact, kind="stable")[:k]
+            results.append((rows[order], 1 - exact[order]))
+        return results
+
+    def _hits(self, rows, distances, return_fields, threshold):
+        keep = [(int(row), float(distance)) for row, distance in zip(rows, distances) if distance <= threshold]
+        if not keep:
+            return []
+        fields = {row: values for row, *values in self.db.execute(
+            f"SELECT row, id, prompt, response, name, path FROM records WHERE row IN ({','.join('?' * len(keep))})",
+            [row for row, _ in keep])}
+        occurrences = {}
+        if "occurrences" in return_fields:
+            ids = [values[0] for values in fields.values()]
+            for record_id, name, path in self.db.execute(
+                    f"SELECT id, name, path FROM occurrences WHERE id IN ({','.join('?' * len(ids))}) "
+                    f"ORDER BY rowid", ids):
+                occurrences.setdefault(record_id, []).append({"name": name, "path": path})
+        hits = []
+        for row, distance in keep:
+            record_id, prompt, response, name, path = fields[row]
+            hit = {"id": f"{self.index_name}:{record_id}", "prompt": prompt, "response": response, "name": name,
+                   "path": path, "vector_distance": distance,
+                   "occurrences": merge_occurrences([{"name": name, "path": path}], occurrences.get(record_id, []))}
+            hits.append({field: hit[field] for field in return_fields if field in hit})
+        return hits
+
+    def _canonical_id(self, prompt):
+        """The id of the record a stored prompt is kept in."""
+        record_id = self.deduplicator.find(prompt) if self.deduplicator is not None else None
+        return record_id or self.record_id(prompt)
+
+    def export_snapshot(self, path, batch_size=10000):
+        """
+        Writes the JSON objects, the records and the vectors of the store to a snapshot directory, see
+        SnapshotWriter. The occurrences of deduplicated prompts are kept in the metadata of their records.
+        :return: str - A message indicating the number of objects and prompts exported.
+        """
+        with self.lock, SnapshotWriter(path, self.model_id, self.index_name) as writer:
+            documents = self.db.execute("SELECT suffix, json FROM documents")
+            while True:
+                batch = documents.fetchmany(batch_size)
+                if not batch:
+                    break
+                writer.write_documents((suffix, json.loads(stored)) for suffix, stored in batch)
+            occurrences = {}
+            for record_id, name, record_path in self.db.execute(
+                    "SELECT id, name, path FROM occurrences ORDER BY rowid"):
+                occurrences.setdefault(record_id, []).append({"name": name, "path": record_path})
+            records = self.db.execute(
+                "SELECT row, id, prompt, response, name, path FROM records WHERE deleted = 0 ORDER BY row")
+            while True:
+                batch = records.fetchmany(batch_size)
+                if not batch:
+                    break
+                rows = [row for row, *_ in batch]
+                metadatas = []
+                for _, record_id, _, _, name, record_path in batch:
+                    metadata = {"name": name, "path": record_path}
+                    if record_id in occurrences:
+                        metadata["occurrences"] = merge_occurrences([{"name": name, "path": record_path}],
+                                                                    occurrences[record_id])
+                    metadatas.append(metadata)
+                # Sorted rows read the memory-mapped vectors sequentially
+                writer.write_records([(prompt, response, metadata) for (_, _, prompt, response, _, _), metadata
+                                      in zip(batch, metadatas)], self.matrix.vectors[rows])
+        return f"Export {writer.documents} objects and {writer.count} prompts to {path}."
+
+    def import_snapshot(self, path, verify=True, batch_size=10000):
+        """
+        Loads a snapshot written by `export_snapshot` of any JSON vector store, without embedding the prompts. The
+        vectors are read from the memory-mapped snapshot and appended to the matrix of the store. Stored JSON
+        objects and records with the same suffixes and prompts are replaced, use `clear_index` first to restore the
+        snapshot alone.
+        :param path: The snapshot directory.
+        :param verify: Whether to check the checksums of the snapshot files.
+        :param batch_size: Number of records per transaction.
+        :raises ValueError: If the snapshot is corrupted or its vectors were embedded with another model.
+        :return: str - A message indicating the number of objects and prompts imported.
+        """
+        snapshot = Snapshot(path, self.model_id, verify)
+        diff = count = 0
+        with self.lock:
+            for documents in snapshot.documents(batch_size):
+                with self.db:
+                    diff += len(documents) - self.db.execute(
+                        f"SELECT COUNT(*) FROM documents WHERE suffix IN ({','.join('?' * len(documents))})",
+                        [suffix for suffix, _ in documents]).fetchone()[0]
+                    self.db.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?)",
+                                        [(suffix, json.dumps(json_data)) for suffix, json_data in documents])
+                    # The conversations are indexed again from their start by the next append_item
+                    self.db.executemany("DELETE FROM watermarks WHERE suffix = ?",
+                                        [(suffix,) for suffix, _ in documents])
+            for records, vectors in snapshot.records(self.index_name, batch_size):
+                count += self._store_records(records, vectors)
+                with self.db:
+                    self.db.executemany("INSERT OR IGNORE INTO occurrences VALUES (?, ?, ?)", [
+                        (self._canonical_id(prompt), occurrence["name"], occurrence["path"])
+                        for prompt, _, metadata in records for occurrence in metadata.get("occurrences", [])])
+        return f"Import {diff} objects to JSON_store and {count} prompts to vector_index."
+
+    def delete_prompts(self, prompts):
+        """Removes the records of prompts from the index."""
+        with self.lock, self.db:
+            self._delete_ids([self.record_id(prompt) for prompt in prompts])
+
+    def _delete_ids(self, ids):
+        """Removes the records of ids, with the store locked in a transaction."""
+        rows = [row for row, in self.db.execute(
+            f"SELECT row FROM records WHERE id IN ({','.join('?' * len(ids))})", ids)]
+        self.db.execute(f"UPDATE records SET deleted = 1 WHERE id IN ({','.join('?' * len(ids))})", ids)
+        self.db.execute(f"DELETE FROM occurrences WHERE id IN ({','.join('?' * len(ids))})", ids)
+        self.deleted[rows] = True
+        if self.lexical_index is not None:
+            self.lexical_index.remove(f"{self.index_name}:{record_id}" for record_id in ids)
+        if self.deduplicator is not None:
+            for record_id in ids:
+                self.deduplicator.remove(record_id)
+
+    def _remove_occurrences(self, records):
+        """
+        Removes (prompt, response, metadata) records of prompts at these paths of a JSON object, with the store
+        locked in a transaction. A record stored for the same prompt elsewhere is kept, a record listing occurrences
+        (with a deduplicator, or for a prompt repeated in one object) only loses these occurrences and is removed
+        with its last one. See RedisVectorStoreForJSON._delete_records.
+        """
+        removed = {}
+        for prompt, _, metadata in records:
+            removed.setdefault(self._canonical_id(prompt), []).append((metadata["name"], metadata["path"]))
+        owned = []
+        for record_id, occurrences in removed.items():
+            stored = self.db.execute("SELECT prompt, response, name, path FROM records WHERE id = ? AND deleted = 0",
+                                     (record_id,)).fetchone()
+            if stored is None:
+                continue
+            prompt, response, name, path = stored
+            listed = merge_occurrences([(name, path)], self.db.execute(
+                "SELECT name, path FROM occurrences WHERE id = ? ORDER BY rowid", (record_id,)).fetchall())
+            remaining = [occurrence for occurrence in listed if occurrence not in occurrences]
+            if not remaining:
+                owned.append(record_id)
+                continue
+            self.db.executemany("DELETE FROM occurrences WHERE id = ? AND name = ? AND path = ?",
+                                [(record_id, *occurrence) for occurrence in occurrences])
+            if (name, path) in occurrences:
+                # The record moves to a remaining occurrence
+                self.db.execute("UPDATE records SET name = ?, path = ? WHERE id = ?", (*remaining[0], record_id))
+                if self.lexical_index is not None:
+                    self._index_lexically([(record_id, prompt, response, *remaining[0])])
+        self._delete_ids(owned)
+
+    def clear_index(self):
+        """
+        Clear the vector index, the JSON objects are kept.
+        :return:
+        """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM records")
+            self.db.execute("DELETE FROM occurrences")
+            self.db.execute("DELETE FROM settings WHERE key IN ('dims', 'quantization')")
+            self.matrix = None
+            self.codes = None
+            self.deleted = np.zeros(0, dtype=bool)
+            if self.lexical_index is not None:
+                self.lexical_index.clear()
+            if self.deduplicator is not None:
+                self.deduplicator.clear()
+            for stored_file in [os.path.join(self.directory, "vectors.f32")] + self._code_files():
+                if os.path.exists(stored_file):
+                    os.remove(stored_file)
+
+    def delete_index(self):
+        """Deletes the store and its files."""
+        self.clear_index()
+        self.db.close()
+        os.remove(os.path.join(self.directory, "store.sqlite"))
+
+    def _get(self, suffix):
+        row = self.db.execute("SELECT json FROM documents WHERE suffix = ?", (suffix,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def __iter__(self):
+        for suffix, in self.db.execute("SELECT suffix FROM documents"):
+            yield suffix
+
+    def __getitem__(self, item):
+        return self._get(item)
+
+    @staticmethod
+    def extract_prompt_response_pairs(json_data, prompt_path, response_relative_position=None):
+        """
+        Extracts (prompt, response, path of the prompt) tuples, see RedisVectorStoreForJSON.extract_prompt_response_pairs.
+        """
+        return compile_pair_extractor(prompt_path, response_relative_position).extract(json_data)
+
+    def extract_utterances(self, json_name, path, start_shift, end_shift):
+        """
+        Extracts a range of utterances from a stored JSON object relative to the current index.
+
+        :param json_name: The name of the JSON object, "{index_name}-{suffix}" as in the "name" of search results.
+        :param path: The path to the current utterance in the JSON object.
+        :param start_shift: The start of the range relative to the current index.
+        :param end_shift: The end of the range relative to the current index.
+        :return: A list of utterances, truncated at the ends of the conversation.
+        """
+        return self.get_context_windows([{"name": json_name, "path": path}], start_shift, end_shift)[0]
+
+    def get_context_windows(self, hits, start_shift, end_shift):
+        """
+        Returns the utterances around each hit of a `search_item` result.
+        """
+        slices, windows = plan_context_windows([hit_location(hit) for hit in hits], start_shift, end_shift)
+        fetched = []
+        for json_name, base_path, start, end in slices:
+            document = self._get(json_name[len(self.index_name) + 1:])
+            matches = compile_path(base_path).find(document) if document is not None else []
+            conversation = matches[0].value if matches and isinstance(matches[0].value, list) else []
+            fetched.append(conversation[start:end])
+        return [fetched[window[0]][window[1]:window[1] + window[2]] if window is not None else []
+                for window in windows]
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+import weakref
+
+import redis
+import redis.asyncio
+
+_lock = threading.Lock()
+_pools = {}
+# redis.asyncio connections are bound to the event loop that opened them: one set of pools per loop
+_async_pools = weakref.WeakKeyDictionary()
+_unbound_async_pools = {}
+
+
+def _pool(pools, pool_class, redis_url, kwargs):
+    key = (redis_url, tuple(sorted(kwargs.items())))
+    with _lock:
+        pool = pools.get(key)
+        if pool is None:
+            pool = pools[key] = pool_class.from_url(redis_url, **kwargs)
+        return pool
+
+
+def get_connection_pool(redis_url, **kwargs):
+    """
+    Returns the connection pool shared by all synchronous clients of a Redis URL and connection settings.
+    :param redis_url: The Redis URL.
+    :param kwargs: Connection settings, e.g. max_connections, socket_timeout or ssl_ca_certs.
+    """
+    return _pool(_pools, redis.ConnectionPool, redis_url, kwargs)
+
+
+def get_async_connection_pool(redis_url, **kwargs):
+    """
+    Returns the connection pool shared by all redis.asyncio clients of a Redis URL and connection settings on the
+    running event loop. Connections are bound to the loop that opened them, so each loop gets its own pools, released
+    with the loop. Called outside a running loop, it returns a pool shared by such callers.
+    :param redis_url: The Redis URL.
+    :param kwargs: Connection settings, e.g. max_connections, socket_timeout or ssl_ca_certs.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _pool(_unbound_async_pools, redis.asyncio.ConnectionPool, redis_url, kwargs)
+    with _lock:
+        pools = _async_pools.get(loop)
+        if pools is None:
+            pools = _async_pools[loop] = {}
+    return _pool(pools, redis.asyncio.ConnectionPool, redis_url, kwargs)
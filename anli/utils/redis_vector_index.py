@@ -0,0 +1,147 @@
+import asyncio
+
+
+class RedisVectorIndex:
+    """
+    The vector index of the Redis stores, a redisvl SemanticCache whose records are written and searched in bulk.
+
+    The stores use redisvl only through this class: the keys, fields and serialization of the records, the schema
+    of the search index and the range queries. A redisvl upgrade changes this file only, and tests replace it with
+    an in-memory index with the same methods.
+    """
+    def __init__(self, index_name, client, vectorizer, distance_threshold):
+        """
+        Opens or creates the vector index "{index_name}_vector_index".
+        :param index_name: The name of the store.
+        :param client: The redis.Redis client of the store, its connection pool is shared with the index.
+        :param vectorizer: A redisvl vectorizer.
+        :param distance_threshold: The default semantic distance threshold of the SemanticCache.
+        """
+        try:
+            from redisvl.extensions.llmcache import SemanticCache
+        except ImportError:
+            raise ImportError(
+                "`redisvl` package not found, please install it with "
+                "`pip install redisvl`"
+            )
+        self.index_name = index_name
+        self.client = client
+        self.cache = SemanticCache(
+            name=f"{index_name}_vector_index",                     # underlying search index name
+            prefix=f"{index_name}_vector_index:item",              # redis key prefix
+            redis_client=client,  # shared redis connection pool
+            vectorizer=vectorizer,
+            distance_threshold=distance_threshold,               # semantic distance threshold
+        )
+        self.name = self.cache._index.name
+        self.id_field = self.cache.entry_id_field_name
+        self.prompt_field = self.cache.prompt_field_name
+        self.response_field = self.cache.response_field_name
+        self.metadata_field = self.cache.metadata_field_name
+        self.vector_field = self.cache.vector_field_name
+
+    @property
+    def model(self):
+        """The name of the embedding model of the vectorizer."""
+        return self.cache._vectorizer.model
+
+    @property
+    def ttl(self):
+        return self.cache.ttl
+
+    def embed_many(self, texts, batch_size=256):
+        return self.cache._vectorizer.embed_many(texts, batch_size=batch_size)
+
+    def key(self, prompt):
+        """The Redis key of the record of a prompt."""
+        return self.cache._index.key(self.cache.hash_input(prompt))
+
+    @property
+    def key_pattern(self):
+        """The pattern matching the keys of all the records."""
+        return self.cache._index.key("*")
+
+    def serialize(self, metadata):
+        return self.cache.serialize(metadata)
+
+    def deserialize(self, value):
+        return self.cache.deserialize(value)
+
+    def payload(self, prompt, response, metadata, vector, fields):
+        """The record of a prompt, the same as SemanticCache.store(), plus the indexed hash fields `fields`."""
+        from redisvl.redis.utils import array_to_buffer
+
+        return {
+            self.id_field: self.cache.hash_input(prompt),
+            self.prompt_field: prompt,
+            self.response_field: response,
+            self.vector_field: array_to_buffer(vector),
+            self.metadata_field: self.serialize(metadata),
+            **fields,
+        }
+
+    def load(self, payloads, batch_size=500):
+        """Writes records returned by `payload` with pipelines, setting the TTL of the cache if any."""
+        self.cache._index.load(data=payloads, ttl=self.cache._ttl, id_field=self.id_field, batch_size=batch_size)
+
+    def add_fields(self, fields):
+        """
+        Adds redisvl field definitions to the schema of the search index. An index created without them is created
+        again, Redis re-indexes its records in the background.
+        :return: True if the index was created again.
+        """
+        index = self.cache._index
+        index.schema.add_fields(fields)
+        existing = set()
+        for attribute in self.client.ft(self.name).info()["attributes"]:
+            attribute = [value.decode() if isinstance(value, bytes) else value for value in attribute]
+            existing.add(attribute[attribute.index("identifier") + 1])
+        if all(field["name"] in existing for field in fields):
+            return False
+        index.create(overwrite=True)
+        return True
+
+    def range_query(self, vector, num_results, return_fields, distance_threshold, filter=None):
+        """Returns the redisvl RangeQuery of the records closer to `vector`, pre-filtered by a VectorFilter."""
+        from redisvl.query import RangeQuery
+        from redisvl.query.filter import FilterExpression
+
+        return RangeQuery(vector=vector,
+                          vector_field_name=self.vector_field,
+                          return_fields=return_fields,
+                          distance_threshold=distance_threshold,
+                          num_results=num_results,
+                          return_score=True,
+                          filter_expression=FilterExpression(filter.to_redis(self.index_name))
+                          if filter is not None else None)
+
+    def process_results(self, raw, range_query):
+        """Converts the raw result of a range query into a list of hits."""
+        from redisvl.index.index import process_results
+
+        return process_results(raw, query=range_query, storage_type=self.cache._index.storage_type)
+
+    def search_many(self, range_queries):
+        """Runs range queries with one pipeline, returns the hits of each."""
+        pipe = self.client.ft(self.name).pipeline(transaction=False)
+        for range_query in range_queries:
+            pipe.search(range_query.query, query_params=range_query.params)
+        return [self.process_results(raw, range_query) for raw, range_query in zip(pipe.execute(), range_queries)]
+
+    async def asearch_many(self, client, range_queries):
+        """Runs range queries concurrently on a redis.asyncio client, returns the hits of each."""
+        search = client.ft(self.name)
+        raw_results = await asyncio.gather(*[search.search(range_query.query, query_params=range_query.params)
+                                             for range_query in range_queries])
+        return [self.process_results(raw, range_query) for raw, range_query in zip(raw_results, range_queries)]
+
+    def set_threshold(self, threshold):
+        self.cache.set_threshold(threshold)
+
+    def clear(self):
+        """Deletes all the records."""
+        self.cache.clear()
+
+    def delete(self):
+        """Drops the search index and its records."""
+        self.cache.index.delete(drop=True)
@@ -1,56 +1,99 @@
+import numpy as np
 import redis
-from jsonpath_ng.ext import parse
-from jsonpath_ng import Index, Child
 from uuid import uuid4
 
+from anli.utils.context_window import fetch_context_windows, hit_location
+from anli.utils.dedup import merge_occurrences
+from anli.utils.embedding_engine import DEFAULT_EMBEDDING_MODEL, get_embedding_engine
+from anli.utils.json_paths import array_lengths, compile_pair_extractor, extract_slice_pairs, plan_append, plan_update
+from anli.utils.lexical_index import hybrid_search
+from anli.utils.redis_pool import get_connection_pool
+from anli.utils.redis_vector_index import RedisVectorIndex
+from anli.utils.snapshot import Snapshot, SnapshotWriter, load_redis_documents, redis_documents
+from anli.utils.vector_filters import VectorFilter, redis_indexed_fields, redis_schema_fields
+
 
 class RedisVectorStoreForJSON:
+    # The vector index, all redisvl calls go through it
+    vector_index_class = RedisVectorIndex
+
     def __init__(self, index_name, default_semantic_distance_threshold=0.1,
-                 redis_url="redis://localhost:6379", vectorizer=None, **kwargs):
+                 redis_url="redis://localhost:6379", vectorizer=None, embedding_cache=None, redis_config=None,
+                 filter_fields=None, lexical_index=None, deduplicator=None, redis_client=None, **kwargs):
         """
         Creates a RedisVectorStoreForJSON object.
         :param index_name:
         :param default_semantic_distance_threshold:
         :param redis_url:
-        :param vectorizer: If None, use the default HFTextVectorizer ("sentence-transformers/all-mpnet-base-v2").
-        Otherwise, use the provided vectorizer. We suggest to use "jinaai/jina-embeddings-v2-base-en" for English,
+        :param vectorizer: If None, use the shared EmbeddingEngine of "sentence-transformers/all-mpnet-base-v2".
+        Otherwise, use the provided vectorizer, e.g. `get_embedding_engine(name, cpu_optimized=True).as_vectorizer()`.
+        Use `EmbeddingDispatcher(engine).as_vectorizer()` to embed the queries of concurrent searches in batches.
+        We suggest to use "jinaai/jina-embeddings-v2-base-en" for English,
         but trust_remote_code=true is not supported yet. https://github.com/UKPLab/sentence-transformers/issues/2352
+        :param embedding_cache: An optional EmbeddingCache consulted before every vectorizer call, it can be shared
+        with other stores.
+        :param redis_config: An optional RedisConfig, its url and connection pool settings replace redis_url.
+        Stores with the same url and settings share one connection pool, also used by the vector index.
+        :param filter_fields: {field: "tag" or "numeric"}, the metadata fields given when upserting that searches can
+        filter on with a VectorFilter, e.g. {"tenant": "tag", "timestamp": "numeric"}. The JSON object name and the
+        prompt path are always filterable.
+        :param lexical_index: An optional LexicalIndex of the prompts. Searches answer exact-term queries from it
+        without embedding them, and fuse its results with the vector results for the other queries. It is kept in
+        memory and rebuilt from the vector index when empty.
+        :param deduplicator: An optional Deduplicator. Prompts duplicating a stored prompt, exactly or nearly, are not
+        embedded again: their name and path are added to the "occurrences" of its record, a list of {"name", "path"}
+        kept in its metadata, so `get_context_windows(hit["metadata"]["occurrences"], ...)` reaches all of their
+        sources. It is kept in memory and rebuilt from the vector index when empty.
+        :param redis_client: An optional redis.Redis client used instead of a client of the shared connection pool of
+        redis_url.
         """
-        try:
-            from redisvl.extensions.llmcache import SemanticCache
-        except ImportError:
-            raise ImportError(
-                "`redisvl` package not found, please install it with "
-                "`pip install redisvl`"
-            )
-        self.client = redis.Redis.from_url(redis_url, decode_responses=False, **kwargs)
+        if redis_config is not None:
+            redis_url = redis_config.redis_url
+            kwargs = {**redis_config.connection_kwargs(), **kwargs}
+        self.client = redis_client or redis.Redis(connection_pool=get_connection_pool(redis_url, **kwargs))
         self.index_name = index_name
         self.redis_url = redis_url
         self.default_semantic_distance_threshold = default_semantic_distance_threshold
         self.vectorizer = vectorizer
+        self.embedding_cache = embedding_cache
+        self.filter_fields = dict(filter_fields or {})
+        self.lexical_index = lexical_index
+        self.deduplicator = deduplicator
         if self.vectorizer is None:
-            self.vector_index = SemanticCache(
-                name=f"{self.index_name}_vector_index",                     # underlying search index name
-                prefix=f"{self.index_name}_vector_index:item",              # redis key prefix
-                redis_url=self.redis_url,  # redis connection url string
-                distance_threshold=self.default_semantic_distance_threshold,               # semantic distance threshold
-                **kwargs
-            )
-        else:
-            self.vector_index = SemanticCache(
-                name=f"{self.index_name}_vector_index",                     # underlying search index name
-                prefix=f"{self.index_name}_vector_index:item",              # redis key prefix
-                redis_url=self.redis_url,  # redis connection url string
-                vectorizer=self.vectorizer,
-                distance_threshold=self.default_semantic_distance_threshold,               # semantic distance threshold
-                **kwargs
-            )
+            # The default model is loaded once per process and shared with the other stores using it
+            self.vectorizer = get_embedding_engine(DEFAULT_EMBEDDING_MODEL).as_vectorizer()
+        self.vector_index = self.vector_index_class(self.index_name, self.client, self.vectorizer,
+                                                    self.default_semantic_distance_threshold)
+        self._create_filter_fields()
+        if self.lexical_index is not None and not len(self.lexical_index):
+            self.rebuild_lexical_index()
+        if self.deduplicator is not None and not len(self.deduplicator):
+            self.rebuild_deduplicator()
+
+    def _create_filter_fields(self):
+        """
+        Adds the filterable fields to the schema of the vector index, see RedisVectorIndex.add_fields. When the
+        index is created again, the hash fields of the records written before are backfilled from their metadata,
+        otherwise filtered searches would not find them.
+        """
+        if self.vector_index.add_fields(redis_schema_fields(self.filter_fields)):
+            self._backfill_indexed_fields()
+
+    def _backfill_indexed_fields(self, batch_size=1000):
+        """Writes the indexed hash fields of the records of the vector index from their metadata."""
+        for records in self._scan_records(batch_size):
+            pipe = self.client.pipeline(transaction=False)
+            for key, _, _, metadata, _ in records:
+                if "name" in metadata and "path" in metadata:
+                    pipe.hset(key, mapping=redis_indexed_fields(metadata, self.filter_fields))
+            pipe.execute()
 
     def upsert_item(self, json_data: dict,
                     json_prompt_paths: [str] = None,
                     response_relative_position: int = None,
                     json_storage_id_suffix: str = None,
-                    json_storage_path: str = '$'):
+                    json_storage_path: str = '$',
+                    metadata: dict = None):
         """
         Inserts or updates a JSON object in Redis and optionally indexes its vector representations.
         Stores the JSON object in Redis at 'json_storage_path' in "{self.index_name}-{json_storage_id_suffix}" and
@@ -71,81 +114,578 @@ class RedisVectorStoreForJSON:
                                        Specify this to update an existing object.
         :param json_storage_path: (Optional) Path in Redis where the JSON object is stored. Defaults to the root ('$').
                                   Specify this to store or update the JSON object at a specific subpath.
+        :param metadata: (Optional) A dict stored with the vector of each prompt, e.g. {"tenant": "acme"}. Its
+                         `filter_fields` can be used in search filters.
         :return: str - A message indicating the number of objects upserted.
         """
-        # Set or generate the JSON object ID
-        if json_storage_id_suffix is None:
-            json_storage_id_suffix = str(uuid4())
+        return self.upsert_many([json_data], json_prompt_paths, response_relative_position,
+                                [json_storage_id_suffix], json_storage_path, metadatas=[metadata])
 
-        # Store the JSON object in Redis
-        self.client.json().set(f"{self.index_name}-{json_storage_id_suffix}", json_storage_path, json_data)
-
-        l = self.client.scard(f"{self.index_name}-collections")
-        # Track the JSON object ID in a Redis set
-        self.client.sadd(f"{self.index_name}-collections", json_storage_id_suffix)
-
-        diff = self.client.scard(f"{self.index_name}-collections") - l
-
-        # Convert json_prompt_paths to a list if it's a string
+    def upsert_many(self, documents,
+                    json_prompt_paths: [str] = None,
+                    response_relative_position: int = None,
+                    json_storage_id_suffixes: [str] = None,
+                    json_storage_path: str = '$',
+                    batch_size: int = 500,
+                    embedding_batch_size: int = 256,
+                    metadatas: [dict] = None):
+        """
+        Inserts or updates many JSON objects, like `upsert_item`, with a few round-trips per batch.
+
+        For each batch of `batch_size` documents, the JSON writes and the collection set updates are
+        sent in one pipeline, the extracted prompts are embedded with one `embed_many` call and the
+        vector records are written in pipelined chunks. The vector records have the format of
+        `vector_index.store()`, plus the hash fields searches filter on.
+
+        :param documents: An iterable of JSON objects to be stored.
+        :param json_prompt_paths: See `upsert_item`.
+        :param response_relative_position: See `upsert_item`.
+        :param json_storage_id_suffixes: An iterable of suffixes, one per document. A new UUID is generated for
+                                         the documents without one (None) or if not provided.
+        :param json_storage_path: See `upsert_item`.
+        :param batch_size: Number of documents per pipeline.
+        :param embedding_batch_size: Number of prompts per embedding model call.
+        :param metadatas: An iterable of metadata dicts, one per document, see `upsert_item`.
+        :return: str - A message indicating the number of objects upserted.
+        """
         if isinstance(json_prompt_paths, str):
             json_prompt_paths = [json_prompt_paths]
+        documents = iter(documents)
+        suffixes = iter(json_storage_id_suffixes) if json_storage_id_suffixes is not None else None
+        metadatas = iter(metadatas) if metadatas is not None else None
+
+        diff = count = 0
+        while True:
+            batch = []
+            for json_data in documents:
+                suffix = next(suffixes, None) if suffixes is not None else None
+                metadata = next(metadatas, None) if metadatas is not None else None
+                batch.append((suffix if suffix is not None else str(uuid4()), json_data, metadata))
+                if len(batch) >= batch_size:
+                    break
+            if not batch:
+                break
+
+            # Store the JSON objects and track their IDs in one round-trip
+            pipe = self.client.json().pipeline(transaction=False)
+            for suffix, json_data, _ in batch:
+                pipe.set(f"{self.index_name}-{suffix}", json_storage_path, json_data)
+                pipe.sadd(f"{self.index_name}-collections", suffix)
+                pipe.delete(f"{self.index_name}-watermarks-{suffix}")
+            diff += sum(pipe.execute()[1::3])
+
+            if json_prompt_paths is not None:
+                count += self._store_prompts(batch, json_prompt_paths, response_relative_position,
+                                             json_storage_path, embedding_batch_size, batch_size)
+                watermarks = self._watermarks(batch, json_prompt_paths, json_storage_path)
+                if watermarks:
+                    pipe = self.client.pipeline(transaction=False)
+                    for watermarks_key, mapping in watermarks.items():
+                        pipe.hset(watermarks_key, mapping=mapping)
+                    pipe.execute()
 
-        # Index prompts and responses if paths are provided
         if json_prompt_paths is not None:
-            count = 0
+            return f"Upsert {diff} objects to JSON_store and {count} prompts to vector_index."
+        return f"Upsert {diff} objects to JSON_store, skipped vector_index."
+
+    def _watermarks(self, batch, json_prompt_paths, json_storage_path):
+        """
+        Returns the watermarks of `append_item` for the upserted batch of (suffix, json_data, metadata): the length
+        of the array holding the prompts of each prompt path, {watermarks key: {prompt path: length}}. Prompt paths
+        not below a simple array path, and objects stored below the root, get none and are indexed again from their
+        start by the next `append_item`.
+        """
+        if json_storage_path != "$":
+            return {}
+        watermarks = {}
+        for suffix, json_data, _ in batch:
+            lengths = array_lengths(json_data, json_prompt_paths)
+            if lengths:
+                watermarks[f"{self.index_name}-watermarks-{suffix}"] = lengths
+        return watermarks
+
+    def _store_prompts(self, batch, json_prompt_paths, response_relative_position, json_storage_path,
+                       embedding_batch_size, write_batch_size):
+        """
+        Embeds the prompts of a batch of (suffix, json_data, metadata) in bulk and writes their vector records.
+        :return: The number of prompts stored.
+        """
+        records = self._records(batch, json_prompt_paths, response_relative_position, json_storage_path)
+        return self._store_records(records, embedding_batch_size, write_batch_size)
+
+    def _records(self, batch, json_prompt_paths, response_relative_position, json_storage_path):
+        """Extracts the (prompt, response, metadata) records of a batch of (suffix, json_data, metadata)."""
+        records = []
+        for suffix, json_data, metadata in batch:
             for prompt_path in json_prompt_paths:
-                # Extract prompt-response pairs based on the provided path and position
                 pairs = self.extract_prompt_response_pairs(json_data, prompt_path,
                                                            response_relative_position=response_relative_position)
-                # Store each pair's vector representation
                 for prompt, response, p in pairs:
-                    # Remove leading '$' from prompt_path if present
-                    formatted_prompt_path = p.lstrip('$.')
+                    stored_path = f"{json_storage_path}.{p.lstrip('$.')}"
+                    records.append((prompt, response, {**(metadata or {}), "name": f"{self.index_name}-{suffix}",
+                                                       "path": stored_path}))
+        return records
 
-                    # Merge paths
-                    stored_path = f"{json_storage_path}.{formatted_prompt_path}"
+    def _store_records(self, records, embedding_batch_size=256, write_batch_size=500):
+        """
+        Embeds (prompt, response, metadata) records in bulk and writes them to the vector index.
+        :return: The number of records stored.
+        """
+        if not records:
+            return 0
 
-                    self.vector_index.store(prompt=prompt,
-                                            response=response,
-                                            metadata={"name": f"{self.index_name}-{json_storage_id_suffix}",
-                                                      "path": stored_path})
-                    count += 1
-            return f"Upsert {diff} objects to JSON_store and {count} prompts to vector_index."
+        new_records = self._deduplicate(records) if self.deduplicator is not None else self._collapse(records)
+        if new_records:
+            vectors = self._embed_many([prompt for prompt, _, _ in new_records], embedding_batch_size)
+            self._write_records(new_records, vectors, write_batch_size)
+        return len(records)
+
+    def _write_records(self, records, vectors, write_batch_size=500):
+        """Writes (prompt, response, metadata) records and their vectors to the vector index."""
+        self.vector_index.load(self._payloads(records, vectors), write_batch_size)
+        self._index_lexically(records)
+
+    @staticmethod
+    def _collapse(records):
+        """
+        Merges the (prompt, response, metadata) records repeating a prompt of the same JSON object into one record,
+        the first, listing all their paths in its "occurrences". Its vector record then stays while one of them
+        remains, see `_delete_records`.
+        """
+        merged = {}
+        for prompt, response, metadata in records:
+            occurrence = {"name": metadata["name"], "path": metadata["path"]}
+            record = merged.get((prompt, metadata["name"]))
+            if record is None:
+                merged[(prompt, metadata["name"])] = (prompt, response, metadata, [occurrence])
+            else:
+                record[3].append(occurrence)
+        return [(prompt, response, {**metadata, "occurrences": occurrences} if len(occurrences) > 1 else metadata)
+                for prompt, response, metadata, occurrences in merged.values()]
+
+    def _deduplicate(self, records):
+        """
+        Collapses the (prompt, response, metadata) records duplicating each other or a stored prompt, see
+        `deduplicator`. The occurrences of the duplicates of stored prompts are added to their records.
+        :return: The records of the new canonical prompts, with their occurrences in their metadata.
+        """
+        cache = self.vector_index
+        canonical = {}
+        duplicates = {}
+        for prompt, response, metadata in records:
+            occurrence = {"name": metadata["name"], "path": metadata["path"]}
+            key = self.deduplicator.find(prompt)
+            if key is None:
+                key = cache.key(prompt)
+                self.deduplicator.add(key, prompt)
+                canonical[key] = (prompt, response, {**metadata, "occurrences": []})
+            if key in canonical:
+                canonical[key][2]["occurrences"] = merge_occurrences(canonical[key][2]["occurrences"], [occurrence])
+            else:
+                duplicates.setdefault(key, []).append((prompt, response, metadata))
+        if not duplicates:
+            return list(canonical.values())
+
+        pipe = self.client.pipeline(transaction=False)
+        for key in duplicates:
+            pipe.hget(key, cache.metadata_field)
+        stored = pipe.execute()
+        for (key, duplicate_records), metadata in zip(duplicates.items(), stored):
+            occurrences = [{"name": m["name"], "path": m["path"]} for _, _, m in duplicate_records]
+            if metadata is None:
+                # The record expired or was deleted, the first duplicate replaces it
+                self.deduplicator.remove(key)
+                prompt, response, first = duplicate_records[0]
+                key = cache.key(prompt)
+                self.deduplicator.add(key, prompt)
+                canonical[key] = (prompt, response, {**first, "occurrences": merge_occurrences([], occurrences)})
+                continue
+            metadata = cache.deserialize(metadata)
+            metadata["occurrences"] = merge_occurrences(metadata.get("occurrences", [
+                {"name": metadata["name"], "path": metadata["path"]}]), occurrences)
+            pipe.hset(key, cache.metadata_field, cache.serialize(metadata))
+        pipe.execute()
+        return list(canonical.values())
+
+    @staticmethod
+    def _lexical_payload(prompt, response, metadata):
+        return {"prompt": prompt, "response": response, "name": metadata.get("name"), "path": metadata.get("path"),
+                "metadata": metadata}
+
+    def _index_lexically(self, records):
+        """Adds (prompt, response, metadata) records to the lexical index, under the keys of their vector records."""
+        if self.lexical_index is None:
+            return
+        self.lexical_index.add_many((self.vector_index.key(prompt), prompt,
+                                     self._lexical_payload(prompt, response, metadata))
+                                    for prompt, response, metadata in records)
+
+    def rebuild_lexical_index(self, batch_size=1000):
+        """Indexes the prompts of the vector index in the lexical index, e.g. after a restart."""
+        self.lexical_index.clear()
+        for records in self._scan_records(batch_size):
+            self.lexical_index.add_many((key, prompt, self._lexical_payload(prompt, response, metadata))
+                                        for key, prompt, response, metadata, _ in records)
+
+    def rebuild_deduplicator(self, batch_size=1000):
+        """Adds the prompts of the vector index to the deduplicator, e.g. after a restart."""
+        self.deduplicator.clear()
+        for records in self._scan_records(batch_size):
+            for key, prompt, _, _, _ in records:
+                self.deduplicator.add(key, prompt)
+
+    def _scan_records(self, batch_size=1000, vectors=False):
+        """
+        Yields lists of the (key, prompt, response, metadata, vector) of the records of the vector index, the vectors
+        are float32 arrays if requested, else None.
+        """
+        keys = []
+        for key in self.client.scan_iter(match=self.vector_index.key_pattern, count=batch_size):
+            keys.append(key.decode() if isinstance(key, bytes) else key)
+            if len(keys) >= batch_size:
+                yield self._read_records(keys, vectors)
+                keys = []
+        if keys:
+            yield self._read_records(keys, vectors)
+
+    def _read_records(self, keys, vectors=False):
+        cache = self.vector_index
+        fields = [cache.prompt_field, cache.response_field, cache.metadata_field]
+        if vectors:
+            fields.append(cache.vector_field)
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, fields)
+        records = []
+        for key, (prompt, response, metadata, *vector) in zip(keys, pipe.execute()):
+            if prompt is None:
+                continue
+            prompt, response = [value.decode() if isinstance(value, bytes) else value or ""
+                                for value in (prompt, response)]
+            records.append((key, prompt, response, cache.deserialize(metadata) if metadata is not None else {},
+                            np.frombuffer(vector[0], dtype=np.float32) if vectors else None))
+        return records
+
+    def export_snapshot(self, path, batch_size=1000):
+        """
+        Writes the JSON objects and the vector records of the store to a snapshot directory, see SnapshotWriter,
+        reading them with pipelines. The snapshot can be imported by any JSON vector store embedding with the same
+        model.
+
+        :param path: The snapshot directory.
+        :param batch_size: Number of keys per pipeline.
+        :return: str - A message indicating the number of objects and prompts exported.
+        """
+        with SnapshotWriter(path, self.vector_index.model, self.index_name) as writer:
+            for documents in redis_documents(self.client, self.index_name, batch_size):
+                writer.write_documents(documents)
+            for records in self._scan_records(batch_size, vectors=True):
+                if records:
+                    writer.write_records([(prompt, response, metadata) for _, prompt, response, metadata, _ in records],
+                                         np.stack([vector for *_, vector in records]))
+        return f"Export {writer.documents} objects and {writer.count} prompts to {path}."
+
+    def import_snapshot(self, path, verify=True, batch_size=1000):
+        """
+        Loads a snapshot written by `export_snapshot` of any JSON vector store, without embedding the prompts: the
+        JSON objects and the vector records are written with pipelines, the vectors are read from the memory-mapped
+        snapshot. Stored objects and records with the same suffixes and prompts are replaced.
+
+        :param path: The snapshot directory.
+        :param verify: Whether to check the checksums of the snapshot files.
+        :param batch_size: Number of objects or records per pipeline.
+        :raises ValueError: If the snapshot is corrupted or its vectors were embedded with another model.
+        :return: str - A message indicating the number of objects and prompts imported.
+        """
+        snapshot = Snapshot(path, self.vector_index.model, verify)
+        diff = count = 0
+        for documents in snapshot.documents(batch_size):
+            diff += load_redis_documents(self.client, self.index_name, documents)
+        cache = self.vector_index
+        for records, vectors in snapshot.records(self.index_name, batch_size):
+            self._write_records(records, vectors, batch_size)
+            if self.deduplicator is not None:
+                for prompt, _, _ in records:
+                    self.deduplicator.add(cache.key(prompt), prompt)
+            count += len(records)
+        return f"Import {diff} objects to JSON_store and {count} prompts to vector_index."
+
+    def append_item(self, new_items, json_storage_id_suffix: str,
+                    json_prompt_paths: [str] = None,
+                    response_relative_position: int = None,
+                    array_path: str = '$.conversation',
+                    metadata: dict = None):
+        """
+        Appends utterances to the conversation array of a stored JSON object and indexes only the new prompts.
+
+        The items are appended with JSON.ARRAPPEND. For each prompt path, the array length indexed so far is kept
+        as a watermark in "{self.index_name}-watermarks-{json_storage_id_suffix}", so only the prompts after it are
+        extracted and embedded, plus the prompts whose response position falls among the new items. `upsert_item`
+        sets the watermarks of its prompt paths. Without a watermark, e.g. after `import_snapshot`, the whole array
+        is indexed once.
+
+        :param new_items: The utterances to append.
+        :param json_storage_id_suffix: The suffix of the stored JSON object, see `upsert_item`.
+        :param json_prompt_paths: See `upsert_item`. The prompts must be inside the elements of `array_path`.
+        :param response_relative_position: See `upsert_item`.
+        :param array_path: A simple path of the conversation array in the stored object, e.g. "$.conversation".
+        :param metadata: See `upsert_item`, it is stored with the vectors of the prompts indexed by this call.
+        :return: str - A message indicating the number of prompts indexed.
+        """
+        key = f"{self.index_name}-{json_storage_id_suffix}"
+        watermarks_key = f"{self.index_name}-watermarks-{json_storage_id_suffix}"
+        if isinstance(json_prompt_paths, str):
+            json_prompt_paths = [json_prompt_paths]
+
+        pipe = self.client.json().pipeline(transaction=False)
+        pipe.arrappend(key, array_path, *new_items)
+        if json_prompt_paths is not None:
+            pipe.hmget(watermarks_key, json_prompt_paths)
+        results = pipe.execute()
+        length = results[0][0] if isinstance(results[0], list) else results[0]
+        if json_prompt_paths is None:
+            return f"Append {len(new_items)} items to JSON_store, skipped vector_index."
+
+        starts, offset = plan_append(dict(zip(json_prompt_paths, results[1])), length, response_relative_position)
+        elements = self.client.json().get(key, f"{array_path}[{offset}:{length}]") or []
+
+        records = self._slice_records(key, json_prompt_paths, response_relative_position, array_path,
+                                      elements, offset, starts, metadata=metadata)
+        count = self._store_records(records)
+        self.client.hset(watermarks_key, mapping={prompt_path: length for prompt_path in json_prompt_paths})
+        return f"Append {len(new_items)} items to JSON_store and {count} prompts to vector_index."
+
+    def update_utterance(self, json_storage_id_suffix: str, position: int, item=None,
+                         json_prompt_paths: [str] = None,
+                         response_relative_position: int = None,
+                         array_path: str = '$.conversation',
+                         metadata: dict = None):
+        """
+        Replaces or deletes one utterance of a stored conversation and re-indexes only the affected prompts.
+
+        Replacing an utterance re-indexes the prompt at its position and the prompt whose response it is. Deleting
+        it shifts the following utterances, so the prompts from its position on are re-indexed. The vector records
+        of the affected prompts are removed first.
+
+        :param json_storage_id_suffix: The suffix of the stored JSON object, see `upsert_item`.
+        :param position: The position of the utterance in the conversation array.
+        :param item: The new utterance, or None to delete it.
+        :param json_prompt_paths: See `append_item`.
+        :param response_relative_position: See `upsert_item`.
+        :param array_path: See `append_item`.
+        :param metadata: See `append_item`.
+        :return: str - A message indicating the number of prompts indexed.
+        """
+        key = f"{self.index_name}-{json_storage_id_suffix}"
+        watermarks_key = f"{self.index_name}-watermarks-{json_storage_id_suffix}"
+        if isinstance(json_prompt_paths, str):
+            json_prompt_paths = [json_prompt_paths]
+
+        start, stop, offset, end = plan_update(position, item is None, response_relative_position)
+        old_elements = []
+        if json_prompt_paths is not None:
+            old_elements = self.client.json().get(key, f"{array_path}[{offset}:{'' if end is None else end}]") or []
+
+        if item is None:
+            self.client.json().arrpop(key, array_path, position)
         else:
-            return f"Upsert {diff} objects to JSON_store, skipped vector_index."
+            self.client.json().set(key, f"{array_path}[{position}]", item)
+        if json_prompt_paths is None:
+            return "Update 1 item in JSON_store, skipped vector_index."
+
+        starts = {prompt_path: start for prompt_path in json_prompt_paths}
+        old_records = self._slice_records(key, json_prompt_paths, response_relative_position, array_path,
+                                          old_elements, offset, starts, stop)
+        self._delete_records(key, old_records)
+
+        new_elements = list(old_elements)
+        if 0 <= position - offset < len(new_elements):
+            if item is None:
+                new_elements.pop(position - offset)
+            else:
+                new_elements[position - offset] = item
+        records = self._slice_records(key, json_prompt_paths, response_relative_position, array_path,
+                                      new_elements, offset, starts, stop, metadata)
+        count = self._store_records(records)
+
+        if item is None:
+            watermarks = self.client.hgetall(watermarks_key)
+            lowered = {field: int(value) - 1 for field, value in watermarks.items() if int(value) > position}
+            if lowered:
+                self.client.hset(watermarks_key, mapping=lowered)
+        return f"Update 1 item in JSON_store and {count} prompts to vector_index."
+
+    def _slice_records(self, key, json_prompt_paths, response_relative_position, array_path, elements, offset,
+                       starts, stop=None, metadata=None):
+        """Extracts the (prompt, response, metadata) records of the prompts in a slice of a conversation array."""
+        return [(prompt, response, {**(metadata or {}), "name": key, "path": path})
+                for prompt, response, path in extract_slice_pairs(json_prompt_paths, response_relative_position,
+                                                                  array_path, elements, offset, starts, stop)]
+
+    def _delete_records(self, key, records):
+        """
+        Deletes the vector records of (prompt, response, metadata) records, if their prompts at these paths of the
+        JSON object `key` own them: a record stored for the same prompt elsewhere is kept. The records listing
+        "occurrences" (with a deduplicator, or for a prompt repeated in one object) only lose these occurrences, a
+        record is deleted with its last occurrence.
+        """
+        if not records:
+            return
+        cache = self.vector_index
+        removed = {}
+        for prompt, _, metadata in records:
+            record_key = self.deduplicator.find(prompt) if self.deduplicator is not None else None
+            record_key = record_key or cache.key(prompt)
+            removed.setdefault(record_key, []).append({"name": key, "path": metadata["path"]})
+        pipe = self.client.pipeline(transaction=False)
+        for record_key in removed:
+            pipe.hmget(record_key, [cache.prompt_field, cache.response_field, cache.metadata_field])
+        owned, updated = [], []
+        for (record_key, occurrences), (prompt, response, metadata) in zip(removed.items(), pipe.execute()):
+            if metadata is None:
+                continue
+            metadata = cache.deserialize(metadata)
+            if "occurrences" not in metadata:
+                if {"name": metadata.get("name"), "path": metadata.get("path")} in occurrences:
+                    owned.append(record_key)
+                continue
+            remaining = [occurrence for occurrence in metadata["occurrences"] if occurrence not in occurrences]
+            if not remaining:
+                owned.append(record_key)
+            elif len(remaining) < len(metadata["occurrences"]):
+                metadata = {**metadata, **remaining[0], "occurrences": remaining}
+                prompt, response = [value.decode() if isinstance(value, bytes) else value or ""
+                                    for value in (prompt, response)]
+                updated.append((record_key, prompt, response, metadata))
+        if updated:
+            for record_key, _, _, metadata in updated:
+                pipe.hset(record_key, mapping={cache.metadata_field: cache.serialize(metadata),
+                                               **redis_indexed_fields(metadata, self.filter_fields)})
+            pipe.execute()
+            if self.lexical_index is not None:
+                self.lexical_index.add_many((record_key, prompt, self._lexical_payload(prompt, response, metadata))
+                                            for record_key, prompt, response, metadata in updated)
+        if owned:
+            self.client.delete(*owned)
+            if self.lexical_index is not None:
+                self.lexical_index.remove(owned)
+            if self.deduplicator is not None:
+                for record_key in owned:
+                    self.deduplicator.remove(record_key)
 
     def search_item(self, query, num_results=1, return_fields=["response", "name", "path", "vector_distance"],
-                    semantic_distance_threshold=None):
-        if semantic_distance_threshold is not None:
-            self.vector_index.set_threshold(semantic_distance_threshold)
+                    semantic_distance_threshold=None, filter: VectorFilter = None):
+        """
+        Searches the prompts semantically close to the query.
+
+        The threshold only applies to this call, the shared vector index is not modified, so concurrent searches
+        with different thresholds are safe.
+
+        :param query: The query text.
+        :param num_results: Maximum number of results.
+        :param return_fields: The fields to return for each result.
+        :param semantic_distance_threshold: Maximum vector distance, defaults to default_semantic_distance_threshold.
+        :param filter: A VectorFilter, only the prompts matching it are searched. The lexical index is not used
+        with a filter.
+        :return: A list of dicts with the return fields, closest first. With a lexical index, the hits are ranked
+        by reciprocal-rank fusion and the prompts found only lexically have no "vector_distance".
+        """
+        if self.lexical_index is not None and filter is None:
+            return self.search_many([query], num_results, return_fields, semantic_distance_threshold)[0]
+        vector = self._embed_many([query])[0]
+        range_query = self._range_query(vector, num_results, return_fields, semantic_distance_threshold, filter)
+        return self._process_hits(self.vector_index.search_many([range_query]))[0]
+
+    def search_many(self, queries, num_results=1, return_fields=["response", "name", "path", "vector_distance"],
+                    semantic_distance_threshold=None, batch_size=256, filter: VectorFilter = None):
+        """
+        Searches many queries, like `search_item`, with one embedding call and one pipeline per batch.
+
+        :param queries: A list of query texts.
+        :param num_results: Maximum number of results per query.
+        :param return_fields: The fields to return for each result.
+        :param semantic_distance_threshold: Maximum vector distance, defaults to default_semantic_distance_threshold.
+        :param batch_size: Number of queries per embedding call and pipeline.
+        :param filter: A VectorFilter applied to all queries.
+        :return: A list with the results of each query, in the order of the queries.
+        """
+        if self.lexical_index is not None and filter is None:
+            return hybrid_search(self.lexical_index, queries, num_results,
+                                 lambda pending: self._vector_search_many(pending, num_results, return_fields,
+                                                                          semantic_distance_threshold, batch_size),
+                                 ["id", *return_fields])
+        return self._vector_search_many(queries, num_results, return_fields, semantic_distance_threshold, batch_size,
+                                        filter)
+
+    def _vector_search_many(self, queries, num_results, return_fields, semantic_distance_threshold, batch_size,
+                            filter=None):
+        results = []
+        for position in range(0, len(queries), batch_size):
+            batch = queries[position:position + batch_size]
+            vectors = self._embed_many(batch, batch_size)
+            range_queries = [self._range_query(vector, num_results, return_fields, semantic_distance_threshold,
+                                               filter) for vector in vectors]
+            results.extend(self._process_hits(self.vector_index.search_many(range_queries)))
+        return results
+
+    def _payloads(self, records, vectors):
+        """Returns the vector index records of (prompt, response, metadata), the same as SemanticCache.store()."""
+        cache = self.vector_index
+        return [cache.payload(prompt, response, metadata, vector, redis_indexed_fields(metadata, self.filter_fields))
+                for (prompt, response, metadata), vector in zip(records, vectors)]
+
+    def _embed_many(self, texts, batch_size=256):
+        """Embeds texts with the vectorizer of the vector index, through the embedding cache if there is one."""
+        if not texts:
+            return []
+        vector_index = self.vector_index
+
+        def embed(batch):
+            return vector_index.embed_many(batch, batch_size)
 
-        res = self.vector_index.check(prompt=query, num_results=num_results, return_fields=return_fields)
+        if self.embedding_cache is None:
+            return embed(texts)
+        return self.embedding_cache.embed_many(vector_index.model, texts, embed)
 
-        if semantic_distance_threshold is not None:
-            self.vector_index.set_threshold(self.default_semantic_distance_threshold)
+    def _range_query(self, vector, num_results, return_fields, semantic_distance_threshold, filter=None):
+        if semantic_distance_threshold is None:
+            semantic_distance_threshold = self.default_semantic_distance_threshold
+        return self.vector_index.range_query(vector, num_results, return_fields, semantic_distance_threshold, filter)
 
-        return res
+    def _process_hits(self, results):
+        """
+        Post-processes search results like SemanticCache.check(): deserializes the metadata and refreshes the TTL
+        of the hits, in one pipeline.
+        """
+        keys = self._prepare_hits(results)
+        if keys:
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.expire(key, self.vector_index.ttl)
+            pipe.execute()
+        return results
+
+    def _prepare_hits(self, results):
+        """Deserializes the metadata of the hits, returns the keys whose TTL should be refreshed."""
+        cache = self.vector_index
+        keys = []
+        for hits in results:
+            for hit in hits:
+                if cache.ttl:
+                    keys.append(hit[cache.id_field])
+                if cache.metadata_field in hit:
+                    hit[cache.metadata_field] = cache.deserialize(hit[cache.metadata_field])
+        return keys
 
     def set_default_semantic_distance_threshold(self, threshold):
         self.default_semantic_distance_threshold = threshold
         self.vector_index.set_threshold(threshold)
 
     def set_vectorizer(self, vectorizer):
-        try:
-            from redisvl.extensions.llmcache import SemanticCache
-        except ImportError:
-            raise ImportError(
-                "`redisvl` package not found, please install it with "
-                "`pip install redisvl`"
-            )
         self.vectorizer = vectorizer
-        self.vector_index = SemanticCache(
-            name=f"{self.index_name}_vector_index",  # underlying search index name
-            prefix=f"{self.index_name}_vector_index:item",  # redis key prefix
-            redis_url=self.redis_url,  # redis connection url string
-            vectorizer=self.vectorizer,
-            distance_threshold=self.default_semantic_distance_threshold  # semantic distance threshold
-        )
+        self.vector_index = self.vector_index_class(self.index_name, self.client, self.vectorizer,
+                                                    self.default_semantic_distance_threshold)
+        self._create_filter_fields()
 
     def clear_index(self):
         """
@@ -153,10 +693,18 @@ class RedisVectorStoreForJSON:
         :return:
         """
         self.vector_index.clear()
+        if self.lexical_index is not None:
+            self.lexical_index.clear()
+        if self.deduplicator is not None:
+            self.deduplicator.clear()
 
     def delete_index(self):
         # Remove the underlying index
-        self.vector_index.index.delete(drop=True)
+        self.vector_index.delete()
+        if self.lexical_index is not None:
+            self.lexical_index.clear()
+        if self.deduplicator is not None:
+            self.deduplicator.clear()
 
     def __len__(self):
         return self.client.scard(f"{self.index_name}-collections")
@@ -190,37 +738,16 @@ class RedisVectorStoreForJSON:
         If None, only prompts are extracted, and responses are set to an empty string.
 
         Returns:
-        - A list of tuples (prompt, response).
+        - A list of tuples (prompt, response, path of the prompt). The prompt path is parsed once and cached, responses
+        are read directly from the conversation array.
         """
-        prompt_expr = parse(prompt_path)
-        prompts = [match for match in prompt_expr.find(json_data)]
-
-        pairs = []
-        for prompt in prompts:
-            # Extract prompt text
-            prompt_text = prompt.value
-
-            # Check if response position is provided
-            if response_relative_position is not None:
-                conversation_index = prompt.full_path.left.right.index
-                response_index = conversation_index + response_relative_position
-                response_path = Child(prompt.full_path.left.left, Index(response_index))
-                response_expr = parse(str(response_path))
-                response_matches = response_expr.find(json_data)
-
-                response_content = response_matches[0].value.get('content', '') if response_matches else ''
-            else:
-                # If no response position is provided, set response to empty
-                response_content = ''
-
-            pairs.append((prompt_text, response_content, str(prompt.full_path)))
-
-        return pairs
+        return compile_pair_extractor(prompt_path, response_relative_position).extract(json_data)
 
     @staticmethod
     def extract_utterances(redis_client, json_name, path, start_shift, end_shift):
         """
-        Extracts a range of utterances from a RedisJSON object relative to the current index.
+        Extracts a range of utterances from a RedisJSON object relative to the current index. Only the range is
+        fetched from Redis, not the whole conversation.
 
         :param redis_client: The Redis client instance.
         :param json_name: The name of the JSON object in Redis.
@@ -230,29 +757,20 @@ class RedisVectorStoreForJSON:
         :return: A list of utterances or None for indices out of boundary.
         """
         try:
-            # Extract the base path and current index from the path
-            path_parts = path.split('[')
-            # Assuming index is in the rightmost part of the path
-            current_index = int(path_parts[-1].split(']')[0])
-            # everything before the last part is the base path
-            base_path = '['.join(path_parts[:-1]).rstrip('.')
-
-            # Fetch the conversation from the base path, since the path should have no wildcards,
-            # this should return a list of 1
-            conversation = redis_client.json().get(json_name, base_path)[0]
-
-            # Calculate the range of indexes
-            start_index, end_index = (max(current_index + start_shift, 0),
-                                      min(current_index + end_shift, len(conversation)))
-
-            # Extract the relevant utterances
-            utterances = []
-            for i in range(start_index, end_index):
-                utterances.append(conversation[i])
-
-            return utterances
-
-        except IndexError as e:
+            return fetch_context_windows(redis_client, [(json_name, path)], start_shift, end_shift)[0]
+        except ValueError as e:
             import warnings
             warnings.warn(f"Index out of boundary when extracting utterances: {e}")
             return []
+
+    def get_context_windows(self, hits, start_shift, end_shift):
+        """
+        Fetches the utterances around each hit of a `search_item` result with one pipeline. Only the needed array
+        slices are read from RedisJSON, overlapping windows of the same conversation are fetched once.
+
+        :param hits: The result of `search_item`.
+        :param start_shift: The start of the range relative to each hit's index.
+        :param end_shift: The end of the range relative to each hit's index.
+        :return: A list with the utterances around each hit.
+        """
+        return fetch_context_windows(self.client, [hit_location(hit) for hit in hits], start_shift, end_shift)
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+SNAPSHOT_FORMAT = 1
+HEADER_FILE = "header.json"
+VECTORS_FILE = "vectors.f32"
+RECORDS_FILE = "records.jsonl"
+DOCUMENTS_FILE = "documents.jsonl"
+
+
+class _ChecksummedFile:
+    """A binary file being written, with the SHA256 of what was written."""
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.file.write(data)
+        self.sha256.update(data)
+
+    def close(self):
+        self.file.close()
+        return self.sha256.hexdigest()
+
+
+def _file_sha256(path, chunk_size=1 << 24):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot of a JSON vector store to a directory, so it can be restored without embedding its prompts:
+
+    - vectors.f32: the prompt embeddings, a raw row-major float32 matrix that is memory-mapped when restoring.
+    - records.jsonl: one [prompt, response, metadata] line per vector, in the order of the vectors.
+    - documents.jsonl: one [suffix, JSON object] line per stored document.
+    - header.json: the format, the embedding model, the vector dimensions, the counts and the SHA256 of each file.
+      It is written last, a snapshot without header is incomplete.
+
+    # Example usage
+    with SnapshotWriter("snapshots/conversations", model="sentence-transformers/all-mpnet-base-v2") as writer:
+        writer.write_documents([("a", conversation)])
+        writer.write_records([(prompt, response, {"name": "conversations-a", "path": path})], vectors)
+    """
+    def __init__(self, path, model, index_name=None):
+        """
+        Creates the snapshot directory and its files.
+        :param path: The snapshot directory.
+        :param model: The id of the embedding model of the vectors, checked when restoring.
+        :param index_name: The index name of the store, the "{index_name}-" prefix of the stored names is replaced
+        by the index name of the store restoring the snapshot.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.model = model
+        self.index_name = index_name
+        self.dims = None
+        self.count = 0
+        self.documents = 0
+        header = os.path.join(path, HEADER_FILE)
+        if os.path.exists(header):
+            os.remove(header)
+        self.files = {name: _ChecksummedFile(os.path.join(path, name))
+                      for name in (VECTORS_FILE, RECORDS_FILE, DOCUMENTS_FILE)}
+
+    def write_records(self, records, vectors):
+        """Appends (prompt, response, metadata) records and their vectors."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(vectors) != len(records):
+            raise ValueError(f"{len(records)} records but {len(vectors)} vectors.")
+        if not len(records):
+            return
+        if self.dims is None:
+            self.dims = vectors.shape[1]
+        elif vectors.shape[1] != self.dims:
+            raise ValueError(f"Vectors of {vectors.shape[1]} dimensions in a snapshot of {self.dims} dimensions.")
+        self.files[VECTORS_FILE].write(vectors.tobytes())
+        self.files[RECORDS_FILE].write("".join(json.dumps(list(record), ensure_ascii=False) + "\n"
+                                               for record in records).encode("utf-8"))
+        self.count += len(records)
+
+    def write_documents(self, documents):
+        """Appends (suffix, JSON object) documents."""
+        lines = [json.dumps([suffix, json_data], ensure_ascii=False) + "\n" for suffix, json_data in documents]
+        self.files[DOCUMENTS_FILE].write("".join(lines).encode("utf-8"))
+        self.documents += len(lines)
+
+    def close(self):
+        """Closes the files and writes the header."""
+        checksums = {name: file.close() for name, file in self.files.items()}
+        header = {"format": SNAPSHOT_FORMAT, "model": self.model, "index_name": self.index_name, "dims": self.dims,
+                  "count": self.count, "documents": self.documents, "sha256": checksums}
+        temporary = os.path.join(self.path, HEADER_FILE + ".tmp")
+        with open(temporary, "w") as file:
+            json.dump(header, file, indent=2)
+        os.replace(temporary, os.path.join(self.path, HEADER_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for file in self.files.values():
+                file.close()
+
+
+class Snapshot:
+    """
+    A snapshot written by SnapshotWriter, opened for restoring. The vectors are memory-mapped, the records and
+    documents are read in batches.
+    """
+    def __init__(self, path, model=None, verify=True):
+        """
+        Opens a snapshot.
+        :param path: The snapshot directory.
+        :param model: The id of the embedding model of the store restoring the snapshot, None to skip the check.
+        :param verify: Whether to check the SHA256 of the files, it reads them once.
+        :raises ValueError: If the snapshot is incomplete, of another format or model, or corrupted.
+        """
+        self.path = path
+        header = os.path.join(path, HEADER_FILE)
+        if not os.path.exists(header):
+            raise ValueError(f"No snapshot header in {path}, the snapshot is missing or incomplete.")
+        with open(header) as file:
+            self.header = json.load(file)
+        if self.header.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {self.header.get('format')}.")
+        if model is not None and self.header["model"] != model:
+            raise ValueError(f"The snapshot vectors were embedded with {self.header['model']}, "
+                             f"the store embeds with {model}.")
+        if verify:
+            for name, checksum in self.header["sha256"].items():
+                if _file_sha256(os.path.join(path, name)) != checksum:
+                    raise ValueError(f"Checksum mismatch of {name} in snapshot {path}.")
+
+    @property
+    def model(self):
+        return self.header["model"]
+
+    @property
+    def dims(self):
+        return self.header["dims"]
+
+    def __len__(self):
+        return self.header["count"]
+
+    @property
+    def vectors(self):
+        """The memory-mapped (count, dims) float32 matrix of the vectors."""
+        if not len(self):
+            return np.zeros((0, self.dims or 0), dtype=np.float32)
+        return np.memmap(os.path.join(self.path, VECTORS_FILE), dtype=np.float32, mode="r",
+                         shape=(len(self), self.dims))
+
+    def rename(self, name, index_name):
+        """Returns a stored name with the index name of the snapshot replaced by `index_name`."""
+        source = self.header.get("index_name")
+        if source is None or index_name is None or not name.startswith(f"{source}-"):
+            return name
+        return f"{index_name}-{name[len(source) + 1:]}"
+
+    def records(self, index_name=None, batch_size=10000):
+        """
+        Yields batches of ((prompt, response, metadata) records, their vectors). The names in the metadata are
+        renamed for the store of `index_name`.
+        """
+        vectors = self.vectors
+        position = 0
+        batch = []
+        with open(os.path.join(self.path, RECORDS_FILE), encoding="utf-8") as file:
+            for line in file:
+                prompt, response, metadata = json.loads(line)
+                if "name" in metadata:
+                    metadata["name"] = self.rename(metadata["name"], index_name)
+                if "occurrences" in metadata:
+                    metadata["occurrences"] = [{**occurrence, "name": self.rename(occurrence["name"], index_name)}
+                                               for occurrence in metadata["occurrences"]]
+                batch.append((prompt, response, metadata))
+                if len(batch) >= batch_size:
+                    yield batch, np.asarray(vectors[position:position + len(batch)])
+                    position += len(batch)
+                    batch = []
+        if batch:
+            yield batch, np.asarray(vectors[position:position + len(batch)])
+
+    def documents(self, batch_size=1000):
+        """Yields batches of (suffix, JSON object) documents."""
+        batch = []
+        with open(os.path.join(self.path, DOCUMENTS_FILE), encoding="utf-8") as file:
+            for line in file:
+                batch.append(tuple(json.loads(line)))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+
+def redis_documents(client, index_name, batch_size=1000):
+    """Yields batches of the (suffix, JSON object) documents of a Redis JSON store, read with pipelines."""
+    suffixes = [suffix.decode() if isinstance(suffix, bytes) else suffix
+                for suffix in client.smembers(f"{index_name}-collections")]
+    for start in range(0, len(suffixes), batch_size):
+        batch = suffixes[start:start + batch_size]
+        pipe = client.json().pipeline(transaction=False)
+        for suffix in batch:
+            pipe.get(f"{index_name}-{suffix}")
+        yield [(suffix, json_data) for suffix, json_data in zip(batch, pipe.execute()) if json_data is not None]
+
+
+def load_redis_documents(client, index_name, documents):
+    """Writes (suffix, JSON object) documents to a Redis JSON store in one pipeline, returns the number of new ones."""
+    pipe = client.json().pipeline(transaction=False)
+    for suffix, json_data in documents:
+        pipe.set(f"{index_name}-{suffix}", "$", json_data)
+        pipe.sadd(f"{index_name}-collections", suffix)
+        # The conversations are indexed again from their start by the next append_item
+        pipe.delete(f"{index_name}-watermarks-{suffix}")
+    return sum(pipe.execute()[1::3])
@@ -1,3 +1,16 @@
+import asyncio
+import inspect
+import re
+import time
+
+# A run of punctuation, optionally closed by quotes or brackets, e.g. "?!", "..." or '."'.
+_MARK_RUN = re.compile(r'[.!?,;:]+[.!?,;:"\')\]”’]*')
+# The continuation of a run that was cut at a chunk boundary.
+_RUN_CONTINUATION = re.compile(r'[.!?,;:"\')\]”’]*')
+# Only the end of the current word is needed to recognize abbreviations.
+_MAX_WORD = 16
+
+
 class StreamSentence:
     """
     A class to process text streams and send complete sentences or meaningful phrases.
@@ -6,9 +19,22 @@ class StreamSentence:
     It assembles these chunks into complete sentences or phrases, based on punctuation and
     checks for at least one space in the chunk to determine completeness.
 
+    Each character is scanned once: the scanner keeps its position and the state of the current
+    sentence between chunks, and the received chunks are only joined when sentences are sent.
+    A punctuation mark ends a sentence when it is followed by whitespace, so decimals ("3.14"),
+    times ("12:30") and URLs are kept together, and a period after a known abbreviation ("Dr.",
+    "e.g.") or a single letter ("J. R. R. Tolkien") does not split.
+    A phrase too short to be sent ("Hi.") is merged with the following one.
+
+    Optional flush policies bound the latency of text waiting for punctuation: when more than
+    `max_wait` seconds passed since the last send, or `max_chars` characters or `max_words`
+    words are buffered, the buffered text is sent up to the last word boundary. `max_wait` is
+    checked when chunks arrive and by `poll`; `AsyncStreamSentence` calls `poll` on a timer.
+
     Attributes:
-        buffer (str): A buffer to hold incoming text chunks.
+        buffer (str): The received text that has not been sent yet.
         send (function): A function that handles the sending of complete text chunks.
+        abbreviations (frozenset): Lower-case words that do not end a sentence when followed by a period.
 
     Methods:
         process_chunk(chunk): Processes a single chunk of text from the stream.
@@ -26,18 +52,53 @@ class StreamSentence:
         stream_processor.process_chunk(chunk)
 
     stream_processor.end_stream()
+
+    # Or directly from an LLM token stream
+    stream_processor.consume(llm.stream("ice cream"))
+    await stream_processor.aconsume(llm.astream("ice cream"))
     """
-    def __init__(self, send_function, end_string: str="<END>"):
+    abbreviations = frozenset(["mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "e.g", "i.e", "cf",
+                               "approx", "dept", "fig", "vol"])
+
+    def __init__(self, send_function, end_string: str="<END>",
+                 max_wait: float=None, max_chars: int=None, max_words: int=None):
         """
         Initializes the StreamProcessor with a specified send function.
 
         Args:
             send_function (function): A function that will be used to send the processed text.
             end_string (string): A string to be sent to indicate end of streaming. Default: <END>
+            max_wait (float, optional): Maximum seconds since the last send (or the first chunk)
+                before buffered text is sent at a word boundary.
+            max_chars (int, optional): Maximum buffered characters. A single word longer than
+                this is sent whole, once the text after it arrives.
+            max_words (int, optional): Maximum buffered words.
         """
-        self.buffer = ""
         self.send = send_function
         self.end_string = end_string
+        self.max_wait = max_wait
+        self.max_chars = max_chars
+        self.max_words = max_words
+        self._reset_stream()
+
+    def _reset_stream(self):
+        self._parts = []       # received chunks not sent yet
+        self._offset = 0       # stream position of the first character in _parts
+        self._length = 0       # number of characters received
+        self._pending = None   # (position, run, word) of a punctuation run waiting for the next character
+        self._last_emit = None  # time of the last send, or of the first chunk
+        self._words = 0        # buffered words, only counted when max_words is set
+        self._in_word = False  # the received text ends inside a word
+        self._reset_sentence()
+
+    def _reset_sentence(self):
+        self._content = False  # a non-space character was seen
+        self._gap = False      # whitespace was seen after the content
+        self._valid = False    # a non-space character was seen after a gap, i.e. is_valid_chunk() holds
+
+    @property
+    def buffer(self):
+        return "".join(self._parts).lstrip()
 
     @staticmethod
     def is_valid_chunk(chunk):
@@ -47,6 +108,8 @@ class StreamSentence:
         A chunk is considered valid if it contains at least one space, indicating it being more
         than a single short word or abbreviation. So "Hi John" or "Hold on" are valid.
 
+        The scanner tracks this condition incrementally for the current sentence.
+
         Args:
             chunk (str): The text chunk to be evaluated.
 
@@ -55,6 +118,51 @@ class StreamSentence:
         """
         return ' ' in chunk
 
+    def _update(self, text):
+        """Updates the state of the current sentence with scanned text, in O(len(text))."""
+        if self._valid or not text:
+            return
+        if text.isspace():
+            self._gap = self._content
+            return
+        stripped = text.rstrip()
+        inner_space = len(stripped.split(None, 1)) > 1
+        if self._content:
+            self._valid = self._gap or stripped[0].isspace() or inner_space
+        else:
+            self._content = True
+            self._valid = inner_space
+        self._gap = text[-1].isspace()
+
+    def _word_before(self, chunk, start):
+        """Returns the end of the word before position `start` of the chunk, for abbreviation checks."""
+        tail = chunk[max(start - _MAX_WORD, 0):start]
+        if len(tail) < _MAX_WORD and len(self._parts) > 1:
+            # The word may have started in previous chunks, still in _parts since they were not sent.
+            previous = []
+            missing = _MAX_WORD - len(tail)
+            for part in reversed(self._parts[:-1]):
+                previous.append(part[-missing:])
+                missing -= len(previous[-1])
+                if missing <= 0:
+                    break
+            tail = "".join(reversed(previous)) + tail
+        if not tail or tail[-1].isspace():
+            return ""
+        return tail.rsplit(None, 1)[-1]
+
+    def _resolve(self, following, splits):
+        """Decides whether the pending punctuation run ends a sentence, given the character after it."""
+        position, run, word = self._pending
+        self._pending = None
+        if not following.isspace():
+            return
+        if run == "." and (word.lower() in self.abbreviations or (len(word) == 1 and word.isalpha())):
+            return
+        if self._valid:
+            splits.append(position)
+            self._reset_sentence()
+
     def process_chunk(self, chunk):
         """
         Processes a chunk of text, appending it to the buffer and sending complete sentences.
@@ -66,22 +174,129 @@ class StreamSentence:
         Args:
             chunk (str): A chunk of text from the stream.
         """
-        self.buffer += chunk
-        # Define punctuation marks where splitting can occur
-        punctuation_marks = '.!?,;:'
+        if not chunk:
+            return
+        if self._last_emit is None:
+            self._last_emit = time.monotonic()
+        if self.max_words is not None:
+            words = len(chunk.split())
+            if words and self._in_word and not chunk[0].isspace():
+                words -= 1
+            self._words += words
+            self._in_word = not chunk[-1].isspace()
+        self._parts.append(chunk)
+        base = self._length
+        self._length += len(chunk)
+        splits = []
+        position = 0
+
+        if self._pending is not None:
+            # A punctuation run at the end of the previous chunk may continue in this one.
+            continuation = _RUN_CONTINUATION.match(chunk).end()
+            if continuation:
+                _, run, word = self._pending
+                self._update(chunk[:continuation])
+                self._pending = (base + continuation - 1, run + chunk[:continuation], word)
+                position = continuation
+            if position < len(chunk):
+                self._resolve(chunk[position], splits)
+
+        found = _MARK_RUN.search(chunk, position)
+        while found is not None:
+            start, end = found.span()
+            run = found.group()
+            if not self._valid:
+                self._update(chunk[position:start])
+                self._update(run)
+            self._pending = (base + end - 1, run, self._word_before(chunk, start) if run == "." else "")
+            position = end
+            if end < len(chunk):
+                self._resolve(chunk[end], splits)
+            found = _MARK_RUN.search(chunk, position)
+
+        if not self._valid:
+            self._update(chunk[position:])
+
+        if splits:
+            # Join the received chunks once for all sentences completed by this chunk.
+            text = "".join(self._parts)
+            start = 0
+            for split in splits:
+                stop = split + 1 - self._offset
+                self._emit(text[start:stop].strip())
+                start = stop
+            self._parts = [text[start:]] if start < len(text) else []
+            self._offset += start
+            if self.max_words is not None:
+                self._words = len(text[start:].split())
+
+        self._apply_flush_policy()
+
+    def _emit(self, sentence):
+        self.send(sentence)
+        self._last_emit = time.monotonic()
+
+    def _flushable(self):
+        """Whether the buffer has a word boundary after some content."""
+        return self._valid or self._gap
+
+    def _flush_to_word_boundary(self):
+        """Sends the buffered text up to its last word boundary."""
+        text = "".join(self._parts)
+        # Text ending with punctuation is only waiting for the next character to be sent whole.
+        if text[-1:].isspace() or self._pending is not None and self._pending[0] == self._length - 1:
+            cut = len(text)
+        else:
+            words = text.rsplit(None, 1)
+            if len(words) < 2 and not text[:1].isspace():
+                return False
+            cut = len(text) - len(words[-1])
+        sentence = text[:cut].strip()
+        if not sentence:
+            return False
+        self._emit(sentence)
+        rest = text[cut:]
+        self._parts = [rest] if rest else []
+        self._offset += cut
+        if self._pending is not None and self._pending[0] < self._offset:
+            self._pending = None
+        self._reset_sentence()
+        self._update(rest)
+        if self.max_words is not None:
+            self._words = len(rest.split())
+        return True
+
+    def _apply_flush_policy(self):
+        buffered = self._length - self._offset
+        if not buffered:
+            return False
+        if self.max_chars is not None and buffered >= self.max_chars:
+            # A word longer than max_chars is held until its end arrives, words are never cut.
+            return self._flushable() and self._flush_to_word_boundary()
+        if self.max_words is not None and self._words >= self.max_words:
+            return self._flush_to_word_boundary()
+        return self.poll()
+
+    def time_until_flush(self):
+        """
+        Returns the seconds until `max_wait` forces a flush of the buffered text, or None if no
+        flush is due (no `max_wait`, or no complete word buffered).
+        """
+        if self.max_wait is None or self._length == self._offset or not self._flushable():
+            return None
+        return max(0.0, self._last_emit + self.max_wait - time.monotonic())
 
-        while any(mark in self.buffer for mark in punctuation_marks):
-            # Find the earliest punctuation mark to split
-            split_points = [self.buffer.find(mark) for mark in punctuation_marks if mark in self.buffer]
-            split_point = min(split_points)
+    def poll(self):
+        """
+        Applies the `max_wait` policy without new text. Call it periodically when chunks may stall.
 
-            # Extracting the sentence or phrase
-            sentence = self.buffer[:split_point+1].strip()
-            if self.is_valid_chunk(sentence):
-                self.send(sentence)
-                self.buffer = self.buffer[split_point+1:].strip()
-            else:
-                break  # Avoids splitting too short phrases
+        Returns:
+            bool: True if text was sent.
+        """
+        remaining = self.time_until_flush()
+        if remaining is None or remaining > 0:
+            return False
+        return self._flush_to_word_boundary()
 
     def end_stream(self):
         """
@@ -91,9 +306,152 @@ class StreamSentence:
         and then sends a "<END>" signal to indicate the end of the stream.
         """
         # Sending any remaining text in the buffer
-        if self.buffer.strip():
-            self.send(self.buffer.strip())
+        remaining = "".join(self._parts).strip()
+        if remaining:
+            self._emit(remaining)
+        self._reset_stream()
 
         # Sending the "<END>" string
         self.send(self.end_string)
 
+    def consume(self, chunks):
+        """
+        Processes every chunk of an iterable, e.g. `LLMInterface.stream`, then ends the stream.
+
+        Args:
+            chunks (iterable): The text chunks.
+        """
+        for chunk in chunks:
+            self.process_chunk(chunk)
+        self.end_stream()
+
+    async def aconsume(self, chunks):
+        """
+        Processes every chunk of an async iterable, e.g. `LLMInterface.astream`, then ends the stream.
+
+        Args:
+            chunks (async iterable): The text chunks.
+        """
+        async for chunk in chunks:
+            self.process_chunk(chunk)
+        self.end_stream()
+
+
+class AsyncStreamSentence:
+    """
+    Runs many sentence streams concurrently on one asyncio event loop.
+
+    Each stream reads chunks from an async iterable (e.g. `LLMInterface.astream`) into its own
+    `StreamSentence`. While a stream waits for its next chunk, the `max_wait` policy is applied on
+    a timer, so text is sent within `max_wait` seconds even if the model stalls mid-sentence.
+    The send function may be a coroutine function. Time to first sentence and the gaps between
+    sends are recorded per stream.
+
+    # Example usage
+    multiplexer = AsyncStreamSentence(max_wait=0.5, max_words=12)
+    for session_id, websocket in sessions.items():
+        multiplexer.add_stream(session_id, llm.astream(prompts[session_id]), websocket.send)
+    await multiplexer.join()
+    print(multiplexer.metrics())
+    """
+    def __init__(self, end_string: str="<END>", max_wait: float=None, max_chars: int=None, max_words: int=None):
+        """
+        Args:
+            end_string (string): A string to be sent to indicate end of each stream. Default: <END>
+            max_wait (float, optional): See `StreamSentence`.
+            max_chars (int, optional): See `StreamSentence`.
+            max_words (int, optional): See `StreamSentence`.
+        """
+        self.end_string = end_string
+        self.max_wait = max_wait
+        self.max_chars = max_chars
+        self.max_words = max_words
+        self.tasks = {}
+        self._metrics = {}
+
+    def add_stream(self, stream_id, chunks, send_function):
+        """
+        Starts processing a stream on the running event loop.
+
+        Args:
+            stream_id: A hashable identifier for the stream, used for its metrics.
+            chunks (async iterable): The text chunks of the stream.
+            send_function (function or coroutine function): Receives each sentence and the end string.
+
+        Returns:
+            asyncio.Task: The task processing the stream.
+        """
+        task = asyncio.ensure_future(self._run(stream_id, chunks, send_function))
+        self.tasks[stream_id] = task
+        return task
+
+    async def join(self):
+        """Waits for all streams to end."""
+        await asyncio.gather(*self.tasks.values())
+
+    async def _run(self, stream_id, chunks, send_function):
+        metrics = {"started_at": time.monotonic(), "first_sentence_at": None, "last_sentence_at": None,
+                   "sentences": 0, "max_gap": 0.0, "total_gap": 0.0}
+        self._metrics[stream_id] = metrics
+        outbox = []
+        processor = StreamSentence(outbox.append, end_string=self.end_string, max_wait=self.max_wait,
+                                   max_chars=self.max_chars, max_words=self.max_words)
+
+        async def deliver():
+            for sentence in outbox:
+                now = time.monotonic()
+                if sentence != self.end_string:
+                    if metrics["first_sentence_at"] is None:
+                        metrics["first_sentence_at"] = now
+                    else:
+                        gap = now - metrics["last_sentence_at"]
+                        metrics["max_gap"] = max(metrics["max_gap"], gap)
+                        metrics["total_gap"] += gap
+                    metrics["last_sentence_at"] = now
+                    metrics["sentences"] += 1
+                result = send_function(sentence)
+                if inspect.isawaitable(result):
+                    await result
+            outbox.clear()
+
+        iterator = chunks.__aiter__()
+        next_chunk = asyncio.ensure_future(iterator.__anext__())
+        try:
+            while True:
+                # Keep waiting on the same pending read so that timeouts never cancel the source.
+                done, _ = await asyncio.wait({next_chunk}, timeout=processor.time_until_flush())
+                if not done:
+                    processor.poll()
+                    await deliver()
+                    continue
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    break
+                processor.process_chunk(chunk)
+                await deliver()
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+        finally:
+            if not next_chunk.done():
+                next_chunk.cancel()
+        processor.end_stream()
+        await deliver()
+
+    def metrics(self, stream_id=None):
+        """
+        Returns the latency metrics of one stream, or of all streams keyed by stream id.
+
+        Per stream: time to first sentence, the mean and maximum gap between consecutive
+        sentences in seconds, and the number of sentences sent.
+        """
+        if stream_id is None:
+            return {key: self.metrics(key) for key in self._metrics}
+        metrics = self._metrics[stream_id]
+        first = metrics["first_sentence_at"]
+        gaps = metrics["sentences"] - 1
+        return {
+            "time_to_first_sentence": first - metrics["started_at"] if first is not None else None,
+            "mean_gap": metrics["total_gap"] / gaps if gaps > 0 else None,
+            "max_gap": metrics["max_gap"] if gaps > 0 else None,
+            "sentences": metrics["sentences"],
+        }
@@ -0,0 +1,123 @@
+import re
+
+FILTER_FIELD_TYPES = ("tag", "numeric")
+RESERVED_FIELDS = ("id", "prompt", "response", "prompt_vector", "metadata", "name", "path", "path_prefixes")
+PATH_PREFIX_SEPARATOR = "|"
+
+_TAG_SPECIAL = re.compile(r"([,.<>{}\[\]\"':;!@#$%^&*()\-+=~/|\\ ])")
+
+
+def normalize_path(path):
+    """Writes a concrete JSON path the way the stores do: "$.conversation[3]" -> "$.conversation.[3]"."""
+    path = path.strip().rstrip(".")
+    if path == "$":
+        return path
+    body = path[1:] if path.startswith("$") else "." + path.lstrip(".")
+    return "$" + re.sub(r"(?<!\.)\[", ".[", body)
+
+
+def path_prefixes(path):
+    """Returns the prefixes of a stored path at segment boundaries, e.g. "$", "$.conversation", "$.conversation.[3]"."""
+    segments = normalize_path(path).split(".")
+    return [".".join(segments[:i]) for i in range(1, len(segments) + 1)]
+
+
+def escape_tag(value):
+    """Escapes the characters of a tag value that have a meaning in the Redis query syntax."""
+    return _TAG_SPECIAL.sub(r"\\\1", str(value))
+
+
+def _as_list(values):
+    return [values] if isinstance(values, (str, int, float)) else list(values)
+
+
+class VectorFilter:
+    """
+    A structured filter on the prompts of a JSON vector store, applied by the vector index before the similarity
+    search, so that `num_results` hits are found among the matching prompts only.
+
+    - `documents`: the `json_storage_id_suffix` of the JSON objects, or a list of them.
+    - `path_prefix`: a path the prompt paths start with, matched by whole segments: "$.conversation" matches
+      "$.conversation.[3].content" but not "$.conversations.[3].content".
+    - `tags`: {field: value or list of values}, for tag fields given as metadata when upserting.
+    - `ranges`: {field: (minimum, maximum)}, inclusive, None for an open bound, for numeric metadata fields.
+
+    All conditions must hold. The Redis store translates the filter into a query pre-filter (its fields are
+    declared with the `filter_fields` of the store) and the Chroma store into a `where` clause.
+
+    # Example usage
+    recent = VectorFilter(path_prefix="$.conversation", tags={"tenant": "acme"}, ranges={"timestamp": (since, None)})
+    hits = store.search_item("delete the pod", num_results=3, filter=recent)
+    """
+    def __init__(self, documents=None, path_prefix=None, tags=None, ranges=None):
+        self.documents = _as_list(documents) if documents is not None else None
+        self.path_prefix = normalize_path(path_prefix) if path_prefix is not None else None
+        self.tags = {field: _as_list(values) for field, values in (tags or {}).items()}
+        self.ranges = dict(ranges or {})
+        for field in list(self.tags) + list(self.ranges):
+            if field in RESERVED_FIELDS:
+                raise ValueError(f"{field} is a reserved field, use `documents` or `path_prefix` to filter on it.")
+
+    def to_redis(self, index_name):
+        """Returns the filter in the Redis query syntax, "*" if it has no condition."""
+        conditions = []
+        if self.documents is not None:
+            names = "|".join(escape_tag(f"{index_name}-{document}") for document in self.documents)
+            conditions.append(f"@name:{{{names}}}")
+        if self.path_prefix is not None:
+            conditions.append(f"@path_prefixes:{{{escape_tag(self.path_prefix)}}}")
+        for field, values in self.tags.items():
+            conditions.append(f"@{field}:{{{'|'.join(escape_tag(value) for value in values)}}}")
+        for field, (minimum, maximum) in self.ranges.items():
+            conditions.append(f"@{field}:[{'-inf' if minimum is None else minimum} "
+                              f"{'+inf' if maximum is None else maximum}]")
+        if not conditions:
+            return "*"
+        return conditions[0] if len(conditions) == 1 else f"({' '.join(conditions)})"
+
+    def to_chroma(self, index_name):
+        """Returns the filter as a Chroma `where` clause, None if it has no condition."""
+        conditions = []
+        if self.documents is not None:
+            conditions.append({"name": {"$in": [f"{index_name}-{document}" for document in self.documents]}})
+        if self.path_prefix is not None:
+            conditions.append({f"path:{self.path_prefix}": True})
+        for field, values in self.tags.items():
+            conditions.append({field: {"$in": values}})
+        for field, (minimum, maximum) in self.ranges.items():
+            if minimum is not None:
+                conditions.append({field: {"$gte": minimum}})
+            if maximum is not None:
+                conditions.append({field: {"$lte": maximum}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def redis_schema_fields(filter_fields):
+    """Returns the redisvl field definitions of the filterable fields of the Redis store."""
+    fields = [{"name": "name", "type": "tag", "attrs": {"case_sensitive": True}},
+              {"name": "path_prefixes", "type": "tag",
+               "attrs": {"separator": PATH_PREFIX_SEPARATOR, "case_sensitive": True}}]
+    for field, field_type in (filter_fields or {}).items():
+        if field in RESERVED_FIELDS:
+            raise ValueError(f"{field} is a reserved field name.")
+        if field_type not in FILTER_FIELD_TYPES:
+            raise ValueError(f"Unknown type {field_type} of filter field {field}, use 'tag' or 'numeric'.")
+        fields.append({"name": field, "type": field_type})
+    return fields
+
+
+def redis_indexed_fields(metadata, filter_fields):
+    """Returns the hash fields the Redis store indexes for the metadata of a prompt."""
+    fields = {"name": metadata["name"], "path": metadata["path"],
+              "path_prefixes": PATH_PREFIX_SEPARATOR.join(path_prefixes(metadata["path"]))}
+    for field in filter_fields or {}:
+        if metadata.get(field) is not None:
+            fields[field] = metadata[field]
+    return fields
+
+
+def chroma_metadata(metadata):
+    """Returns the Chroma metadata of a prompt: its metadata and a flag per prefix of its path."""
+    return {**metadata, **{f"path:{prefix}": True for prefix in path_prefixes(metadata["path"])}}
@@ -0,0 +1,69 @@
+"""
+Ingestion throughput of ChromaVectorStoreForJSON.upsert_many, on a first ingest and on a re-ingest of the same
+conversations with the last turns removed, which updates the utterances in place and prunes the removed ones.
+
+Needs a local Redis Stack (RedisJSON) and chromadb. By default prompts are embedded with the deterministic embeddings
+of the Fake LLM backend so that only the storage is measured; use --hf-embeddings to include the embedding model.
+
+Usage: python benchmarks/bench_chroma_upsert.py --conversations 2000 --turns 6 --redis-url redis://localhost:6379
+"""
+import argparse
+import tempfile
+import time
+
+from anli.llms.fake import FakeLLM
+from anli.utils.chroma_vector_store import ChromaVectorStoreForJSON
+
+
+class FakeEmbeddings:
+    def __init__(self, dims):
+        self.llm = FakeLLM(embedding_dims=dims)
+
+    def embed_documents(self, texts):
+        return self.llm.embed(texts)
+
+
+def make_conversations(count, turns):
+    return [{"conversation": [{"role": "user" if turn % 2 == 0 else "assistant",
+                               "content": f"message {turn} of conversation {i} about pod worker-{i % 97}"}
+                              for turn in range(turns)]}
+            for i in range(count)]
+
+
+def measure(store, documents, args):
+    suffixes = [f"doc-{i}" for i in range(len(documents))]
+    start = time.perf_counter()
+    store.upsert_many(documents, "$.conversation[?(@.role == 'user')].content", response_relative_position=1,
+                      json_storage_id_suffixes=suffixes, batch_size=args.batch_size)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--redis-url", default="redis://localhost:6379")
+    parser.add_argument("--hf-embeddings", action="store_true")
+    args = parser.parse_args()
+
+    documents = make_conversations(args.conversations, args.turns)
+    shrunk = [{"conversation": document["conversation"][:-2]} for document in documents]
+    with tempfile.TemporaryDirectory() as path:
+        store = ChromaVectorStoreForJSON("bench_chroma_upsert", redis_url=args.redis_url, chromadb_path=path)
+        if not args.hf_embeddings:
+            store.embedding_function = FakeEmbeddings(256)
+        try:
+            for name, batch in (("ingest", documents), ("re-ingest", shrunk)):
+                prompts = args.conversations * ((len(batch[0]["conversation"]) + 1) // 2)
+                seconds = measure(store, batch, args)
+                print(f"{name:>10}: {seconds:8.2f} s {args.conversations / seconds:10.1f} conversations/s "
+                      f"{prompts / seconds:10.1f} prompts/s, {store.collection._collection.count()} utterances")
+        finally:
+            store.client.delete(*[f"{store.index_name}-doc-{i}" for i in range(len(documents))],
+                                f"{store.index_name}-collections")
+            store.chroma_client.delete_collection(store.index_name)
+
+
+if __name__ == "__main__":
+    main()
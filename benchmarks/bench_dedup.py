@@ -0,0 +1,81 @@
+"""
+Ingest time and stored vectors of LocalVectorStoreForJSON with and without a Deduplicator, on support conversations
+where most user turns repeat a few greetings and templated questions with small variations (punctuation, casing,
+filler words).
+
+Prompts are embedded with the deterministic embeddings of the Fake LLM backend, with --embed-latency seconds added
+per embedded prompt to account for a real model on CPU.
+
+Usage: python benchmarks/bench_dedup.py --conversations 2000 --turns 6 --embed-latency 0.002
+"""
+import argparse
+import random
+import tempfile
+import time
+
+from anli.llms.fake import FakeLLM
+from anli.utils.dedup import Deduplicator
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+COMMON = ["Hi", "hi!", "Thanks", "thanks!", "OK", "ok.", "Thank you so much", "bye"]
+QUESTIONS = ["my order {order} has not arrived yet and it has been two weeks",
+             "how do i reset my password on the mobile app",
+             "i would like to cancel my subscription because it is too expensive",
+             "can you send me the invoice of order {order} again"]
+FILLERS = ["", "please", "!", "?", " any idea"]
+
+
+def make_conversation(rng, turns, orders):
+    conversation = []
+    for turn in range(turns):
+        if rng.random() < 0.5:
+            prompt = rng.choice(COMMON)
+        elif rng.random() < 0.8:
+            prompt = rng.choice(QUESTIONS).format(order=rng.randrange(orders)) + rng.choice(FILLERS)
+            prompt = prompt.capitalize() if rng.random() < 0.5 else prompt
+        else:
+            prompt = f"a unique question number {rng.random()} about something else entirely"
+        conversation += [{"role": "user", "content": prompt}, {"role": "assistant", "content": f"answer {turn}"}]
+    return {"conversation": conversation}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--embed-latency", type=float, default=0.002)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    documents = [make_conversation(rng, args.turns, args.orders) for _ in range(args.conversations)]
+    llm = FakeLLM(embedding_dims=256)
+    embedded = []
+
+    def embed(texts):
+        embedded.append(len(texts))
+        time.sleep(args.embed_latency * len(texts))
+        return llm.embed(texts)
+
+    print(f"{'store':>8} {'prompts':>8} {'embedded':>9} {'ingest s':>9} {'find us':>8}")
+    for name, deduplicator in (("plain", None), ("dedup", Deduplicator())):
+        embedded.clear()
+        with tempfile.TemporaryDirectory() as path:
+            store = LocalVectorStoreForJSON("bench", path=path, vectorizer=embed, deduplicator=deduplicator)
+            start = time.perf_counter()
+            for position in range(0, len(documents), 100):
+                store.upsert_many(documents[position:position + 100], "$.conversation[?(@.role == 'user')].content",
+                                  response_relative_position=1)
+            elapsed = time.perf_counter() - start
+            find = ""
+            if deduplicator is not None:
+                probes = [turn["content"] for document in documents[:200] for turn in document["conversation"][::2]]
+                start = time.perf_counter()
+                for probe in probes:
+                    deduplicator.find(probe)
+                find = f"{(time.perf_counter() - start) / len(probes) * 1e6:.1f}"
+            print(f"{name:>8} {args.conversations * args.turns:>8} {sum(embedded):>9} {elapsed:>9.2f} {find:>8}")
+
+
+if __name__ == "__main__":
+    main()
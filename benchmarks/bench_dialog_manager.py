@@ -0,0 +1,59 @@
+"""
+Prompt size and prompt-build time per turn of a long conversation: naive prompts concatenating the whole history
+versus DialogManager prompts under a token budget (ring buffer window, cached summaries, BM25 recall).
+
+Summaries are written by the Fake LLM backend. The prefill estimate is the prompt tokens of the last turn at
+--prefill-rate tokens per second (a small model on CPU).
+
+Usage: python benchmarks/bench_dialog_manager.py --turns 2000 --budget 1024 --window 32 --prefill-rate 400
+"""
+import argparse
+import random
+import statistics
+import time
+
+from anli.dialog_manager import DialogManager, count_tokens, llm_summarizer
+from anli.llms.fake import FakeLLM
+
+VOCABULARY = [f"word{rank}" for rank in range(5000)]
+# Word frequencies follow Zipf's law, as in natural text
+WEIGHTS = [1 / (rank + 1) for rank in range(5000)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--budget", type=int, default=1024)
+    parser.add_argument("--window", type=int, default=32)
+    parser.add_argument("--prefill-rate", type=float, default=400)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    turns = [("user" if i % 2 == 0 else "assistant", " ".join(rng.choices(VOCABULARY, WEIGHTS, k=rng.randint(5, 40))))
+             for i in range(args.turns)]
+    llm = FakeLLM(default_response="The user worked on pods and services.")
+    dialog = DialogManager(token_budget=args.budget, window=args.window, summarizer=llm_summarizer(llm))
+    history = []
+
+    print(f"{'turn':>6} {'naive tokens':>13} {'naive ms':>9} {'budget tokens':>14} {'budget ms':>10}")
+    naive_times, budget_times = [], []
+    for number, (role, content) in enumerate(turns, 1):
+        start = time.perf_counter()
+        history.append((role, content))
+        naive = "\n".join(f"{r}: {c}" for r, c in history)
+        naive_tokens = count_tokens(naive)
+        naive_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        prompt = dialog.build_prompt(content) if role == "user" else dialog.build_prompt()
+        dialog.add_turn(role, content)
+        budget_times.append(time.perf_counter() - start)
+        if number in (10, 100, 1000) or number == len(turns):
+            print(f"{number:>6} {naive_tokens:>13} {statistics.mean(naive_times[-10:]) * 1000:>9.3f} "
+                  f"{count_tokens(prompt):>14} {statistics.mean(budget_times[-10:]) * 1000:>10.3f}")
+    print(f"prefill of the last prompt: naive {naive_tokens / args.prefill_rate:.1f} s, "
+          f"budgeted {count_tokens(prompt) / args.prefill_rate:.1f} s; {llm.calls} summaries")
+
+
+if __name__ == "__main__":
+    main()
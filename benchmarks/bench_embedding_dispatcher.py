@@ -0,0 +1,78 @@
+"""
+Throughput and latency of concurrent single-query embeddings, called directly or through an EmbeddingDispatcher.
+
+By default the embedder is simulated with a fixed cost per call and a small cost per text, like a CPU forward pass of
+short texts; use --model to embed with a sentence-transformers model through the EmbeddingEngine.
+
+Usage: python benchmarks/bench_embedding_dispatcher.py --threads 32 --queries 2000 --max-wait 0.005 [--model sentence-transformers/all-mpnet-base-v2]
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from anli.llms.fake import FakeLLM
+from anli.utils.embedding_dispatcher import EmbeddingDispatcher
+from anli.utils.embedding_engine import EmbeddingEngine
+
+
+class SimulatedEmbedder:
+    model = "simulated"
+    dims = 256
+
+    def __init__(self, call_cost, text_cost):
+        self.llm = FakeLLM(embedding_dims=self.dims)
+        self.call_cost = call_cost
+        self.text_cost = text_cost
+        # A CPU model runs one forward pass at a time
+        self.lock = threading.Lock()
+
+    def embed_many(self, texts, **kwargs):
+        with self.lock:
+            time.sleep(self.call_cost + self.text_cost * len(texts))
+            return self.llm.embed(texts)
+
+
+def run(embed, queries, threads):
+    latencies = []
+
+    def query(text):
+        start = time.perf_counter()
+        embed(text)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(query, queries))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return len(queries) / seconds, statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-wait", type=float, default=0.005)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--call-cost", type=float, default=0.004)
+    parser.add_argument("--text-cost", type=float, default=0.0002)
+    parser.add_argument("--model", default=None)
+    args = parser.parse_args()
+
+    embedder = EmbeddingEngine(args.model) if args.model else SimulatedEmbedder(args.call_cost, args.text_cost)
+    queries = [f"why is pod worker-{i % 97} not running after the update {i}" for i in range(args.queries)]
+    dispatcher = EmbeddingDispatcher(embedder, max_wait=args.max_wait, max_batch_size=args.max_batch_size)
+    embedder.embed_many(queries[:8])
+    for name, embed in (("direct", lambda text: embedder.embed_many([text])), ("dispatcher", dispatcher.embed)):
+        throughput, median, p99 = run(embed, queries, args.threads)
+        print(f"{name:>10}: {throughput:9.1f} queries/s  latency p50 {median:7.2f} ms  p99 {p99:7.2f} ms")
+    metrics = dispatcher.metrics()
+    dispatcher.close()
+    print(f"batch size mean {metrics['batch_size']['mean']:.1f} p99 {metrics['batch_size']['p99']}, "
+          f"queue wait p50 {metrics['queue_wait_ms']['p50']} ms p99 {metrics['queue_wait_ms']['p99']} ms")
+
+
+if __name__ == "__main__":
+    main()
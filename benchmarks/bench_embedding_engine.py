@@ -0,0 +1,58 @@
+"""
+Sentences/sec of the EmbeddingEngine: the default model, the CPU-optimized int8 model and optionally the ONNX backend,
+on utterances of mixed lengths. Also reports the model load time and the largest cosine distance between the
+optimized and the default embeddings.
+
+Needs sentence-transformers (and optimum[onnxruntime] for --onnx).
+
+Usage: python benchmarks/bench_embedding_engine.py --model sentence-transformers/all-mpnet-base-v2 --sentences 2000 [--onnx]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from anli.utils.embedding_engine import EmbeddingEngine
+
+WORDS = ("pod deployment node restart scale delete logs namespace service ingress replica cluster memory cpu "
+         "timeout error please can you the why is my not running after update").split()
+
+
+def make_sentences(count, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(int(rng.lognormvariate(2.3, 0.7)) + 1)) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="sentence-transformers/all-mpnet-base-v2")
+    parser.add_argument("--sentences", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--onnx", action="store_true")
+    args = parser.parse_args()
+
+    sentences = make_sentences(args.sentences)
+    settings = [("default", {"device": "cpu"}),
+                ("cpu int8", {"cpu_optimized": True, "num_threads": args.threads})]
+    if args.onnx:
+        settings.append(("cpu onnx", {"cpu_optimized": True, "backend": "onnx", "num_threads": args.threads}))
+    reference = None
+    for name, kwargs in settings:
+        engine = EmbeddingEngine(args.model, normalize=True, **kwargs)
+        start = time.perf_counter()
+        engine.client
+        load = time.perf_counter() - start
+        engine.encode(sentences[:32])
+        start = time.perf_counter()
+        vectors = engine.encode(sentences)
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference = vectors
+        distance = float(np.max(1 - np.sum(vectors * reference, axis=1)))
+        print(f"{name:>9}: load {load:6.2f} s {len(sentences) / seconds:9.1f} sentences/s "
+              f"max cosine distance to default {distance:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Prompt/response pair extraction over long conversations: the compiled extractor versus the previous implementation,
+which parsed the prompt path for every document and built, printed and parsed a JSONPath for every response.
+
+Usage: python benchmarks/bench_extract_pairs.py --turns 10000 --documents 3
+"""
+import argparse
+import time
+
+from jsonpath_ng import Child, Index
+from jsonpath_ng.ext import parse
+
+from anli.utils.json_paths import extract_prompt_response_pairs
+
+PROMPT_PATH = "$.conversation[?(@.role == 'user')].content"
+
+
+def legacy_extract_prompt_response_pairs(json_data, prompt_path, response_relative_position=None):
+    """The previous implementation, kept here as the baseline."""
+    pairs = []
+    for prompt in parse(prompt_path).find(json_data):
+        if response_relative_position is not None:
+            index = prompt.full_path.left.right
+            conversation_index = index.indices[0] if hasattr(index, "indices") else index.index
+            response_path = Child(prompt.full_path.left.left, Index(conversation_index + response_relative_position))
+            response_matches = parse(str(response_path)).find(json_data)
+            response_content = response_matches[0].value.get('content', '') if response_matches else ''
+        else:
+            response_content = ''
+        pairs.append((prompt.value, response_content, str(prompt.full_path)))
+    return pairs
+
+
+def make_conversation(turns):
+    return {"conversation": [{"role": "user" if turn % 2 == 0 else "assistant", "content": f"message {turn}"}
+                             for turn in range(turns)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=10000)
+    parser.add_argument("--documents", type=int, default=3)
+    args = parser.parse_args()
+    documents = [make_conversation(args.turns) for _ in range(args.documents)]
+    results = {}
+    for name, extract in (("compiled", extract_prompt_response_pairs), ("legacy", legacy_extract_prompt_response_pairs)):
+        start = time.perf_counter()
+        results[name] = [extract(document, PROMPT_PATH, 1) for document in documents]
+        seconds = time.perf_counter() - start
+        pairs = sum(len(pairs) for pairs in results[name])
+        print(f"{name:>9}: {seconds:8.3f} s {pairs / seconds:12.0f} pairs/s")
+    assert results["compiled"] == results["legacy"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Recall@k and latency of LocalVectorStoreForJSON searches, vector-only versus hybrid with a LexicalIndex, on
+identifier queries (a pod name or an error code) and on sentence queries.
+
+Prompts are embedded with the deterministic embeddings of the Fake LLM backend, with --embed-latency seconds added
+per embedding call to account for a real model; use --model to embed with a sentence-transformers model.
+The expected hit of a query is the prompt it was made from.
+
+Usage: python benchmarks/bench_hybrid_search.py --prompts 20000 --queries 200 --k 5 --embed-latency 0.005
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from anli.llms.fake import FakeLLM
+from anli.utils.embedding_engine import EmbeddingEngine
+from anli.utils.lexical_index import LexicalIndex
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+TEMPLATES = ["why is pod {pod} crashing with {code}", "restart {pod} after the {code} error",
+             "show the logs of {pod}, it returns {code}", "is {code} on {pod} caused by memory"]
+PARAPHRASES = ["pod {pod} keeps crashing, error {code}", "{code} again on {pod}, please have a look"]
+
+
+def make_prompts(count, rng):
+    prompts = []
+    for i in range(count):
+        pod, code = f"worker-{i}", f"E{1000 + i % 9000}"
+        prompts.append((rng.choice(TEMPLATES).format(pod=pod, code=code), pod, code))
+    return prompts
+
+
+def measure(store, queries, expected, k):
+    latencies, found = [], 0
+    for query, target in zip(queries, expected):
+        start = time.perf_counter()
+        hits = store.search_item(query, num_results=k)
+        latencies.append(time.perf_counter() - start)
+        found += any(hit["response"] == target for hit in hits)
+    return found / len(queries), statistics.median(latencies) * 1000, max(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--embed-latency", type=float, default=0.005)
+    parser.add_argument("--model", default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    prompts = make_prompts(args.prompts, rng)
+    if args.model:
+        embed = EmbeddingEngine(args.model).embed_many
+    else:
+        llm = FakeLLM(embedding_dims=256)
+
+        def embed(texts):
+            time.sleep(args.embed_latency)
+            return llm.embed(texts)
+
+    sample = rng.sample(range(args.prompts), args.queries)
+    query_sets = {
+        "pod name": [prompts[i][1] for i in sample],
+        "error code": [prompts[i][2] for i in sample],
+        "sentence": [rng.choice(PARAPHRASES).format(pod=prompts[i][1], code=prompts[i][2]) for i in sample],
+    }
+    expected = [f"answer {i}" for i in sample]
+    documents = [{"conversation": [{"role": "user", "content": prompt},
+                                   {"role": "assistant", "content": f"answer {i}"}]}
+                 for i, (prompt, _, _) in enumerate(prompts)]
+
+    print(f"{'queries':>10} {'search':>7} {'recall@k':>9} {'p50 ms':>8} {'max ms':>8}")
+    for name, lexical_index in (("vector", None), ("hybrid", LexicalIndex())):
+        with tempfile.TemporaryDirectory() as path:
+            store = LocalVectorStoreForJSON("bench", default_semantic_distance_threshold=2.0, path=path,
+                                            vectorizer=embed, lexical_index=lexical_index)
+            store.upsert_many(documents, "$.conversation[?(@.role == 'user')].content", response_relative_position=1)
+            for query_set, queries in query_sets.items():
+                recall, median, worst = measure(store, queries, expected, args.k)
+                print(f"{query_set:>10} {name:>7} {recall:>9.3f} {median:>8.2f} {worst:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
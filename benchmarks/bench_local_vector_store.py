@@ -0,0 +1,92 @@
+"""
+LocalVectorStoreForJSON at 10^4-10^6 vectors: bulk load, open and search latency, optionally compared with the Redis
+backend (needs a local Redis Stack and redisvl).
+
+Random unit vectors are loaded directly, so no embedding model is involved. Queries are perturbed stored vectors.
+
+Usage: python benchmarks/bench_local_vector_store.py --sizes 10000 100000 1000000 --dims 768 [--redis-url redis://localhost:6379]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+
+def records(count):
+    return [(f"prompt {i}", f"response {i}", {"name": "bench-doc", "path": f"$.conversation.[{i}].content"})
+            for i in range(count)]
+
+
+def query_latencies(search, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000, max(latencies) * 1000
+
+
+def bench_local(vectors, queries, args):
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStoreForJSON("bench", path=path)
+        start = time.perf_counter()
+        store._store_records(records(len(vectors)), vectors)
+        load = time.perf_counter() - start
+        start = time.perf_counter()
+        store = LocalVectorStoreForJSON("bench", path=path)
+        opened = time.perf_counter() - start
+        median, worst = query_latencies(lambda query: store._top_k(query[None], args.k), queries)
+        start = time.perf_counter()
+        store._top_k(queries, args.k)
+        batch = time.perf_counter() - start
+        print(f"{len(vectors):>9} {'local':>6} load {load:8.2f} s  open {opened * 1000:8.1f} ms  "
+              f"query p50 {median:8.2f} ms  max {worst:8.2f} ms  batch {len(queries) / batch:9.1f} q/s")
+
+
+def bench_redis(vectors, queries, args):
+    from redisvl.utils.vectorize import BaseVectorizer
+    from anli.utils.redis_vector_store import RedisVectorStoreForJSON
+
+    class NoVectorizer(BaseVectorizer):
+        pass
+
+    store = RedisVectorStoreForJSON("bench_local_vs_redis", redis_url=args.redis_url,
+                                    vectorizer=NoVectorizer(model="none", dims=vectors.shape[1], client=None))
+    try:
+        index = store.vector_index
+        start = time.perf_counter()
+        index.load(store._payloads(records(len(vectors)), vectors.tolist()), batch_size=1000)
+        load = time.perf_counter() - start
+        search = lambda query: index.search_many([store._range_query(query.tolist(), args.k, ["response"], 2.0)])
+        median, worst = query_latencies(search, queries)
+        print(f"{len(vectors):>9} {'redis':>6} load {load:8.2f} s  {'':>16}  "
+              f"query p50 {median:8.2f} ms  max {worst:8.2f} ms")
+    finally:
+        store.delete_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        vectors = rng.normal(size=(size, args.dims)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = vectors[rng.integers(0, size, args.queries)] + rng.normal(scale=0.05, size=(args.queries, args.dims))
+        queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+        bench_local(vectors, queries, args)
+        if args.redis_url:
+            bench_redis(vectors, queries, args)
+
+
+if __name__ == "__main__":
+    main()
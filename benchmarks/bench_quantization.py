@@ -0,0 +1,55 @@
+"""
+Recall@k, memory and query latency of LocalVectorStoreForJSON quantization settings: exact float32, float16, int8 and
+product quantization, each with exact re-ranking of the best candidates.
+
+The vectors are drawn around random cluster centers, like embeddings of related utterances. Recall@k is the share
+of the exact top k found by the quantized search.
+
+Usage: python benchmarks/bench_quantization.py --size 200000 --dims 768 --k 10 --rerank-factor 4
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dims", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(args.clusters, args.dims))
+    vectors = centers[rng.integers(0, args.clusters, args.size)] + rng.normal(scale=0.5, size=(args.size, args.dims))
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    queries = vectors[rng.integers(0, args.size, args.queries)] + rng.normal(scale=0.02, size=(args.queries, args.dims))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+    truth = [set(np.argsort(-(vectors @ query))[:args.k]) for query in queries]
+    records = [(f"prompt {i}", "", {"name": "bench-doc", "path": f"$.conversation.[{i}].content"})
+               for i in range(args.size)]
+
+    print(f"{'quantization':>12} {'recall@k':>9} {'vectors MB':>11} {'codes MB':>9} {'query ms':>9}")
+    for quantization in (None, "float16", "int8", "pq"):
+        with tempfile.TemporaryDirectory() as path:
+            store = LocalVectorStoreForJSON("bench", path=path, quantization=quantization,
+                                            rerank_factor=args.rerank_factor)
+            store._store_records(records, vectors)
+            start = time.perf_counter()
+            found = [set(store._top_k(query[None], args.k)[0][0]) for query in queries]
+            latency = (time.perf_counter() - start) / len(queries) * 1000
+            recall = np.mean([len(f & t) / args.k for f, t in zip(found, truth)])
+            memory = store.memory_usage()
+            print(f"{quantization or 'float32':>12} {recall:>9.3f} {memory['vectors'] / 1e6:>11.1f} "
+                  f"{memory['codes'] / 1e6:>9.1f} {latency:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Ingestion throughput of RedisVectorStoreForJSON: upsert_item per document versus upsert_many.
+
+Needs a local Redis Stack (RedisJSON and RediSearch) and redisvl. By default prompts are embedded with the
+deterministic embeddings of the Fake LLM backend so that only the Redis round-trips are measured; use
+--hf-vectorizer to include the default sentence-transformers model.
+
+Usage: python benchmarks/bench_redis_upsert.py --conversations 2000 --turns 6 --redis-url redis://localhost:6379
+"""
+import argparse
+import time
+
+from redisvl.utils.vectorize import BaseVectorizer
+
+from anli.llms.fake import FakeLLM
+from anli.utils.redis_vector_store import RedisVectorStoreForJSON
+
+
+class FakeVectorizer(BaseVectorizer):
+    def embed(self, text, preprocess=None, as_buffer=False, **kwargs):
+        return self.client.embed([text])[0]
+
+    def embed_many(self, texts, preprocess=None, batch_size=1000, as_buffer=False, **kwargs):
+        return self.client.embed(texts)
+
+
+def make_conversations(count, turns):
+    return [{"conversation": [{"role": "user" if turn % 2 == 0 else "assistant",
+                               "content": f"message {turn} of conversation {i} about pod worker-{i % 97}"}
+                              for turn in range(turns)]}
+            for i in range(count)]
+
+
+def measure(store, documents, bulk, args):
+    suffixes = [f"doc-{i}" for i in range(len(documents))]
+    start = time.perf_counter()
+    if bulk:
+        store.upsert_many(documents, "$.conversation[?(@.role == 'user')].content", response_relative_position=1,
+                          json_storage_id_suffixes=suffixes, batch_size=args.batch_size)
+    else:
+        for suffix, document in zip(suffixes, documents):
+            store.upsert_item(document, "$.conversation[?(@.role == 'user')].content", response_relative_position=1,
+                              json_storage_id_suffix=suffix)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--redis-url", default="redis://localhost:6379")
+    parser.add_argument("--hf-vectorizer", action="store_true")
+    args = parser.parse_args()
+
+    vectorizer = None if args.hf_vectorizer else FakeVectorizer(model="fake", dims=256,
+                                                                 client=FakeLLM(embedding_dims=256))
+    documents = make_conversations(args.conversations, args.turns)
+    prompts = args.conversations * ((args.turns + 1) // 2)
+    for name, bulk in (("upsert_item", False), ("upsert_many", True)):
+        store = RedisVectorStoreForJSON(f"bench_upsert_{name}", redis_url=args.redis_url, vectorizer=vectorizer)
+        try:
+            seconds = measure(store, documents, bulk, args)
+        finally:
+            store.client.delete(*[f"{store.index_name}-doc-{i}" for i in range(len(documents))],
+                                f"{store.index_name}-collections")
+            store.delete_index()
+        print(f"{name:>12}: {seconds:8.2f} s {args.conversations / seconds:10.1f} conversations/s "
+              f"{prompts / seconds:10.1f} prompts/s")
+
+
+if __name__ == "__main__":
+    main()
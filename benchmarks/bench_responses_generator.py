@@ -0,0 +1,73 @@
+"""
+Response latency of confirmations phrased by the LLM for every executed intent versus ResponsesGenerator: templates
+rendered in place, generative templates phrased by the LLM once per result shape.
+
+The LLM is the Fake LLM backend decoding at --token-rate tokens per second (a small model on CPU), no model is
+loaded.
+
+Usage: python benchmarks/bench_responses_generator.py --responses 200 --token-rate 20
+"""
+import argparse
+import random
+import time
+
+from anli.integration_layer import IntegrationLayer
+from anli.llms.fake import FakeLLM
+from anli.responses_generator import ResponsesGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--responses", type=int, default=200)
+    parser.add_argument("--token-rate", type=float, default=20)
+    args = parser.parse_args()
+
+    integration_layer = IntegrationLayer()
+
+    @integration_layer.register(intent="delete_pod", response_template="Deleted pod {name}.")
+    def delete_pod(name: str):
+        return None
+
+    @integration_layer.register(intent="scale", response_template="Scaled {name} to {replicas} replicas.")
+    def scale(name: str, replicas: int):
+        return None
+
+    @integration_layer.register(intent="list_pods", response_template="Pods in {namespace}: {result}",
+                                response_generative=True)
+    def list_pods(namespace: str):
+        return []
+
+    rng = random.Random(0)
+    requests = []
+    for i in range(args.responses):
+        intent = rng.choice(["delete_pod", "scale", "list_pods"])
+        if intent == "delete_pod":
+            requests.append(({"intent": intent, "parameters": {"name": f"worker-{i}"}}, None))
+        elif intent == "scale":
+            requests.append(({"intent": intent, "parameters": {"name": f"web-{i}", "replicas": rng.randint(2, 9)}},
+                             None))
+        else:
+            pods = [f"pod-{j}" for j in range(rng.choice([0, 1, 3]))]
+            requests.append(({"intent": intent, "parameters": {"namespace": f"team-{i % 7}"}}, pods))
+
+    llm = FakeLLM(default_response="Done, the pods of {namespace} are {result}.", token_latency=1 / args.token_rate)
+    started = time.perf_counter()
+    for context, result in requests:
+        llm.generate(f"Tell the user the outcome of {context} with result {result!r}.", max_tokens=32)
+    naive = (time.perf_counter() - started) / len(requests)
+
+    llm.calls = 0
+    generator = ResponsesGenerator(integration_layer, llm=llm)
+    latencies = []
+    for context, result in requests:
+        started = time.perf_counter()
+        generator.generate(context, result)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    print(f"LLM phrasing       {naive * 1000:9.1f} ms per response, {len(requests)} LLM calls")
+    print(f"ResponsesGenerator {sum(latencies) / len(latencies) * 1000:9.3f} ms per response, "
+          f"median {latencies[len(latencies) // 2] * 1e6:.1f} us, {llm.calls} LLM calls; {generator.stats()}")
+
+
+if __name__ == "__main__":
+    main()
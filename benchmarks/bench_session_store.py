@@ -0,0 +1,76 @@
+"""
+Messages per second of many concurrent sessions in a SessionStore with one shard (a global lock) versus sharded
+locks, with the resident sessions bounded by --max-mb and written behind to a sqlite file.
+
+Each message adds a user turn and builds a prompt, the work a front-end thread does per message besides the LLM.
+--io-latency simulates the wait of a session on I/O while it is held (e.g. the NLU or an action), --load-latency a
+round trip to a remote backend when an evicted session is rehydrated, both in milliseconds.
+
+Usage: python benchmarks/bench_session_store.py --sessions 5000 --threads 32 --messages 20000 --max-mb 16 \
+       --io-latency 1 --load-latency 0.5
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from anli.dialog_manager import DialogManager
+from anli.session_store import SessionStore, SqliteSessionBackend
+
+
+class RemoteBackend(SqliteSessionBackend):
+    def __init__(self, path, load_latency):
+        super().__init__(path)
+        self.load_latency = load_latency
+
+    def load(self, session_id):
+        time.sleep(self.load_latency / 1000)
+        return super().load(session_id)
+
+
+def run(store, sessions, threads, messages, io_latency):
+    def worker(seed):
+        rng = random.Random(seed)
+        for i in range(messages // threads):
+            with store.session(f"session-{rng.randrange(sessions)}") as dialog:
+                dialog.add_turn("user", f"restart the pod worker-{i} in namespace team-{seed}")
+                dialog.build_prompt()
+                if io_latency:
+                    time.sleep(io_latency / 1000)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    store.close()
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--max-mb", type=float, default=16)
+    parser.add_argument("--io-latency", type=float, default=1.0)
+    parser.add_argument("--load-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        for shards in (1, 64):
+            backend = RemoteBackend(os.path.join(path, f"sessions-{shards}.sqlite"), args.load_latency)
+            store = SessionStore(factory=lambda: DialogManager(window=16), backend=backend, shards=shards,
+                                 max_bytes=args.max_mb * 2 ** 20, flush_interval=0.5)
+            rate = run(store, args.sessions, args.threads, args.messages, args.io_latency)
+            resident = sum(shard.size for shard in store.shards) / 2 ** 20
+            print(f"shards={shards:<3} {rate:9.0f} messages/s, {len(store)} resident sessions, "
+                  f"~{resident:.1f} MB resident")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Cold start of a LocalVectorStoreForJSON from a snapshot versus re-embedding: time to export the store, to import the
+snapshot (with and without checksum verification) into an empty store, and the estimated time to embed the prompts
+again at --embed-rate prompts per second (a sentence-transformers model on CPU).
+
+The store is filled with random unit vectors, no model is loaded.
+
+Usage: python benchmarks/bench_snapshot.py --prompts 200000 --dims 384 --embed-rate 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=200000)
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--embed-rate", type=float, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    def unavailable(texts):
+        raise RuntimeError("The benchmark does not embed.")
+
+    with tempfile.TemporaryDirectory() as path:
+        source = LocalVectorStoreForJSON("source", path=path, vectorizer=unavailable)
+        for start in range(0, args.prompts, 50000):
+            count = min(50000, args.prompts - start)
+            records = [(f"prompt {i}", f"response {i}", {"name": f"source-{i // 10}", "path": f"$.c.[{i % 10}]"})
+                       for i in range(start, start + count)]
+            source._store_records(records, rng.standard_normal((count, args.dims), dtype=np.float32))
+
+        snapshot = os.path.join(path, "snapshot")
+        started = time.perf_counter()
+        source.export_snapshot(snapshot)
+        print(f"export            {time.perf_counter() - started:8.2f} s")
+        for verify in (True, False):
+            target = LocalVectorStoreForJSON(f"target-{verify}", path=path, vectorizer=unavailable)
+            started = time.perf_counter()
+            target.import_snapshot(snapshot, verify=verify)
+            print(f"import verify={verify!s:<5} {time.perf_counter() - started:8.2f} s")
+        print(f"re-embed estimate {args.prompts / args.embed_rate:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
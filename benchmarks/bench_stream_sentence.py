@@ -0,0 +1,93 @@
+"""
+StreamSentence throughput over long streamed LLM outputs, compared with the previous implementation that
+rescanned the whole buffer for every punctuation mark on every chunk.
+
+The stream is made of 1-4 character chunks like LLM tokens. "plain" text only has ordinary sentences. "tricky" text
+opens with a phrase too short to be sent ("Sure,") and contains decimals and abbreviations: the previous
+implementation got stuck on them and kept the whole output in its buffer, which is where it became quadratic.
+
+Usage: python benchmarks/bench_stream_sentence.py --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+
+from anli.utils.stream_sentence import StreamSentence
+
+PLAIN_SENTENCES = ["The pod temp-worker was deleted from the default namespace.",
+                   "Three replicas are running on node-a and node-b, all healthy.",
+                   "Is there anything else you would like me to do?",
+                   "The logs were reviewed; nothing unusual was found!"]
+TRICKY_SENTENCES = ["Version 1.2.3 is running on 3 nodes, e.g. node-a and node-b.",
+                    "Dr. Smith reviewed the logs at 10:45; nothing unusual was found!"]
+
+
+class LegacyStreamSentence:
+    """The previous implementation, kept here as the baseline."""
+    def __init__(self, send_function):
+        self.buffer = ""
+        self.send = send_function
+
+    def process_chunk(self, chunk):
+        self.buffer += chunk
+        punctuation_marks = '.!?,;:'
+        while any(mark in self.buffer for mark in punctuation_marks):
+            split_points = [self.buffer.find(mark) for mark in punctuation_marks if mark in self.buffer]
+            split_point = min(split_points)
+            sentence = self.buffer[:split_point + 1].strip()
+            if ' ' in sentence:
+                self.send(sentence)
+                self.buffer = self.buffer[split_point + 1:].strip()
+            else:
+                break
+
+    def end_stream(self):
+        if self.buffer.strip():
+            self.send(self.buffer.strip())
+
+
+def make_chunks(size, tricky, rng):
+    text = "Sure, " if tricky else ""
+    sentences = PLAIN_SENTENCES + TRICKY_SENTENCES if tricky else PLAIN_SENTENCES
+    while len(text) < size:
+        text += rng.choice(sentences) + " "
+    chunks = []
+    position = 0
+    while position < len(text):
+        step = rng.randint(1, 4)
+        chunks.append(text[position:position + step])
+        position += step
+    return chunks
+
+
+def measure(cls, chunks):
+    sent = []
+    processor = cls(sent.append)
+    start = time.perf_counter()
+    for chunk in chunks:
+        processor.process_chunk(chunk)
+    processor.end_stream()
+    return time.perf_counter() - start, len(sent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--legacy-limit", type=int, default=100000,
+                        help="Skip the previous implementation above this size for the tricky text.")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    print(f"{'chars':>9} {'text':>7} {'implementation':>15} {'seconds':>9} {'MB/s':>8} {'sent':>7}")
+    for size in args.sizes:
+        for tricky in (False, True):
+            chunks = make_chunks(size, tricky, rng)
+            for name, cls in (("StreamSentence", StreamSentence), ("legacy", LegacyStreamSentence)):
+                if cls is LegacyStreamSentence and tricky and size > args.legacy_limit:
+                    continue
+                seconds, sent = measure(cls, chunks)
+                print(f"{size:>9} {'tricky' if tricky else 'plain':>7} {name:>15} {seconds:>9.4f} "
+                      f"{size / seconds / 1e6:>8.2f} {sent:>7}")
+
+
+if __name__ == "__main__":
+    main()
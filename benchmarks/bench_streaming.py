@@ -0,0 +1,50 @@
+"""
+End-to-end streaming benchmark on the offline Fake backend: LLMInterface.stream -> StreamSentence.
+
+Reports time to first token, time to first sentence and total time for a configurable latency model.
+
+Usage: python benchmarks/bench_streaming.py --token-latency 0.02 --prefill-latency 0.001 --runs 5
+"""
+import argparse
+import statistics
+import time
+
+from anli.config import LLMInterface
+from anli.utils.stream_sentence import StreamSentence
+
+RESPONSE = ("Sure, I can help with that. The pod temp-worker was deleted from the default namespace, "
+            "and no other resources were affected. Is there anything else you would like me to do?")
+
+
+def run_once(llm, prompt):
+    start = time.perf_counter()
+    first_sentence = []
+
+    def send(text):
+        if not first_sentence:
+            first_sentence.append(time.perf_counter() - start)
+
+    tokens = llm.stream(prompt)
+    StreamSentence(send).consume(tokens)
+    return tokens.time_to_first_token, first_sentence[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    parser.add_argument("--prefill-latency", type=float, default=0.001)
+    parser.add_argument("--prompt-tokens", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    llm = LLMInterface(config={"llm": {"type": "Fake", "default_response": RESPONSE,
+                                       "token_latency": args.token_latency,
+                                       "prefill_latency": args.prefill_latency}})
+    prompt = " ".join(["word"] * args.prompt_tokens)
+    results = [run_once(llm, prompt) for _ in range(args.runs)]
+    for name, values in zip(("time to first token", "time to first sentence", "total"), zip(*results)):
+        print(f"{name:>24}: median {statistics.median(values) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -120,6 +120,11 @@ setup(
         # 'Programming Language :: Python :: 3.8',
         # 'Operating System :: OS Independent',
     ],
+    entry_points={
+        'console_scripts': [
+            'anli-daemon=anli.llms.daemon:main',
+        ],
+    },
     python_requires='>=3.6',
     # Include any package data here
     package_data={'anli': ['data/*']},
@@ -0,0 +1,331 @@
+"""
+In-memory stand-ins for a Redis Stack client and the redisvl vector index, to test the Redis store without a server.
+
+FakeRedis implements the hash, set and RedisJSON commands the store sends, on plain connections and pipelines, and
+returns hash values as bytes like redis-py. FakeVectorIndex has the methods of RedisVectorIndex, its records are
+hashes of the FakeRedis and its range queries are brute-force cosine searches honoring VectorFilter pre-filters on
+the indexed hash fields, so records missing a field do not match, as in RediSearch. FakeAsyncRedis is the
+redis.asyncio client of the same data, for the async store.
+"""
+import copy
+import fnmatch
+import hashlib
+import json
+import re
+
+import numpy as np
+
+from anli.utils.async_redis_vector_store import AsyncRedisVectorStoreForJSON
+from anli.utils.redis_vector_store import RedisVectorStoreForJSON
+from anli.utils.vector_filters import PATH_PREFIX_SEPARATOR
+
+_PATH = re.compile(r"^\$((?:\.\w+|\[\d+\])*)(\[(\d*):(\d*)\])?$")
+
+
+def _steps(path):
+    match = _PATH.match(path)
+    if match is None:
+        raise ValueError(f"Unsupported path {path}")
+    steps = [int(step[1:-1]) if step.startswith("[") else step[1:]
+             for step in re.findall(r"\.\w+|\[\d+\]", match.group(1))]
+    if match.group(2) is None:
+        return steps, None
+    return steps, slice(int(match.group(3) or 0), int(match.group(4)) if match.group(4) else None)
+
+
+def _encode(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.indexes = {}
+        self.commands = 0
+
+    # Hashes
+    def hset(self, key, field=None, value=None, mapping=None):
+        fields = {field: value} if field is not None else {}
+        fields.update(mapping or {})
+        stored = self.data.setdefault(key, {})
+        added = sum(_decode(name) not in stored for name in fields)
+        stored.update((_decode(name), _encode(value)) for name, value in fields.items())
+        return added
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        stored = self.data.get(key, {})
+        return [stored.get(field) for field in fields]
+
+    def hgetall(self, key):
+        return {name.encode(): value for name, value in self.data.get(key, {}).items()}
+
+    # Sets
+    def sadd(self, key, *members):
+        stored = self.data.setdefault(key, set())
+        added = sum(_encode(member) not in stored for member in members)
+        stored.update(_encode(member) for member in members)
+        return added
+
+    def scard(self, key):
+        return len(self.data.get(key, ()))
+
+    def smembers(self, key):
+        return set(self.data.get(key, ()))
+
+    # Keys
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def scan_iter(self, match="*", count=None):
+        return iter([key for key in list(self.data) if fnmatch.fnmatchcase(key, match)])
+
+    def json(self):
+        return FakeJSON(self)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakeJSON:
+    def __init__(self, client):
+        self.client = client
+
+    def _locate(self, key, path):
+        steps, selection = _steps(path)
+        node = self.client.data[key]
+        for step in steps[:-1]:
+            node = node[step]
+        return node, steps, selection
+
+    def set(self, key, path, obj):
+        obj = copy.deepcopy(obj)
+        if path == "$":
+            self.client.data[key] = obj
+            return True
+        node, steps, _ = self._locate(key, path)
+        node[steps[-1]] = obj
+        return True
+
+    def get(self, key, *paths):
+        if key not in self.client.data:
+            return None
+        if not paths:
+            return copy.deepcopy(self.client.data[key])
+        node, steps, selection = self._locate(key, paths[0])
+        node = node[steps[-1]] if steps else node
+        return copy.deepcopy(node[selection] if selection is not None else [node])
+
+    def arrappend(self, key, path, *objs):
+        node, steps, _ = self._locate(key, path)
+        node[steps[-1]].extend(copy.deepcopy(objs))
+        return [len(node[steps[-1]])]
+
+    def arrpop(self, key, path, index=-1):
+        node, steps, _ = self._locate(key, path)
+        return [node[steps[-1]].pop(index)]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.client, self)
+
+
+class FakePipeline:
+    """Queues the commands and runs them on execute(), JSON commands first if it is a JSON pipeline."""
+    def __init__(self, client, json_commands=None):
+        self.targets = [target for target in (json_commands, client) if target is not None]
+        self.client = client
+        self.queued = []
+
+    def __getattr__(self, name):
+        for target in self.targets:
+            if hasattr(target, name):
+                return lambda *args, **kwargs: self.queued.append((getattr(target, name), args, kwargs)) or self
+        raise AttributeError(name)
+
+    def execute(self):
+        self.client.commands += 1
+        results = [command(*args, **kwargs) for command, args, kwargs in self.queued]
+        self.queued.clear()
+        return results
+
+
+class FakeAsyncRedis:
+    """The redis.asyncio client of a FakeRedis: its commands are coroutines, its pipelines are executed with await."""
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        async def run(*args, **kwargs):
+            return command(*args, **kwargs)
+        return run
+
+    async def sscan_iter(self, key, match=None, count=None):
+        for member in self.client.smembers(key):
+            yield member
+
+    def json(self):
+        return FakeAsyncRedis(FakeJSON(self.client))
+
+    def pipeline(self, transaction=True):
+        return FakeAsyncPipeline(self.client)
+
+
+class FakeAsyncPipeline(FakePipeline):
+    """A redis.asyncio pipeline, `json()` queues RedisJSON commands on the same pipeline."""
+    def json(self):
+        commands = FakePipeline(self.client, FakeJSON(self.client))
+        commands.queued = self.queued
+        return commands
+
+    async def execute(self):
+        return super().execute()
+
+
+class FakeVectorizer:
+    """A vectorizer embedding with the bag-of-words vectors of a FakeLLM."""
+    def __init__(self, llm, model="fake"):
+        self.llm = llm
+        self.model = model
+        self.calls = 0
+
+    def embed_many(self, texts, batch_size=1000, **kwargs):
+        self.calls += 1
+        return self.llm.embed(texts)
+
+
+class FakeRangeQuery:
+    def __init__(self, vector, num_results, return_fields, distance_threshold, filter):
+        self.vector = np.asarray(vector, dtype=np.float32)
+        self.num_results = num_results
+        self.return_fields = return_fields
+        self.distance_threshold = distance_threshold
+        self.filter = filter
+
+
+class FakeVectorIndex:
+    """The methods of RedisVectorIndex, on the hashes of a FakeRedis."""
+    BASE_FIELDS = ("prompt", "response", "prompt_vector")
+
+    def __init__(self, index_name, client, vectorizer, distance_threshold):
+        self.index_name = index_name
+        self.client = client
+        self.vectorizer = vectorizer
+        self.distance_threshold = distance_threshold
+        self.name = f"{index_name}_vector_index"
+        self.prefix = f"{index_name}_vector_index:item"
+        self.id_field, self.prompt_field, self.response_field = "id", "prompt", "response"
+        self.metadata_field, self.vector_field = "metadata", "prompt_vector"
+        self.ttl = None
+        self.client.indexes.setdefault(self.name, set(self.BASE_FIELDS))
+
+    @property
+    def model(self):
+        return self.vectorizer.model
+
+    def embed_many(self, texts, batch_size=256):
+        return self.vectorizer.embed_many(texts, batch_size=batch_size)
+
+    def key(self, prompt):
+        return f"{self.prefix}:{hashlib.sha256(prompt.encode()).hexdigest()}"
+
+    @property
+    def key_pattern(self):
+        return f"{self.prefix}:*"
+
+    def serialize(self, metadata):
+        return json.dumps(metadata)
+
+    def deserialize(self, value):
+        return json.loads(value)
+
+    def payload(self, prompt, response, metadata, vector, fields):
+        return {self.id_field: hashlib.sha256(prompt.encode()).hexdigest(), self.prompt_field: prompt,
+                self.response_field: response, self.vector_field: np.asarray(vector, dtype=np.float32).tobytes(),
+                self.metadata_field: self.serialize(metadata), **fields}
+
+    def load(self, payloads, batch_size=500):
+        pipe = self.client.pipeline(transaction=False)
+        for payload in payloads:
+            pipe.hset(f"{self.prefix}:{payload[self.id_field]}", mapping=payload)
+        pipe.execute()
+
+    def add_fields(self, fields):
+        existing = self.client.indexes[self.name]
+        if all(field["name"] in existing for field in fields):
+            return False
+        existing.update(field["name"] for field in fields)
+        return True
+
+    def range_query(self, vector, num_results, return_fields, distance_threshold, filter=None):
+        return FakeRangeQuery(vector, num_results, return_fields, distance_threshold, filter)
+
+    def _matches(self, record, filter):
+        if filter is None:
+            return True
+        values = {name: _decode(value) for name, value in record.items() if name != self.vector_field}
+        if filter.documents is not None and \
+                values.get("name") not in [f"{self.index_name}-{document}" for document in filter.documents]:
+            return False
+        if filter.path_prefix is not None and \
+                filter.path_prefix not in values.get("path_prefixes", "").split(PATH_PREFIX_SEPARATOR):
+            return False
+        for field, accepted in filter.tags.items():
+            if field not in values or values[field] not in [str(value) for value in accepted]:
+                return False
+        for field, (minimum, maximum) in filter.ranges.items():
+            if field not in values or (minimum is not None and float(values[field]) < minimum) or \
+                    (maximum is not None and float(values[field]) > maximum):
+                return False
+        return True
+
+    def search_many(self, range_queries):
+        self.client.commands += 1
+        keys = [key for key in self.client.data if key.startswith(self.prefix + ":")]
+        results = []
+        for query in range_queries:
+            hits = []
+            for key in keys:
+                record = self.client.data[key]
+                if not self._matches(record, query.filter):
+                    continue
+                vector = np.frombuffer(record[self.vector_field], dtype=np.float32)
+                distance = 1 - float(np.dot(vector, query.vector) /
+                                     ((np.linalg.norm(vector) * np.linalg.norm(query.vector)) or 1.0))
+                if distance <= query.distance_threshold:
+                    hit = {field: _decode(record[field]) for field in query.return_fields if field in record}
+                    hits.append({"id": key, **hit, "vector_distance": f"{max(distance, 0.0):.6f}"})
+            hits.sort(key=lambda hit: float(hit["vector_distance"]))
+            results.append(hits[:query.num_results])
+        return results
+
+    async def asearch_many(self, client, range_queries):
+        return self.search_many(range_queries)
+
+    def set_threshold(self, threshold):
+        self.distance_threshold = threshold
+
+    def clear(self):
+        self.client.delete(*[key for key in self.client.data if key.startswith(self.prefix + ":")])
+
+    def delete(self):
+        self.clear()
+        self.client.indexes.pop(self.name, None)
+
+
+class FakeRedisVectorStore(RedisVectorStoreForJSON):
+    vector_index_class = FakeVectorIndex
+
+
+class FakeAsyncRedisVectorStore(AsyncRedisVectorStoreForJSON):
+    store_class = FakeRedisVectorStore
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from anli.llms.fake import FakeLLM
+from anli.utils.lexical_index import LexicalIndex
+from anli.utils.vector_filters import VectorFilter
+from fake_redis import FakeAsyncRedis, FakeAsyncRedisVectorStore, FakeRedis, FakeVectorizer
+
+PROMPT_PATH = "$.conversation[?(@.role == 'user')].content"
+
+
+def conversation(*turns):
+    return {"conversation": [{"role": "user" if i % 2 == 0 else "assistant", "content": turn}
+                             for i, turn in enumerate(turns)]}
+
+
+def make_store(**kwargs):
+    client = FakeRedis()
+    return FakeAsyncRedisVectorStore("chat", default_semantic_distance_threshold=0.5, redis_client=client,
+                                     async_redis_client=FakeAsyncRedis(client),
+                                     vectorizer=FakeVectorizer(FakeLLM(embedding_dims=64)),
+                                     filter_fields={"tenant": "tag"}, **kwargs)
+
+
+def test_upsert_many_in_batches():
+    store = make_store()
+
+    async def run():
+        documents = [conversation(f"restart the pod worker-{i}", f"Restarted worker-{i}.", f"scale web to {i}",
+                                  "Done.") for i in range(5)]
+        message = await store.upsert_many(documents, PROMPT_PATH, response_relative_position=1,
+                                          json_storage_id_suffixes=[f"c{i}" for i in range(5)], batch_size=2,
+                                          metadatas=[{"tenant": "acme" if i % 2 else "beta"} for i in range(5)])
+        assert message == "Upsert 5 objects to JSON_store and 10 prompts to vector_index."
+        assert await store.length() == 5 and await store["c3"] == documents[3]
+        assert sorted([key async for key in store]) == [f"c{i}".encode() for i in range(5)]
+
+    asyncio.run(run())
+    client = store.store.client
+    # One embedding call and a few pipelines per batch of documents, as in the synchronous store
+    assert store.store.vectorizer.calls == 3 and client.commands == 9
+    assert client.hgetall("chat-watermarks-c3") == {PROMPT_PATH.encode(): b"4"}
+    record = client.data[store.vector_index.key("restart the pod worker-3")]
+    assert record["name"] == b"chat-c3" and record["path"] == b"$.conversation.[0].content"
+    assert record["tenant"] == b"acme" and record["response"] == b"Restarted worker-3."
+
+
+def test_search_many_keeps_query_order_and_filters():
+    store = make_store()
+
+    async def run():
+        await store.upsert_many([conversation("restart the pod worker", "Restarted.", "list the nodes", "3 nodes."),
+                                 conversation("delete the pod worker", "Deleted.")], PROMPT_PATH, 1, ["a", "b"],
+                                metadatas=[{"tenant": "acme"}, {"tenant": "beta"}])
+        results = await store.search_many(["list the nodes", "delete the pod worker", "unrelated words only"],
+                                          num_results=2, batch_size=2)
+        assert [[hit["response"] for hit in hits] for hits in results] == \
+            [["3 nodes."], ["Deleted.", "Restarted."], []]
+        assert results[1][0]["name"] == "chat-b"
+        assert float(results[1][0]["vector_distance"]) == pytest.approx(0, abs=1e-6)
+
+        filtered = await store.search_item("delete the pod worker", num_results=2,
+                                           filter=VectorFilter(tags={"tenant": "acme"}))
+        assert [hit["response"] for hit in filtered] == ["Restarted."]
+        assert await store.search_item("delete the pod worker", num_results=2,
+                                       filter=VectorFilter(documents="a", path_prefix="$.conversation.[2]")) == []
+
+    asyncio.run(run())
+
+
+def test_hybrid_search_answers_exact_terms_without_embedding():
+    store = make_store(lexical_index=LexicalIndex())
+
+    async def run():
+        await store.upsert_many([conversation(f"why is pod worker-{i} crashing", f"worker-{i} is out of memory")
+                                 for i in range(20)], PROMPT_PATH, 1, [f"c{i}" for i in range(20)])
+        calls = store.store.vectorizer.calls
+        hits = await store.search_item("worker-7", num_results=3)
+        assert [hit["response"] for hit in hits] == ["worker-7 is out of memory"]
+        assert store.store.vectorizer.calls == calls
+
+        hits, = await store.search_many(["why is pod worker-7 crashing"], num_results=3)
+        assert hits[0]["response"] == "worker-7 is out of memory"
+        assert store.store.vectorizer.calls == calls + 1
+
+    asyncio.run(run())
+
+
+def test_get_context_windows():
+    store = make_store()
+
+    async def run():
+        await store.upsert_item(conversation("restart the api", "Done.", "list the pods", "3 pods.", "scale web",
+                                             "OK."), PROMPT_PATH, 1, "c")
+        hits = await store.search_many(["list the pods", "scale web"], num_results=1,
+                                       semantic_distance_threshold=0.01)
+        windows = await store.get_context_windows([hits[0][0], hits[1][0]], -1, 2)
+        assert [[turn["content"] for turn in window] for window in windows] == [
+            ["Done.", "list the pods", "3 pods."], ["3 pods.", "scale web", "OK."]]
+
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+from anli.llms.fake import FakeLLM
+from anli.utils.chroma_vector_store import ChromaVectorStoreForJSON
+from fake_redis import FakeRedis
+
+PROMPT_PATH = "$.conversation[?(@.role == 'user')].content"
+
+
+class StubCollection:
+    """The Chroma collection calls of `upsert_many`, on a dict of id -> (prompt, metadata)."""
+    def __init__(self):
+        self.records = {}
+        self.upserts = []
+
+    def get(self, where, include):
+        names = where["name"]["$in"]
+        ids = [record_id for record_id, (_, metadata) in self.records.items() if metadata["name"] in names]
+        return {"ids": ids, "metadatas": [self.records[record_id][1] for record_id in ids]}
+
+    def delete(self, ids):
+        for record_id in ids:
+            self.records.pop(record_id)
+
+    def upsert(self, ids, metadatas, documents, embeddings):
+        assert len(set(ids)) == len(ids) == len(embeddings)
+        self.upserts.append(len(ids))
+        self.records.update(zip(ids, zip(documents, metadatas)))
+
+
+class Stub:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+def make_store(max_batch_size):
+    # chromadb is optional, the store is assembled around a stub collection
+    store = ChromaVectorStoreForJSON.__new__(ChromaVectorStoreForJSON)
+    llm = FakeLLM(embedding_dims=16)
+    store.client = FakeRedis()
+    store.chroma_client = Stub(max_batch_size=max_batch_size)
+    store.collection = Stub(_collection=StubCollection())
+    store.embedding_function = Stub(embed_documents=llm.embed)
+    store.embedding_model_name = "fake"
+    store.embedding_cache = None
+    store.index_name = "chat"
+    return store
+
+
+def conversation(*turns):
+    return {"conversation": [{"role": "user" if i % 2 == 0 else "assistant", "content": turn}
+                             for i, turn in enumerate(turns)]}
+
+
+def test_utterances_are_upserted_in_place_and_pruned():
+    store = make_store(max_batch_size=2)
+    collection = store.collection._collection
+    store.upsert_many([conversation("restart the api", "Done.", "list the pods", "3 pods.", "scale web", "OK."),
+                       conversation("restart the api", "Again.")], PROMPT_PATH, 1, ["a", "b"])
+    assert sorted(collection.records) == ["a:$.conversation.[0].content", "a:$.conversation.[2].content",
+                                          "a:$.conversation.[4].content", "b:$.conversation.[0].content"]
+    # The repeated prompt is stored once per utterance, in upserts of at most max_batch_size
+    assert collection.upserts == [2, 2]
+    _, metadata = collection.records["a:$.conversation.[2].content"]
+    assert metadata["response"] == "3 pods." and metadata["name"] == "chat-a"
+    assert metadata["path:$.conversation.[2]"] is True
+
+    store.upsert_item(conversation("restart the api", "Done."), PROMPT_PATH, 1, "a")
+    assert sorted(collection.records) == ["a:$.conversation.[0].content", "b:$.conversation.[0].content"]
+
+
+def test_pruning_matches_whole_path_segments():
+    store = make_store(max_batch_size=100)
+    collection = store.collection._collection
+    store.upsert_item({"a": conversation("restart the api", "Done."), "ab": conversation("list the pods", "3.")},
+                      ["$.a.conversation[?(@.role == 'user')].content",
+                       "$.ab.conversation[?(@.role == 'user')].content"], 1, "doc")
+    store.upsert_item(conversation("stop the api", "Stopped."), PROMPT_PATH, 1, "doc", json_storage_path="$.a")
+    assert sorted(collection.records) == ["doc:$.a.conversation.[0].content", "doc:$.ab.conversation.[0].content"]
+    assert collection.records["doc:$.a.conversation.[0].content"][0] == "stop the api"
+    assert store.client.json().get("chat-doc")["ab"] == conversation("list the pods", "3.")
+
+
+def utterances(collection):
+    return {record_id: (prompt, metadata["response"]) for record_id, (prompt, metadata) in collection.records.items()}
+
+
+def test_append_item_indexes_only_new_prompts():
+    store = make_store(max_batch_size=100)
+    collection = store.collection._collection
+    store.upsert_item(conversation("restart the api", "Done.", "list the pods", "3 pods."), PROMPT_PATH, 1, "c")
+    assert store.client.hgetall("chat-watermarks-c") == {PROMPT_PATH.encode(): b"4"}
+    assert store.append_item([{"role": "user", "content": "scale web"}], "c", PROMPT_PATH, 1) == \
+        "Append 1 items to JSON_store and 1 prompts to vector_index."
+    assert collection.upserts[-1] == 1
+
+    # The prompt is indexed again with its response once it is appended
+    store.append_item([{"role": "assistant", "content": "Scaled."}], "c", PROMPT_PATH, 1)
+    assert collection.upserts[-1] == 1
+    assert utterances(collection) == {"c:$.conversation.[0].content": ("restart the api", "Done."),
+                                      "c:$.conversation.[2].content": ("list the pods", "3 pods."),
+                                      "c:$.conversation.[4].content": ("scale web", "Scaled.")}
+    assert len(store["c"]["conversation"]) == 6
+
+
+def test_update_utterance_reindexes_affected_prompts():
+    store = make_store(max_batch_size=100)
+    collection = store.collection._collection
+    store.upsert_item(conversation("restart the api", "Done.", "list the pods", "3 pods.", "scale web", "OK."),
+                      PROMPT_PATH, 1, "c")
+    store.update_utterance("c", 3, {"role": "assistant", "content": "2 pods."}, PROMPT_PATH, 1)
+    assert utterances(collection)["c:$.conversation.[2].content"] == ("list the pods", "2 pods.")
+    # An utterance replaced by a response is no longer a prompt
+    store.update_utterance("c", 2, {"role": "assistant", "content": "Listing."}, PROMPT_PATH, 1)
+    assert "c:$.conversation.[2].content" not in collection.records
+
+    # Deleting an utterance shifts the following prompts
+    store.update_utterance("c", 0, None, PROMPT_PATH, 1)
+    assert utterances(collection) == {"c:$.conversation.[3].content": ("scale web", "OK.")}
+    assert store.client.hgetall("chat-watermarks-c") == {PROMPT_PATH.encode(): b"5"}
@@ -0,0 +1,30 @@
+import pytest
+from anli.utils.context_window import hit_location, plan_context_windows, split_array_path
+
+
+def test_split_array_path():
+    assert split_array_path("$.conversation.[2].content") == ("$.conversation", 2)
+    assert split_array_path("conversation.[12]") == ("$.conversation", 12)
+    assert split_array_path("$.a.[1].b.[3].content") == ("$.a.[1].b", 3)
+    with pytest.raises(ValueError):
+        split_array_path("$.title")
+
+
+def test_overlapping_windows_are_merged_per_conversation():
+    hits = [("doc-1", "$.conversation.[10].content"), ("doc-2", "$.conversation.[10].content"),
+            ("doc-1", "$.conversation.[1].content"), ("doc-1", "$.conversation.[12].content"),
+            ("doc-1", "$.conversation.[30].content")]
+    slices, windows = plan_context_windows(hits, -2, 3)
+    assert slices == [("doc-1", "$.conversation", 0, 4), ("doc-1", "$.conversation", 8, 15),
+                      ("doc-1", "$.conversation", 28, 33), ("doc-2", "$.conversation", 8, 13)]
+    assert windows == [(1, 0, 5), (3, 0, 5), (0, 0, 4), (1, 2, 5), (2, 0, 5)]
+
+
+def test_empty_windows():
+    slices, windows = plan_context_windows([("doc", "$.c.[0]")], -3, -1)
+    assert slices == [] and windows == [None]
+
+
+def test_hit_location():
+    assert hit_location({"name": "doc", "path": "$.c.[1]"}) == ("doc", "$.c.[1]")
+    assert hit_location({"metadata": {"name": "doc", "path": "$.c.[1]"}}) == ("doc", "$.c.[1]")
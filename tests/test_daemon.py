@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+
+import pytest
+from anli.config import LLMInterface
+from anli.llms.daemon import InferenceDaemon, DaemonClient, DaemonError
+
+
+class EchoModel:
+    """A stand-in for CombinedLlamaCpp that echoes the prompt word by word."""
+    def __init__(self, token_delay=0.0):
+        self.token_delay = token_delay
+        self.closed_streams = 0
+
+    def generate(self, prompt, **kwargs):
+        return prompt.upper()
+
+    def stream(self, prompt, **kwargs):
+        try:
+            for word in prompt.split(" "):
+                time.sleep(self.token_delay)
+                yield word + " "
+        finally:
+            self.closed_streams += 1
+
+    def embed(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def select(self, prompt, options, **kwargs):
+        if not options:
+            raise ValueError("no options")
+        return max(options, key=lambda option: option in prompt)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = InferenceDaemon(EchoModel(), str(tmp_path / "anli.sock"))
+    daemon.start()
+    yield daemon
+    daemon.shutdown()
+
+
+def test_operations(daemon):
+    client = DaemonClient(daemon.socket_path)
+    assert client.ping() == "pong"
+    assert client.generate("hello world") == "HELLO WORLD"
+    assert "".join(client.stream("a b c")) == "a b c "
+    assert client.embed(["ab", "abcd"]) == [[2.0, 1.0], [4.0, 1.0]]
+    assert client.select("please delete it", ["create", "delete"]) == "delete"
+    client.close()
+
+
+def test_error_is_reported_and_connection_reusable(daemon):
+    client = DaemonClient(daemon.socket_path)
+    with pytest.raises(DaemonError):
+        client.select("anything", [])
+    assert client.generate("ok") == "OK"
+
+
+def test_cancel_stream(daemon):
+    daemon.model.token_delay = 0.01
+    client = DaemonClient(daemon.socket_path)
+    tokens = client.stream(" ".join(["word"] * 200))
+    assert next(tokens) == "word "
+    tokens.close()
+    assert client.generate("still usable") == "STILL USABLE"
+    assert daemon.model.closed_streams == 1
+
+
+def test_error_mid_stream_ends_the_stream(daemon):
+    class FailingStream(EchoModel):
+        def stream(self, prompt, **kwargs):
+            yield "first "
+            raise RuntimeError("decoding failed")
+
+    daemon.model = FailingStream()
+    client = DaemonClient(daemon.socket_path, timeout=5)
+    tokens = client.stream("a b c")
+    assert next(tokens) == "first "
+    with pytest.raises(DaemonError, match="RuntimeError: decoding failed"):
+        next(tokens)
+    assert client.generate("still usable") == "STILL USABLE"
+
+
+def test_clients_are_served_concurrently(daemon):
+    results = {}
+
+    def run(i):
+        client = DaemonClient(daemon.socket_path)
+        results[i] = [client.generate(f"client {i} request {j}") for j in range(5)]
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: [f"CLIENT {i} REQUEST {j}" for j in range(5)] for i in range(4)}
+
+
+def test_config_selects_daemon_client(daemon):
+    llm = LLMInterface(config={"llm": {"type": "Daemon", "socket_path": daemon.socket_path}})
+    assert isinstance(llm.models, DaemonClient)
+    assert llm.models.generate("hi") == "HI"
@@ -0,0 +1,96 @@
+from anli.llms.fake import FakeLLM
+from anli.utils.dedup import Deduplicator, canonical_text, hamming, merge_occurrences, simhash
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+PROMPT_PATH = "$.conversation[?(@.role == 'user')].content"
+
+
+def conversation(*turns):
+    return {"conversation": [{"role": "user" if i % 2 == 0 else "assistant", "content": turn}
+                             for i, turn in enumerate(turns)]}
+
+
+def test_canonical_text_and_simhash():
+    assert canonical_text("  Thanks,\tthe POD is up! ") == "thanks the pod is up"
+    close = hamming(simhash("my order has not arrived yet and it has been two weeks"),
+                    simhash("my order has not arrived yet, it has been two weeks!"))
+    far = hamming(simhash("my order has not arrived yet and it has been two weeks"),
+                  simhash("some completely different sentence about the weather in paris"))
+    assert close < 8 < far
+
+
+def test_exact_and_near_duplicates():
+    dedup = Deduplicator()
+    dedup.add("a", "My order has not arrived yet and it has been two weeks")
+    dedup.add("b", "Thanks!")
+    assert dedup.find("my order has not arrived yet, it has been two weeks!") == "a"
+    assert dedup.find("thanks") == "b"
+    # Short prompts are only compared exactly, prompts with other numbers are never near duplicates
+    assert dedup.find("thanks a lot") is None
+    dedup.add("c", "please restart the pod worker-1 in the staging cluster")
+    assert dedup.find("please restart the pod worker-2 in the staging cluster") is None
+    assert dedup.find("some completely different sentence about the weather in paris") is None
+
+    dedup.remove("a")
+    assert dedup.find("my order has not arrived yet and it has been two weeks") is None and len(dedup) == 2
+    assert Deduplicator(max_distance=0).find("thanks") is None
+
+
+def test_merge_occurrences():
+    first = {"name": "a", "path": "$.c.[0]"}
+    second = {"name": "b", "path": "$.c.[2]"}
+    assert merge_occurrences([first], [second, first, second]) == [first, second]
+
+
+def test_local_store_collapses_duplicates(tmp_path):
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return FakeLLM(embedding_dims=64).embed(texts)
+
+    store = LocalVectorStoreForJSON("dedup", default_semantic_distance_threshold=2, path=str(tmp_path),
+                                    vectorizer=embed, deduplicator=Deduplicator())
+    store.upsert_item(conversation("Thanks!", "You're welcome", "my order has not arrived yet and it has been two weeks",
+                                   "Sorry about that"), PROMPT_PATH, 1, json_storage_id_suffix="a")
+    store.upsert_item(conversation("thanks", "Anytime", "My order has not arrived yet, it has been two weeks!",
+                                   "Let me check"), PROMPT_PATH, 1, json_storage_id_suffix="b")
+    assert embedded == ["Thanks!", "my order has not arrived yet and it has been two weeks"]
+
+    hits = store.search_item("my order has not arrived yet and it has been two weeks", 1,
+                             ["response", "occurrences"])
+    assert hits == [{"response": "Sorry about that",
+                     "occurrences": [{"name": "dedup-a", "path": "$.conversation.[2].content"},
+                                     {"name": "dedup-b", "path": "$.conversation.[2].content"}]}]
+    assert store.get_context_windows(hits[0]["occurrences"], 1, 2) == [
+        [{"role": "assistant", "content": "Sorry about that"}], [{"role": "assistant", "content": "Let me check"}]]
+
+    reopened = LocalVectorStoreForJSON("dedup", path=str(tmp_path), vectorizer=embed, deduplicator=Deduplicator())
+    embedded.clear()
+    reopened.upsert_item(conversation("THANKS"), PROMPT_PATH, json_storage_id_suffix="c")
+    assert embedded == [] and len(reopened.deduplicator) == 2
+    reopened.delete_prompts(["Thanks!"])
+    reopened.upsert_item(conversation("THANKS"), PROMPT_PATH, json_storage_id_suffix="c")
+    assert embedded == ["THANKS"]
+
+
+def test_failed_embedding_leaves_no_duplicate_entry(tmp_path):
+    failures = [RuntimeError("model not loaded")]
+
+    def embed(texts):
+        if failures:
+            raise failures.pop()
+        return FakeLLM(embedding_dims=32).embed(texts)
+
+    store = LocalVectorStoreForJSON("dedup", default_semantic_distance_threshold=2, path=str(tmp_path),
+                                    vectorizer=embed, deduplicator=Deduplicator())
+    document = conversation("why is pod worker-1 crashing", "OOM killed.")
+    try:
+        store.upsert_item(document, PROMPT_PATH, 1, json_storage_id_suffix="a")
+    except RuntimeError:
+        pass
+    assert len(store.deduplicator) == 0
+    assert store.db.execute("SELECT COUNT(*) FROM occurrences").fetchone()[0] == 0
+    store.upsert_item(document, PROMPT_PATH, 1, json_storage_id_suffix="a")
+    assert store.db.execute("SELECT COUNT(*) FROM records").fetchone()[0] == 1
+    assert store.search_item("why is pod worker-1 crashing", 1, ["response"])[0]["response"] == "OOM killed."
@@ -0,0 +1,92 @@
+from anli.dialog_manager import DialogManager, count_tokens, llm_summarizer, vector_store_retriever
+from anli.llms.fake import FakeLLM
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+from fake_redis import FakeRedis, FakeRedisVectorStore, FakeVectorizer
+
+
+def test_recent_turns_fit_the_budget():
+    counted = []
+
+    def count(text):
+        counted.append(text)
+        return count_tokens(text)
+
+    dialog = DialogManager(token_budget=40, window=4, count_tokens=count, relevant_turns=0)
+    for i in range(6):
+        dialog.add_turn("user" if i % 2 == 0 else "assistant", f"turn number {i}")
+    assert len(counted) == 6 and len(dialog.turns) == 4
+    # Each turn costs 3 words plus 4 tokens of overhead, the input 2 + 4: 4 turns fit in 34 tokens
+    messages = dialog.build_messages("next one")
+    assert messages == [{"role": "user", "content": "turn number 2"}, {"role": "assistant", "content": "turn number 3"},
+                        {"role": "user", "content": "turn number 4"}, {"role": "assistant", "content": "turn number 5"},
+                        {"role": "user", "content": "next one"}]
+    dialog.token_budget = 25
+    assert [message["content"] for message in dialog.build_messages("next one")] == [
+        "turn number 4", "turn number 5", "next one"]
+    assert len(counted) == 6 + 2
+    assert dialog.build_prompt().endswith("user: turn number 4\nassistant: turn number 5\nassistant:")
+
+
+def test_summaries_and_recall():
+    llm = FakeLLM(rules=[(r"user: (?P<first>[^\n]+)", "The user asked: \\g<first>.")])
+    dialog = DialogManager(token_budget=200, window=4, summarizer=llm_summarizer(llm), summary_size=2)
+    dialog.manage_context("restart the pod worker-1", {"intent": "restart", "pod": "worker-1"})
+    dialog.add_turn("assistant", "Restarted worker-1.")
+    for i in range(4):
+        dialog.add_turn("user" if i % 2 == 0 else "assistant", f"small talk {i}")
+    dialog.manage_context("show the logs of worker-1", {"intent": "logs"})
+    assert dialog.context == {"intent": "logs", "pod": "worker-1"}
+    # The first two turns were summarized once, the third is waiting for the next summary
+    assert llm.calls == 1 and len(dialog.pending) == 1
+
+    messages = dialog.build_messages("is worker-1 healthy")
+    assert messages[0] == {"role": "system",
+                           "content": "Summary of earlier conversation: The user asked: restart the pod worker-1."}
+    assert {"role": "assistant", "content": "Restarted worker-1."} in messages
+    assert messages[-2:] == [{"role": "user", "content": "show the logs of worker-1"},
+                             {"role": "user", "content": "is worker-1 healthy"}]
+    dialog.build_messages("is worker-1 healthy")
+    assert llm.calls == 1
+
+
+def test_vector_store_retriever(tmp_path):
+    store = LocalVectorStoreForJSON("dialog", default_semantic_distance_threshold=2, path=str(tmp_path),
+                                    vectorizer=FakeLLM(embedding_dims=64).embed)
+    conversation = {"conversation": [{"role": "user", "content": "restart the pod worker-1"},
+                                     {"role": "assistant", "content": "Restarted worker-1."},
+                                     {"role": "user", "content": "thanks"},
+                                     {"role": "assistant", "content": "You're welcome."}]}
+    store.upsert_item(conversation, "$.conversation[?(@.role == 'user')].content", 1, json_storage_id_suffix="s1")
+    other = {"conversation": [{"role": "user", "content": "restart the pod worker-2"},
+                              {"role": "assistant", "content": "Restarted worker-2."}]}
+    store.upsert_item(other, "$.conversation[?(@.role == 'user')].content", 1, json_storage_id_suffix="s2")
+    retrieve = vector_store_retriever(store, "dialog-s1")
+    assert retrieve("restart the pod worker-1", 1) == conversation["conversation"][:2]
+
+    dialog = DialogManager(window=2, retriever=retrieve, relevant_turns=1)
+    for turn in conversation["conversation"]:
+        dialog.add_turn(turn["role"], turn["content"])
+    assert dialog.build_messages("restart the pod worker-1")[:2] == conversation["conversation"][:2]
+
+
+def test_summary_tokens_include_the_prefix():
+    dialog = DialogManager(window=1, summarizer=lambda turns: "short", summary_size=1)
+    dialog.add_turn("user", "first")
+    dialog.add_turn("user", "second")
+    summary = dialog.summaries[0]
+    assert summary.tokens == count_tokens(summary.content) + dialog.message_overhead
+
+
+def test_vector_store_retriever_filters_the_conversation():
+    store = FakeRedisVectorStore("dialog", 2, redis_client=FakeRedis(),
+                                 vectorizer=FakeVectorizer(FakeLLM(embedding_dims=64)))
+    conversation = {"conversation": [{"role": "user", "content": "restart the pod worker-1"},
+                                     {"role": "assistant", "content": "Restarted worker-1."}]}
+    store.upsert_item(conversation, "$.conversation[?(@.role == 'user')].content", 1, json_storage_id_suffix="s1")
+    for i in range(5):
+        other = {"conversation": [{"role": "user", "content": f"restart the pod worker-1 {i}"},
+                                  {"role": "assistant", "content": "Restarted."}]}
+        store.upsert_item(other, "$.conversation[?(@.role == 'user')].content", 1, json_storage_id_suffix=f"o{i}")
+    # The other conversations are closer to the query and would fill all the unfiltered hits
+    retrieve = vector_store_retriever(store, "dialog-s1", search_factor=1)
+    assert retrieve("restart the pod worker-1 0 1 2 3 4", 1) == conversation["conversation"]
@@ -0,0 +1,76 @@
+import multiprocessing
+
+import numpy as np
+
+from anli.utils.embedding_cache import EmbeddingCache
+
+
+class CountingModel:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), float(text.count(" ")), 1.0] for text in texts]
+
+
+def test_only_missing_texts_are_embedded(tmp_path):
+    cache = EmbeddingCache(cache_dir=str(tmp_path))
+    model = CountingModel()
+    first = cache.embed_many("m", ["hello world", "bye", "hello world"], model)
+    assert model.calls == [["hello world", "bye"]]
+    assert first[0] == first[2] == [11.0, 1.0, 1.0]
+    second = cache.embed_many("m", ["hello   world", "new one", "bye"], model)
+    assert model.calls[-1] == ["new one"]
+    assert second[0] == first[0] and second[2] == first[1]
+    stats = cache.stats()
+    assert stats["memory_hits"] == 2 and stats["misses"] == 3
+    assert stats["bytes_saved"] == len("hello world") + len("hello   world") + len("bye")
+
+
+def test_models_are_kept_apart_and_persisted(tmp_path):
+    cache = EmbeddingCache(cache_dir=str(tmp_path), lru_limit=1)
+    cache.embed_many("model/a", [f"text {i}" for i in range(3000)], CountingModel())
+    cache.embed_many("model-b", ["text 1"], lambda texts: [[9.0, 9.0]])
+    cache.close()
+
+    reopened = EmbeddingCache(cache_dir=str(tmp_path))
+    model = CountingModel()
+    assert reopened.embed("model/a", "text 2999", model) == [9.0, 1.0, 1.0]
+    assert reopened.embed("model-b", "text 1", model) == [9.0, 9.0]
+    assert model.calls == []
+    assert reopened.stats()["disk_hits"] == 2
+    assert reopened.stats()["entries"] == {"model/a": 3000, "model-b": 1}
+
+
+def _fill(cache_dir, worker):
+    cache = EmbeddingCache(cache_dir=cache_dir, lru_limit=1)
+    for start in range(0, 600, 50):
+        texts = [f"text {worker} {i}" for i in range(start, start + 50)] + [f"shared {start}"]
+        cache.embed_many("m", texts, CountingModel())
+    cache.close()
+
+
+def test_processes_share_the_files(tmp_path):
+    processes = [multiprocessing.get_context("fork").Process(target=_fill, args=(str(tmp_path), worker))
+                 for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    cache = EmbeddingCache(cache_dir=str(tmp_path), lru_limit=1)
+    model = CountingModel()
+    texts = [f"text {worker} {i}" for worker in range(4) for i in range(600)]
+    texts += [f"shared {i}" for i in range(0, 600, 50)]
+    assert cache.embed_many("m", texts, model) == CountingModel()(texts)
+    assert model.calls == [] and cache.stats()["entries"] == {"m": len(texts)}
+
+
+def test_disk_entries_are_capped(tmp_path):
+    cache = EmbeddingCache(cache_dir=str(tmp_path), max_disk_entries=10)
+    cache.embed_many("m", [f"query {i}" for i in range(25)], CountingModel())
+    assert cache.stats()["entries"] == {"m": 10}
+    assert cache.embed("m", "query 20", CountingModel()) == [8.0, 1.0, 1.0]
+    assert isinstance(cache.lru[("m", cache.key("query 20"))], np.ndarray)
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from anli.llms.fake import FakeLLM
+from anli.utils.embedding_dispatcher import EmbeddingDispatcher, Histogram
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+
+class SlowEmbedder:
+    """Embeds with a fixed cost per call, like a forward pass on CPU."""
+    model = "slow-fake"
+    dims = 16
+
+    def __init__(self, latency=0.02):
+        self.llm = FakeLLM(embedding_dims=16)
+        self.latency = latency
+        self.calls = []
+
+    def embed_many(self, texts):
+        self.calls.append(len(texts))
+        time.sleep(self.latency)
+        return self.llm.embed(texts)
+
+
+def test_concurrent_requests_are_batched():
+    embedder = SlowEmbedder()
+    dispatcher = EmbeddingDispatcher(embedder, max_wait=0.05, max_batch_size=64)
+    texts = [f"delete pod worker-{i}" for i in range(16)]
+    results = {}
+    barrier = threading.Barrier(len(texts))
+
+    def search(text):
+        barrier.wait()
+        results[text] = dispatcher.embed(text)
+
+    threads = [threading.Thread(target=search, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    dispatcher.close()
+
+    assert results == dict(zip(texts, FakeLLM(embedding_dims=16).embed(texts)))
+    assert len(embedder.calls) < len(texts) and sum(embedder.calls) == len(texts)
+    metrics = dispatcher.metrics()
+    assert metrics["batch_size"]["count"] == len(embedder.calls)
+    assert metrics["queue_wait_ms"]["count"] == len(texts)
+    assert sum(metrics["batch_size"]["buckets"].values()) == len(embedder.calls)
+
+
+def test_full_batches_do_not_wait():
+    embedder = SlowEmbedder(latency=0)
+    dispatcher = EmbeddingDispatcher(embedder, max_wait=10, max_batch_size=4)
+    start = time.perf_counter()
+    assert len(dispatcher.embed_many([f"text {i}" for i in range(6)])) == 6
+    assert time.perf_counter() - start < 1
+    dispatcher.close()
+
+
+def test_errors_reach_every_caller_of_the_batch():
+    def fail(texts):
+        raise ValueError("model unavailable")
+
+    dispatcher = EmbeddingDispatcher(fail, max_wait=0.01)
+    futures = [dispatcher.submit([f"text {i}"]) for i in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result()
+    dispatcher.close()
+    with pytest.raises(RuntimeError):
+        dispatcher.submit(["text"])
+
+
+def test_histogram_quantiles():
+    histogram = Histogram((1, 2, 4, 8))
+    for value in (0.5, 1.5, 1.5, 3, 20):
+        histogram.observe(value)
+    assert histogram.to_dict()["buckets"] == {1: 1, 2: 2, 4: 1, 8: 0, float("inf"): 1}
+    assert histogram.quantile(0.5) == 2 and histogram.quantile(1.0) == 20
+
+
+def test_local_store_searches_through_the_dispatcher(tmp_path):
+    dispatcher = EmbeddingDispatcher(FakeLLM(embedding_dims=16).embed, max_wait=0.001)
+    store = LocalVectorStoreForJSON("dispatch", path=str(tmp_path), vectorizer=dispatcher)
+    store.upsert_item({"conversation": [{"role": "user", "content": "delete the pod"},
+                                        {"role": "assistant", "content": "Deleted."}]},
+                      "$.conversation[?(@.role == 'user')].content", response_relative_position=1)
+    assert store.search_item("delete the pod")[0]["response"] == "Deleted."
+    dispatcher.close()
+
+
+def test_concurrent_local_store_searches_are_batched(tmp_path):
+    embedder = SlowEmbedder()
+    dispatcher = EmbeddingDispatcher(embedder, max_wait=0.05, max_batch_size=64)
+    store = LocalVectorStoreForJSON("dispatch", path=str(tmp_path), vectorizer=dispatcher)
+    queries = [f"delete pod worker-{i}" for i in range(16)]
+    store.upsert_item({"conversation": [turn for i, query in enumerate(queries)
+                                        for turn in ({"role": "user", "content": query},
+                                                     {"role": "assistant", "content": f"Deleted {i}."})]},
+                      "$.conversation[?(@.role == 'user')].content", response_relative_position=1)
+    expected = {query: store.search_item(query) for query in queries}
+    embedder.calls.clear()
+    results = {}
+    barrier = threading.Barrier(len(queries))
+
+    def search(query):
+        barrier.wait()
+        results[query] = store.search_item(query)
+
+    threads = [threading.Thread(target=search, args=(query,)) for query in queries]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    dispatcher.close()
+
+    assert results == expected
+    assert sum(embedder.calls) == len(queries) and max(embedder.calls) > 1
@@ -0,0 +1,56 @@
+import numpy as np
+
+from anli.llms.fake import FakeLLM
+from anli.utils.embedding_engine import EmbeddingEngine, get_embedding_engine
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+
+class FakeSentenceTransformer:
+    def __init__(self):
+        self.llm = FakeLLM(embedding_dims=16)
+        self.batches = []
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, convert_to_numpy=True):
+        self.batches.append(list(texts))
+        return np.array(self.llm.embed(texts))
+
+    def get_sentence_embedding_dimension(self):
+        return 16
+
+
+def fake_engine(monkeypatch, **kwargs):
+    loads = []
+    model = FakeSentenceTransformer()
+    monkeypatch.setattr(EmbeddingEngine, "_load", lambda self: loads.append(self.model) or model)
+    return EmbeddingEngine("fake-model", **kwargs), model, loads
+
+
+def test_engines_are_shared_per_model_and_options():
+    assert get_embedding_engine("model-a") is get_embedding_engine("model-a")
+    assert get_embedding_engine("model-a") is not get_embedding_engine("model-b")
+    assert get_embedding_engine("model-a", cpu_optimized=True) is not get_embedding_engine("model-a")
+
+
+def test_model_is_loaded_once_on_first_use(monkeypatch):
+    engine, model, loads = fake_engine(monkeypatch)
+    assert not engine.loaded
+    np.testing.assert_allclose(engine.embed("delete the pod"), FakeLLM(embedding_dims=16).embed(["delete the pod"])[0],
+                               atol=1e-6)
+    engine.embed_documents(["scale the deployment"])
+    assert loads == ["fake-model"] and engine.dims == 16
+
+
+def test_length_bucketed_batches_keep_order(monkeypatch):
+    engine, model, _ = fake_engine(monkeypatch, batch_size=4, max_batch_tokens=40)
+    texts = [("word " * (i % 7 * 10)) + str(i) for i in range(30)]
+    vectors = engine.embed_many(texts)
+    np.testing.assert_allclose(vectors, FakeLLM(embedding_dims=16).embed(texts), atol=1e-6)
+    assert sorted(text for batch in model.batches for text in batch) == sorted(texts)
+    for batch in model.batches:
+        assert len(batch) <= 4
+        assert len(batch) == 1 or len(batch) * (max(map(len, batch)) // 4 + 2) <= 40
+
+
+def test_local_store_defaults_to_the_shared_engine(tmp_path):
+    store = LocalVectorStoreForJSON("engine", path=str(tmp_path))
+    assert store.vectorizer is get_embedding_engine() and not store.vectorizer.loaded
@@ -0,0 +1,47 @@
+import time
+
+from anli.config import LLMInterface
+from anli.llms.fake import FakeLLM
+
+
+def test_rules_scripts_and_default():
+    llm = FakeLLM(responses=["first", "second"], rules=[(r"delete (?P<name>\S+)", r"Deleted \g<name>.")])
+    assert llm.generate("please delete temp-worker now") == "Deleted temp-worker."
+    assert [llm.generate("hi"), llm.generate("hi"), llm.generate("hi")] == ["first", "second", "first"]
+    assert FakeLLM(default_response="Fine.").generate("anything") == "Fine."
+
+
+def test_stream_max_tokens_and_stop():
+    llm = FakeLLM(default_response="one two three. four five")
+    assert list(llm.stream("x")) == ["one", " two", " three.", " four", " five"]
+    assert llm.generate("x", max_tokens=2) == "one two"
+    assert llm.generate("x", stop=["."]) == "one two three"
+
+
+def test_latency_model():
+    llm = FakeLLM(default_response="a b c d", token_latency=0.01, prefill_latency=0.005)
+    start = time.perf_counter()
+    llm.generate("p1 p2 p3 p4")
+    assert time.perf_counter() - start >= 4 * 0.005 + 4 * 0.01
+    assert (llm.prompt_tokens, llm.completion_tokens) == (4, 4)
+
+
+def test_select_is_deterministic():
+    llm = FakeLLM(rules=[("remove", "delete")])
+    assert llm.select("please remove the pod", ["create", "delete", "edit"]) == "delete"
+    assert llm.select("edit the deployment", ["create", "delete", "edit"]) == "edit"
+    assert FakeLLM(seed=1).select("zzz", ["a", "b", "c"]) == FakeLLM(seed=1).select("zzz", ["a", "b", "c"])
+
+
+def test_embeddings_are_deterministic_and_similar_for_shared_words():
+    llm = FakeLLM(embedding_dims=128)
+    a, b, c = llm.embed(["delete the pod", "delete the pod please", "weather tomorrow"])
+    assert a == FakeLLM(embedding_dims=128).embed(["delete the pod"])[0]
+    cosine = lambda x, y: sum(i * j for i, j in zip(x, y))
+    assert cosine(a, b) > cosine(a, c)
+
+
+def test_config_selects_fake_backend():
+    llm = LLMInterface(config={"llm": {"type": "Fake", "default_response": "Hello there, nice to meet you."}})
+    assert isinstance(llm.models, FakeLLM)
+    assert "".join(llm.stream("hi")) == "Hello there, nice to meet you."
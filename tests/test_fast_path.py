@@ -0,0 +1,123 @@
+import pytest
+from anli.integration_layer import IntegrationLayer
+from anli.fast_path import FastPathMatcher
+
+
+@pytest.fixture
+def matcher():
+    integration_layer = IntegrationLayer()
+
+    @integration_layer.register(intent="add", examples=["add {a} and {b}", "what is {a} plus {b}"])
+    def add(a: int, b: int) -> int:
+        return a + b
+
+    @integration_layer.register(intent="delete_pod", examples=["delete pod {name}", "remove the pod named {name}"])
+    def delete_pod(name: str):
+        return name
+
+    @integration_layer.register(intent="list_pods", aliases=["show pods", "get pods"])
+    def list_pods(namespace: str = "default"):
+        return namespace
+
+    return FastPathMatcher(integration_layer)
+
+
+def test_example_pattern_with_type_conversion(matcher):
+    match = matcher.match("Add 3 and  4.")
+    assert match.intent == "add"
+    assert match.parameters == {"a": 3, "b": 4}
+    assert match.source == "pattern"
+
+
+def test_pattern_preserves_case_and_strips_quotes(matcher):
+    match = matcher.match("Remove the pod named 'Temp-Worker'")
+    assert match.intent == "delete_pod"
+    assert match.parameters == {"name": "Temp-Worker"}
+
+
+def test_pattern_conversion_failure_falls_through(matcher):
+    assert matcher.match("add three and four") is None
+
+
+def test_alias_with_filler(matcher):
+    match = matcher.match("please show pods now")
+    assert match.intent == "list_pods"
+    assert match.parameters == {}
+    assert matcher.match("show pods in the kube-system namespace") is None
+    assert matcher.lookup("show pods in the kube-system namespace").intent == "list_pods"
+
+
+def test_learned_phrasing(matcher):
+    assert matcher.match("get rid of temp-worker") is None
+    matcher.learn("Get rid of temp-worker", "delete_pod", {"name": "temp-worker"})
+    match = matcher.match("get rid of temp-worker!")
+    assert match.intent == "delete_pod"
+    assert match.confidence == 1.0
+
+
+def test_learned_persistence(matcher, tmp_path):
+    learned_file = str(tmp_path / "learned.json")
+    matcher.learn("nuke it", "delete_pod", {"name": "it"})
+    matcher.save_learned(learned_file)
+    reloaded = FastPathMatcher(matcher.integration_layer, learned_file=learned_file)
+    assert reloaded.match("nuke it").parameters == {"name": "it"}
+
+
+def test_recompiles_after_registration(matcher):
+    assert matcher.match("multiply 2 by 5") is None
+
+    @matcher.integration_layer.register(intent="multiply", examples=["multiply {a} by {b}"])
+    def multiply(a: float, b: float):
+        return a * b
+
+    assert matcher.match("multiply 2 by 5").parameters == {"a": 2.0, "b": 5.0}
+
+
+def test_resolve_and_stats(matcher):
+    assert matcher.resolve("add 1 and 2", fallback=lambda text: ("llm", {})) == ("add", {"a": 1, "b": 2})
+    assert matcher.resolve("tell me a joke", fallback=lambda text: ("llm", {})) == ("llm", {})
+    stats = matcher.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_resolve_learns_fallback_parses_only_when_asked(matcher):
+    calls = []
+
+    def llm_parse(text):
+        calls.append(text)
+        return {"get rid of temp-worker": ("delete_pod", {"name": "temp-worker"}),
+                "delete something": ("delete_pod", {"pod": "x"})}.get(text, ("chat", {}))
+
+    # Unconfirmed parses are not learned by default
+    assert matcher.resolve("get rid of temp-worker", fallback=llm_parse) == ("delete_pod", {"name": "temp-worker"})
+    assert matcher.match("get rid of temp-worker") is None
+    for _ in range(2):
+        assert matcher.resolve("get rid of temp-worker", fallback=llm_parse, learn=True) == \
+            ("delete_pod", {"name": "temp-worker"})
+        assert matcher.resolve("delete something", fallback=llm_parse, learn=True) == ("delete_pod", {"pod": "x"})
+        assert matcher.resolve("tell me a joke", fallback=llm_parse, learn=True) == ("chat", {})
+    # Only the parse binding to a registered function was learned
+    assert calls.count("get rid of temp-worker") == 2 and len(calls) == 6
+    assert matcher.lookup("Get rid of temp-worker.").source == "learned"
+
+
+def test_learned_parses_are_checked_against_the_registry(matcher):
+    matcher.learn("nuke it", "delete_pod", {"name": "it"})
+    matcher.learn("clean up", "cleanup", {})
+    assert matcher.match("nuke it").source == "learned"
+    assert matcher.lookup("clean up") is None
+
+    # The function of the intent was replaced by one with other parameters
+    @matcher.integration_layer.register(intent="delete_pod")
+    def delete_pod(pod: str):
+        return pod
+
+    assert matcher.match("nuke it") is None
+
+    @matcher.integration_layer.register(intent="cleanup")
+    def cleanup():
+        return None
+
+    assert matcher.match("clean up").intent == "cleanup"
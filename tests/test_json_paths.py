@@ -0,0 +1,39 @@
+from anli.utils.json_paths import compile_pair_extractor, compile_path, extract_prompt_response_pairs
+
+CONVERSATION = {"conversation": [
+    {"role": "patient", "content": "I'm feeling unwell."},
+    {"role": "doctor", "content": "What symptoms?"},
+    {"role": "patient", "content": "I have a headache."},
+]}
+PROMPT_PATH = "$.conversation[?(@.role == 'patient')].content"
+
+
+def test_pairs_with_responses():
+    assert extract_prompt_response_pairs(CONVERSATION, PROMPT_PATH, response_relative_position=1) == [
+        ("I'm feeling unwell.", "What symptoms?", "conversation.[0].content"),
+        ("I have a headache.", "", "conversation.[2].content"),
+    ]
+
+
+def test_pairs_without_responses_and_negative_positions():
+    assert [r for _, r, _ in extract_prompt_response_pairs(CONVERSATION, PROMPT_PATH)] == ["", ""]
+    assert [r for _, r, _ in extract_prompt_response_pairs(CONVERSATION, PROMPT_PATH, -1)] == ["", "What symptoms?"]
+
+
+def test_non_array_prompts_have_no_response():
+    assert extract_prompt_response_pairs({"title": "hello"}, "$.title", 1) == [("hello", "", "title")]
+
+
+def test_compiled_paths_are_cached():
+    assert compile_path(PROMPT_PATH) is compile_path(PROMPT_PATH)
+    assert compile_pair_extractor(PROMPT_PATH, 1) is compile_pair_extractor(PROMPT_PATH, 1)
+
+
+def test_slice_extraction_matches_whole_document():
+    conversation = [{"role": "patient" if i % 3 else "doctor", "content": f"utterance {i}"} for i in range(20)]
+    for shift in (None, 1, -2):
+        extractor = compile_pair_extractor(PROMPT_PATH, shift)
+        expected = [pair for pair in extractor.extract({"conversation": conversation})
+                    if 7 <= int(pair[2].split("[")[1].split("]")[0]) < 15]
+        offset = 5
+        assert extractor.extract_slice("$.conversation", conversation[offset:17], offset, 7, 15) == expected
@@ -0,0 +1,90 @@
+from anli.llms.fake import FakeLLM
+from anli.utils.lexical_index import LexicalIndex, hybrid_hits, reciprocal_rank_fusion, tokenize
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+PROMPT_PATH = "$.conversation[?(@.role == 'user')].content"
+
+
+def conversation(*turns):
+    return {"conversation": [{"role": "user" if i % 2 == 0 else "assistant", "content": turn}
+                             for i, turn in enumerate(turns)]}
+
+
+def test_identifiers_are_kept_whole_and_split():
+    assert tokenize("Pod worker-12 failed: ERR_CONN_RESET") == [
+        "pod", "worker-12", "worker", "12", "failed", "err_conn_reset", "err", "conn", "reset"]
+
+
+def test_bm25_ranking_and_updates():
+    index = LexicalIndex(max_df_ratio=1.0)
+    index.add("a", "why is pod worker-12 crashing", {"response": "OOM"})
+    index.add("b", "restart pod worker-13")
+    index.add("c", "list the nodes of the cluster")
+    assert [doc_id for doc_id, _, _ in index.search("pod worker-12")] == ["a", "b"]
+    assert index.search("worker-12")[0][2] == {"response": "OOM"}
+    index.max_df_ratio = 0.5
+    assert [doc_id for doc_id, _, _ in index.search("pod worker-12")] == ["a"]  # "pod" and "worker" are common
+    assert sorted(doc_id for doc_id, _, _ in index.search("pod")) == ["a", "b"]
+    index.max_df_ratio = 1.0
+    index.add("a", "delete the namespace")
+    assert [doc_id for doc_id, _, _ in index.search("worker-12")] == ["b"]  # by the "worker" part
+    index.remove(["b", "unknown"])
+    assert len(index) == 2 and "pod" not in index.postings
+
+
+def test_exact_match_needs_selective_identifier_terms():
+    index = LexicalIndex(max_exact_hits=2)
+    for i in range(5):
+        index.add(f"doc-{i}", f"why is pod worker-{i} crashing")
+    assert [doc_id for doc_id, _, _ in index.exact_match("worker-3")] == ["doc-3"]
+    assert index.exact_match("pod") is None  # no identifier
+    assert index.exact_match("worker-9") is None  # not indexed
+    assert index.exact_match("why is pod worker-3 crashing") is None  # too many terms
+    index.add("doc-6", "worker-3 again")
+    index.add("doc-7", "worker-3 once more")
+    assert index.exact_match("worker-3") is None  # not selective
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=1)
+    assert [doc_id for doc_id, _ in fused] == ["a", "c", "b"]
+    hits = hybrid_hits([{"id": "a", "response": "A", "vector_distance": 0.1}], [("z", 2.0, {"response": "Z"})],
+                       2, ["response", "vector_distance"])
+    assert hits == [{"response": "A", "vector_distance": 0.1}, {"response": "Z"}]
+
+
+def test_local_store_hybrid_search(tmp_path):
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return FakeLLM(embedding_dims=64).embed(texts)
+
+    store = LocalVectorStoreForJSON("hybrid", default_semantic_distance_threshold=0.9, path=str(tmp_path),
+                                    vectorizer=embed, lexical_index=LexicalIndex())
+    store.upsert_many([conversation(f"why is pod worker-{i} crashing", f"worker-{i} is out of memory")
+                       for i in range(20)], PROMPT_PATH, response_relative_position=1)
+    embedded.clear()
+    hits = store.search_item("worker-7", num_results=3)
+    assert hits == [{"response": "worker-7 is out of memory", "name": hits[0]["name"],
+                     "path": "$.conversation.[0].content"}]
+    assert embedded == []
+
+    hits = store.search_item("why is pod worker-7 crashing", num_results=3)
+    assert hits[0]["response"] == "worker-7 is out of memory" and embedded == ["why is pod worker-7 crashing"]
+
+    store.delete_prompts(["why is pod worker-7 crashing"])
+    assert all(hit["response"] != "worker-7 is out of memory" for hit in store.search_item("worker-7", 3))
+    reopened = LocalVectorStoreForJSON("hybrid", path=str(tmp_path), vectorizer=embed, lexical_index=LexicalIndex())
+    assert len(reopened.lexical_index) == 19
+
+
+def test_lexical_only_hits_must_cover_the_query(tmp_path):
+    store = LocalVectorStoreForJSON("threshold", default_semantic_distance_threshold=0.1, path=str(tmp_path),
+                                    vectorizer=FakeLLM(embedding_dims=64).embed, lexical_index=LexicalIndex())
+    store.upsert_item(conversation("delete the pod temp-worker now", "Deleted."), PROMPT_PATH, 1)
+    assert store.search_item("what is the weather now in paris", 1) == []
+    assert store.lexical_index.coverage("delete pod temp-worker", store.lexical_index.search("pod")[0][0]) == 1.0
+    # Over the distance threshold for the Fake LLM embeddings, but all its terms are in the prompt
+    assert store.search_item("delete the pod temp-worker", 1, ["response", "vector_distance"]) == [
+        {"response": "Deleted."}]
@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+
+from anli.llms.fake import FakeLLM
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+
+PROMPT_PATH = "$.conversation[?(@.role == 'user')].content"
+
+
+def conversation(*turns):
+    return {"conversation": [{"role": "user" if i % 2 == 0 else "assistant", "content": turn}
+                             for i, turn in enumerate(turns)]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalVectorStoreForJSON("test", default_semantic_distance_threshold=0.5, path=str(tmp_path),
+                                   vectorizer=FakeLLM(embedding_dims=64).embed)
+
+
+def test_upsert_search_and_context(store, tmp_path):
+    message = store.upsert_item(conversation("delete the pod worker", "Deleted.", "list all the nodes", "3 nodes."),
+                                PROMPT_PATH, response_relative_position=1, json_storage_id_suffix="c1")
+    assert message == "Upsert 1 objects to JSON_store and 2 prompts to vector_index."
+    hits = store.search_item("please delete the pod worker", num_results=2)
+    assert hits[0]["response"] == "Deleted." and hits[0]["name"] == "test-c1"
+    assert hits[0]["path"] == "$.conversation.[0].content"
+    assert all(hit["vector_distance"] <= 0.5 for hit in hits)
+    assert store.get_context_windows(hits[:1], 0, 2) == [conversation("delete the pod worker", "Deleted.")["conversation"]]
+    assert store.extract_utterances("test-c1", "$.conversation.[2].content", -1, 0) == [
+        {"role": "assistant", "content": "Deleted."}]
+    assert store["c1"]["conversation"][3]["content"] == "3 nodes."
+    assert list(store) == ["c1"] and len(store) == 1
+
+    reopened = LocalVectorStoreForJSON("test", default_semantic_distance_threshold=0.5, path=str(tmp_path),
+                                       vectorizer=FakeLLM(embedding_dims=64).embed)
+    assert reopened.search_item("please delete the pod worker", num_results=2) == hits
+
+
+def test_same_prompt_replaces_record_and_delete(store):
+    store.upsert_item(conversation("restart the api", "Old."), PROMPT_PATH, 1, "a")
+    store.upsert_item(conversation("restart the api", "New."), PROMPT_PATH, 1, "b")
+    assert store.matrix.rows == 1
+    assert [hit["response"] for hit in store.search_item("restart the api", num_results=5)] == ["New."]
+    store.delete_prompts(["restart the api"])
+    assert store.search_item("restart the api") == []
+
+
+def test_top_k_matches_brute_force(store):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3000, 16)).astype(np.float32)
+    records = [(f"p{i}", "", {"name": "test-x", "path": f"$.c.[{i}]"}) for i in range(len(vectors))]
+    store._store_records(records, vectors)
+    query = rng.normal(size=(1, 16)).astype(np.float32)
+    query /= np.linalg.norm(query)
+    rows, distances = store._top_k(query, 10)[0]
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    assert list(rows) == list(np.argsort(-(normalized @ query[0]))[:10])
+    assert np.all(np.diff(distances) >= 0)
+
+
+@pytest.mark.parametrize("quantization, rerank_factor", [("float16", 2), ("int8", 4), ("pq", 50)])
+def test_quantized_search_reranks_exactly(tmp_path, quantization, rerank_factor):
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(20, 32))
+    vectors = (centers[rng.integers(0, 20, 5000)] + rng.normal(scale=0.3, size=(5000, 32))).astype(np.float32)
+    store = LocalVectorStoreForJSON("q", path=str(tmp_path), quantization=quantization, rerank_factor=rerank_factor,
+                                    pq_train_size=2000)
+    store._store_records([(f"p{i}", "", {"name": "q-x", "path": f"$.c.[{i}]"}) for i in range(5000)], vectors)
+    assert store.codes.trained
+    memory = store.memory_usage()
+    assert memory["vectors"] == 5000 * 32 * 4 and memory["codes"] < memory["vectors"]
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = normalized[:20]
+    recall = np.mean([len(set(store._top_k(query[None], 10)[0][0]) & set(np.argsort(-(normalized @ query))[:10]))
+                      / 10 for query in queries])
+    assert recall >= 0.9
+    rows, distances = store._top_k(queries[:1], 10)[0]
+    assert np.allclose(distances, 1 - normalized[rows] @ queries[0], atol=1e-5)
+
+    reopened = LocalVectorStoreForJSON("q", path=str(tmp_path), quantization=quantization, pq_train_size=2000)
+    assert reopened.codes.trained and reopened.memory_usage() == memory
+    exact = LocalVectorStoreForJSON("q", path=str(tmp_path))
+    assert exact.codes is None and exact.memory_usage()["codes"] == 0
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_scalar_codes_are_scored_by_blocks(tmp_path, quantization):
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(2500, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    store = LocalVectorStoreForJSON("q", path=str(tmp_path), quantization=quantization)
+    store._store_records([(f"p{i}", "", {"name": "q-x", "path": f"$.c.[{i}]"}) for i in range(2500)], vectors)
+    codes = store.codes.codes.vectors[:2500].astype(np.float32)
+    if store.codes.scales is not None:
+        codes *= store.codes.scales.vectors[:2500]
+    queries = vectors[:3]
+    assert np.allclose(store.codes.scores(queries, 2500, block_rows=1000), queries @ codes.T, atol=1e-5)
+    assert np.allclose(store.codes.scores(queries, 2500), queries @ vectors.T, atol=0.02)
+
+
+def responses(store, query, num_results=5):
+    return [(hit["response"], hit["path"]) for hit in store.search_item(query, num_results=num_results,
+                                                                         semantic_distance_threshold=0.01)]
+
+
+def test_append_item_indexes_only_new_prompts(tmp_path):
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return FakeLLM(embedding_dims=64).embed(texts)
+
+    store = LocalVectorStoreForJSON("test", 0.5, path=str(tmp_path), vectorizer=embed)
+    store.upsert_item(conversation("restart the pod worker", "Restarted.", "list the nodes", "3 nodes."),
+                      PROMPT_PATH, 1, "c")
+    embedded.clear()
+    assert store.append_item([{"role": "user", "content": "scale web to 3"}], "c", PROMPT_PATH, 1) == \
+        "Append 1 items to JSON_store and 1 prompts to vector_index."
+    assert embedded == ["scale web to 3"]
+    assert responses(store, "scale web to 3") == [("", "$.conversation.[4].content")]
+
+    # The prompt is indexed again with its response once it is appended
+    store.append_item([{"role": "assistant", "content": "Scaled."}], "c", PROMPT_PATH, 1)
+    assert responses(store, "scale web to 3") == [("Scaled.", "$.conversation.[4].content")]
+    assert len(store["c"]["conversation"]) == 6
+    assert store.append_item([{"role": "assistant", "content": "Anything else?"}], "c") == \
+        "Append 1 items to JSON_store, skipped vector_index."
+
+
+def test_update_utterance_reindexes_affected_prompts(store):
+    store.upsert_item(conversation("restart the pod worker", "Restarted.", "list the nodes", "3 nodes.",
+                                   "scale web to 3", "Scaled."), PROMPT_PATH, 1, "c")
+    store.update_utterance("c", 1, {"role": "assistant", "content": "Worker restarted."}, PROMPT_PATH, 1)
+    assert responses(store, "restart the pod worker") == [("Worker restarted.", "$.conversation.[0].content")]
+    store.update_utterance("c", 2, {"role": "user", "content": "list the pods"}, PROMPT_PATH, 1)
+    assert responses(store, "list the nodes") == []
+    assert responses(store, "list the pods") == [("3 nodes.", "$.conversation.[2].content")]
+
+    # Deleting an utterance shifts the following prompts
+    store.update_utterance("c", 0, None, PROMPT_PATH, 1)
+    assert [turn["content"] for turn in store["c"]["conversation"]][:2] == ["Worker restarted.", "list the pods"]
+    assert responses(store, "restart the pod worker") == []
+    assert responses(store, "scale web to 3") == [("Scaled.", "$.conversation.[3].content")]
+    # The watermark moved with the array, so the next append only indexes the new prompt
+    store.append_item([{"role": "user", "content": "drain the node"}], "c", PROMPT_PATH, 1)
+    assert responses(store, "drain the node") == [("", "$.conversation.[5].content")]
+
+
+def test_repeated_prompt_keeps_its_record_while_a_copy_remains(store):
+    store.upsert_item(conversation("restart the api", "Restarted.", "restart the api", "Restarted again."),
+                      PROMPT_PATH, 1, "c")
+    # The record of the last copy moves to the first one
+    store.update_utterance("c", 2, {"role": "user", "content": "start the api"}, PROMPT_PATH, 1)
+    assert [path for _, path in responses(store, "restart the api")] == ["$.conversation.[0].content"]
+    store.update_utterance("c", 0, {"role": "user", "content": "stop the api"}, PROMPT_PATH, 1)
+    assert responses(store, "restart the api") == []
+
+    # A record owned by another object is not removed by an edit of this one
+    store.upsert_item(conversation("start the api", "Started."), PROMPT_PATH, 1, "other")
+    store.update_utterance("c", 2, {"role": "user", "content": "stop it"}, PROMPT_PATH, 1)
+    assert [hit["name"] for hit in store.search_item("start the api")] == ["test-other"]
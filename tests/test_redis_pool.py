@@ -0,0 +1,30 @@
+import asyncio
+
+from anli.config import RedisConfig
+from anli.utils.redis_pool import get_async_connection_pool, get_connection_pool
+
+
+def test_pools_are_shared_per_url_and_settings():
+    assert get_connection_pool("redis://localhost:6379", max_connections=5) is \
+        get_connection_pool("redis://localhost:6379", max_connections=5)
+    assert get_connection_pool("redis://localhost:6379", max_connections=5) is not \
+        get_connection_pool("redis://localhost:6380", max_connections=5)
+    pool = get_async_connection_pool("redis://localhost:6379", max_connections=7)
+    assert pool is get_async_connection_pool("redis://localhost:6379", max_connections=7)
+    assert pool.max_connections == 7
+
+
+def test_redis_config_pool_settings():
+    config = RedisConfig(config={"redis": {"url": "redis://cache:6379/1", "max_connections": 8, "socket_timeout": 2}})
+    assert config.connection_kwargs() == {"max_connections": 8, "socket_timeout": 2, "socket_connect_timeout": 5,
+                                          "health_check_interval": 30}
+
+
+def test_async_pools_are_bound_to_their_event_loop():
+    async def pools():
+        return get_async_connection_pool("redis://localhost:6379", max_connections=3), \
+            get_async_connection_pool("redis://localhost:6379", max_connections=3)
+
+    first, same = asyncio.run(pools())
+    second, _ = asyncio.run(pools())
+    assert first is same and first is not second
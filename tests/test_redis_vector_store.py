@@ -0,0 +1,186 @@
+import os
+import time
+
+import pytest
+
+from anli.llms.fake import FakeLLM
+from anli.utils.redis_vector_store import RedisVectorStoreForJSON
+from anli.utils.vector_filters import VectorFilter
+from fake_redis import FakeRedis, FakeRedisVectorStore, FakeVectorIndex, FakeVectorizer
+
+PROMPT_PATH = "$.conversation[?(@.role == 'user')].content"
+
+
+def conversation(*turns):
+    return {"conversation": [{"role": "user" if i % 2 == 0 else "assistant", "content": turn}
+                             for i, turn in enumerate(turns)]}
+
+
+@pytest.fixture
+def store():
+    return FakeRedisVectorStore("chat", default_semantic_distance_threshold=0.5, redis_client=FakeRedis(),
+                                vectorizer=FakeVectorizer(FakeLLM(embedding_dims=64)), filter_fields={"tenant": "tag"})
+
+
+def test_upsert_many_in_batches(store):
+    documents = [conversation(f"restart the pod worker-{i}", f"Restarted worker-{i}.", f"scale web to {i}", "Done.")
+                 for i in range(5)]
+    message = store.upsert_many(documents, PROMPT_PATH, response_relative_position=1,
+                                json_storage_id_suffixes=[f"c{i}" for i in range(5)], batch_size=2,
+                                metadatas=[{"tenant": "acme" if i % 2 else "beta"} for i in range(5)])
+    assert message == "Upsert 5 objects to JSON_store and 10 prompts to vector_index."
+    # One embedding call and a few pipelines per batch of documents
+    assert store.vectorizer.calls == 3 and store.client.commands == 9
+    assert len(store) == 5 and store["c3"] == documents[3]
+    assert store.client.hgetall("chat-watermarks-c3") == {PROMPT_PATH.encode(): b"4"}
+
+    record = store.client.data[store.vector_index.key("restart the pod worker-3")]
+    assert record["name"] == b"chat-c3" and record["path"] == b"$.conversation.[0].content"
+    assert record["tenant"] == b"acme"
+    assert record["path_prefixes"] == b"$|$.conversation|$.conversation.[0]|$.conversation.[0].content"
+    assert record["response"] == b"Restarted worker-3."
+    assert store.vector_index.deserialize(record["metadata"]) == {"tenant": "acme", "name": "chat-c3",
+                                                                  "path": "$.conversation.[0].content"}
+
+    # Upserting again replaces the objects and their records
+    store.upsert_many([conversation("restart the pod worker-3", "Already running.")], PROMPT_PATH, 1, ["c3"])
+    assert len(store) == 5
+    assert store.client.data[store.vector_index.key("restart the pod worker-3")]["response"] == b"Already running."
+
+
+def test_search_many_keeps_query_order(store):
+    store.upsert_many([conversation("restart the pod worker", "Restarted.", "list the nodes", "3 nodes."),
+                       conversation("delete the pod worker", "Deleted.")], PROMPT_PATH, 1, ["a", "b"],
+                      metadatas=[{"tenant": "acme"}, {"tenant": "beta"}])
+    calls = store.vectorizer.calls
+    results = store.search_many(["list the nodes", "delete the pod worker", "unrelated words only"],
+                                num_results=2, batch_size=2)
+    assert store.vectorizer.calls == calls + 2
+    assert [[hit["response"] for hit in hits] for hits in results] == [["3 nodes."], ["Deleted.", "Restarted."], []]
+    assert float(results[1][0]["vector_distance"]) == pytest.approx(0, abs=1e-6)
+    assert results[1][0]["name"] == "chat-b"
+
+    assert store.search_item("delete the pod worker", num_results=2, semantic_distance_threshold=0.1) == \
+        results[1][:1]
+    filtered = store.search_many(["delete the pod worker"], num_results=2, filter=VectorFilter(tags={"tenant": "acme"}))
+    assert [hit["response"] for hit in filtered[0]] == ["Restarted."]
+    assert store.search_item("delete the pod worker", num_results=2,
+                             filter=VectorFilter(documents="a", path_prefix="$.conversation.[2]")) == []
+
+
+def responses(store, query, num_results=5):
+    return [(hit["response"], hit["path"]) for hit in store.search_item(query, num_results=num_results,
+                                                                         semantic_distance_threshold=0.01)]
+
+
+def test_append_item_indexes_only_new_prompts(store):
+    store.upsert_item(conversation("restart the pod worker", "Restarted.", "list the nodes", "3 nodes."),
+                      PROMPT_PATH, 1, "c")
+    calls = store.vectorizer.calls
+    assert store.append_item([{"role": "user", "content": "scale web to 3"}], "c", PROMPT_PATH, 1) == \
+        "Append 1 items to JSON_store and 1 prompts to vector_index."
+    assert store.vectorizer.calls == calls + 1
+    assert responses(store, "scale web to 3") == [("", "$.conversation.[4].content")]
+
+    # The prompt is indexed again with its response once it is appended
+    assert store.append_item([{"role": "assistant", "content": "Scaled."}], "c", PROMPT_PATH, 1) == \
+        "Append 1 items to JSON_store and 1 prompts to vector_index."
+    assert responses(store, "scale web to 3") == [("Scaled.", "$.conversation.[4].content")]
+    assert len(store["c"]["conversation"]) == 6
+    assert store.append_item([{"role": "assistant", "content": "Anything else?"}], "c") == \
+        "Append 1 items to JSON_store, skipped vector_index."
+
+
+def test_update_utterance_reindexes_affected_prompts(store):
+    store.upsert_item(conversation("restart the pod worker", "Restarted.", "list the nodes", "3 nodes.",
+                                   "scale web to 3", "Scaled."), PROMPT_PATH, 1, "c")
+    store.update_utterance("c", 1, {"role": "assistant", "content": "Worker restarted."}, PROMPT_PATH, 1)
+    assert responses(store, "restart the pod worker") == [("Worker restarted.", "$.conversation.[0].content")]
+    store.update_utterance("c", 2, {"role": "user", "content": "list the pods"}, PROMPT_PATH, 1)
+    assert responses(store, "list the nodes") == []
+    assert responses(store, "list the pods") == [("3 nodes.", "$.conversation.[2].content")]
+
+    # Deleting an utterance shifts the following prompts
+    store.update_utterance("c", 0, None, PROMPT_PATH, 1)
+    assert [turn["content"] for turn in store["c"]["conversation"]][:2] == ["Worker restarted.", "list the pods"]
+    assert responses(store, "restart the pod worker") == []
+    assert responses(store, "scale web to 3") == [("Scaled.", "$.conversation.[3].content")]
+
+
+def test_repeated_prompt_keeps_its_record_while_a_copy_remains(store):
+    store.upsert_item(conversation("restart the api", "Restarted.", "restart the api", "Restarted again."),
+                      PROMPT_PATH, 1, "c")
+    store.upsert_item(conversation("restart the api", "Done."), PROMPT_PATH, 1, "other")
+    store.upsert_item(conversation("restart the api", "Restarted.", "restart the api", "Restarted again."),
+                      PROMPT_PATH, 1, "c")
+    store.update_utterance("c", 0, {"role": "user", "content": "stop the api"}, PROMPT_PATH, 1)
+    assert responses(store, "restart the api") == [("Restarted.", "$.conversation.[2].content")]
+    store.update_utterance("c", 2, {"role": "user", "content": "start the api"}, PROMPT_PATH, 1)
+    assert responses(store, "restart the api") == []
+
+    # A record owned by another object is not removed by an edit of this one
+    store.upsert_item(conversation("restart the api", "Done."), PROMPT_PATH, 1, "other")
+    store.upsert_item(conversation("start the api", "Started."), PROMPT_PATH, 1, "c")
+    store.update_utterance("c", 0, {"role": "user", "content": "restart the api"}, PROMPT_PATH, 1)
+    store.upsert_item(conversation("restart the api", "Done."), PROMPT_PATH, 1, "other")
+    store.update_utterance("c", 0, {"role": "user", "content": "stop the api"}, PROMPT_PATH, 1)
+    assert [hit["name"] for hit in store.search_item("restart the api")] == ["chat-other"]
+
+
+def test_records_of_an_index_created_again_are_backfilled():
+    client = FakeRedis()
+    vectorizer = FakeVectorizer(FakeLLM(embedding_dims=64))
+    old = FakeRedisVectorStore("chat", 0.5, redis_client=client, vectorizer=vectorizer)
+    old.upsert_item(conversation("restart the api", "Done."), PROMPT_PATH, 1, "a", metadata={"tenant": "acme"})
+    # Records written before the filter fields existed
+    for record in client.data.values():
+        if isinstance(record, dict) and "prompt" in record:
+            for field in ("name", "path", "path_prefixes"):
+                record.pop(field)
+    client.indexes["chat_vector_index"] = set(FakeVectorIndex.BASE_FIELDS)
+
+    store = FakeRedisVectorStore("chat", 0.5, redis_client=client, vectorizer=vectorizer,
+                                 filter_fields={"tenant": "tag"})
+    recent = VectorFilter(documents="a", path_prefix="$.conversation", tags={"tenant": "acme"})
+    assert [hit["response"] for hit in store.search_item("restart the api", filter=recent)] == ["Done."]
+
+
+@pytest.mark.skipif(not os.environ.get("ANLI_TEST_REDIS_URL"),
+                    reason="Set ANLI_TEST_REDIS_URL to a Redis Stack server to run the Redis query tests")
+def test_redis_pre_filters_against_redis_stack():
+    pytest.importorskip("redisvl")
+    from anli.utils.embedding_engine import redisvl_vectorizer
+
+    llm = FakeLLM(embedding_dims=64)
+    embedder = type("Embedder", (), {"model": "fake", "dims": 64, "embed": lambda self, text: llm.embed([text])[0],
+                                     "embed_many": lambda self, texts: llm.embed(texts)})()
+    store = RedisVectorStoreForJSON(f"anli_test_{os.getpid()}", 0.5, redis_url=os.environ["ANLI_TEST_REDIS_URL"],
+                                    vectorizer=redisvl_vectorizer(embedder),
+                                    filter_fields={"tenant": "tag", "timestamp": "numeric"})
+    try:
+        store.upsert_many([conversation("restart the pod worker-1", "Restarted.", "restart the pod worker-2", "OK."),
+                           conversation("restart the pod worker-1 now", "Again.")], PROMPT_PATH, 1, ["s-1", "s.2"],
+                          metadatas=[{"tenant": "acme corp", "timestamp": 10}, {"tenant": "beta", "timestamp": 20}])
+        # Waits for the background indexing of the hashes
+        for _ in range(50):
+            if len(store.search_item("restart the pod worker-1", num_results=5)) == 3:
+                break
+            time.sleep(0.1)
+
+        def search(**conditions):
+            return sorted((hit["name"], hit["path"]) for hit in store.search_item(
+                "restart the pod worker-1", num_results=5, filter=VectorFilter(**conditions)))
+
+        name = store.index_name
+        assert search(documents="s.2") == [(f"{name}-s.2", "$.conversation.[0].content")]
+        assert search(documents=["s-1"], path_prefix="$.conversation.[2]") == \
+            [(f"{name}-s-1", "$.conversation.[2].content")]
+        assert search(path_prefix="$.conversation.[2]") == search(path_prefix="$.conversation.[2].content")
+        assert search(path_prefix="$.conv") == []
+        assert [hit[0] for hit in search(tags={"tenant": "acme corp"})] == [f"{name}-s-1"] * 2
+        assert [hit[0] for hit in search(ranges={"timestamp": (15, None)})] == [f"{name}-s.2"]
+    finally:
+        store.client.delete(*[f"{store.index_name}-{suffix}" for suffix in ("s-1", "s.2")],
+                            f"{store.index_name}-collections", *[f"{store.index_name}-watermarks-{suffix}"
+                                                                 for suffix in ("s-1", "s.2")])
+        store.delete_index()
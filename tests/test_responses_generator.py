@@ -0,0 +1,106 @@
+import pytest
+
+from anli.integration_layer import IntegrationLayer
+from anli.llms.fake import FakeLLM
+from anli.responses_generator import ResponsesGenerator, ResponseTemplate
+
+
+@pytest.fixture
+def integration_layer():
+    integration_layer = IntegrationLayer()
+
+    @integration_layer.register(intent="delete_pod", response_template="Deleted pod {name}.")
+    def delete_pod(name: str):
+        return None
+
+    @integration_layer.register(intent="scale",
+                                response_template="Scaled {name} to {replicas} replicas in {seconds:.1f} s.")
+    def scale(name: str, replicas: int):
+        return {"seconds": 1.25}
+
+    @integration_layer.register(intent="list_pods", response_template="Pods: {result}", response_generative=True)
+    def list_pods(namespace: str = "default"):
+        return []
+
+    return integration_layer
+
+
+def test_template_rendering_without_llm(integration_layer):
+    llm = FakeLLM()
+    generator = ResponsesGenerator(integration_layer, llm=llm)
+    assert generator.generate({"intent": "delete_pod", "parameters": {"name": "temp-worker"}}, None) == \
+        "Deleted pod temp-worker."
+    assert generator.generate({"intent": "scale", "parameters": {"name": "web", "replicas": 3}}, {"seconds": 1.25}) == \
+        "Scaled web to 3 replicas in 1.2 s."
+    assert generator.generate({"intent": "unknown", "parameters": {}}, 42) == "42"
+    assert generator.generate({"intent": "unknown", "parameters": {}}, None) == "Done."
+    assert llm.calls == 0 and generator.stats()["rendered"] == 4
+
+    @integration_layer.register(intent="delete_pod", response_template="Pod {name} is gone.")
+    def delete_pod(name: str):
+        return None
+
+    assert generator.generate({"intent": "delete_pod", "parameters": {"name": "a"}}, None) == "Pod a is gone."
+
+
+def test_generative_phrasings_are_cached_per_shape(integration_layer):
+    llm = FakeLLM(rules=[(r"\{result\} = \[\]", "There are no pods in {namespace}."),
+                         (r"\{result\} = \['", "Found {result} in {namespace}.")])
+    generator = ResponsesGenerator(integration_layer, llm=llm)
+    context = {"intent": "list_pods", "parameters": {"namespace": "dev"}}
+    assert generator.generate(context, []) == "There are no pods in dev."
+    assert generator.generate({"intent": "list_pods", "parameters": {"namespace": "prod"}}, []) == \
+        "There are no pods in prod."
+    assert llm.calls == 1
+    assert generator.generate(context, ["a", "b"]) == "Found ['a', 'b'] in dev."
+    assert generator.generate(context, ["c", "d", "e"]) == "Found ['c', 'd', 'e'] in dev."
+    assert llm.calls == 2 and generator.stats()["cache_hits"] == 2
+
+
+def test_errors_and_clarifications(integration_layer):
+    generator = ResponsesGenerator(integration_layer)
+    assert generator.generate({"intent": "delete_pod", "parameters": {"name": "x"}}, KeyError("x")) == \
+        "Sorry, delete pod failed: 'x'"
+    assert generator.generate({"intent": "scale", "parameters": {"name": "web"}, "missing": ["replicas"]}, None) == \
+        "Please provide the replicas to scale."
+
+    # Phrasings with unknown placeholders are not used
+    llm = FakeLLM(rules=[(r"Outcome: error", "Could not delete {pod}."),
+                         (r"Outcome: clarification", "How many {missing} should {name} have?")])
+    generator = ResponsesGenerator(integration_layer, llm=llm)
+    assert generator.generate({"intent": "delete_pod", "parameters": {"name": "x"}}, KeyError("x")) == \
+        "Sorry, delete pod failed: 'x'"
+    assert generator.generate({"intent": "scale", "parameters": {"name": "web"}, "missing": ["replicas"]}, None) == \
+        "How many replicas should web have?"
+    assert generator.stats()["cached"] == 1
+
+
+def test_template_validation():
+    assert ResponseTemplate("{result[count]!r} pods in {namespace}").fields == {"result", "namespace"}
+    with pytest.raises(ValueError, match="Positional"):
+        ResponseTemplate("Deleted {0}.")
+    for text in ("{result.__class__}", "{result[0]}", "{name!r}", "{name:>10}"):
+        with pytest.raises(ValueError, match="Only"):
+            ResponseTemplate(text, bare_fields=True)
+
+
+def test_llm_phrasings_cannot_access_attributes(integration_layer):
+    llm = FakeLLM(rules=[(r"Outcome: error", "{result.__class__.__init__.__globals__[ResponseTemplate]}")])
+    generator = ResponsesGenerator(integration_layer, llm=llm)
+    assert generator.generate({"intent": "delete_pod", "parameters": {"name": "x"}}, KeyError("x")) == \
+        "Sorry, delete pod failed: 'x'"
+    assert generator.stats()["cached"] == 0
+
+
+def test_phrasings_with_values_are_not_cached(integration_layer):
+    llm = FakeLLM(rules=[(r"\{name\} = 'worker-1'", "Could not delete pod worker-1, it does not exist."),
+                         (r"Outcome: error", "Could not delete pod {name}: {error}.")])
+    generator = ResponsesGenerator(integration_layer, llm=llm)
+    assert generator.generate({"intent": "delete_pod", "parameters": {"name": "worker-1"}}, KeyError("gone")) == \
+        "Could not delete pod worker-1, it does not exist."
+    assert generator.stats()["cached"] == 0
+    assert generator.generate({"intent": "delete_pod", "parameters": {"name": "db-0"}}, KeyError("gone")) == \
+        "Could not delete pod db-0: 'gone'."
+    assert generator.generate({"intent": "delete_pod", "parameters": {"name": "db-1"}}, KeyError("gone")) == \
+        "Could not delete pod db-1: 'gone'."
+    assert llm.calls == 2 and generator.stats()["cached"] == 1
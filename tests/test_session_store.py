@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from anli.dialog_manager import DialogManager, llm_summarizer
+from anli.llms.fake import FakeLLM
+from anli.session_store import SessionStore, SqliteSessionBackend
+
+
+class CountingBackend(SqliteSessionBackend):
+    def __init__(self, path):
+        super().__init__(path)
+        self.loads = []
+        self.saves = []
+
+    def load(self, session_id):
+        self.loads.append(session_id)
+        return super().load(session_id)
+
+    def save_many(self, states):
+        self.saves.append(sorted(states))
+        super().save_many(states)
+
+
+def test_dialog_state_round_trip():
+    llm = FakeLLM(default_response="They talked.")
+    dialog = DialogManager(window=3, summarizer=llm_summarizer(llm), summary_size=2)
+    dialog.manage_context("restart the pod worker-1", {"pod": "worker-1"})
+    for i in range(6):
+        dialog.add_turn("assistant" if i % 2 == 0 else "user", f"turn {i}")
+    restored = DialogManager(window=3, summarizer=llm_summarizer(llm), summary_size=2).restore(dialog.state())
+    assert restored.state() == dialog.state()
+    assert restored.build_messages("worker-1") == dialog.build_messages("worker-1")
+    assert llm.calls == 2
+
+
+def test_write_behind_and_rehydration(tmp_path):
+    backend = CountingBackend(str(tmp_path / "sessions.sqlite"))
+    store = SessionStore(backend=backend, shards=4, idle_ttl=0, flush_interval=None)
+    for session_id in ("a", "b"):
+        with store.session(session_id) as dialog:
+            dialog.manage_context(f"hello from {session_id}", {"user": session_id})
+    assert len(store) == 2 and backend.saves == []
+
+    # Evicted sessions wait for the next write, their next message rehydrates them without reading the backend
+    store.evict_idle()
+    assert len(store) == 0
+    with store.session("a") as dialog:
+        assert dialog.context == {"user": "a"}
+        dialog.add_turn("assistant", "hi")
+    assert backend.loads == ["a", "b"]
+    store.flush()
+    assert sorted(sum(backend.saves, [])) == ["a", "b"]
+
+    store.close()
+    other = SessionStore(backend=backend, flush_interval=None)
+    with other.session("a") as dialog:
+        assert dialog.build_messages() == [{"role": "user", "content": "hello from a"},
+                                           {"role": "assistant", "content": "hi"}]
+    other.delete("b")
+    with other.session("b") as dialog:
+        assert dialog.position == 0
+
+
+def test_memory_bound(tmp_path):
+    backend = CountingBackend(str(tmp_path / "sessions.sqlite"))
+    store = SessionStore(backend=backend, shards=1, idle_ttl=None, max_bytes=3 * 4096, flush_interval=None)
+    for i in range(5):
+        with store.session(i) as dialog:
+            dialog.add_turn("user", f"message {i}")
+    # Three sessions fit, the least recently used were evicted
+    assert [session_id for session_id in range(5) if session_id in store] == [2, 3, 4]
+    store.flush()
+    with store.session(0) as dialog:
+        assert dialog.build_messages() == [{"role": "user", "content": "message 0"}]
+    assert 0 in store and 2 not in store
+
+
+def test_concurrent_sessions(tmp_path):
+    store = SessionStore(backend=SqliteSessionBackend(str(tmp_path / "sessions.sqlite")), shards=8,
+                         max_bytes=40 * 4096, flush_interval=0.01)
+
+    def chat(worker):
+        for i in range(50):
+            with store.session(f"session-{(worker * 7 + i) % 100}") as dialog:
+                dialog.add_turn("user", f"message {worker} {i}")
+
+    threads = [threading.Thread(target=chat, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+    assert len(store) <= 40
+
+    other = SessionStore(backend=store.backend, flush_interval=None)
+    positions = []
+    for session_id in range(100):
+        with other.session(f"session-{session_id}") as dialog:
+            positions.append(dialog.position)
+    assert sum(positions) == 8 * 50
+
+
+def test_failed_writes_are_retried(tmp_path):
+    class FailingOnce(CountingBackend):
+        def save_many(self, states):
+            if not self.saves:
+                self.saves.append(None)
+                raise ConnectionError("backend down")
+            super().save_many(states)
+
+    backend = FailingOnce(str(tmp_path / "sessions.sqlite"))
+    store = SessionStore(backend=backend, shards=2, idle_ttl=0, flush_interval=None)
+    for session_id in ("a", "b"):
+        with store.session(session_id) as dialog:
+            dialog.add_turn("user", f"hello from {session_id}")
+    with pytest.raises(ConnectionError):
+        store.flush()
+    store.flush()
+    assert sorted(sum(backend.saves[1:], [])) == ["a", "b"]
+
+    backend.saves = []
+    store = SessionStore(backend=backend, shards=2, idle_ttl=0.05, flush_interval=0.01)
+    for session_id in ("c", "d"):
+        with store.session(session_id) as dialog:
+            dialog.add_turn("user", f"hello from {session_id}")
+    time.sleep(0.3)
+    assert len(store) == 0 and store.flusher.is_alive()
+    store.close()
+    assert sorted(sum(backend.saves[1:], [])) == ["c", "d"]
+    assert SqliteSessionBackend(backend.path).load("c") is not None
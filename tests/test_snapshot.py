@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from anli.llms.fake import FakeLLM
+from anli.utils.dedup import Deduplicator
+from anli.utils.local_vector_store import LocalVectorStoreForJSON
+from anli.utils.snapshot import Snapshot, SnapshotWriter
+
+PROMPT_PATH = "$.conversation[?(@.role == 'user')].content"
+
+
+def conversation(*turns):
+    return {"conversation": [{"role": "user" if i % 2 == 0 else "assistant", "content": turn}
+                             for i, turn in enumerate(turns)]}
+
+
+def fake_embed(embedded):
+    def embed(texts):
+        embedded.extend(texts)
+        return FakeLLM(embedding_dims=32).embed(texts)
+    return embed
+
+
+def test_writer_and_reader(tmp_path):
+    vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+    with SnapshotWriter(str(tmp_path), "model", "source") as writer:
+        writer.write_documents([("a", {"x": 1})])
+        writer.write_records([(f"p{i}", "", {"name": "source-a", "path": f"$.c.[{i}]",
+                                             "occurrences": [{"name": "source-a", "path": f"$.c.[{i}]"}]})
+                              for i in range(4)], vectors)
+    snapshot = Snapshot(str(tmp_path), "model")
+    assert len(snapshot) == 4 and snapshot.dims == 3
+    batches = list(snapshot.records("target", batch_size=3))
+    assert [len(records) for records, _ in batches] == [3, 1]
+    np.testing.assert_array_equal(np.concatenate([batch for _, batch in batches]), vectors)
+    assert batches[1][0][0][2] == {"name": "target-a", "path": "$.c.[3]",
+                                   "occurrences": [{"name": "target-a", "path": "$.c.[3]"}]}
+    assert list(snapshot.documents()) == [[("a", {"x": 1})]]
+
+    with pytest.raises(ValueError, match="embedded with model"):
+        Snapshot(str(tmp_path), "other-model")
+    with open(tmp_path / "vectors.f32", "r+b") as file:
+        file.write(b"\1")
+    with pytest.raises(ValueError, match="Checksum mismatch of vectors.f32"):
+        Snapshot(str(tmp_path))
+    assert len(Snapshot(str(tmp_path), verify=False)) == 4
+
+
+def test_local_store_round_trip(tmp_path):
+    embedded = []
+    embed = fake_embed(embedded)
+    source = LocalVectorStoreForJSON("source", default_semantic_distance_threshold=2, path=str(tmp_path / "stores"),
+                                     vectorizer=embed, deduplicator=Deduplicator())
+    source.upsert_many([conversation(f"why is pod worker-{i} crashing", f"answer {i}", "thanks", "welcome")
+                        for i in range(30)], PROMPT_PATH, response_relative_position=1,
+                       json_storage_id_suffixes=[str(i) for i in range(30)])
+    assert source.export_snapshot(str(tmp_path / "snapshot")) == \
+        f"Export 30 objects and 31 prompts to {tmp_path / 'snapshot'}."
+
+    embedded.clear()
+    target = LocalVectorStoreForJSON("target", default_semantic_distance_threshold=2, path=str(tmp_path / "stores"),
+                                     vectorizer=embed, deduplicator=Deduplicator())
+    assert target.import_snapshot(str(tmp_path / "snapshot"), batch_size=7) == \
+        "Import 30 objects to JSON_store and 31 prompts to vector_index."
+    assert embedded == [] and target["3"] == source["3"]
+
+    fields = ["response", "name", "path", "occurrences"]
+    hits = target.search_item("thanks", 1, fields)
+    assert hits[0]["name"] == "target-0" and len(hits[0]["occurrences"]) == 30
+    query = "why is pod worker-7 crashing"
+    restored, original = [sorted((hit["response"], hit["vector_distance"]) for hit in store.search_item(query, 40))
+                          for store in (target, source)]
+    assert [response for response, _ in restored] == [response for response, _ in original]
+    np.testing.assert_allclose([distance for _, distance in restored], [distance for _, distance in original],
+                               atol=1e-6)
+    assert target.get_context_windows(hits[0]["occurrences"][-1:], 1, 2) == [[{"role": "assistant",
+                                                                                "content": "welcome"}]]
+    embedded.clear()
+    target.upsert_item(conversation("THANKS"), PROMPT_PATH, json_storage_id_suffix="new")
+    assert embedded == []
@@ -0,0 +1,132 @@
+import asyncio
+import random
+import time
+
+import pytest
+from anli.utils.stream_sentence import AsyncStreamSentence, StreamSentence
+
+
+def stream(chunks):
+    sent = []
+    processor = StreamSentence(sent.append)
+    for chunk in chunks:
+        processor.process_chunk(chunk)
+    processor.end_stream()
+    return sent
+
+
+def test_splits_on_punctuation_followed_by_space():
+    assert stream(["Hello there", ", how are", " you doing", " today? I am", " fine."]) == [
+        "Hello there,", "how are you doing today?", "I am fine.", "<END>"]
+
+
+def test_short_phrase_is_merged_with_the_next_one():
+    assert stream(["Hi. How are you? Good", " to see you."]) == ["Hi. How are you?", "Good to see you.", "<END>"]
+
+
+def test_decimals_times_and_abbreviations():
+    text = "Pi is about 3.14 today. We meet at 12:30 with Dr. Smith, e.g. in room 4. Done now."
+    assert stream([text]) == ["Pi is about 3.14 today.", "We meet at 12:30 with Dr. Smith,",
+                              "e.g. in room 4.", "Done now.", "<END>"]
+
+
+def test_punctuation_runs_and_closing_quotes():
+    assert stream(['He said "stop it." Then', " what?! Really", "..."]) == [
+        'He said "stop it."', "Then what?!", "Really...", "<END>"]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_chunking_does_not_change_the_result(seed):
+    text = ("Sure, I can help. The pod temp-worker (v1.2.3) was deleted at 10:45 a.m. by Mr. Jones; "
+            "nothing else changed... Anything else? \"Yes,\" she said. No!")
+    rng = random.Random(seed)
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 5)
+        chunks.append(text[position:position + size])
+        position += size
+    assert stream(chunks) == stream([text])
+
+
+def test_buffer_and_reuse_after_end_stream():
+    sent = []
+    processor = StreamSentence(sent.append)
+    processor.process_chunk("Hello there, my")
+    assert processor.buffer == "my"
+    processor.end_stream()
+    assert processor.buffer == ""
+    processor.process_chunk("Second stream, yes")
+    processor.end_stream()
+    assert sent == ["Hello there,", "my", "<END>", "Second stream,", "yes", "<END>"]
+
+
+def test_max_chars_flushes_at_word_boundary():
+    sent = []
+    processor = StreamSentence(sent.append, max_chars=20)
+    processor.process_chunk("one two three four five six")
+    assert sent == ["one two three four five"]
+    assert processor.buffer == "six"
+    processor.process_chunk("seveneightnineteneleven")
+    assert len(sent) == 1
+    processor.process_chunk(" twelve")
+    assert sent[-1] == "sixseveneightnineteneleven"
+
+
+def test_max_chars_never_cuts_a_word_streamed_in_pieces():
+    text = "Supercalifragilisticexpialidocious is long, antidisestablishmentarianism too"
+    for size in (1, 3, 7):
+        sent = []
+        processor = StreamSentence(sent.append, max_chars=10)
+        for position in range(0, len(text), size):
+            processor.process_chunk(text[position:position + size])
+        processor.end_stream()
+        # Pieces are only separated at spaces
+        assert " ".join(sent[:-1]) == text
+
+
+def test_max_words_flushes_complete_words():
+    sent = []
+    processor = StreamSentence(sent.append, max_words=3)
+    for chunk in ["al", "pha be", "ta gam", "ma del", "ta"]:
+        processor.process_chunk(chunk)
+    assert sent == ["alpha beta"]
+    processor.end_stream()
+    assert sent == ["alpha beta", "gamma delta", "<END>"]
+
+
+def test_max_wait_flushes_on_poll():
+    sent = []
+    processor = StreamSentence(sent.append, max_wait=0.05)
+    processor.process_chunk("waiting for the model")
+    assert processor.time_until_flush() > 0
+    assert not processor.poll()
+    time.sleep(0.06)
+    assert processor.poll()
+    assert sent == ["waiting for the"]
+    assert processor.time_until_flush() is None
+
+
+def test_async_multiplexer_interleaves_streams_and_flushes_stalls():
+    async def chunks(parts, delay):
+        for part in parts:
+            await asyncio.sleep(delay)
+            yield part
+
+    async def run():
+        received = {"a": [], "b": []}
+
+        async def send_b(text):
+            received["b"].append(text)
+
+        multiplexer = AsyncStreamSentence(max_wait=0.05)
+        multiplexer.add_stream("a", chunks(["Hello there, ", "friend of mine."], 0.0), received["a"].append)
+        multiplexer.add_stream("b", chunks(["stalled output ", "for a while."], 0.1), send_b)
+        await multiplexer.join()
+        return received, multiplexer.metrics()
+
+    received, metrics = asyncio.run(run())
+    assert received["a"] == ["Hello there,", "friend of mine.", "<END>"]
+    assert received["b"] == ["stalled output", "for a while.", "<END>"]
+    assert metrics["a"]["sentences"] == 2
+    assert metrics["b"]["time_to_first_sentence"] < 0.3
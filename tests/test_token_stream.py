@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+from anli.llms.streaming import TokenStream
+from anli.utils.stream_sentence import StreamSentence
+
+
+class Decoder:
+    """Yields numbered tokens and records how far decoding got."""
+    def __init__(self, count, delay=0.0):
+        self.count = count
+        self.delay = delay
+        self.decoded = 0
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            for i in range(self.count):
+                time.sleep(self.delay)
+                self.decoded += 1
+                yield f"t{i} "
+        finally:
+            self.closed = True
+
+
+def test_sync_iteration_and_metrics():
+    with TokenStream(Decoder(10)) as tokens:
+        assert list(tokens) == [f"t{i} " for i in range(10)]
+    metrics = tokens.metrics()
+    assert metrics["token_count"] == 10
+    assert metrics["time_to_first_token"] is not None
+
+
+def test_backpressure_bounds_decoding():
+    decoder = Decoder(1000)
+    tokens = TokenStream(iter(decoder), max_queue=4)
+    time.sleep(0.05)
+    # The queue holds 4 tokens and the decoder is blocked handing over the 5th.
+    assert decoder.decoded == 5
+    assert next(tokens) == "t0 "
+    tokens.cancel()
+
+
+def test_cancel_stops_decoding():
+    decoder = Decoder(1000, delay=0.001)
+    tokens = TokenStream(iter(decoder))
+    next(tokens)
+    tokens.cancel()
+    time.sleep(0.05)
+    assert decoder.closed
+    assert decoder.decoded < 1000
+    assert list(tokens) == []
+
+
+def test_errors_are_raised_to_the_consumer():
+    def failing():
+        yield "a"
+        raise RuntimeError("decoding failed")
+
+    tokens = TokenStream(failing())
+    assert next(tokens) == "a"
+    with pytest.raises(RuntimeError):
+        next(tokens)
+
+
+def test_async_iteration_into_stream_sentence():
+    sent = []
+
+    async def run():
+        tokens = TokenStream(["Hello there", ", how are", " you doing", " today?"])
+        await StreamSentence(sent.append).aconsume(tokens)
+
+    asyncio.run(run())
+    assert sent == ["Hello there,", "how are you doing today?", "<END>"]
+
+
+def test_async_break_cancels_decoding():
+    decoder = Decoder(1000, delay=0.001)
+
+    async def run():
+        async with TokenStream(iter(decoder)) as tokens:
+            async for _ in tokens:
+                break
+
+    asyncio.run(run())
+    time.sleep(0.05)
+    assert decoder.closed
+    assert decoder.decoded < 1000
@@ -0,0 +1,51 @@
+import pytest
+
+from anli.utils.vector_filters import (VectorFilter, chroma_metadata, normalize_path, path_prefixes,
+                                       redis_indexed_fields, redis_schema_fields)
+
+
+def test_paths_are_matched_by_whole_segments():
+    assert normalize_path("$.conversation[3].content") == "$.conversation.[3].content"
+    assert normalize_path("conversation") == "$.conversation"
+    assert path_prefixes("$.conversation.[3].content") == ["$", "$.conversation", "$.conversation.[3]",
+                                                           "$.conversation.[3].content"]
+    assert "$.conversation" not in path_prefixes("$.conversations.[0].content")
+
+
+def test_redis_pre_filter():
+    recent = VectorFilter(documents=["s-1", "s-2"], path_prefix="$.conversation",
+                          tags={"tenant": "acme"}, ranges={"timestamp": (1700000000, None)})
+    assert recent.to_redis("chat") == (r"(@name:{chat\-s\-1|chat\-s\-2} @path_prefixes:{\$\.conversation} "
+                                       r"@tenant:{acme} @timestamp:[1700000000 +inf])")
+    assert VectorFilter(ranges={"timestamp": (None, 5)}).to_redis("chat") == "@timestamp:[-inf 5]"
+    assert VectorFilter().to_redis("chat") == "*"
+
+
+def test_chroma_where_clause():
+    recent = VectorFilter(documents="s-1", path_prefix="$.conversation", tags={"tenant": ["acme", "beta"]},
+                          ranges={"timestamp": (10, 20)})
+    assert recent.to_chroma("chat") == {"$and": [{"name": {"$in": ["chat-s-1"]}},
+                                                 {"path:$.conversation": True},
+                                                 {"tenant": {"$in": ["acme", "beta"]}},
+                                                 {"timestamp": {"$gte": 10}},
+                                                 {"timestamp": {"$lte": 20}}]}
+    assert VectorFilter(documents="s-1").to_chroma("chat") == {"name": {"$in": ["chat-s-1"]}}
+    assert VectorFilter().to_chroma("chat") is None
+
+
+def test_stored_fields():
+    metadata = {"name": "chat-s-1", "path": "$.conversation.[0].content", "tenant": "acme", "note": "x"}
+    assert redis_indexed_fields(metadata, {"tenant": "tag", "timestamp": "numeric"}) == {
+        "name": "chat-s-1", "path": "$.conversation.[0].content", "tenant": "acme",
+        "path_prefixes": "$|$.conversation|$.conversation.[0]|$.conversation.[0].content"}
+    assert chroma_metadata(metadata)["path:$.conversation.[0]"] is True
+    assert [field["name"] for field in redis_schema_fields({"tenant": "tag"})] == ["name", "path_prefixes", "tenant"]
+
+
+def test_invalid_fields():
+    with pytest.raises(ValueError):
+        redis_schema_fields({"timestamp": "date"})
+    with pytest.raises(ValueError):
+        redis_schema_fields({"path": "tag"})
+    with pytest.raises(ValueError):
+        VectorFilter(tags={"name": "chat-s-1"})